@@ -25,6 +25,9 @@ API_PASSWORD = os.getenv("API_PASSWORD", "password")
 # Hash the password (in a real app, you'd store the hashed password)
 API_PASSWORD_HASH = pwd_context.hash(API_PASSWORD)
 
+# Users allowed to use the administration endpoints (comma-separated)
+ADMIN_USERS = {user.strip() for user in os.getenv("ADMIN_USERS", API_USERNAME).split(",") if user.strip()}
+
 def verify_password(plain_password, hashed_password):
     """
     Verify a password against a hash.
@@ -67,4 +70,24 @@ def authenticate_user(credentials: HTTPBasicCredentials = Depends(security)):
             headers={"WWW-Authenticate": "Basic"},
         )
     
-    return credentials.username
\ No newline at end of file
+    return credentials.username
+
+def authenticate_admin(username: str = Depends(authenticate_user)):
+    """
+    Authenticate an administrator (one of ADMIN_USERS).
+    
+    Args:
+        username (str): The authenticated user
+        
+    Returns:
+        str: The username if the user is an administrator
+        
+    Raises:
+        HTTPException: If the user is not an administrator
+    """
+    if username not in ADMIN_USERS:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Administrator access required",
+        )
+    return username
@@ -0,0 +1,169 @@
+"""
+Page bands module for the Invoice OCR API.
+This module splits a large page into horizontal bands of text so that they can
+be OCRed in parallel on several workers, and stitches the results back into
+the result of the whole page.
+
+Bands are only cut across blank rows found with a row projection profile (the
+number of dark pixels on each row), so no line of text is ever cut in two,
+and the bands are read top to bottom, in the reading order of the page.
+"""
+import os
+from typing import List, Tuple
+
+import numpy as np
+from dotenv import load_dotenv
+from PIL import Image
+
+from .engines import OCRResult, OCRWord
+
+# Load environment variables
+load_dotenv()
+
+# When pages are split into bands: "off", "idle" (only on workers that would
+# otherwise stay idle) or "always"
+OCR_BANDS = os.getenv("OCR_BANDS", "off")
+
+# Pages with fewer pixels are never split (an A4 page at 200 dpi has 3.7 million)
+OCR_BAND_MIN_PIXELS = int(os.getenv("OCR_BAND_MIN_PIXELS", "4000000"))
+
+# Maximum number of bands per page
+OCR_BAND_MAX = int(os.getenv("OCR_BAND_MAX", "4"))
+
+# Gray level under which a pixel is ink
+INK_THRESHOLD = 128
+
+# Rows with at most this fraction of ink pixels are blank (dust, scanner noise)
+BLANK_ROW_INK = 0.002
+
+# Blank runs shorter than this fraction of the page height are gaps between the
+# lines of a paragraph, where cutting could change how Tesseract reads the text
+MIN_GAP_FRACTION = 1 / 150
+
+# Row ranges (top, bottom) of the bands of a page
+Band = Tuple[int, int]
+
+# Block numbers of the words of each band are offset by this much, so that the
+# lines of different bands never share the same number
+BAND_BLOCK_OFFSET = 10000
+
+
+def band_count(image: Image.Image, spare_workers: int, mode: str = OCR_BANDS) -> int:
+    """
+    Decide how many bands a page should be split into.
+
+    Args:
+        image (Image.Image): Page image
+        spare_workers (int): Workers with nothing to do
+        mode (str): "off", "idle" or "always" (see OCR_BANDS)
+
+    Returns:
+        int: Number of bands, 1 to OCR the page whole
+    """
+    if mode == "off" or image.width * image.height < OCR_BAND_MIN_PIXELS:
+        return 1
+    if mode == "idle":
+        # The page takes one worker, the other bands the spare ones
+        return max(1, min(OCR_BAND_MAX, spare_workers + 1))
+    return OCR_BAND_MAX
+
+
+def find_gaps(image: Image.Image, min_gap: int) -> List[Band]:
+    """
+    Find the runs of blank rows of a page.
+
+    Args:
+        image (Image.Image): Page image
+        min_gap (int): Minimum height of a run, in rows
+
+    Returns:
+        List[Band]: Row ranges of the blank runs, top to bottom
+    """
+    pixels = np.asarray(image.convert("L"))
+    ink = (pixels < INK_THRESHOLD).sum(axis=1)
+    blank = ink <= BLANK_ROW_INK * image.width
+    # Edges of the blank runs: +1 where a run starts, -1 after it ends
+    edges = np.diff(np.concatenate(([0], blank.astype(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1)
+    ends = np.flatnonzero(edges == -1)
+    return [(int(start), int(end)) for start, end in zip(starts, ends) if end - start >= min_gap]
+
+
+def plan_bands(image: Image.Image, count: int) -> List[Band]:
+    """
+    Split a page into at most `count` bands of similar height, cutting in the
+    middle of blank runs.
+
+    Args:
+        image (Image.Image): Page image
+        count (int): Wanted number of bands
+
+    Returns:
+        List[Band]: Row ranges of the bands, top to bottom; a single band for
+        the whole page when it cannot be split
+    """
+    height = image.height
+    if count < 2:
+        return [(0, height)]
+    gaps = find_gaps(image, max(4, int(height * MIN_GAP_FRACTION)))
+    # Blank margins at the top and bottom of the page are not worth a cut
+    cuts = [(start + end) // 2 for start, end in gaps if start > 0 and end < height]
+    min_band = height // (2 * count)
+
+    chosen: List[int] = []
+    for k in range(1, count):
+        target = height * k // count
+        usable = [
+            cut for cut in cuts
+            if all(abs(cut - other) >= min_band for other in chosen + [0, height])
+        ]
+        if usable:
+            chosen.append(min(usable, key=lambda cut: abs(cut - target)))
+
+    bounds = [0] + sorted(chosen) + [height]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def crop_band(image: Image.Image, band: Band) -> Image.Image:
+    """
+    Cut a band out of its page, across the whole page width.
+    """
+    top, bottom = band
+    return image.crop((0, top, image.width, bottom))
+
+
+def stitch_bands(results: List[OCRResult], bands: List[Band], size: Tuple[int, int]) -> OCRResult:
+    """
+    Merge the OCR results of the bands of a page into the result of the page.
+
+    Band texts are separated by a blank line, as Tesseract separates the blocks
+    of a page, and word positions are moved back to page coordinates.
+
+    Args:
+        results (List[OCRResult]): OCR results of the bands, top to bottom
+        bands (List[Band]): Row ranges of the bands
+        size (Tuple[int, int]): Width and height of the page
+
+    Returns:
+        OCRResult: OCR result of the whole page
+    """
+    texts = [result.text.strip("\f").strip("\n") for result in results]
+    text = "\n\n".join(band_text for band_text in texts if band_text) + "\n"
+    if any(result.text.endswith("\f") for result in results):
+        # Keep the page separator Tesseract ends the text of a page with
+        text += "\f"
+
+    words = []
+    for index, (result, (top, _)) in enumerate(zip(results, bands)):
+        for word in result.words:
+            block, paragraph, line = word.line
+            words.append(OCRWord(
+                text=word.text,
+                conf=word.conf,
+                left=word.left,
+                top=word.top + top,
+                width=word.width,
+                height=word.height,
+                line=(index * BAND_BLOCK_OFFSET + block, paragraph, line),
+            ))
+    return OCRResult(text, words, size)
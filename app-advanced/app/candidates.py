@@ -0,0 +1,376 @@
+"""
+Field candidates module for the Invoice OCR API.
+This module keeps every possible value found for an invoice field instead of
+the first pattern match, and ranks them with a score combining:
+
+- the priority of the pattern that found the value (e.g. "Total" before "Subtotal"),
+- the OCR confidence of the words the value was read from,
+- the position of the value on the page (e.g. totals are near the bottom).
+
+Values whose label points to another field (a subtotal for the total amount,
+a due date for the invoice date) are penalized. The best candidates of
+related fields are then checked against each other (the due date is not
+before the invoice date, the line items add up to the total), and fields read
+with a low OCR confidence can be read again on their own line only.
+"""
+import os
+import re
+from bisect import bisect_right
+from dataclasses import dataclass
+from decimal import Decimal
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from dotenv import load_dotenv
+from PIL import Image
+
+from .engines import OCRResult, OCRWord
+
+# Load environment variables
+load_dotenv()
+
+# Weights of the score components
+PATTERN_WEIGHT = 0.5
+CONFIDENCE_WEIGHT = 0.3
+POSITION_WEIGHT = 0.2
+
+# Score multiplier of a value whose label points to another field
+LABEL_PENALTY = 0.5
+
+# Number of candidates kept per field
+MAX_CANDIDATES = 5
+
+# Fields whose best value was read with a lower OCR confidence (0 to 100) are
+# read again on their own line
+FIELD_RETRY_CONFIDENCE = float(os.getenv("FIELD_RETRY_CONFIDENCE", "70"))
+
+# Line crops smaller than this height (in pixels) are enlarged before OCR
+MIN_RETRY_LINE_HEIGHT = 40
+
+# Box of a region of a page: left, top, right, bottom
+Box = Tuple[int, int, int, int]
+
+
+@dataclass
+class Candidate:
+    """
+    A possible value of an invoice field.
+
+    Attributes:
+        value (Any): Normalized value (e.g. a date or a Decimal)
+        text (str): Text the value was read from
+        score (float): Ranking score, from 0 to 1
+        start (int): Position of the value in the document text
+        confidence (Optional[float]): Mean OCR confidence of its words (0 to 1), None if unknown
+        page (Optional[int]): Index of the page the value is on, None if unknown
+        box (Optional[Box]): Lines of the page the value and its label are on
+        retried (bool): The value was read again on its own line
+    """
+    value: Any
+    text: str
+    score: float
+    start: int
+    confidence: Optional[float] = None
+    page: Optional[int] = None
+    box: Optional[Box] = None
+    retried: bool = False
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Get the candidate as a JSON-compatible dictionary.
+        """
+        value = self.value
+        if isinstance(value, Decimal):
+            value = float(value)
+        elif hasattr(value, "isoformat"):
+            value = value.isoformat()
+        return {
+            "value": value,
+            "text": self.text,
+            "score": round(self.score, 3),
+            "confidence": None if self.confidence is None else round(self.confidence, 3),
+            "page": self.page,
+            "retried": self.retried,
+        }
+
+
+class WordIndex:
+    """
+    Positions of the OCR words in the text of a document, used to find the
+    words (and so the confidence and location) behind any part of the text.
+    """
+
+    def __init__(self, pages: List[OCRResult], separator: str = "\f"):
+        self._pages = pages
+        # (start, end, page index, word), in text order
+        self._spans: List[Tuple[int, int, int, OCRWord]] = []
+        offset = 0
+        for page_index, page in enumerate(pages):
+            cursor = 0
+            for word in page.words:
+                position = page.text.find(word.text, cursor)
+                if position < 0:
+                    continue
+                end = position + len(word.text)
+                self._spans.append((offset + position, offset + end, page_index, word))
+                cursor = end
+            offset += len(page.text) + len(separator)
+        self._starts = [span[0] for span in self._spans]
+
+    def words(self, start: int, end: int) -> List[Tuple[int, OCRWord]]:
+        """
+        Get the words overlapping a part of the text.
+
+        Returns:
+            List[Tuple[int, OCRWord]]: Page index and word of each overlapping word
+        """
+        words = []
+        i = max(0, bisect_right(self._starts, start) - 1)
+        while i < len(self._spans) and self._spans[i][0] < end:
+            span_start, span_end, page_index, word = self._spans[i]
+            if span_end > start:
+                words.append((page_index, word))
+            i += 1
+        return words
+
+    def confidence(self, start: int, end: int) -> Optional[float]:
+        """
+        Get the mean OCR confidence (0 to 1) of a part of the text, None if unknown.
+        """
+        confidences = [word.conf for _, word in self.words(start, end) if word.conf >= 0]
+        if not confidences:
+            return None
+        return sum(confidences) / len(confidences) / 100
+
+    def position(self, start: int, end: int) -> Optional[float]:
+        """
+        Get the vertical position (0 at the top, 1 at the bottom) of a part of
+        the text on its page, None if unknown.
+        """
+        words = self.words(start, end)
+        if not words:
+            return None
+        page_index, word = words[0]
+        height = self._pages[page_index].size[1]
+        return min(1.0, word.top / height) if height else None
+
+    def line_box(self, start: int, end: int) -> Optional[Tuple[int, Box]]:
+        """
+        Get the box of the whole lines a part of the text is on.
+
+        Returns:
+            Optional[Tuple[int, Box]]: Page index and box, None if unknown
+        """
+        words = self.words(start, end)
+        if not words:
+            return None
+        page_index = words[0][0]
+        lines = {word.line for index, word in words if index == page_index}
+        line_words = [word for word in self._pages[page_index].words if word.line in lines]
+        return page_index, (
+            min(word.left for word in line_words),
+            min(word.top for word in line_words),
+            max(word.left + word.width for word in line_words),
+            max(word.top + word.height for word in line_words),
+        )
+
+
+def find_candidates(
+    text: str,
+    patterns: List[str],
+    parse: Callable[[str], Any],
+    index: Optional[WordIndex] = None,
+    prefer: Optional[str] = None,
+    penalty: Optional[str] = None,
+) -> List[Candidate]:
+    """
+    Find and rank the possible values of a field.
+
+    Every match of every pattern is a candidate. The same value found several
+    times is kept once, with its best score.
+
+    Args:
+        text (str): OCR text of the document
+        patterns (List[str]): Patterns capturing the value in their first group, by priority
+        parse (Callable[[str], Any]): Normalizes a captured value, returns None if it is not valid
+        index (Optional[WordIndex]): OCR words of the text, for confidences and positions
+        prefer (Optional[str]): Where the value usually is on the page: "top", "bottom" or None
+        penalty (Optional[str]): Pattern matching, on the line before the value,
+            a label that points to another field
+
+    Returns:
+        List[Candidate]: The best candidates, best first
+    """
+    found: Dict[Any, Candidate] = {}
+    for rank, pattern in enumerate(patterns):
+        priority = 1.0 / (1.0 + 0.25 * rank)
+        for match in re.finditer(pattern, text):
+            raw = match.group(1).strip()
+            value = parse(raw)
+            if value is None:
+                continue
+            start, end = match.span(1)
+
+            confidence = index.confidence(start, end) if index else None
+            position = index.position(start, end) if index else None
+            if position is None:
+                position = start / max(1, len(text))
+            position_score = {"top": 1.0 - position, "bottom": position}.get(prefer, 0.5)
+
+            if confidence is None:
+                score = (PATTERN_WEIGHT * priority + POSITION_WEIGHT * position_score) / (
+                    PATTERN_WEIGHT + POSITION_WEIGHT
+                )
+            else:
+                score = (
+                    PATTERN_WEIGHT * priority
+                    + CONFIDENCE_WEIGHT * confidence
+                    + POSITION_WEIGHT * position_score
+                )
+
+            label = text[text.rfind("\n", 0, match.start()) + 1:start]
+            if penalty and re.search(penalty, label):
+                score *= LABEL_PENALTY
+
+            location = index.line_box(match.start(), end) if index else None
+            candidate = Candidate(
+                value=value,
+                text=raw,
+                score=score,
+                start=start,
+                confidence=confidence,
+                page=location[0] if location else None,
+                box=location[1] if location else None,
+            )
+            best = found.get(value)
+            if best is None or candidate.score > best.score:
+                found[value] = candidate
+
+    ranked = sorted(found.values(), key=lambda candidate: candidate.score, reverse=True)
+    return ranked[:MAX_CANDIDATES]
+
+
+def amounts_match(a: Decimal, b: Decimal) -> bool:
+    """
+    Check whether two amounts are equal, within rounding (1 cent or 1%).
+    """
+    return abs(a - b) <= max(Decimal("0.01"), abs(b) * Decimal("0.01"))
+
+
+def check_consistency(
+    candidates: Dict[str, List[Candidate]],
+    items: List[Dict[str, Any]],
+    charges: Sequence[Decimal] = (),
+) -> Tuple[Dict[str, Optional[Candidate]], List[str]]:
+    """
+    Choose the value of each field, checking related fields against each other.
+
+    The best candidate of each field is chosen, unless it contradicts another
+    field: then the best consistent combination of candidates is used instead,
+    or a warning is reported if there is none.
+
+    Args:
+        candidates (Dict[str, List[Candidate]]): Candidates of each field, best first
+        items (List[Dict[str, Any]]): Extracted line items
+        charges (Sequence[Decimal]): Amounts added to the items to make up the total (taxes, shipping)
+
+    Returns:
+        Tuple[Dict[str, Optional[Candidate]], List[str]]: Chosen candidate of each field and warnings
+    """
+    chosen = {field: (ranked[0] if ranked else None) for field, ranked in candidates.items()}
+    warnings = []
+
+    date, due_date = chosen.get("date"), chosen.get("due_date")
+    if date and due_date and due_date.value < date.value:
+        pairs = [
+            (date_candidate, due_candidate)
+            for date_candidate in candidates["date"]
+            for due_candidate in candidates["due_date"]
+            # The same text cannot be both dates
+            if due_candidate.value >= date_candidate.value and due_candidate.start != date_candidate.start
+        ]
+        if pairs:
+            chosen["date"], chosen["due_date"] = max(pairs, key=lambda pair: pair[0].score + pair[1].score)
+        else:
+            warnings.append("The due date is before the invoice date")
+
+    total = chosen.get("total_amount")
+    amounts = [Decimal(str(item["amount"])) for item in items if item.get("amount") is not None]
+    if total and amounts:
+        items_total = sum(amounts) + sum(charges)
+        if not amounts_match(items_total, total.value):
+            matching = [
+                candidate for candidate in candidates["total_amount"]
+                if amounts_match(items_total, candidate.value)
+            ]
+            if matching:
+                chosen["total_amount"] = matching[0]
+            else:
+                warnings.append(f"The line items and charges add up to {items_total}, not to the total amount")
+
+    return chosen, warnings
+
+
+def needs_retry(candidate: Optional[Candidate]) -> bool:
+    """
+    Check whether a chosen value should be read again on its own line.
+    """
+    return (
+        candidate is not None
+        and candidate.box is not None
+        and candidate.confidence is not None
+        and candidate.confidence * 100 < FIELD_RETRY_CONFIDENCE
+    )
+
+
+def crop_line(page: Image.Image, box: Box) -> Image.Image:
+    """
+    Cut the lines of a value out of its page, across the whole page width,
+    enlarged if the text is small.
+
+    Args:
+        page (Image.Image): Page image, as given to OCR
+        box (Box): Lines of the value (see WordIndex.line_box)
+
+    Returns:
+        Image.Image: The lines, ready for OCR
+    """
+    _, top, _, bottom = box
+    margin = max(4, (bottom - top) // 2)
+    crop = page.crop((0, max(0, top - margin), page.width, min(page.height, bottom + margin)))
+    if bottom - top < MIN_RETRY_LINE_HEIGHT:
+        crop = crop.resize((crop.width * 2, crop.height * 2), Image.LANCZOS)
+    return crop
+
+
+def reread(
+    candidate: Candidate,
+    result: OCRResult,
+    patterns: List[str],
+    parse: Callable[[str], Any],
+) -> Candidate:
+    """
+    Use the value read again on its own line if it was read more confidently.
+
+    Args:
+        candidate (Candidate): Value read on the whole page
+        result (OCRResult): OCR result of the value's lines
+        patterns (List[str]): Patterns of the field
+        parse (Callable[[str], Any]): Normalizer of the field
+
+    Returns:
+        Candidate: The better of the two values
+    """
+    found = find_candidates(result.text, patterns, parse, WordIndex([result]))
+    if not found or found[0].confidence is None or found[0].confidence <= (candidate.confidence or 0):
+        return candidate
+    best = found[0]
+    return Candidate(
+        value=best.value,
+        text=best.text,
+        score=candidate.score + CONFIDENCE_WEIGHT * (best.confidence - (candidate.confidence or 0)),
+        start=candidate.start,
+        confidence=best.confidence,
+        page=candidate.page,
+        box=candidate.box,
+        retried=True,
+    )
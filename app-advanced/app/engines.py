@@ -0,0 +1,488 @@
+"""
+OCR engine module for the Invoice OCR API.
+This module hides the OCR backend behind a small interface, so that the rest of
+the pipeline does not depend on how Tesseract is invoked.
+
+Every engine call accepts a timeout and a cancellation event: a call that runs
+out of time or gets cancelled stops the OCR work and returns immediately.
+
+Engines are created once per OCR language and reused by every request.
+"""
+import os
+import re
+import shlex
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+import pytesseract
+from dotenv import load_dotenv
+from PIL import Image
+
+from .tuning import load_tuning
+
+# Load environment variables from .env file, then the tuned settings
+load_dotenv()
+load_tuning()
+
+# Set Tesseract executable path from environment variable
+tesseract_cmd_path = os.getenv("TESSERACT_CMD_PATH")
+if tesseract_cmd_path:
+    pytesseract.pytesseract.tesseract_cmd = tesseract_cmd_path
+
+# Tesseract configuration used for every OCR call (page segmentation mode 4:
+# a single column of text of variable sizes)
+TESSERACT_CONFIG = os.getenv("TESSERACT_CONFIG", "--psm 4")
+
+# Threads each Tesseract process may use (OMP_THREAD_LIMIT), 0 to let OpenMP use
+# every core. Parallel OCR jobs using many threads each oversubscribe the CPU,
+# run `python -m benchmarks.autotune` to pick this and OCR_WORKERS
+TESSERACT_THREADS = int(os.getenv("TESSERACT_THREADS", "0"))
+
+# How often (in seconds) a running OCR process checks for cancellation
+CANCEL_POLL_INTERVAL = 0.1
+
+
+class OCRTimeoutError(Exception):
+    """
+    Raised when an OCR call does not finish within its time budget.
+    """
+
+
+class OCRCancelledError(Exception):
+    """
+    Raised when an OCR call is cancelled, e.g. because the client disconnected.
+    """
+
+
+@dataclass(frozen=True)
+class OCRWord:
+    """
+    A word recognized by OCR, with its position on the page.
+
+    Attributes:
+        text (str): Recognized word
+        conf (float): Recognition confidence, from 0 to 100
+        left (int): Left edge of the word, in pixels
+        top (int): Top edge of the word, in pixels
+        width (int): Width of the word, in pixels
+        height (int): Height of the word, in pixels
+        line (Tuple[int, int, int]): Block, paragraph and line numbers of the word
+    """
+    text: str
+    conf: float
+    left: int
+    top: int
+    width: int
+    height: int
+    line: Tuple[int, int, int]
+
+
+@dataclass(frozen=True)
+class OCRResult:
+    """
+    Text of a page, with the recognized words when the engine provides them.
+
+    Attributes:
+        text (str): Recognized text
+        words (List[OCRWord]): Recognized words in reading order, empty if not available
+        size (Tuple[int, int]): Width and height of the recognized image
+        rotation (int): Clockwise rotation (0, 90, 180 or 270 degrees) applied to the page before OCR
+        skipped (Optional[str]): Why the page was not OCRed (e.g. "blank"), None if it was
+    """
+    text: str
+    words: List[OCRWord]
+    size: Tuple[int, int]
+    rotation: int = 0
+    skipped: Optional[str] = None
+
+
+def parse_osd(osd: str) -> Optional[Tuple[int, float]]:
+    """
+    Parse the orientation and script detection output of Tesseract.
+
+    Args:
+        osd (str): Content of the OSD output
+
+    Returns:
+        Optional[Tuple[int, float]]: Clockwise rotation (in degrees) that makes
+        the page upright and its confidence, None if not found
+    """
+    rotate = re.search(r"Rotate:\s*(\d+)", osd)
+    confidence = re.search(r"Orientation confidence:\s*([\d.]+)", osd)
+    if not rotate:
+        return None
+    return int(rotate.group(1)) % 360, float(confidence.group(1)) if confidence else 0.0
+
+
+def parse_tsv(tsv: str) -> List[OCRWord]:
+    """
+    Parse the TSV output of Tesseract into words.
+
+    Args:
+        tsv (str): Content of the TSV output
+
+    Returns:
+        List[OCRWord]: Words with their confidence and position
+    """
+    words = []
+    lines = tsv.splitlines()
+    for row in lines[1:]:
+        fields = row.split("\t")
+        # Only word rows (level 5) have text
+        if len(fields) < 12 or fields[0] != "5" or not fields[11].strip():
+            continue
+        words.append(OCRWord(
+            text=fields[11].strip(),
+            conf=float(fields[10]),
+            left=int(fields[6]),
+            top=int(fields[7]),
+            width=int(fields[8]),
+            height=int(fields[9]),
+            line=(int(fields[2]), int(fields[3]), int(fields[4])),
+        ))
+    return words
+
+
+class OCREngine:
+    """
+    Base class for OCR engines.
+    """
+
+    name = "base"
+
+    def image_to_string(
+        self,
+        image: Image.Image,
+        timeout: Optional[float] = None,
+        cancel_event: Optional[threading.Event] = None,
+    ) -> str:
+        """
+        Recognize the text of an image.
+
+        Args:
+            image (Image.Image): Image to recognize
+            timeout (Optional[float]): Time budget in seconds, None for no limit
+            cancel_event (Optional[threading.Event]): Set to abort the call
+
+        Returns:
+            str: Recognized text
+
+        Raises:
+            OCRTimeoutError: If the time budget is exhausted
+            OCRCancelledError: If the call is cancelled
+        """
+        raise NotImplementedError
+
+    def recognize(
+        self,
+        image: Image.Image,
+        timeout: Optional[float] = None,
+        cancel_event: Optional[threading.Event] = None,
+        single_block: bool = False,
+    ) -> OCRResult:
+        """
+        Recognize the text of an image, with the position and confidence of
+        each word when the engine provides them.
+
+        Args:
+            image (Image.Image): Image to recognize
+            timeout (Optional[float]): Time budget in seconds, None for no limit
+            cancel_event (Optional[threading.Event]): Set to abort the call
+            single_block (bool): The image is a single block of text (e.g. a few lines cut out of a page)
+
+        Returns:
+            OCRResult: Recognized text and words
+
+        Raises:
+            OCRTimeoutError: If the time budget is exhausted
+            OCRCancelledError: If the call is cancelled
+        """
+        text = self.image_to_string(image, timeout=timeout, cancel_event=cancel_event)
+        return OCRResult(text, [], image.size)
+
+    def detect_orientation(
+        self,
+        image: Image.Image,
+        timeout: Optional[float] = None,
+        cancel_event: Optional[threading.Event] = None,
+    ) -> Optional[Tuple[int, float]]:
+        """
+        Detect how a page is oriented (orientation and script detection).
+
+        Args:
+            image (Image.Image): Page image
+            timeout (Optional[float]): Time budget in seconds, None for no limit
+            cancel_event (Optional[threading.Event]): Set to abort the call
+
+        Returns:
+            Optional[Tuple[int, float]]: Clockwise rotation (in degrees) that makes
+            the page upright and its confidence, None if the engine cannot tell
+
+        Raises:
+            OCRTimeoutError: If the time budget is exhausted
+            OCRCancelledError: If the call is cancelled
+        """
+        return None
+
+    def check(self, languages: Tuple[str, ...] = ()) -> Optional[str]:
+        """
+        Check that the engine can run OCR, without running it.
+
+        Args:
+            languages (Tuple[str, ...]): Language codes the engine must support
+
+        Returns:
+            Optional[str]: Why the engine cannot run OCR, None if it can
+        """
+        return None
+
+    def with_language(self, lang: str) -> "OCREngine":
+        """
+        Get an engine recognizing the given language(s).
+
+        Engines that do not support language selection return themselves.
+
+        Args:
+            lang (str): Tesseract language code(s), e.g. "fra" or "eng+fra"
+
+        Returns:
+            OCREngine: Engine for this language
+        """
+        return self
+
+
+class TesseractEngine(OCREngine):
+    """
+    OCR engine running the Tesseract command line tool.
+
+    Tesseract is run as a subprocess that is killed as soon as the timeout
+    expires or the call is cancelled.
+    """
+
+    name = "tesseract"
+
+    def __init__(self, config: str = TESSERACT_CONFIG, lang: Optional[str] = None, threads: int = TESSERACT_THREADS):
+        self.config = config
+        self.lang = lang
+        self.threads = threads
+        self._languages: Dict[str, "TesseractEngine"] = {}
+        self._languages_lock = threading.Lock()
+
+    def image_to_string(self, image, timeout=None, cancel_event=None):
+        return self._run(image, "txt", timeout, cancel_event)
+
+    def recognize(self, image, timeout=None, cancel_event=None, single_block=False):
+        config = None
+        if single_block:
+            # Page segmentation mode 6: a single uniform block of text
+            config = re.sub(r"--psm\s+\d+", "", self.config).strip() + " --psm 6"
+        # A single Tesseract run writes both the text and the words
+        outputs = self._run_outputs(image, ("txt", "tsv"), timeout, cancel_event, config)
+        return OCRResult(outputs["txt"], parse_tsv(outputs["tsv"]), image.size)
+
+    def detect_orientation(self, image, timeout=None, cancel_event=None):
+        installed = available_languages()
+        if installed is None or "osd" not in installed:
+            return None
+        try:
+            # Page segmentation mode 0: orientation and script detection only
+            output = self._run(image, "osd", timeout, cancel_event, "--psm 0")
+        except pytesseract.TesseractError:
+            # e.g. too few characters to tell
+            return None
+        return parse_osd(output)
+
+    def check(self, languages=()):
+        cmd = pytesseract.pytesseract.tesseract_cmd
+        if shutil.which(cmd) is None:
+            return f"Tesseract not found: {cmd}"
+        installed = available_languages()
+        if installed is None:
+            # Read the languages again on the next check
+            available_languages.cache_clear()
+            return "Tesseract cannot be run"
+        missing = [lang for lang in languages if lang not in installed]
+        if missing:
+            return f"Missing Tesseract languages: {', '.join(missing)}"
+        return None
+
+    def with_language(self, lang):
+        if lang == self.lang:
+            return self
+        with self._languages_lock:
+            engine = self._languages.get(lang)
+            if engine is None:
+                engine = self._languages[lang] = TesseractEngine(self.config, lang, self.threads)
+            return engine
+
+    def _run(
+        self,
+        image: Image.Image,
+        extension: str,
+        timeout: Optional[float],
+        cancel_event: Optional[threading.Event],
+        config: Optional[str] = None,
+    ) -> str:
+        """
+        Run Tesseract on an image and return its output for the given extension.
+        """
+        return self._run_outputs(image, (extension,), timeout, cancel_event, config)[extension]
+
+    def _run_outputs(
+        self,
+        image: Image.Image,
+        extensions: Tuple[str, ...],
+        timeout: Optional[float],
+        cancel_event: Optional[threading.Event],
+        config: Optional[str] = None,
+    ) -> Dict[str, str]:
+        """
+        Run Tesseract once on an image and return its outputs for the given extensions.
+        """
+        if cancel_event is not None and cancel_event.is_set():
+            raise OCRCancelledError("OCR cancelled")
+        if timeout is not None and timeout <= 0:
+            raise OCRTimeoutError("OCR time budget exhausted")
+
+        with tempfile.TemporaryDirectory(prefix="ocr_") as tmp_dir:
+            input_path = os.path.join(tmp_dir, "input.png")
+            output_base = os.path.join(tmp_dir, "output")
+            image.save(input_path, format="PNG")
+
+            cmd_args = [pytesseract.pytesseract.tesseract_cmd, input_path, output_base]
+            if self.lang:
+                cmd_args += ["-l", self.lang]
+            cmd_args += shlex.split(config if config is not None else self.config,
+                                    posix=sys.platform != "win32")
+            cmd_args += list(extensions)
+
+            try:
+                proc = subprocess.Popen(
+                    cmd_args, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+                    env=self.process_env()
+                )
+            except FileNotFoundError:
+                raise pytesseract.TesseractNotFoundError()
+
+            error_output = self._wait(proc, timeout, cancel_event)
+            if proc.returncode:
+                raise pytesseract.TesseractError(
+                    proc.returncode, " ".join(error_output.decode("utf-8", "replace").splitlines()).strip()
+                )
+
+            outputs = {}
+            for extension in extensions:
+                with open(f"{output_base}.{extension}", "r", encoding="utf-8") as output:
+                    outputs[extension] = output.read()
+            return outputs
+
+    def process_env(self) -> Optional[Dict[str, str]]:
+        """
+        Get the environment of the Tesseract processes, limiting their OpenMP
+        threads when configured.
+
+        Returns:
+            Optional[Dict[str, str]]: Environment, None to inherit the current one
+        """
+        if self.threads <= 0:
+            return None
+        return {**os.environ, "OMP_THREAD_LIMIT": str(self.threads)}
+
+    @staticmethod
+    def _wait(
+        proc: subprocess.Popen,
+        timeout: Optional[float],
+        cancel_event: Optional[threading.Event],
+    ) -> bytes:
+        """
+        Wait for a Tesseract process, killing it on timeout or cancellation.
+
+        Returns:
+            bytes: What the process wrote to stderr
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            wait = CANCEL_POLL_INTERVAL
+            if deadline is not None:
+                wait = min(wait, max(0.0, deadline - time.monotonic()))
+            try:
+                _, error_output = proc.communicate(timeout=wait)
+                return error_output
+            except subprocess.TimeoutExpired:
+                pass
+
+            if cancel_event is not None and cancel_event.is_set():
+                proc.kill()
+                proc.communicate()
+                raise OCRCancelledError("OCR cancelled")
+            if deadline is not None and time.monotonic() >= deadline:
+                proc.kill()
+                proc.communicate()
+                raise OCRTimeoutError(f"OCR did not finish within {timeout:.1f} seconds")
+
+
+# OCR engine used by the pipeline: "tesseract", or "fake" to load test the API
+# without running OCR (see app/fake_engine.py)
+OCR_ENGINE = os.getenv("OCR_ENGINE", "tesseract")
+
+
+def create_engine(name: str = OCR_ENGINE) -> OCREngine:
+    """
+    Create an OCR engine by name.
+
+    Args:
+        name (str): "tesseract" or "fake"
+
+    Returns:
+        OCREngine: The new engine
+
+    Raises:
+        ValueError: If the engine name is unknown
+    """
+    if name == "tesseract":
+        return TesseractEngine()
+    if name == "fake":
+        from .fake_engine import create_fake_engine
+        return create_fake_engine()
+    raise ValueError(f"Unknown OCR engine: {name}")
+
+
+# Engine used by the OCR pipeline
+default_engine = create_engine()
+
+
+def get_engine(lang: Optional[str] = None) -> OCREngine:
+    """
+    Get the OCR engine used by the pipeline.
+
+    Args:
+        lang (Optional[str]): Tesseract language code(s), None for the engine default
+
+    Returns:
+        OCREngine: The configured OCR engine
+    """
+    if lang is None:
+        return default_engine
+    return default_engine.with_language(lang)
+
+
+@lru_cache(maxsize=1)
+def available_languages() -> Optional[FrozenSet[str]]:
+    """
+    Get the languages for which Tesseract has trained data installed.
+    The list is read once and cached for the lifetime of the process.
+
+    Returns:
+        Optional[FrozenSet[str]]: Language codes, or None if Tesseract cannot be run
+    """
+    try:
+        return frozenset(pytesseract.get_languages(config=""))
+    except (pytesseract.TesseractNotFoundError, pytesseract.TesseractError, OSError):
+        return None
@@ -0,0 +1,124 @@
+"""
+Fake OCR engine for load testing the Invoice OCR API.
+This engine does not recognize anything: it replays recorded OCR calls, waiting
+as long as the real engine took and returning the text it produced. It lets
+the API be load tested and sized independently of the OCR speed of the
+machine running the test.
+
+Select it with OCR_ENGINE=fake. FAKE_OCR_PROFILE points to a profile recorded
+with `python -m benchmarks.record_ocr`, a JSON object:
+
+    {"samples": [{"seconds": 2.4, "pixels": 8699840, "text": "FACTURE ..."}]}
+
+Without a profile, latencies follow a log-normal distribution with a median
+of FAKE_OCR_LATENCY seconds and a fixed invoice text is returned.
+"""
+import json
+import os
+import random
+import threading
+from typing import Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from PIL import Image
+
+from .engines import OCREngine, OCRTimeoutError, OCRCancelledError
+
+# Load environment variables
+load_dotenv()
+
+# Recorded profile replayed by the fake engine (empty for the built-in distribution)
+FAKE_OCR_PROFILE = os.getenv("FAKE_OCR_PROFILE", "")
+
+# Median latency (in seconds) and spread of the built-in latency distribution
+FAKE_OCR_LATENCY = float(os.getenv("FAKE_OCR_LATENCY", "2.0"))
+FAKE_OCR_SIGMA = float(os.getenv("FAKE_OCR_SIGMA", "0.4"))
+
+# Text returned when no profile is used
+DEFAULT_TEXT = (
+    "ACME Inc\n"
+    "INVOICE #12345\n"
+    "Date: 01/15/2023\n"
+    "Due Date: 02/15/2023\n"
+    "Total: $1,234.50\n"
+)
+
+
+class FakeEngine(OCREngine):
+    """
+    OCR engine replaying recorded latencies and texts.
+
+    Latencies are scaled by the number of pixels of the image relative to the
+    recorded image, so smaller pages are faster, as with the real engine.
+    """
+
+    name = "fake"
+
+    def __init__(
+        self,
+        samples: Optional[List[Dict]] = None,
+        median: float = FAKE_OCR_LATENCY,
+        sigma: float = FAKE_OCR_SIGMA,
+        seed: Optional[int] = None,
+    ):
+        self.samples = samples or []
+        self.median = median
+        self.sigma = sigma
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+
+    @classmethod
+    def from_profile(cls, path: str) -> "FakeEngine":
+        """
+        Create an engine replaying a recorded profile.
+
+        Args:
+            path (str): Path to the profile JSON file
+
+        Returns:
+            FakeEngine: Engine replaying the profile
+        """
+        with open(path, "r", encoding="utf-8") as profile_file:
+            return cls(samples=json.load(profile_file)["samples"])
+
+    def latency(self, image: Image.Image) -> Tuple[float, str]:
+        """
+        Draw the latency and text of the next call.
+
+        Args:
+            image (Image.Image): Image given to the engine
+
+        Returns:
+            Tuple[float, str]: Latency in seconds and text to return
+        """
+        with self._random_lock:
+            if not self.samples:
+                return self._random.lognormvariate(0, self.sigma) * self.median, DEFAULT_TEXT
+            sample = self._random.choice(self.samples)
+        seconds = sample["seconds"]
+        if sample.get("pixels"):
+            seconds *= image.width * image.height / sample["pixels"]
+        return seconds, sample["text"]
+
+    def image_to_string(self, image, timeout=None, cancel_event=None):
+        seconds, text = self.latency(image)
+        wait = seconds if timeout is None else max(0.0, min(seconds, timeout))
+        # Waiting on the event returns early when the call is cancelled
+        event = cancel_event or threading.Event()
+        if event.wait(wait):
+            raise OCRCancelledError("OCR cancelled")
+        if timeout is not None and seconds > timeout:
+            raise OCRTimeoutError(f"OCR did not finish within {timeout:.1f} seconds")
+        return text
+
+
+def create_fake_engine() -> FakeEngine:
+    """
+    Create the fake engine configured by the environment.
+
+    Returns:
+        FakeEngine: Engine replaying FAKE_OCR_PROFILE, or the built-in distribution
+    """
+    if FAKE_OCR_PROFILE:
+        return FakeEngine.from_profile(FAKE_OCR_PROFILE)
+    return FakeEngine()
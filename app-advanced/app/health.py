@@ -0,0 +1,124 @@
+"""
+Health module for the Invoice OCR API.
+This module tells a load balancer what this replica can do:
+
+- liveness: the process answers requests (restart it otherwise),
+- readiness: it can take OCR work now: the OCR engine can run, the worker pool
+  is not drowning, there is disk space for uploads and the results store can
+  be read (stop sending it traffic otherwise),
+- load: a cheap score for least-loaded routing between ready replicas.
+"""
+import os
+import shutil
+import sqlite3
+from typing import Any, Dict, Optional, Sequence, Tuple
+
+from dotenv import load_dotenv
+
+from .engines import OCREngine
+from .workers import OCRWorkerPool
+
+# Load environment variables
+load_dotenv()
+
+# The pool is saturated when every worker is busy and the oldest queued job has
+# waited longer than this (in seconds)
+READY_MAX_QUEUE_WAIT = float(os.getenv("READY_MAX_QUEUE_WAIT", "10"))
+
+# Maximum number of queued OCR jobs per worker for the replica to be ready
+READY_MAX_QUEUE_PER_WORKER = float(os.getenv("READY_MAX_QUEUE_PER_WORKER", "4"))
+
+# Minimum free space (in MB) in the upload directory for the replica to be ready
+READY_MIN_FREE_MB = float(os.getenv("READY_MIN_FREE_MB", "100"))
+
+
+def check_result(ok: bool, detail: str) -> Dict[str, Any]:
+    """
+    Build the result of a readiness check.
+    """
+    return {"ok": ok, "detail": detail}
+
+
+def check_engine(engine: OCREngine, languages: Sequence[str] = ()) -> Dict[str, Any]:
+    """
+    Check that the OCR engine can run, with the configured languages.
+    """
+    problem = engine.check(tuple(languages))
+    return check_result(problem is None, problem or f"{engine.name} engine available")
+
+
+def check_workers(pool: OCRWorkerPool, max_queue_wait: float = READY_MAX_QUEUE_WAIT) -> Dict[str, Any]:
+    """
+    Check that the worker pool is not saturated: when every worker is busy,
+    queued jobs must still start within max_queue_wait seconds.
+    """
+    stats = pool.stats()
+    wait = pool.oldest_wait()
+    saturated = stats["busy"] >= stats["workers"] and wait > max_queue_wait
+    detail = f"{stats['busy']}/{stats['workers']} workers busy, oldest queued job waiting {wait:.1f} s"
+    return check_result(not saturated, detail)
+
+
+def check_queue(pool: OCRWorkerPool, max_per_worker: float = READY_MAX_QUEUE_PER_WORKER) -> Dict[str, Any]:
+    """
+    Check that the queue of OCR jobs is not too deep.
+    """
+    stats = pool.stats()
+    max_queued = max_per_worker * stats["workers"]
+    return check_result(stats["queued"] <= max_queued, f"{stats['queued']} jobs queued (max {max_queued:g})")
+
+
+def check_disk(path: str, min_free_mb: float = READY_MIN_FREE_MB) -> Dict[str, Any]:
+    """
+    Check that there is enough free disk space for uploads.
+    """
+    try:
+        free_mb = shutil.disk_usage(path).free / (1024 * 1024)
+    except OSError as e:
+        return check_result(False, f"Cannot read the disk usage of {path}: {str(e)}")
+    return check_result(free_mb >= min_free_mb, f"{free_mb:.0f} MB free (min {min_free_mb:g})")
+
+
+def check_store(store) -> Dict[str, Any]:
+    """
+    Check that the results store can be read, if it is enabled.
+    """
+    if store is None:
+        return check_result(True, "disabled")
+    try:
+        store.ping()
+    except sqlite3.Error as e:
+        return check_result(False, f"Cannot read the results store: {str(e)}")
+    return check_result(True, "available")
+
+
+def check_readiness(
+    engine: OCREngine,
+    languages: Sequence[str],
+    pool: OCRWorkerPool,
+    upload_dir: str,
+    store: Optional[Any],
+) -> Tuple[bool, Dict[str, Dict[str, Any]]]:
+    """
+    Run every readiness check. The checks do not run OCR and only touch the
+    disk to read its usage and the results database, so they can be polled often.
+
+    Args:
+        engine (OCREngine): OCR engine of the pipeline
+        languages (Sequence[str]): Language codes the engine must support
+        pool (OCRWorkerPool): OCR worker pool
+        upload_dir (str): Directory the uploads are saved in
+        store (Optional[ResultsStore]): Results store, None if disabled
+
+    Returns:
+        Tuple[bool, Dict[str, Dict[str, Any]]]: Whether every check passed, and
+        the result of each check
+    """
+    checks = {
+        "engine": check_engine(engine, languages),
+        "workers": check_workers(pool),
+        "queue": check_queue(pool),
+        "disk": check_disk(upload_dir),
+        "store": check_store(store),
+    }
+    return all(check["ok"] for check in checks.values()), checks
@@ -0,0 +1,464 @@
+"""
+Hot-folder module for the Invoice OCR API.
+This module runs a daemon that watches a directory where scanners drop invoice
+files, OCRs them in batches on the worker pool, and writes the results next to
+them and/or into the results store.
+
+The directory is laid out as follows:
+
+    <HOTFOLDER_DIR>/               files dropped by the scanners
+    <HOTFOLDER_DIR>/done/          processed files, each with a <name>.json result
+    <HOTFOLDER_DIR>/failed/        files that could not be processed, with a <name>.json error
+    <HOTFOLDER_DIR>/.hotfolder/    claimed files being processed and the journal
+
+A file is claimed by renaming it into .hotfolder/processing, which is atomic on
+a single filesystem: a file is never claimed twice, even by two daemons
+watching the same directory, and a file still being written under a temporary
+name (.part, .tmp) is never picked up. Every claim and outcome is recorded in a
+SQLite journal, and the result of a file is written before the file is moved
+out of processing, so after a crash the daemon resumes the claimed files and
+each file ends up processed exactly once.
+
+Usage (from the app-advanced directory):
+    python -m app.hotfolder [--dir hotfolder] [--once]
+"""
+import argparse
+import asyncio
+import datetime
+import os
+import signal
+import sqlite3
+import threading
+import time
+import uuid
+from typing import List, Optional
+
+from dotenv import load_dotenv
+from fastapi.concurrency import run_in_threadpool
+
+from .imaging import allowed_formats, sniff_format, SNIFF_SIZE
+from .languages import resolve_language
+from .logger import app_logger
+from .ocr_processor import process_invoice_async
+from .responses import dumps_pretty, filter_extracted_data
+from .store import results_store
+from .tracing import span
+from .utils import hash_file
+from .workers import BULK, OCR_WORKERS, request_deadline
+
+# Load environment variables
+load_dotenv()
+
+# Directory watched for new files
+HOTFOLDER_DIR = os.getenv("HOTFOLDER_DIR", "hotfolder")
+
+# Seconds between two scans of the directory
+HOTFOLDER_INTERVAL = float(os.getenv("HOTFOLDER_INTERVAL", "2"))
+
+# Files modified more recently than this (in seconds) may still be written
+HOTFOLDER_SETTLE = float(os.getenv("HOTFOLDER_SETTLE", "2"))
+
+# Files OCRed together; their pages share the worker pool
+HOTFOLDER_BATCH = int(os.getenv("HOTFOLDER_BATCH", str(OCR_WORKERS)))
+
+# Where results go: "file" (a JSON file next to the processed file), "store"
+# (the results store) or "both"
+HOTFOLDER_RESULTS = os.getenv("HOTFOLDER_RESULTS", "file")
+
+# OCR language of the files, empty for OCR_LANGUAGE
+HOTFOLDER_LANGUAGE = os.getenv("HOTFOLDER_LANGUAGE", "")
+
+# A file whose processing was interrupted this many times (e.g. it crashes the
+# daemon) is moved to failed/ instead of being tried again
+HOTFOLDER_MAX_ATTEMPTS = int(os.getenv("HOTFOLDER_MAX_ATTEMPTS", "3"))
+
+# Names of files still being written, never claimed
+PARTIAL_SUFFIXES = (".part", ".partial", ".tmp", ".crdownload")
+
+# User recorded in the results store
+HOTFOLDER_USER = "hotfolder"
+
+# Journal states
+CLAIMED = "claimed"
+DONE = "done"
+FAILED = "failed"
+
+JOURNAL_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS files (
+        name TEXT PRIMARY KEY,
+        original TEXT NOT NULL,
+        state TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        content_hash TEXT,
+        invoice_id INTEGER,
+        error TEXT,
+        claimed_at TEXT NOT NULL,
+        finished_at TEXT
+    )
+"""
+
+
+def now() -> str:
+    """
+    Current UTC time, as stored in the journal.
+    """
+    return datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds")
+
+
+class Journal:
+    """
+    SQLite journal of the claimed files and of their outcome.
+
+    Every change is committed with synchronous=FULL, so a state read after a
+    crash is the last one written. The connection is shared by the event loop
+    and the threads moving the files, one statement at a time.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=10.0, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=FULL")
+        self._conn.execute(JOURNAL_SCHEMA)
+        self._conn.commit()
+
+    def claim(self, name: str, original: str) -> None:
+        """
+        Record a claimed file.
+
+        Args:
+            name (str): Name of the file in the processing directory
+            original (str): Name the file was dropped with
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO files (name, original, state, claimed_at) VALUES (?, ?, ?, ?)",
+                (name, original, CLAIMED, now()),
+            )
+
+    def start(self, name: str) -> int:
+        """
+        Record an attempt at processing a claimed file.
+
+        Returns:
+            int: Number of attempts, this one included
+        """
+        with self._lock, self._conn:
+            self._conn.execute("UPDATE files SET attempts = attempts + 1 WHERE name = ?", (name,))
+            return self._conn.execute("SELECT attempts FROM files WHERE name = ?", (name,)).fetchone()[0]
+
+    def finish(
+        self,
+        name: str,
+        state: str,
+        content_hash: Optional[str] = None,
+        invoice_id: Optional[int] = None,
+        error: Optional[str] = None,
+    ) -> None:
+        """
+        Record the outcome of a file.
+
+        Args:
+            name (str): Name of the file in the processing directory
+            state (str): DONE or FAILED
+            content_hash (Optional[str]): SHA-256 digest of the file content
+            invoice_id (Optional[int]): Id of the result in the results store
+            error (Optional[str]): Why the file failed
+        """
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE files SET state = ?, content_hash = COALESCE(?, content_hash), "
+                "invoice_id = ?, error = ?, finished_at = ? WHERE name = ?",
+                (state, content_hash, invoice_id, error, now(), name),
+            )
+
+    def get(self, name: str) -> Optional[sqlite3.Row]:
+        """
+        Get the journal entry of a file, None if it was never claimed.
+        """
+        with self._lock:
+            return self._conn.execute("SELECT * FROM files WHERE name = ?", (name,)).fetchone()
+
+    def claimed(self) -> List[str]:
+        """
+        List the files claimed but not finished, oldest claim first.
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT name FROM files WHERE state = ? ORDER BY claimed_at, name", (CLAIMED,)
+            ).fetchall()
+        return [row["name"] for row in rows]
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+def original_name(name: str) -> str:
+    """
+    Get the name a file was dropped with from its claimed name.
+    """
+    return name.split("_", 1)[1] if "_" in name else name
+
+
+def write_json(path: str, content) -> None:
+    """
+    Write a JSON document atomically: readers see the whole file or none of it.
+    """
+    temporary = path + ".tmp"
+    with open(temporary, "w", encoding="utf-8") as output:
+        output.write(dumps_pretty(content))
+        output.flush()
+        os.fsync(output.fileno())
+    os.replace(temporary, path)
+
+
+class HotFolder:
+    """
+    Watcher of a hot folder, feeding the dropped files to the OCR workers.
+    """
+
+    def __init__(
+        self,
+        root: str = HOTFOLDER_DIR,
+        batch_size: int = HOTFOLDER_BATCH,
+        settle: float = HOTFOLDER_SETTLE,
+        results: str = HOTFOLDER_RESULTS,
+        lang: Optional[str] = HOTFOLDER_LANGUAGE,
+        max_attempts: int = HOTFOLDER_MAX_ATTEMPTS,
+    ):
+        if results not in ("file", "store", "both"):
+            raise ValueError(f"Invalid results destination: {results}. Use file, store or both")
+        if results == "store" and results_store is None:
+            raise ValueError("The results store is disabled (RESULTS_DB), hot-folder results must go to files")
+        self.root = root
+        self.batch_size = max(1, batch_size)
+        self.settle = settle
+        self.results = results
+        self.lang = resolve_language(lang or None)
+        self.max_attempts = max_attempts
+
+        self.work_dir = os.path.join(root, ".hotfolder")
+        self.processing_dir = os.path.join(self.work_dir, "processing")
+        self.done_dir = os.path.join(root, "done")
+        self.failed_dir = os.path.join(root, "failed")
+        for directory in (self.processing_dir, self.done_dir, self.failed_dir):
+            os.makedirs(directory, exist_ok=True)
+        self.journal = Journal(os.path.join(self.work_dir, "journal.db"))
+
+        if results == "both" and results_store is None:
+            app_logger.warning("The results store is disabled, hot-folder results are only written to files")
+
+    def recover(self) -> List[str]:
+        """
+        Resume after a crash: finish the journal entries of the files whose
+        result was written, and list the claimed files still to process.
+
+        Returns:
+            List[str]: Claimed names of the files to process
+        """
+        # Files renamed into processing just before a crash, never journaled
+        for name in sorted(os.listdir(self.processing_dir)):
+            if self.journal.get(name) is None:
+                self.journal.claim(name, original_name(name))
+
+        pending = []
+        for name in self.journal.claimed():
+            if os.path.exists(os.path.join(self.done_dir, name)):
+                self.journal.finish(name, DONE)
+            elif os.path.exists(os.path.join(self.failed_dir, name)):
+                self.journal.finish(name, FAILED)
+            elif os.path.exists(os.path.join(self.processing_dir, name)):
+                pending.append(name)
+            else:
+                self.journal.finish(name, FAILED, error="The claimed file disappeared")
+        if pending:
+            app_logger.info(f"Hot folder: resuming {len(pending)} interrupted files")
+        return pending
+
+    def scan(self) -> List[str]:
+        """
+        List the files of the hot folder ready to be claimed, oldest first.
+        Hidden files, files still being written and recently modified files
+        are left alone.
+        """
+        ready = []
+        limit = time.time() - self.settle
+        with os.scandir(self.root) as entries:
+            for entry in entries:
+                if entry.name.startswith(".") or entry.name.lower().endswith(PARTIAL_SUFFIXES):
+                    continue
+                try:
+                    if not entry.is_file() or entry.stat().st_mtime > limit:
+                        continue
+                    ready.append((entry.stat().st_mtime, entry.name))
+                except FileNotFoundError:
+                    continue
+        return [name for _, name in sorted(ready)]
+
+    def claim(self, limit: int) -> List[str]:
+        """
+        Claim up to `limit` files by renaming them into the processing directory.
+
+        Returns:
+            List[str]: Claimed names of the files
+        """
+        claimed = []
+        for original in self.scan()[:limit]:
+            name = f"{uuid.uuid4().hex}_{original}"
+            try:
+                os.rename(os.path.join(self.root, original), os.path.join(self.processing_dir, name))
+            except FileNotFoundError:
+                # Claimed by another watcher, or removed
+                continue
+            self.journal.claim(name, original)
+            claimed.append(name)
+        return claimed
+
+    async def process_batch(self, names: List[str]) -> int:
+        """
+        Process claimed files together on the worker pool.
+
+        Returns:
+            int: Number of files processed successfully
+        """
+        outcomes = await asyncio.gather(*(self.process(name) for name in names))
+        return sum(outcomes)
+
+    async def process(self, name: str) -> bool:
+        """
+        Process a claimed file and record its outcome.
+
+        Returns:
+            bool: Whether the file was processed successfully
+        """
+        with span("hotfolder.process", file=original_name(name)):
+            return await self._process(name)
+
+    async def _process(self, name: str) -> bool:
+        path = os.path.join(self.processing_dir, name)
+        original = original_name(name)
+        attempts = self.journal.start(name)
+        if attempts > self.max_attempts:
+            await run_in_threadpool(self.fail, name, f"Interrupted {attempts - 1} times, giving up")
+            return False
+
+        try:
+            content_hash = await run_in_threadpool(hash_file, path)
+            with open(path, "rb") as source:
+                file_format = sniff_format(source.read(SNIFF_SIZE))
+            if file_format not in allowed_formats():
+                raise ValueError(f"Invalid file type. Supported types: {', '.join(allowed_formats())}")
+            deadline = request_deadline(None, time.monotonic())
+            result = await process_invoice_async(path, deadline, self.lang, BULK)
+        except Exception as e:
+            app_logger.warning(f"Hot folder: could not process {original}: {str(e)}")
+            await run_in_threadpool(self.fail, name, str(e))
+            return False
+
+        invoice_id = None
+        if self.results != "file" and results_store is not None:
+            try:
+                invoice_id = await run_in_threadpool(results_store.save, original, content_hash, result, HOTFOLDER_USER)
+            except Exception as e:
+                app_logger.error(f"Hot folder: could not store the result for {original}: {str(e)}")
+        await run_in_threadpool(self.succeed, name, content_hash, result, invoice_id)
+        app_logger.info(f"Hot folder: processed {original}")
+        return True
+
+    def succeed(self, name: str, content_hash: str, result, invoice_id: Optional[int]) -> None:
+        """
+        Write the result of a file, then move it to done/ and journal it.
+        A result that could not be stored is written to a file in any case.
+        """
+        if self.results != "store" or invoice_id is None:
+            write_json(os.path.join(self.done_dir, name + ".json"), {
+                "filename": original_name(name),
+                "content_hash": content_hash,
+                "extracted_data": filter_extracted_data(result.to_model()),
+                "invoice_id": invoice_id,
+            })
+        os.replace(os.path.join(self.processing_dir, name), os.path.join(self.done_dir, name))
+        self.journal.finish(name, DONE, content_hash=content_hash, invoice_id=invoice_id)
+
+    def fail(self, name: str, error: str) -> None:
+        """
+        Write the error of a file, then move it to failed/ and journal it.
+        """
+        write_json(os.path.join(self.failed_dir, name + ".json"), {
+            "filename": original_name(name),
+            "error": error,
+        })
+        os.replace(os.path.join(self.processing_dir, name), os.path.join(self.failed_dir, name))
+        self.journal.finish(name, FAILED, error=error)
+
+    async def run_once(self) -> int:
+        """
+        Process the interrupted files, then the hot folder until it is empty.
+
+        Returns:
+            int: Number of files processed successfully
+        """
+        processed = 0
+        pending = self.recover()
+        while True:
+            batch = pending[:self.batch_size]
+            pending = pending[self.batch_size:]
+            if len(batch) < self.batch_size:
+                batch += self.claim(self.batch_size - len(batch))
+            if not batch:
+                return processed
+            processed += await self.process_batch(batch)
+
+    async def run(self, interval: float = HOTFOLDER_INTERVAL, stop: Optional[asyncio.Event] = None) -> None:
+        """
+        Watch the hot folder until `stop` is set, polling it every `interval`
+        seconds. The batch in progress is finished before stopping.
+        """
+        stop = stop or asyncio.Event()
+        app_logger.info(f"Hot folder: watching {os.path.abspath(self.root)}")
+        while not stop.is_set():
+            await self.run_once()
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=interval)
+            except asyncio.TimeoutError:
+                pass
+        self.journal.close()
+
+
+async def serve(folder: HotFolder, interval: float) -> None:
+    """
+    Run a hot folder until SIGINT or SIGTERM.
+    """
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(signum, stop.set)
+        except (NotImplementedError, RuntimeError):
+            # Not supported on Windows: Ctrl+C stops the daemon at once
+            pass
+    await folder.run(interval, stop)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Watch a directory and OCR the invoice files dropped into it.")
+    parser.add_argument("--dir", default=HOTFOLDER_DIR, help="Directory to watch")
+    parser.add_argument("--interval", type=float, default=HOTFOLDER_INTERVAL, help="Seconds between two scans")
+    parser.add_argument("--batch", type=int, default=HOTFOLDER_BATCH, help="Files OCRed together")
+    parser.add_argument("--results", default=HOTFOLDER_RESULTS, choices=("file", "store", "both"), help="Where results go")
+    parser.add_argument("--once", action="store_true", help="Process the files present and exit")
+    args = parser.parse_args()
+
+    folder = HotFolder(args.dir, batch_size=args.batch, results=args.results)
+    if args.once:
+        processed = asyncio.run(folder.run_once())
+        print(f"Processed {processed} files")
+    else:
+        asyncio.run(serve(folder, args.interval))
+
+
+if __name__ == "__main__":
+    main()
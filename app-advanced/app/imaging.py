@@ -0,0 +1,295 @@
+"""
+Image loading module for the Invoice OCR API.
+This module detects the format of uploaded files from their content and loads
+their frames (pages) one at a time, so that a multi-page TIFF from a fax
+gateway never has to be decoded into memory all at once.
+
+Images are also brought down to the resolution OCR actually needs as early as
+possible: JPEGs are decoded directly at a reduced scale (Pillow draft mode)
+and the number of pixels decoded per image is capped.
+"""
+import os
+from typing import BinaryIO, Iterator, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from PIL import Image, ImageSequence
+
+from .tracing import span
+
+# HEIC/HEIF support is optional and provided by the pillow-heif plugin
+try:
+    from pillow_heif import register_heif_opener
+    register_heif_opener()
+    HEIF_SUPPORTED = True
+except ImportError:  # pragma: no cover - depends on the environment
+    HEIF_SUPPORTED = False
+
+# Load environment variables
+load_dotenv()
+
+# Longest side (in pixels) of the images given to OCR. 3508 px is the height
+# of an A4 page scanned at 300 dpi, more than enough for Tesseract.
+OCR_MAX_SIDE = int(os.getenv("OCR_MAX_SIDE", "3508"))
+
+# Maximum number of pixels decoded for one image (frame), protects the workers
+# against decompression bombs and oversized scans
+MAX_IMAGE_PIXELS = int(os.getenv("MAX_IMAGE_PIXELS", "50000000"))
+
+# Pillow refuses to open images of more than twice Image.MAX_IMAGE_PIXELS
+# pixels. The budget above is checked once the decoder is set up, as JPEGs are
+# decoded at down to 1/8 scale (64 times fewer pixels): Pillow only refuses
+# the images that could not fit in the budget at any scale.
+JPEG_MAX_DRAFT_REDUCTION = 64
+Image.MAX_IMAGE_PIXELS = MAX_IMAGE_PIXELS * JPEG_MAX_DRAFT_REDUCTION // 2
+
+# Number of bytes needed to recognize every supported format
+SNIFF_SIZE = 32
+
+# ISO base media file brands used by HEIC/HEIF images
+HEIF_BRANDS = (b"heic", b"heix", b"hevc", b"hevx", b"heim", b"heis", b"mif1", b"msf1")
+
+# File extensions accepted in ALLOWED_EXTENSIONS, mapped to format names
+EXTENSION_FORMATS = {
+    "png": "png",
+    "jpg": "jpeg",
+    "jpeg": "jpeg",
+    "tif": "tiff",
+    "tiff": "tiff",
+    "webp": "webp",
+    "heic": "heic",
+    "heif": "heic",
+    "pdf": "pdf",
+}
+
+
+class ImageTooLargeError(ValueError):
+    """
+    Raised when an image has more pixels than the decoding budget allows.
+    """
+
+
+def sniff_format(header: bytes) -> Optional[str]:
+    """
+    Detect the format of a file from its first bytes.
+
+    Args:
+        header (bytes): At least the first SNIFF_SIZE bytes of the file
+
+    Returns:
+        Optional[str]: "png", "jpeg", "tiff", "webp", "heic", "pdf" or None if unknown
+    """
+    if header.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if header.startswith(b"\xff\xd8\xff"):
+        return "jpeg"
+    if header[:4] in (b"II*\x00", b"MM\x00*"):
+        return "tiff"
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return "webp"
+    if header[4:8] == b"ftyp" and header[8:12] in HEIF_BRANDS:
+        return "heic"
+    if header.startswith(b"%PDF-"):
+        return "pdf"
+    return None
+
+
+def detect_format(fileobj: BinaryIO) -> Optional[str]:
+    """
+    Detect the format of a file object without consuming it.
+
+    Args:
+        fileobj (BinaryIO): Seekable binary file object
+
+    Returns:
+        Optional[str]: Format name (see sniff_format) or None if unknown
+    """
+    position = fileobj.tell()
+    header = fileobj.read(SNIFF_SIZE)
+    fileobj.seek(position)
+    return sniff_format(header)
+
+
+def allowed_formats() -> List[str]:
+    """
+    Get the formats accepted for upload.
+
+    The ALLOWED_EXTENSIONS environment variable lists them as file extensions
+    (e.g. "png,jpg,tiff"); the actual check is done on the file content.
+    PDF input is not supported by the OCR pipeline yet and HEIC requires the
+    optional pillow-heif package, so neither is ever reported as allowed
+    when it cannot be processed.
+
+    Returns:
+        List[str]: Format names
+    """
+    allowed_extensions = os.getenv("ALLOWED_EXTENSIONS", "png,jpg,jpeg,tif,tiff,webp,heic")
+    formats = []
+    for ext in allowed_extensions.split(","):
+        name = EXTENSION_FORMATS.get(ext.strip().lower().lstrip("."))
+        if name is None or name == "pdf" or (name == "heic" and not HEIF_SUPPORTED):
+            continue
+        if name not in formats:
+            formats.append(name)
+    return formats
+
+
+def draft_size(size: Tuple[int, int], max_side: int = OCR_MAX_SIDE) -> Optional[Tuple[int, int]]:
+    """
+    Compute the size to request from the JPEG decoder for an image.
+
+    Args:
+        size (Tuple[int, int]): Full size of the image
+        max_side (int): Longest side wanted for OCR
+
+    Returns:
+        Optional[Tuple[int, int]]: Requested size, or None if the image is small enough
+    """
+    width, height = size
+    longest = max(width, height)
+    if longest <= max_side:
+        return None
+    scale = max_side / longest
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+
+def check_pixel_budget(image: Image.Image) -> None:
+    """
+    Make sure an image can be decoded within the pixel budget.
+
+    Args:
+        image (Image.Image): Opened (not yet decoded) image
+
+    Raises:
+        ImageTooLargeError: If the image has more than MAX_IMAGE_PIXELS pixels
+    """
+    pixels = image.width * image.height
+    if pixels > MAX_IMAGE_PIXELS:
+        raise ImageTooLargeError(
+            f"Image too large: {image.width}x{image.height} pixels "
+            f"(maximum {MAX_IMAGE_PIXELS} pixels)"
+        )
+
+
+def reduce_for_ocr(image: Image.Image, max_side: int = OCR_MAX_SIDE) -> Image.Image:
+    """
+    Shrink a decoded image by an integer factor if it is far above the OCR resolution.
+
+    Image.reduce() is much cheaper than a resampling resize, and an integer
+    factor keeps the longest side at or above `max_side`.
+
+    Args:
+        image (Image.Image): Decoded image
+        max_side (int): Longest side wanted for OCR
+
+    Returns:
+        Image.Image: The reduced image, or the same image if it is small enough
+    """
+    factor = max(image.size) // max_side
+    if factor < 2:
+        return image
+    return image.reduce(factor)
+
+
+def open_image(file_path: str) -> Image.Image:
+    """
+    Open an image file without decoding it.
+
+    Args:
+        file_path (str): Path to the image file
+
+    Returns:
+        Image.Image: The opened image
+
+    Raises:
+        ImageTooLargeError: If Pillow refuses the image as a decompression bomb
+    """
+    try:
+        return Image.open(file_path)
+    except Image.DecompressionBombError:
+        raise ImageTooLargeError(f"Image too large (maximum {MAX_IMAGE_PIXELS} pixels)")
+
+
+def iter_frames(file_path: str) -> Iterator[Image.Image]:
+    """
+    Iterate over the frames (pages) of an image file, decoding one at a time.
+
+    JPEG images are decoded in grayscale at the smallest scale that is still
+    at least OCR_MAX_SIDE pixels on the longest side. Other formats are
+    decoded at full size and then reduced.
+
+    Each yielded frame is an independent copy, so it can be handed to another
+    thread while the next one is being decoded.
+
+    Args:
+        file_path (str): Path to the image file
+
+    Yields:
+        Image.Image: Each frame of the image
+
+    Raises:
+        ImageTooLargeError: If a frame exceeds the pixel budget
+    """
+    with span("Image.open") as open_span:
+        image = open_image(file_path)
+        if open_span is not None:
+            open_span.set_attribute("image.format", image.format)
+    with image:
+        prepare_decoder(image)
+        for frame in ImageSequence.Iterator(image):
+            check_pixel_budget(frame)
+            yield reduce_for_ocr(frame.copy(), OCR_MAX_SIDE)
+
+
+def count_frames(file_path: str) -> int:
+    """
+    Count the frames (pages) of an image file without decoding them.
+
+    Args:
+        file_path (str): Path to the image file
+
+    Returns:
+        int: Number of frames
+
+    Raises:
+        ImageTooLargeError: If Pillow refuses the image as a decompression bomb
+    """
+    with open_image(file_path) as image:
+        return getattr(image, "n_frames", 1)
+
+
+def load_frame(file_path: str, index: int) -> Image.Image:
+    """
+    Decode a single frame (page) of an image file, exactly as iter_frames yields it.
+
+    Args:
+        file_path (str): Path to the image file
+        index (int): Index of the frame, from 0
+
+    Returns:
+        Image.Image: The frame
+
+    Raises:
+        ImageTooLargeError: If the frame exceeds the pixel budget
+        EOFError: If the file has no such frame
+    """
+    with open_image(file_path) as image:
+        prepare_decoder(image)
+        image.seek(index)
+        check_pixel_budget(image)
+        return reduce_for_ocr(image.copy(), OCR_MAX_SIDE)
+
+
+def prepare_decoder(image: Image.Image) -> None:
+    """
+    Set up the decoding of an opened image: JPEG images are decoded in
+    grayscale at the smallest scale that is still at least OCR_MAX_SIDE pixels
+    on the longest side.
+
+    Args:
+        image (Image.Image): Opened (not yet decoded) image
+    """
+    if image.format == "JPEG":
+        requested = draft_size(image.size, OCR_MAX_SIDE)
+        if requested:
+            # Decode straight to a reduced scale (1/2, 1/4 or 1/8)
+            image.draft("L", requested)
@@ -0,0 +1,159 @@
+"""
+Language module for the Invoice OCR API.
+This module decides which Tesseract language model is used for a document and
+describes how each language writes dates and amounts.
+
+A request can ask for a language explicitly ("fra", "eng+fra") or for "auto":
+the first page is then recognized with all the configured languages at once,
+the language of the document is detected from that text, and the remaining
+pages are recognized with the detected language only.
+"""
+import os
+import re
+import unicodedata
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from dotenv import load_dotenv
+
+from .engines import available_languages
+
+# Load environment variables
+load_dotenv()
+
+# Value of the language setting asking for automatic detection
+AUTO_LANGUAGE = "auto"
+
+# Languages (Tesseract codes) that requests may use, in order of preference
+OCR_LANGUAGES = [
+    lang.strip() for lang in os.getenv("OCR_LANGUAGES", "eng,fra").split(",") if lang.strip()
+]
+
+# Language used when a request does not ask for one ("auto" to detect it)
+OCR_LANGUAGE = os.getenv("OCR_LANGUAGE", AUTO_LANGUAGE)
+
+# Minimum number of keywords found in a text to trust the detected language
+MIN_LANGUAGE_KEYWORDS = 2
+
+
+@dataclass(frozen=True)
+class LanguageProfile:
+    """
+    How invoices in a language write dates and amounts.
+
+    Attributes:
+        code (str): Tesseract language code
+        day_first (bool): Numeric dates are written day first (31/01/2023)
+        decimal_comma (Optional[bool]): Amounts use a decimal comma (1 234,56),
+            None to guess from each amount
+        keywords (frozenset): Common invoice words, used to detect the language
+    """
+    code: str
+    day_first: bool
+    decimal_comma: Optional[bool]
+    keywords: frozenset
+
+
+PROFILES: Dict[str, LanguageProfile] = {
+    "eng": LanguageProfile(
+        code="eng",
+        day_first=False,
+        decimal_comma=None,
+        keywords=frozenset({
+            "invoice", "due", "amount", "payment", "bill", "subtotal", "tax",
+            "quantity", "qty", "description", "price", "from", "the", "and", "of",
+        }),
+    ),
+    "fra": LanguageProfile(
+        code="fra",
+        day_first=True,
+        decimal_comma=True,
+        keywords=frozenset({
+            "facture", "echeance", "montant", "ttc", "ht", "tva", "paiement",
+            "reglement", "payer", "net", "quantite", "designation", "prix",
+            "unitaire", "siret", "le", "la", "les", "des", "du", "et",
+        }),
+    ),
+}
+
+
+def resolve_language(requested: Optional[str]) -> str:
+    """
+    Validate the language asked for by a request.
+
+    Args:
+        requested (Optional[str]): "auto" or Tesseract language code(s) joined
+            with "+", None for the configured default
+
+    Returns:
+        str: Language to use ("auto" or language codes)
+
+    Raises:
+        ValueError: If a language is not one of OCR_LANGUAGES
+    """
+    lang = (requested or OCR_LANGUAGE).strip()
+    if lang == AUTO_LANGUAGE:
+        return lang
+    codes = lang.split("+")
+    unknown = [code for code in codes if code not in OCR_LANGUAGES]
+    if unknown:
+        raise ValueError(
+            f"Unsupported language: {', '.join(unknown)}. "
+            f"Supported languages: {', '.join(OCR_LANGUAGES + [AUTO_LANGUAGE])}"
+        )
+    return lang
+
+
+def detection_languages() -> str:
+    """
+    Get the language model used to recognize the first page in "auto" mode:
+    all configured languages whose trained data is installed.
+
+    Returns:
+        str: Tesseract language codes joined with "+"
+    """
+    installed = available_languages()
+    languages = [lang for lang in OCR_LANGUAGES if installed is None or lang in installed]
+    return "+".join(languages or OCR_LANGUAGES[:1])
+
+
+def detect_language(text: str) -> Optional[str]:
+    """
+    Detect the language of an OCR text from the invoice words it contains.
+
+    Args:
+        text (str): OCR text
+
+    Returns:
+        Optional[str]: Code of the detected language, None if unsure
+    """
+    ascii_text = unicodedata.normalize("NFKD", text).encode("ascii", "ignore").decode("ascii")
+    words = re.findall(r"[a-z]+", ascii_text.lower())
+    scores = {
+        code: sum(1 for word in words if word in profile.keywords)
+        for code, profile in PROFILES.items()
+        if code in OCR_LANGUAGES
+    }
+    if not scores:
+        return None
+    best = max(scores, key=scores.get)
+    if scores[best] < MIN_LANGUAGE_KEYWORDS:
+        return None
+    # A tie is not a decision
+    if list(scores.values()).count(scores[best]) > 1:
+        return None
+    return best
+
+
+def get_profile(lang: Optional[str]) -> Optional[LanguageProfile]:
+    """
+    Get the profile of a language code.
+
+    Args:
+        lang (Optional[str]): Single Tesseract language code
+
+    Returns:
+        Optional[LanguageProfile]: The profile, None for unknown or combined languages
+    """
+    return PROFILES.get(lang) if lang else None
+
@@ -0,0 +1,412 @@
+"""
+Email ingestion module for the Invoice OCR API.
+This module extracts the invoices attached to emails, from a single message
+(.eml) or a whole mailbox (.mbox).
+
+The file is read line by line and split into messages as it is read, so only
+one message is held in memory at a time, whatever the size of the mailbox.
+The image attachments of each message are OCRed in parallel on the worker pool
+while the next messages are being parsed.
+
+Each result is tagged with the Message-ID of its email. An email already
+processed (in the same file, as when a message appears in several exported
+threads, or in the results store) is reported as a duplicate and its
+attachments are not OCRed again.
+
+Usage (from the app-advanced directory):
+    python -m app.mail [--lang eng] [--include-raw-text] inbox.mbox message.eml ...
+"""
+import argparse
+import asyncio
+import hashlib
+import os
+import re
+import tempfile
+import time
+import uuid
+from dataclasses import dataclass, field
+from email import policy
+from email.message import EmailMessage
+from email.parser import BytesParser
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Set
+
+from dotenv import load_dotenv
+from fastapi.concurrency import run_in_threadpool
+
+from .imaging import allowed_formats, sniff_format, SNIFF_SIZE
+from .logger import app_logger
+from .ocr_processor import process_invoice_async
+from .responses import dumps, filter_extracted_data
+from .store import results_store
+from .tracing import span
+from .triage import NotADocumentError
+from .utils import save_buffer
+from .workers import BULK, OCR_WORKERS, request_deadline
+
+# Load environment variables
+load_dotenv()
+
+# Largest message read, in megabytes; the attachments of larger messages are
+# not processed
+MAIL_MAX_MESSAGE_MB = int(os.getenv("MAIL_MAX_MESSAGE_MB", "25"))
+
+# Attachments OCRed at the same time
+MAIL_CONCURRENCY = int(os.getenv("MAIL_CONCURRENCY", str(OCR_WORKERS)))
+
+# User recorded in the results store by the command line
+MAIL_USER = "mail"
+
+# First line of a message: a header field ("Name: value")
+HEADER_LINE = re.compile(rb"^[\x21-\x39\x3b-\x7e]+:")
+
+
+class MailFormatError(ValueError):
+    """
+    Raised when a file is neither an email nor a mailbox.
+    """
+
+
+@dataclass
+class Attachment:
+    """
+    File attached to an email.
+
+    Attributes:
+        filename (str): Name of the attachment
+        content_type (str): MIME type of the attachment
+        payload (bytes): Decoded content
+    """
+    filename: str
+    content_type: str
+    payload: bytes
+
+
+@dataclass
+class MailMessage:
+    """
+    Email with its attachments.
+
+    Attributes:
+        message_id (str): Message-ID, or a digest of the message when it has none
+        subject (Optional[str]): Subject header
+        sender (Optional[str]): From header
+        date (Optional[str]): Date header
+        attachments (List[Attachment]): Attached files
+        error (Optional[str]): Why the message could not be read
+    """
+    message_id: str
+    subject: Optional[str] = None
+    sender: Optional[str] = None
+    date: Optional[str] = None
+    attachments: List[Attachment] = field(default_factory=list)
+    error: Optional[str] = None
+
+
+def header_lines(lines: List[bytes]) -> List[bytes]:
+    """
+    Keep the header lines of a message, up to the first blank line.
+    """
+    for index, line in enumerate(lines):
+        if line in (b"\n", b"\r\n"):
+            return lines[:index + 1]
+    return lines
+
+
+def iter_raw_messages(stream: BinaryIO, max_size: int) -> Iterator[Dict[str, Any]]:
+    """
+    Split an email file into messages, reading it line by line.
+
+    A file starting with a "From " line is a mailbox, where each message starts
+    with such a line ("From " lines of the bodies are escaped as ">From ");
+    any other file is a single message.
+
+    Args:
+        stream (BinaryIO): Email (.eml) or mailbox (.mbox) file
+        max_size (int): Largest message kept whole, in bytes; only the headers
+            of larger messages are kept
+
+    Yields:
+        Dict[str, Any]: "data" (bytes of the message) and "complete" (False
+        when only its headers were kept)
+
+    Raises:
+        MailFormatError: If the file is not an email or a mailbox
+    """
+    lines = iter(stream.readline, b"")
+    first = next(lines, b"")
+    mbox = first.startswith(b"From ")
+    if not mbox and not HEADER_LINE.match(first):
+        raise MailFormatError("The file is not an email (.eml) or a mailbox (.mbox)")
+
+    buffer = [] if mbox else [first]
+    size = len(first) if not mbox else 0
+    complete = True
+    for line in lines:
+        if mbox and line.startswith(b"From "):
+            yield {"data": b"".join(buffer), "complete": complete}
+            buffer, size, complete = [], 0, True
+            continue
+        if mbox and line.startswith(b">") and line.lstrip(b">").startswith(b"From "):
+            line = line[1:]
+        if not complete:
+            continue
+        size += len(line)
+        if size > max_size:
+            buffer, complete = header_lines(buffer), False
+            continue
+        buffer.append(line)
+    if buffer:
+        yield {"data": b"".join(buffer), "complete": complete}
+
+
+def message_id_of(message: EmailMessage, data: bytes) -> str:
+    """
+    Get the Message-ID of a message, without its angle brackets, or a digest
+    of the message when it has none.
+    """
+    message_id = str(message.get("Message-ID") or "").strip().strip("<>").strip()
+    return message_id or "sha256:" + hashlib.sha256(data).hexdigest()
+
+
+def attachments_of(message: EmailMessage) -> List[Attachment]:
+    """
+    List the files attached to a message, including those of forwarded messages.
+    Inline parts are kept when they are named images or documents, as some
+    clients attach scans inline.
+    """
+    attachments = []
+    for part in message.walk():
+        if part.is_multipart():
+            continue
+        filename = part.get_filename()
+        attached = part.get_content_disposition() == "attachment"
+        named_file = filename and part.get_content_maintype() in ("image", "application")
+        if not (attached or named_file):
+            continue
+        payload = part.get_payload(decode=True)
+        if payload:
+            attachments.append(Attachment(os.path.basename(filename or "attachment"), part.get_content_type(), payload))
+    return attachments
+
+
+def parse_message(data: bytes, complete: bool = True) -> MailMessage:
+    """
+    Parse a message and collect its attachments.
+
+    Args:
+        data (bytes): Message, as read from the file
+        complete (bool): False when only the headers of the message were kept
+
+    Returns:
+        MailMessage: Headers and attachments of the message
+    """
+    message = BytesParser(policy=policy.default).parsebytes(data)
+    result = MailMessage(message_id=message_id_of(message, data))
+    try:
+        result.subject = str(message.get("Subject") or "") or None
+        result.sender = str(message.get("From") or "") or None
+        result.date = str(message.get("Date") or "") or None
+    except Exception as e:
+        result.error = f"Invalid headers: {str(e)}"
+        return result
+    if not complete:
+        result.error = f"The message is larger than {MAIL_MAX_MESSAGE_MB} MB"
+        return result
+    try:
+        result.attachments = attachments_of(message)
+    except Exception as e:
+        result.error = f"Invalid message: {str(e)}"
+    return result
+
+
+def iter_messages(stream: BinaryIO, max_size: Optional[int] = None) -> Iterator[MailMessage]:
+    """
+    Parse the messages of an email file one at a time.
+
+    Args:
+        stream (BinaryIO): Email (.eml) or mailbox (.mbox) file
+        max_size (Optional[int]): Largest message processed, in bytes,
+            MAIL_MAX_MESSAGE_MB by default
+
+    Yields:
+        MailMessage: Each message, in file order
+
+    Raises:
+        MailFormatError: If the file is not an email or a mailbox
+    """
+    max_size = MAIL_MAX_MESSAGE_MB * 1024 * 1024 if max_size is None else max_size
+    for raw in iter_raw_messages(stream, max_size):
+        yield parse_message(raw["data"], raw["complete"])
+
+
+async def process_attachment(
+    attachment: Attachment,
+    message_id: str,
+    item: Dict[str, Any],
+    work_dir: str,
+    lang: Optional[str],
+    priority: str,
+    username: Optional[str],
+    include_raw_text: bool,
+    include_items: bool,
+) -> None:
+    """
+    OCR an attachment and fill its result entry.
+    Attachments that are not invoice images are skipped; errors are reported
+    in the entry rather than raised.
+    """
+    file_format = sniff_format(attachment.payload[:SNIFF_SIZE])
+    if file_format not in allowed_formats():
+        item["skipped"] = f"Unsupported file type: {file_format or attachment.content_type}"
+        return
+
+    path = os.path.join(work_dir, f"{uuid.uuid4().hex}_{attachment.filename}")
+    with span("mail.attachment", filename=attachment.filename, message_id=message_id):
+        try:
+            item["content_hash"] = await run_in_threadpool(save_buffer, attachment.payload, path)
+            attachment.payload = b""
+            deadline = request_deadline(None, time.monotonic())
+            result = await process_invoice_async(path, deadline, lang, priority)
+            if results_store is not None:
+                try:
+                    item["invoice_id"] = await run_in_threadpool(
+                        results_store.save, attachment.filename, item["content_hash"], result, username, message_id
+                    )
+                except Exception as e:
+                    app_logger.error(f"Could not store the result for {attachment.filename}: {str(e)}")
+            item["extracted_data"] = filter_extracted_data(
+                result.to_model(), include_raw_text=include_raw_text, include_items=include_items
+            )
+        except NotADocumentError as e:
+            item["skipped"] = str(e)
+        except Exception as e:
+            app_logger.warning(f"Could not process attachment {attachment.filename} of <{message_id}>: {str(e)}")
+            item["error"] = str(e)
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+async def is_duplicate(message_id: str, seen: Set[str]) -> bool:
+    """
+    Tell whether a message was already processed, in this run or before.
+    """
+    if message_id in seen:
+        return True
+    seen.add(message_id)
+    if results_store is None:
+        return False
+    try:
+        return await run_in_threadpool(results_store.has_message, message_id)
+    except Exception as e:
+        app_logger.error(f"Could not look up message <{message_id}>: {str(e)}")
+        return False
+
+
+async def process_mail(
+    stream: BinaryIO,
+    work_dir: str,
+    lang: Optional[str] = None,
+    priority: str = BULK,
+    username: Optional[str] = None,
+    include_raw_text: bool = False,
+    include_items: bool = True,
+    seen: Optional[Set[str]] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Extract the invoices attached to the messages of an email file.
+
+    Messages are parsed one at a time; at most MAIL_CONCURRENCY attachments
+    wait for OCR at once, so parsing pauses while the workers are busy.
+
+    Args:
+        stream (BinaryIO): Email (.eml) or mailbox (.mbox) file
+        work_dir (str): Directory where attachments are written while processed
+        lang (Optional[str]): OCR language or "auto", None for the configured default
+        priority (str): Priority class of the OCR jobs
+        username (Optional[str]): User recorded in the results store
+        include_raw_text (bool): Include the raw OCR text of each invoice
+        include_items (bool): Include the line items of each invoice
+        seen (Optional[Set[str]]): Message-IDs already processed, updated in place
+
+    Returns:
+        List[Dict[str, Any]]: Results of each message (see MailMessageResult)
+
+    Raises:
+        MailFormatError: If the file is not an email or a mailbox
+    """
+    seen = set() if seen is None else seen
+    messages = iter_messages(stream)
+    results = []
+    tasks = []
+    try:
+        while True:
+            message = await run_in_threadpool(next, messages, None)
+            if message is None:
+                break
+            entry = {
+                "message_id": message.message_id,
+                "subject": message.subject,
+                "sender": message.sender,
+                "date": message.date,
+                "duplicate": False,
+                "error": message.error,
+                "attachments": [],
+            }
+            results.append(entry)
+            if message.error:
+                continue
+            if await is_duplicate(message.message_id, seen):
+                entry["duplicate"] = True
+                continue
+
+            for attachment in message.attachments:
+                # Wait for a free slot before writing the next attachment
+                pending = [task for task in tasks if not task.done()]
+                if len(pending) >= MAIL_CONCURRENCY:
+                    await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                item = {"filename": attachment.filename}
+                entry["attachments"].append(item)
+                tasks.append(asyncio.ensure_future(process_attachment(
+                    attachment, message.message_id, item, work_dir, lang, priority, username,
+                    include_raw_text, include_items
+                )))
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+    finally:
+        messages.close()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Extract the invoices attached to .eml and .mbox files.")
+    parser.add_argument("files", nargs="+", help="Email (.eml) or mailbox (.mbox) files")
+    parser.add_argument("--lang", default=None, help="OCR language(s), e.g. fra, eng+fra or auto")
+    parser.add_argument("--include-raw-text", action="store_true", help="Include the raw OCR text")
+    args = parser.parse_args()
+
+    async def run():
+        seen: Set[str] = set()
+        with tempfile.TemporaryDirectory() as work_dir:
+            for path in args.files:
+                with open(path, "rb") as stream:
+                    try:
+                        messages = await process_mail(
+                            stream, work_dir, args.lang, BULK, MAIL_USER,
+                            include_raw_text=args.include_raw_text, seen=seen
+                        )
+                    except MailFormatError as e:
+                        print(f"{path}: {str(e)}")
+                        continue
+                # One JSON line per message
+                for message in messages:
+                    print(dumps({"file": path, **message}).decode("utf-8"))
+
+    asyncio.run(run())
+
+
+if __name__ == "__main__":
+    main()
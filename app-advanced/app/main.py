@@ -5,21 +5,41 @@ This module defines the FastAPI application and its endpoints.
 import os
 import shutil
 import time
-import json
-from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Request, Form, Cookie
+import uuid
+import asyncio
+import datetime
+from fastapi import FastAPI, File, UploadFile, HTTPException, Depends, Request, Form, Cookie, Query, Header
 from fastapi.staticfiles import StaticFiles
-from fastapi.responses import JSONResponse, HTMLResponse, RedirectResponse
+from fastapi.responses import JSONResponse, HTMLResponse, RedirectResponse, StreamingResponse, PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.templating import Jinja2Templates
+from fastapi.concurrency import run_in_threadpool
 from starlette.status import HTTP_303_SEE_OTHER
-from typing import Optional
+from typing import Dict, Optional, Tuple
 import base64
 from dotenv import load_dotenv
 
-from .models import OCRResponse
-from .ocr_processor import process_invoice
-from .auth import authenticate_user, API_USERNAME, verify_password, API_PASSWORD_HASH
+from .models import OCRResponse, StoredInvoice, InvoiceList, MailResponse
+from .ocr_processor import process_invoice_async, invoice_fields
+from .imaging import detect_format, sniff_format, allowed_formats, count_frames, ImageTooLargeError, SNIFF_SIZE
+from .engines import TESSERACT_CONFIG, OCRTimeoutError, OCRCancelledError, get_engine
+from .health import check_readiness
+from .languages import resolve_language, OCR_LANGUAGES
+from .mail import process_mail, MailFormatError
+from .auth import authenticate_user, authenticate_admin, API_USERNAME, verify_password, API_PASSWORD_HASH
 from .logger import app_logger
+from .rate_limit import enforce_ocr_quota
+from .triage import NotADocumentError
+from .profiling import profiler, ProfilerMiddleware, ProfilerBusyError, top_calls, stats_text, SAMPLE, PROFILE_SAMPLE_INTERVAL
+from .progress import (
+    Progress, ProgressGroup, progress_registry, current_progress, tracking, report, event_stream, format_event
+)
+from .singleflight import SingleFlight
+from .tracing import tracer, TracingMiddleware, TRACE_EXPORTER
+from .utils import save_upload_file, save_buffer, current_rss_mb, peak_rss
+from .workers import ocr_pool, request_deadline, resolve_priority, OCRBudget, INTERACTIVE, BULK
+from .store import results_store
+from .responses import ORJSONResponse, CompressionMiddleware, filter_extracted_data, dumps_pretty
 
 # Load environment variables from .env file
 load_dotenv()
@@ -28,6 +48,17 @@ load_dotenv()
 UPLOAD_DIR = os.getenv("UPLOAD_DIR", "uploaded_files")
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
+# Largest file accepted by the raw-body upload endpoint, in megabytes
+MAX_UPLOAD_MB = int(os.getenv("MAX_UPLOAD_MB", "50"))
+MAX_UPLOAD_BYTES = MAX_UPLOAD_MB * 1024 * 1024
+
+# Identical concurrent uploads share a single OCR computation
+ocr_singleflight = SingleFlight()
+
+# Shared OCR computations in flight, by key: their budget, raised by the requests
+# joining them, and the trackers of these requests, given its progress events
+shared_computations: Dict[str, Tuple[OCRBudget, ProgressGroup]] = {}
+
 # Initialize FastAPI application
 app = FastAPI(
     title="Invoice OCR API",
@@ -47,6 +78,15 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Compress large responses (Brotli when available, gzip otherwise)
+app.add_middleware(CompressionMiddleware)
+
+# Count the requests of profiling sessions
+app.add_middleware(ProfilerMiddleware, profiler=profiler)
+
+# Record a trace span per request, continuing the caller's trace (outermost, to time everything)
+app.add_middleware(TracingMiddleware)
+
 # Mount static files
 try:
     app.mount("/static", StaticFiles(directory="app/static"), name="static")
@@ -70,72 +110,808 @@ async def root(request: Request):
     
     return {"message": "Welcome to Invoice OCR API"}
 
-@app.post("/extract/", response_model=OCRResponse)
+@app.post("/extract/", response_model=OCRResponse, response_class=ORJSONResponse)
 async def extract_invoice_data(
+    request: Request,
     file: UploadFile = File(...),
-    username: str = Depends(authenticate_user)
+    include_raw_text: bool = Query(True, description="Include the full OCR text in the response"),
+    include_items: bool = Query(True, description="Include the extracted line items in the response"),
+    include_candidates: bool = Query(False, description="Include the ranked candidate values of each field"),
+    lang: Optional[str] = Query(None, description="OCR language (e.g. eng, fra, eng+fra) or auto"),
+    x_request_timeout: Optional[float] = Header(None, description="OCR time budget in seconds"),
+    x_priority: Optional[str] = Header(None, description="OCR priority class: interactive or bulk"),
+    x_job_id: Optional[str] = Header(None, description="Id to follow the extraction with GET /progress/{job_id}"),
+    username: str = Depends(enforce_ocr_quota)
 ):
     """
     Extract data from an uploaded invoice file.
     
     Parameters:
-    - file: The invoice file (PDF, PNG, or JPEG)
+    - file: The invoice file (PNG, JPEG, TIFF, WebP or HEIC, multi-page files are supported)
+    - include_raw_text: Set to false to leave out the (large) raw OCR text
+    - include_items: Set to false to leave out the line items
+    - include_candidates: Set to true to get the ranked candidate values of each field
+    - lang: OCR language, "auto" to detect it (defaults to OCR_LANGUAGE)
+    - X-Request-Timeout header: Time budget in seconds (capped by OCR_MAX_TIMEOUT)
+    - X-Priority header: "interactive" or "bulk" (defaults to the user's priority)
+    - X-Job-Id header: Id to follow the extraction with GET /progress/{job_id} (generated if missing)
     
     Returns:
     - OCRResponse: Extracted invoice data
     """
     app_logger.info(f"User {username} requested data extraction for file: {file.filename}")
+    deadline = request_deadline(x_request_timeout, time.monotonic())
     
-    # Get allowed extensions from environment variable or use defaults
-    allowed_extensions = os.getenv("ALLOWED_EXTENSIONS", "pdf,png,jpg,jpeg")
-    valid_extensions = ["." + ext.strip() for ext in allowed_extensions.split(",")]
-    file_ext = os.path.splitext(file.filename)[1].lower()
+    try:
+        lang = resolve_language(lang)
+        priority = resolve_priority(x_priority, username)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
-    if file_ext not in valid_extensions:
-        error_msg = f"Invalid file type. Supported types: {', '.join(valid_extensions)}"
-        app_logger.warning(f"Invalid file type attempt: {file_ext} for file {file.filename}")
+    # Check the file type from its content, not from its name
+    error_msg = check_file_format(file)
+    if error_msg:
         raise HTTPException(
             status_code=400,
             detail=error_msg
         )
     
-    # Save the uploaded file
-    file_path = os.path.join(UPLOAD_DIR, file.filename)
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    # Save the uploaded file under a unique name, hashing its content on the way
+    progress = start_progress(x_job_id, file.filename, username)
+    file_path = upload_path(file.filename)
+    content_hash = save_upload_file(file.file, file_path)
+    
+    return await extract_saved_file(
+        request, file.filename, file_path, content_hash, deadline, lang, priority, username,
+        include_raw_text=include_raw_text,
+        include_items=include_items,
+        include_candidates=include_candidates,
+        progress=progress
+    )
+
+@app.post("/extract/stream", response_class=StreamingResponse)
+async def extract_invoice_data_stream(
+    request: Request,
+    file: UploadFile = File(...),
+    include_raw_text: bool = Query(True, description="Include the full OCR text in the response"),
+    include_items: bool = Query(True, description="Include the extracted line items in the response"),
+    include_candidates: bool = Query(False, description="Include the ranked candidate values of each field"),
+    lang: Optional[str] = Query(None, description="OCR language (e.g. eng, fra, eng+fra) or auto"),
+    x_request_timeout: Optional[float] = Header(None, description="OCR time budget in seconds"),
+    x_priority: Optional[str] = Header(None, description="OCR priority class: interactive or bulk"),
+    x_job_id: Optional[str] = Header(None, description="Id to follow the extraction with GET /progress/{job_id}"),
+    username: str = Depends(enforce_ocr_quota)
+):
+    """
+    Extract data from an uploaded invoice file, streaming the progress as
+    Server-Sent Events (text/event-stream).
+    
+    The parameters are the same as for /extract/. The stream sends a
+    "progress" event per stage (received, decoded, preprocessed, ocr page k/n
+    with the fields found so far, extracted, done or error), then a "result"
+    event with the same JSON as /extract/, or a "failure" event with the
+    status code and detail of the error.
+    """
+    app_logger.info(f"User {username} requested streamed data extraction for file: {file.filename}")
+    deadline = request_deadline(x_request_timeout, time.monotonic())
     
     try:
-        # Record start time for performance logging
-        start_time = time.time()
-        
-        # Process the invoice with OCR
-        result = process_invoice(file_path)
-        
-        # Log processing time
-        processing_time = time.time() - start_time
-        app_logger.info(f"Processed {file.filename} in {processing_time:.2f} seconds")
-        
-        # Return the extracted data
-        return OCRResponse(
-            filename=file.filename,
-            extracted_data=result
+        lang = resolve_language(lang)
+        priority = resolve_priority(x_priority, username)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    error_msg = check_file_format(file)
+    if error_msg:
+        raise HTTPException(status_code=400, detail=error_msg)
+    
+    progress = start_progress(x_job_id, file.filename, username)
+    file_path = upload_path(file.filename)
+    content_hash = save_upload_file(file.file, file_path)
+    extraction = asyncio.ensure_future(extract_saved_file(
+        request, file.filename, file_path, content_hash, deadline, lang, priority, username,
+        include_raw_text=include_raw_text,
+        include_items=include_items,
+        include_candidates=include_candidates,
+        progress=progress
+    ))
+    
+    async def events():
+        try:
+            async for chunk in event_stream(progress):
+                yield chunk
+            try:
+                response = await extraction
+                yield f"event: result\ndata: {response.body.decode('utf-8')}\n\n"
+            except HTTPException as e:
+                yield format_event({"status_code": e.status_code, "detail": e.detail}, "failure")
+        finally:
+            # The client went away before the end
+            extraction.cancel()
+    
+    return StreamingResponse(events(), media_type="text/event-stream", headers=STREAM_HEADERS)
+
+@app.post("/extract/raw", response_model=OCRResponse, response_class=ORJSONResponse)
+async def extract_raw_invoice_data(
+    request: Request,
+    include_raw_text: bool = Query(True, description="Include the full OCR text in the response"),
+    include_items: bool = Query(True, description="Include the extracted line items in the response"),
+    include_candidates: bool = Query(False, description="Include the ranked candidate values of each field"),
+    content_type: Optional[str] = Header(None, description="application/octet-stream or image/*"),
+    x_filename: Optional[str] = Header(None, description="Original name of the file"),
+    x_language: Optional[str] = Header(None, description="OCR language (e.g. eng, fra, eng+fra) or auto"),
+    x_request_timeout: Optional[float] = Header(None, description="OCR time budget in seconds"),
+    x_priority: Optional[str] = Header(None, description="OCR priority class: interactive or bulk"),
+    x_job_id: Optional[str] = Header(None, description="Id to follow the extraction with GET /progress/{job_id}"),
+    username: str = Depends(enforce_ocr_quota)
+):
+    """
+    Extract data from an invoice file sent as the raw request body.
+    
+    Unlike /extract/, the body is not parsed as multipart/form-data: it is read
+    straight into a buffer of its Content-Length, and the metadata comes in
+    headers. Meant for machine-to-machine integrations.
+    
+    Parameters:
+    - body: The invoice file, with Content-Type application/octet-stream or image/*
+    - include_raw_text, include_items, include_candidates: As for /extract/
+    - X-Filename header: Original name of the file (defaults to "upload")
+    - X-Language header: OCR language, "auto" to detect it (defaults to OCR_LANGUAGE)
+    - X-Request-Timeout header: Time budget in seconds (capped by OCR_MAX_TIMEOUT)
+    - X-Priority header: "interactive" or "bulk" (defaults to the user's priority)
+    - X-Job-Id header: Id to follow the extraction with GET /progress/{job_id} (generated if missing)
+    
+    Returns:
+    - OCRResponse: Extracted invoice data
+    """
+    filename = os.path.basename(x_filename or "") or "upload"
+    app_logger.info(f"User {username} requested raw data extraction for file: {filename}")
+    deadline = request_deadline(x_request_timeout, time.monotonic())
+    
+    media_type = (content_type or "").split(";")[0].strip().lower()
+    if media_type != "application/octet-stream" and not media_type.startswith("image/"):
+        raise HTTPException(
+            status_code=415,
+            detail="Send the file as application/octet-stream or image/*, or use /extract/ for multipart uploads"
+        )
+    
+    try:
+        lang = resolve_language(x_language)
+        priority = resolve_priority(x_priority, username)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    body = await read_raw_body(request)
+    
+    # Check the file type from its content, before writing anything
+    file_format = sniff_format(bytes(body[:SNIFF_SIZE]))
+    valid_formats = allowed_formats()
+    if file_format not in valid_formats:
+        app_logger.warning(f"Invalid file type attempt: {file_format or 'unknown'} for file {filename}")
+        raise HTTPException(
+            status_code=400,
+            detail=f"Invalid file type. Supported types: {', '.join(valid_formats)}"
         )
+    
+    # Pages are decoded lazily from disk, so the body is written once to the upload directory
+    progress = start_progress(x_job_id, filename, username)
+    file_path = upload_path(filename)
+    content_hash = await run_in_threadpool(save_buffer, body, file_path)
+    del body
+    
+    return await extract_saved_file(
+        request, filename, file_path, content_hash, deadline, lang, priority, username,
+        include_raw_text=include_raw_text,
+        include_items=include_items,
+        include_candidates=include_candidates,
+        progress=progress
+    )
+
+@app.post("/extract/mail", response_model=MailResponse, response_class=ORJSONResponse)
+async def extract_mail_invoices(
+    file: UploadFile = File(...),
+    include_raw_text: bool = Query(False, description="Include the full OCR text of each invoice"),
+    include_items: bool = Query(True, description="Include the extracted line items in the response"),
+    lang: Optional[str] = Query(None, description="OCR language (e.g. eng, fra, eng+fra) or auto"),
+    x_priority: Optional[str] = Header(None, description="OCR priority class: interactive or bulk"),
+    username: str = Depends(enforce_ocr_quota)
+):
+    """
+    Extract the invoices attached to an email (.eml) or to the emails of a mailbox (.mbox).
+    
+    Parameters:
+    - file: The .eml or .mbox file
+    - include_raw_text: Set to true to get the raw OCR text of each invoice
+    - include_items: Set to false to leave out the line items
+    - lang: OCR language, "auto" to detect it (defaults to OCR_LANGUAGE)
+    - X-Priority header: "interactive" or "bulk" (defaults to bulk)
+    
+    Returns:
+    - MailResponse: Results of the attachments of each email; emails already
+      processed (same Message-ID) are marked as duplicates and skipped
+    """
+    app_logger.info(f"User {username} requested extraction from email file: {file.filename}")
+    try:
+        lang = resolve_language(lang)
+        priority = resolve_priority(x_priority or BULK, username)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    try:
+        messages = await process_mail(
+            file.file, UPLOAD_DIR, lang, priority, username,
+            include_raw_text=include_raw_text,
+            include_items=include_items
+        )
+    except MailFormatError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    app_logger.info(
+        f"Processed {len(messages)} emails from {file.filename}, "
+        f"{sum(message['duplicate'] for message in messages)} duplicates"
+    )
+    return ORJSONResponse({"filename": file.filename, "messages": messages})
+
+@app.get("/progress", response_class=ORJSONResponse)
+async def list_progress(username: str = Depends(authenticate_user)):
+    """
+    List the extractions of the user in progress or recently finished, with
+    the last stage each one reached and the seconds since its last event
+    (`idle`), to spot a file stuck in the pipeline.
+    """
+    return ORJSONResponse({"jobs": [progress.summary() for progress in progress_registry.list(username)]})
+
+@app.get("/progress/{job_id}")
+async def get_progress(request: Request, job_id: str, username: str = Depends(authenticate_user)):
+    """
+    Follow an extraction started with the X-Job-Id header.
+    
+    With "Accept: text/event-stream", the events are streamed as Server-Sent
+    Events until the extraction is over (past events first). Otherwise, the
+    summary and the events so far are returned as JSON.
+    """
+    progress = await find_progress(job_id, username)
+    if "text/event-stream" in request.headers.get("accept", ""):
+        return StreamingResponse(event_stream(progress), media_type="text/event-stream", headers=STREAM_HEADERS)
+    return ORJSONResponse({**progress.summary(), "events": progress.events})
+
+@app.get("/invoices", response_model=InvoiceList, response_class=ORJSONResponse)
+async def list_invoices(
+    invoice_number: Optional[str] = Query(None, description="Exact invoice number"),
+    vendor: Optional[str] = Query(None, description="Exact vendor name"),
+    vendor_id: Optional[str] = Query(None, description="Id of the canonical vendor"),
+    date_from: Optional[datetime.date] = Query(None, description="Earliest invoice date"),
+    date_to: Optional[datetime.date] = Query(None, description="Latest invoice date"),
+    content_hash: Optional[str] = Query(None, description="SHA-256 digest of the file"),
+    message_id: Optional[str] = Query(None, description="Message-ID of the email the file was attached to"),
+    q: Optional[str] = Query(None, description="Full-text search in the raw OCR text"),
+    limit: int = Query(50, ge=1, le=500, description="Maximum number of invoices per page"),
+    cursor: Optional[str] = Query(None, description="Cursor returned by the previous page"),
+    include_raw_text: bool = Query(False, description="Include the raw OCR text"),
+    username: str = Depends(authenticate_user)
+):
+    """
+    Search the invoices processed so far, newest first.
+    
+    Returns:
+    - InvoiceList: A page of stored invoices and the cursor of the next page
+    """
+    store = get_results_store()
+    try:
+        items, next_cursor = await run_in_threadpool(
+            store.search,
+            invoice_number=invoice_number,
+            vendor=vendor,
+            vendor_id=vendor_id,
+            date_from=date_from,
+            date_to=date_to,
+            content_hash=content_hash,
+            message_id=message_id,
+            text=q,
+            limit=limit,
+            cursor=cursor,
+            include_raw_text=include_raw_text
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return ORJSONResponse({"items": items, "next_cursor": next_cursor})
+
+@app.get("/invoices/{invoice_id}", response_model=StoredInvoice, response_class=ORJSONResponse)
+async def get_invoice(
+    invoice_id: int,
+    include_raw_text: bool = Query(True, description="Include the raw OCR text"),
+    username: str = Depends(authenticate_user)
+):
+    """
+    Get a stored invoice by id.
+    """
+    store = get_results_store()
+    invoice = await run_in_threadpool(store.get, invoice_id, include_raw_text)
+    if invoice is None:
+        raise HTTPException(status_code=404, detail="Invoice not found")
+    return ORJSONResponse(invoice)
+
+def get_results_store():
+    """
+    Get the results store, failing the request if it is disabled.
+    
+    Returns:
+        ResultsStore: The results store
+    """
+    if results_store is None:
+        raise HTTPException(status_code=404, detail="The results store is disabled")
+    return results_store
+
+async def save_result(filename: str, content_hash: str, result, username: Optional[str]) -> Optional[int]:
+    """
+    Save an extraction result in the results store, if it is enabled.
+    A storage failure is logged but does not fail the extraction.
+    
+    Returns:
+        Optional[int]: Id of the stored result, None if it was not stored
+    """
+    if results_store is None:
+        return None
+    try:
+        return await run_in_threadpool(results_store.save, filename, content_hash, result, username)
     except Exception as e:
-        app_logger.error(f"Error processing file {file.filename}: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Error processing invoice: {str(e)}")
-    finally:
-        # Clean up - remove the uploaded file
-        if os.path.exists(file_path):
-            os.remove(file_path)
+        app_logger.error(f"Could not store the result for {filename}: {str(e)}")
+        return None
 
 @app.get("/health")
+@app.get("/health/live")
 async def health_check():
     """
-    Health check endpoint to verify if the API is running.
+    Liveness endpoint: the API is running and answering requests.
     """
     app_logger.debug("Health check endpoint accessed")
     return {"status": "healthy"}
 
+@app.get("/health/ready")
+async def readiness_check():
+    """
+    Readiness endpoint: the API can take OCR work now.
+    Returns 503 with the failed checks when it cannot.
+    """
+    ready, checks = await run_in_threadpool(
+        check_readiness, get_engine(), OCR_LANGUAGES, ocr_pool, UPLOAD_DIR, results_store
+    )
+    if not ready:
+        failed = ", ".join(f"{name} ({check['detail']})" for name, check in checks.items() if not check["ok"])
+        app_logger.warning(f"Not ready: {failed}")
+    return JSONResponse(
+        {"status": "ready" if ready else "not ready", "load": round(ocr_pool.load(), 3), "checks": checks},
+        status_code=200 if ready else 503
+    )
+
+@app.get("/health/load")
+async def load_score():
+    """
+    Load endpoint for least-loaded routing: running and queued OCR jobs per
+    worker (1.0 when every worker is busy and no job is waiting).
+    """
+    return {"load": round(ocr_pool.load(), 3)}
+
+@app.get("/metrics")
+async def metrics():
+    """
+    Metrics endpoint exposing the OCR pipeline counters.
+    """
+    return {
+        "singleflight": ocr_singleflight.stats(),
+        "workers": ocr_pool.stats(),
+        "memory": {
+            "rss_mb": current_rss_mb(),
+            # Since the process started, per-request peaks are logged
+            "process_peak_rss_mb": peak_rss.lifetime_peak_mb(),
+        },
+        "tracing": {
+            "exporter": TRACE_EXPORTER,
+            "dropped_spans": tracer.dropped,
+            "failed_spans": tracer.failed,
+        },
+    }
+
+@app.post("/admin/profile")
+async def profile(
+    mode: str = Query(SAMPLE, description="sample (every thread, low overhead) or cprofile (event-loop thread, exact)"),
+    seconds: float = Query(10.0, description="Duration of the session, in seconds"),
+    requests: Optional[int] = Query(None, description="End the session once this many requests completed"),
+    format: str = Query("json", description="json, collapsed (sample mode) or text (cprofile mode)"),
+    interval: float = Query(PROFILE_SAMPLE_INTERVAL, description="Seconds between two stack samples"),
+    top: int = Query(30, description="Number of functions listed in the json format"),
+    include_idle: bool = Query(False, description="Keep the samples of threads waiting for work"),
+    username: str = Depends(authenticate_admin)
+):
+    """
+    Profile the running service for a number of seconds or of requests, and
+    return where the time went, with the event-loop lag over the session.
+    
+    Formats:
+    - json: summary and the hottest functions
+    - collapsed: collapsed stacks for flamegraph.pl or speedscope (sample mode)
+    - text: the pstats report (cprofile mode)
+    """
+    expected = "collapsed" if mode == SAMPLE else "text"
+    if format not in ("json", expected):
+        raise HTTPException(status_code=400, detail=f"Format must be json or {expected} in {mode} mode")
+    
+    app_logger.info(f"User {username} started a {mode} profiling session ({seconds} s, {requests} requests)")
+    try:
+        summary, results = await profiler.profile(mode, seconds, requests, interval, include_idle)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except ProfilerBusyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    
+    if format == "collapsed":
+        return PlainTextResponse(results.collapsed())
+    if format == "text":
+        return PlainTextResponse(stats_text(results, top))
+    functions = results.top(top) if mode == SAMPLE else top_calls(results, top)
+    return ORJSONResponse({**summary, "functions": functions})
+
+def format_mb(value: Optional[float]) -> str:
+    """
+    Format a memory size for the logs.
+    
+    Args:
+        value (Optional[float]): Size in megabytes, None if unknown
+        
+    Returns:
+        str: Human-readable size
+    """
+    return "unknown" if value is None else f"{value:.1f} MB"
+
+def check_file_format(file: UploadFile) -> Optional[str]:
+    """
+    Check that an uploaded file is in one of the allowed formats.
+    The format is detected from the file content, not from its name.
+    
+    Args:
+        file (UploadFile): Uploaded file
+        
+    Returns:
+        Optional[str]: Error message if the format is not allowed, None otherwise
+    """
+    valid_formats = allowed_formats()
+    file_format = detect_format(file.file)
+    if file_format not in valid_formats:
+        app_logger.warning(f"Invalid file type attempt: {file_format or 'unknown'} for file {file.filename}")
+        return f"Invalid file type. Supported types: {', '.join(valid_formats)}"
+    return None
+
+def upload_path(filename: str) -> str:
+    """
+    Build a unique path in the upload directory for an uploaded file.
+    Concurrent uploads with the same filename must not overwrite each other.
+    
+    Args:
+        filename (str): Original filename sent by the client
+        
+    Returns:
+        str: Path where the upload can be saved
+    """
+    return os.path.join(UPLOAD_DIR, f"{uuid.uuid4().hex}_{os.path.basename(filename)}")
+
+async def read_raw_body(request: Request, max_size: Optional[int] = None) -> bytearray:
+    """
+    Read a request body into memory, without parsing it.
+    
+    When the client sends a Content-Length, the buffer is allocated once at
+    that size and the chunks are copied into it as they arrive; otherwise
+    (chunked transfer encoding) it grows as the chunks arrive.
+    
+    Args:
+        request (Request): Request whose body is read
+        max_size (Optional[int]): Largest accepted body in bytes, MAX_UPLOAD_BYTES by default
+        
+    Returns:
+        bytearray: The request body
+        
+    Raises:
+        HTTPException: 400 if the body does not match its Content-Length,
+        413 if it is larger than max_size
+    """
+    max_size = MAX_UPLOAD_BYTES if max_size is None else max_size
+    too_large = HTTPException(status_code=413, detail=f"The file is larger than {max_size} bytes")
+    
+    length = request.headers.get("content-length")
+    if length is None:
+        buffer = bytearray()
+        async for chunk in request.stream():
+            buffer += chunk
+            if len(buffer) > max_size:
+                raise too_large
+        return buffer
+    
+    try:
+        expected = int(length)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid Content-Length header")
+    if expected > max_size:
+        raise too_large
+    
+    buffer = bytearray(expected)
+    view = memoryview(buffer)
+    received = 0
+    async for chunk in request.stream():
+        end = received + len(chunk)
+        if end > expected:
+            raise HTTPException(status_code=400, detail="The body is longer than its Content-Length")
+        view[received:end] = chunk
+        received = end
+    view.release()
+    if received != expected:
+        raise HTTPException(status_code=400, detail="The body is shorter than its Content-Length")
+    return buffer
+
+async def extract_saved_file(
+    request: Request,
+    filename: str,
+    file_path: str,
+    content_hash: str,
+    deadline: float,
+    lang: Optional[str],
+    priority: str,
+    username: str,
+    include_raw_text: bool = True,
+    include_items: bool = True,
+    include_candidates: bool = False,
+    progress: Optional[Progress] = None
+):
+    """
+    Process an uploaded invoice saved to disk and build the API response.
+    The saved file is removed once processed.
+    
+    Args:
+        request (Request): Request of the upload, watched for disconnection
+        filename (str): Original name of the file
+        file_path (str): Path of the saved file
+        content_hash (str): SHA-256 digest of the file content
+        deadline (float): time.monotonic() value by which OCR must finish
+        lang (Optional[str]): OCR language or "auto", None for the configured default
+        priority (str): Priority class of the OCR jobs
+        username (str): Authenticated user
+        include_raw_text (bool): Include the full OCR text in the response
+        include_items (bool): Include the extracted line items in the response
+        include_candidates (bool): Include the ranked candidate values of each field
+        progress (Optional[Progress]): Tracker of the extraction, None if not tracked
+        
+    Returns:
+        ORJSONResponse: Extracted invoice data
+        
+    Raises:
+        HTTPException: If the invoice could not be processed
+    """
+    with tracking(progress):
+        try:
+            # Record start time for performance logging
+            start_time = time.time()
+            await report_received(progress, file_path)
+            
+            # Process the invoice with OCR
+            with peak_rss.track() as memory:
+                result = await cancel_on_disconnect(request, run_ocr(file_path, content_hash, deadline, lang, priority))
+            
+            # Log processing time and memory usage
+            processing_time = time.time() - start_time
+            report("extracted", seconds=round(processing_time, 3), fields=invoice_fields(result))
+            app_logger.info(
+                f"Processed {filename} in {processing_time:.2f} seconds "
+                f"(RSS {format_mb(current_rss_mb())}, peak RSS during the request {format_mb(memory.peak_mb)}, "
+                f"growth {format_mb(memory.growth_mb)})"
+            )
+            
+            # Keep the result so it can be looked up later
+            invoice_id = await save_result(filename, content_hash, result, username)
+            
+            # Return the extracted data, serialized directly with orjson
+            return ORJSONResponse({
+                "filename": filename,
+                "extracted_data": filter_extracted_data(
+                    result.to_model(),
+                    include_raw_text=include_raw_text,
+                    include_items=include_items,
+                    include_candidates=include_candidates
+                ),
+                "invoice_id": invoice_id
+            }, headers={"X-Job-Id": progress.job_id} if progress else None)
+        except ImageTooLargeError as e:
+            app_logger.warning(f"Rejected oversized image {filename}: {str(e)}")
+            raise HTTPException(status_code=413, detail=str(e))
+        except NotADocumentError as e:
+            app_logger.warning(f"Rejected {filename}: {str(e)}")
+            raise HTTPException(status_code=422, detail=str(e))
+        except OCRTimeoutError as e:
+            app_logger.warning(f"Timed out processing file {filename}: {str(e)}")
+            raise HTTPException(status_code=504, detail=f"Processing timed out: {str(e)}")
+        except OCRCancelledError:
+            app_logger.info(f"Client disconnected, cancelled processing of {filename}")
+            raise HTTPException(status_code=499, detail="Client disconnected")
+        except Exception as e:
+            app_logger.error(f"Error processing file {filename}: {str(e)}")
+            raise HTTPException(status_code=500, detail=f"Error processing invoice: {str(e)}")
+        finally:
+            # Clean up - remove the uploaded file
+            if os.path.exists(file_path):
+                os.remove(file_path)
+
+
+# Headers of event streams: no caching, and no buffering by reverse proxies (nginx)
+STREAM_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+# Seconds GET /progress/{job_id} waits for an extraction that has not started yet
+PROGRESS_WAIT = 5.0
+
+def start_progress(job_id: Optional[str], filename: str, username: Optional[str]) -> Progress:
+    """
+    Start tracking an extraction.
+    
+    Args:
+        job_id (Optional[str]): Id chosen by the client (X-Job-Id header), None to generate one
+        filename (str): Name of the processed file
+        username (Optional[str]): User who submitted the file
+        
+    Returns:
+        Progress: Tracker of the extraction
+        
+    Raises:
+        HTTPException: 400 if the job id is invalid, 409 if it is already in progress
+    """
+    try:
+        return progress_registry.start(job_id or uuid.uuid4().hex, filename, username)
+    except ValueError as e:
+        status_code = 409 if "in progress" in str(e) else 400
+        raise HTTPException(status_code=status_code, detail=str(e))
+
+async def find_progress(job_id: str, username: Optional[str]) -> Progress:
+    """
+    Get the tracker of an extraction of a user, waiting up to PROGRESS_WAIT
+    seconds for it to start, as clients may start following before their
+    upload has arrived.
+    
+    Raises:
+        HTTPException: 404 if there is no such extraction
+    """
+    waited = 0.0
+    progress = progress_registry.get(job_id)
+    while progress is None and waited < PROGRESS_WAIT:
+        await asyncio.sleep(0.1)
+        waited += 0.1
+        progress = progress_registry.get(job_id)
+    if progress is None or progress.username != username:
+        raise HTTPException(status_code=404, detail=f"No extraction with id {job_id}")
+    return progress
+
+async def report_received(progress: Optional[Progress], file_path: str) -> None:
+    """
+    Record that an uploaded file was saved, with its size and number of pages.
+    """
+    if progress is None:
+        return
+    try:
+        progress.pages = await run_in_threadpool(count_frames, file_path)
+    except Exception:
+        # Reported by the extraction itself
+        progress.pages = None
+    progress.emit("received", bytes=os.path.getsize(file_path), pages=progress.pages)
+
+async def run_ocr(
+    file_path: str,
+    content_hash: str,
+    deadline: float,
+    lang: Optional[str] = None,
+    priority: str = INTERACTIVE
+):
+    """
+    Process an invoice on the OCR worker pool, sharing the computation with any
+    identical request (same content and OCR configuration) already in flight.
+    
+    The shared computation runs with the latest deadline and the most urgent
+    priority of the requests waiting for it, but each request still gives up
+    at its own deadline. Its progress events are reported to every request.
+    
+    Args:
+        file_path (str): Path to the saved invoice file
+        content_hash (str): SHA-256 digest of the file content
+        deadline (float): time.monotonic() value by which OCR must finish
+        lang (Optional[str]): OCR language or "auto", None for the configured default
+        priority (str): Priority class of the OCR jobs
+        
+    Returns:
+        ExtractedInvoice: Extracted data from the invoice
+        
+    Raises:
+        OCRTimeoutError: If the result is not ready by the deadline
+    """
+    lang = resolve_language(lang)
+    key = f"{content_hash}:{TESSERACT_CONFIG}:{lang}"
+    shared = shared_computations.get(key)
+    if shared is not None:
+        budget, group = shared
+        ocr_pool.raise_budget(budget, deadline, priority)
+        group.add(current_progress.get(), joined=True)
+    computation = ocr_singleflight.do(
+        key, lambda: start_shared_ocr(key, file_path, lang, OCRBudget(deadline, priority))
+    )
+    try:
+        return await asyncio.wait_for(computation, timeout=max(0.0, deadline - time.monotonic()))
+    except asyncio.TimeoutError:
+        raise OCRTimeoutError("OCR time budget exhausted")
+
+def start_shared_ocr(key: str, file_path: str, lang: str, budget: OCRBudget) -> asyncio.Task:
+    """
+    Start the OCR computation shared by the identical requests for `key`.
+    
+    The computation works on its own link to the file, removed once it ends:
+    the request that started it may go away, and remove its upload, while
+    others still wait for the result.
+    
+    Args:
+        key (str): Single-flight key of the computation
+        file_path (str): Path to the saved invoice file
+        lang (str): OCR language or "auto"
+        budget (OCRBudget): Deadline and priority of the computation
+        
+    Returns:
+        asyncio.Task: The computation
+    """
+    shared_path = f"{file_path}.shared"
+    try:
+        os.link(file_path, shared_path)
+    except OSError:
+        # File systems without hard links
+        shutil.copyfile(file_path, shared_path)
+    group = ProgressGroup([current_progress.get()])
+    shared_computations[key] = (budget, group)
+    task = asyncio.ensure_future(run_shared_ocr(shared_path, lang, budget, group))
+    task.add_done_callback(lambda _: end_shared_ocr(key, budget, shared_path))
+    return task
+
+async def run_shared_ocr(file_path: str, lang: str, budget: OCRBudget, group: ProgressGroup):
+    """
+    Run a shared OCR computation, reporting its progress to the requests waiting for it.
+    """
+    # Set in the context of this task only
+    current_progress.set(group)
+    return await process_invoice_async(file_path, lang=lang, budget=budget)
+
+def end_shared_ocr(key: str, budget: OCRBudget, shared_path: str) -> None:
+    """
+    Clean up after a shared OCR computation, finished or cancelled.
+    """
+    if key in shared_computations and shared_computations[key][0] is budget:
+        del shared_computations[key]
+    if os.path.exists(shared_path):
+        os.remove(shared_path)
+
+# How often (in seconds) a pending request checks whether its client is still there
+DISCONNECT_POLL_INTERVAL = 0.5
+
+async def cancel_on_disconnect(request: Request, awaitable):
+    """
+    Await a coroutine, cancelling it if the client disconnects in the meantime.
+    
+    Args:
+        request (Request): Request whose client is watched
+        awaitable: Coroutine to run
+        
+    Returns:
+        The result of the coroutine
+        
+    Raises:
+        OCRCancelledError: If the client disconnected before the result was ready
+    """
+    task = asyncio.ensure_future(awaitable)
+    while True:
+        done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_INTERVAL)
+        if done:
+            return task.result()
+        if await request.is_disconnected():
+            task.cancel()
+            raise OCRCancelledError("Client disconnected")
+
 
 # From here, implementation of Jinja templates -------------------------------------------------------------------------
 # Web Interface Routes
@@ -155,9 +931,17 @@ async def web_upload_form(request: Request, auth: Optional[str] = Cookie(None)):
     return templates.TemplateResponse("upload.html", {"request": request, "user": user})
 
 @app.post("/web/process", response_class=HTMLResponse)
-async def web_process_invoice(request: Request, file: UploadFile = File(...), auth: Optional[str] = Cookie(None)):
+async def web_process_invoice(
+    request: Request,
+    file: UploadFile = File(...),
+    auth: Optional[str] = Cookie(None),
+    x_job_id: Optional[str] = Header(None)
+):
     """
     Process the uploaded invoice and show results.
+    
+    The upload page sends an X-Job-Id header to follow the progress on
+    /web/progress/{job_id} while waiting for the results.
     """
     app_logger.info(f"Web process request for file: {file.filename}")
     
@@ -166,36 +950,49 @@ async def web_process_invoice(request: Request, file: UploadFile = File(...), au
     if not user:
         return RedirectResponse(url="/web/login", status_code=HTTP_303_SEE_OTHER)
     
-    # Save the uploaded file
-    file_path = os.path.join(UPLOAD_DIR, file.filename)
-    with open(file_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    # Save the uploaded file under a unique name, hashing its content on the way
+    progress = None
+    if x_job_id:
+        try:
+            progress = progress_registry.start(x_job_id, file.filename, user)
+        except ValueError as e:
+            app_logger.warning(f"Progress of {file.filename} not tracked: {str(e)}")
+    file_path = upload_path(file.filename)
+    content_hash = save_upload_file(file.file, file_path)
     
     try:
-        # Get allowed extensions from environment variable or use defaults
-        allowed_extensions = os.getenv("ALLOWED_EXTENSIONS", "pdf,png,jpg,jpeg")
-        valid_extensions = ["." + ext.strip() for ext in allowed_extensions.split(",")]
-        file_ext = os.path.splitext(file.filename)[1].lower()
-        
-        if file_ext not in valid_extensions:
-            error_msg = f"Invalid file type. Supported types: {', '.join(valid_extensions)}"
-            app_logger.warning(f"Invalid file type attempt: {file_ext} for file {file.filename}")
+        # Check the file type from its content, not from its name
+        error_msg = check_file_format(file)
+        if error_msg:
+            if progress is not None:
+                progress.finish(error=error_msg)
             return templates.TemplateResponse(
                 "error.html", 
                 {"request": request, "error": error_msg, "user": user}
             )
         
-        # Process the invoice with OCR
-        result = process_invoice(file_path)
+        # Process the invoice with OCR, ahead of any queued bulk work
+        deadline = request_deadline(None, time.monotonic())
+        with tracking(progress):
+            await report_received(progress, file_path)
+            started = time.perf_counter()
+            result = await cancel_on_disconnect(
+                request, run_ocr(file_path, content_hash, deadline, priority=INTERACTIVE)
+            )
+            report("extracted", seconds=round(time.perf_counter() - started, 3), fields=invoice_fields(result))
+        
+        # Keep the result so it can be looked up later
+        invoice_id = await save_result(file.filename, content_hash, result, user)
         
         # Create the response model
         response_data = OCRResponse(
             filename=file.filename,
-            extracted_data=result
+            extracted_data=result.to_model(),
+            invoice_id=invoice_id
         )
         
         # Convert to JSON for display
-        result_json = json.dumps(response_data.dict(), indent=4)
+        result_json = dumps_pretty(response_data.model_dump(mode="json", exclude={"extracted_data": {"candidates"}}))
         
         # Return the results page
         return templates.TemplateResponse(
@@ -218,6 +1015,17 @@ async def web_process_invoice(request: Request, file: UploadFile = File(...), au
         if os.path.exists(file_path):
             os.remove(file_path)
 
+@app.get("/web/progress/{job_id}")
+async def web_progress(job_id: str, auth: Optional[str] = Cookie(None)):
+    """
+    Stream the progress of an extraction started from the upload page.
+    """
+    user = verify_web_auth(auth)
+    if not user:
+        raise HTTPException(status_code=401, detail="Not logged in")
+    progress = await find_progress(job_id, user)
+    return StreamingResponse(event_stream(progress), media_type="text/event-stream", headers=STREAM_HEADERS)
+
 @app.get("/web/login", response_class=HTMLResponse)
 async def web_login_form(request: Request, auth: Optional[str] = Cookie(None)):
     """
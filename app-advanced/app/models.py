@@ -1,9 +1,61 @@
 """
 Pydantic models for request and response data.
 These models define the expected structure of the API's input and output.
+
+The OCR pipeline itself works with the lightweight `ExtractedInvoice` dataclass;
+it is converted to the validated `InvoiceData` model only when building a response.
 """
+import datetime
+from dataclasses import dataclass
+from decimal import Decimal
 from typing import Dict, Any, Optional, List
-from pydantic import BaseModel
+from pydantic import BaseModel, ConfigDict, field_serializer
+
+class InvoiceData(BaseModel):
+    """
+    Model representing structured invoice data.
+    This is what we aim to extract from the raw OCR text.
+    
+    Attributes:
+        invoice_number (Optional[str]): Invoice identification number
+        date (Optional[datetime.date]): Invoice date (ISO 8601 in JSON)
+        due_date (Optional[datetime.date]): Payment due date (ISO 8601 in JSON)
+        vendor (Optional[str]): Vendor/supplier name, as found in the document
+        vendor_id (Optional[str]): Id of the matching known vendor
+        canonical_vendor (Optional[str]): Name of the matching known vendor
+        total_amount (Optional[Decimal]): Total invoice amount
+        currency (Optional[str]): ISO 4217 currency code of the total amount
+        items (List[Dict[str, Any]]): List of invoice line items
+        language (Optional[str]): Language of the document (Tesseract code, e.g. "fra")
+        confidence (Dict[str, float]): Score (0 to 1) of the value of each field found
+        warnings (List[str]): Inconsistencies found between the fields
+        candidates (Optional[Dict[str, List[Dict[str, Any]]]]): Ranked candidate values
+            of each field, omitted when not requested
+        raw_text (Optional[str]): Raw OCR text, omitted when not requested
+        additional_info (Dict[str, Any]): Any additional information extracted
+    """
+    model_config = ConfigDict(extra="forbid")
+
+    invoice_number: Optional[str] = None
+    date: Optional[datetime.date] = None
+    due_date: Optional[datetime.date] = None
+    vendor: Optional[str] = None
+    vendor_id: Optional[str] = None
+    canonical_vendor: Optional[str] = None
+    total_amount: Optional[Decimal] = None
+    currency: Optional[str] = None
+    items: List[Dict[str, Any]] = []
+    language: Optional[str] = None
+    confidence: Dict[str, float] = {}
+    warnings: List[str] = []
+    candidates: Optional[Dict[str, List[Dict[str, Any]]]] = None
+    raw_text: Optional[str] = None
+    additional_info: Dict[str, Any] = {}
+
+    @field_serializer("total_amount", when_used="json")
+    def serialize_total_amount(self, value: Optional[Decimal]) -> Optional[float]:
+        # Keep amounts as JSON numbers for existing API clients
+        return float(value) if value is not None else None
 
 class OCRResponse(BaseModel):
     """
@@ -11,29 +63,159 @@ class OCRResponse(BaseModel):
     
     Attributes:
         filename (str): Name of the processed file
-        extracted_data (Dict[str, Any]): Extracted data from the invoice
+        extracted_data (InvoiceData): Extracted data from the invoice
+        invoice_id (Optional[int]): Id of the result in the results store
     """
     filename: str
-    extracted_data: Dict[str, Any]
+    extracted_data: InvoiceData
+    invoice_id: Optional[int] = None
 
-class InvoiceData(BaseModel):
+class StoredInvoice(BaseModel):
     """
-    Model representing structured invoice data.
-    This is what we aim to extract from the raw OCR text.
+    Model representing an extraction result kept in the results store.
+    
+    Attributes:
+        id (int): Id of the stored result
+        filename (str): Name of the processed file
+        content_hash (str): SHA-256 digest of the file content
+        username (Optional[str]): User who submitted the file
+        created_at (datetime.datetime): When the result was stored
+        message_id (Optional[str]): Message-ID of the email the file was attached to
+        extracted_data (InvoiceData): Extracted data from the invoice
+    """
+    id: int
+    filename: str
+    content_hash: str
+    username: Optional[str] = None
+    created_at: datetime.datetime
+    message_id: Optional[str] = None
+    extracted_data: InvoiceData
+
+class InvoiceList(BaseModel):
+    """
+    Response model for a page of stored invoices.
+    
+    Attributes:
+        items (List[StoredInvoice]): Invoices of this page, newest first
+        next_cursor (Optional[str]): Cursor of the next page, None on the last page
+    """
+    items: List[StoredInvoice]
+    next_cursor: Optional[str] = None
+
+class MailAttachmentResult(BaseModel):
+    """
+    Result of an invoice attached to an email.
+    
+    Attributes:
+        filename (str): Name of the attachment
+        content_hash (Optional[str]): SHA-256 digest of the attachment
+        extracted_data (Optional[InvoiceData]): Extracted data, None if not processed
+        invoice_id (Optional[int]): Id of the result in the results store
+        skipped (Optional[str]): Why the attachment was not processed (not an invoice image)
+        error (Optional[str]): Why the processing failed
+    """
+    filename: str
+    content_hash: Optional[str] = None
+    extracted_data: Optional[InvoiceData] = None
+    invoice_id: Optional[int] = None
+    skipped: Optional[str] = None
+    error: Optional[str] = None
+
+class MailMessageResult(BaseModel):
+    """
+    Results of the attachments of an email.
+    
+    Attributes:
+        message_id (str): Message-ID of the email (a digest of it when missing)
+        subject (Optional[str]): Subject of the email
+        sender (Optional[str]): From header of the email
+        date (Optional[str]): Date header of the email
+        duplicate (bool): The email was already processed, its attachments were skipped
+        error (Optional[str]): Why the email could not be read
+        attachments (List[MailAttachmentResult]): Results of the attachments
+    """
+    message_id: str
+    subject: Optional[str] = None
+    sender: Optional[str] = None
+    date: Optional[str] = None
+    duplicate: bool = False
+    error: Optional[str] = None
+    attachments: List[MailAttachmentResult] = []
+
+class MailResponse(BaseModel):
+    """
+    Response model for the email extraction endpoint.
+    
+    Attributes:
+        filename (str): Name of the uploaded .eml or .mbox file
+        messages (List[MailMessageResult]): Results of each email, in file order
+    """
+    filename: str
+    messages: List[MailMessageResult]
+
+@dataclass
+class ExtractedInvoice:
+    """
+    Internal, slotted representation of an extracted invoice.
+    Values are already normalized (dates, Decimal amounts, currency code).
     
     Attributes:
         invoice_number (Optional[str]): Invoice identification number
-        date (Optional[str]): Invoice date
-        due_date (Optional[str]): Payment due date
-        vendor (Optional[str]): Vendor/supplier name
-        total_amount (Optional[float]): Total invoice amount
+        date (Optional[datetime.date]): Invoice date
+        due_date (Optional[datetime.date]): Payment due date
+        vendor (Optional[str]): Vendor/supplier name, as found in the document
+        vendor_id (Optional[str]): Id of the matching known vendor
+        canonical_vendor (Optional[str]): Name of the matching known vendor
+        total_amount (Optional[Decimal]): Total invoice amount
+        currency (Optional[str]): ISO 4217 currency code
         items (List[Dict[str, Any]]): List of invoice line items
-        additional_info (Dict[str, Any]): Any additional information extracted
+        language (Optional[str]): Language of the document
+        confidence (Dict[str, float]): Score (0 to 1) of the value of each field found
+        warnings (List[str]): Inconsistencies found between the fields
+        candidates (Dict[str, List[Dict[str, Any]]]): Ranked candidate values of each field
+        raw_text (str): Raw OCR text
     """
-    invoice_number: Optional[str] = None
-    date: Optional[str] = None
-    due_date: Optional[str] = None
-    vendor: Optional[str] = None
-    total_amount: Optional[float] = None
-    items: List[Dict[str, Any]] = []
-    additional_info: Dict[str, Any] = {}
\ No newline at end of file
+    __slots__ = (
+        "invoice_number", "date", "due_date", "vendor", "vendor_id",
+        "canonical_vendor", "total_amount", "currency", "items", "language",
+        "confidence", "warnings", "candidates", "raw_text",
+    )
+
+    invoice_number: Optional[str]
+    date: Optional[datetime.date]
+    due_date: Optional[datetime.date]
+    vendor: Optional[str]
+    vendor_id: Optional[str]
+    canonical_vendor: Optional[str]
+    total_amount: Optional[Decimal]
+    currency: Optional[str]
+    items: List[Dict[str, Any]]
+    language: Optional[str]
+    confidence: Dict[str, float]
+    warnings: List[str]
+    candidates: Dict[str, List[Dict[str, Any]]]
+    raw_text: str
+
+    def to_model(self) -> InvoiceData:
+        """
+        Convert to the validated response model.
+        
+        Returns:
+            InvoiceData: Response model for this invoice
+        """
+        return InvoiceData(
+            invoice_number=self.invoice_number,
+            date=self.date,
+            due_date=self.due_date,
+            vendor=self.vendor,
+            vendor_id=self.vendor_id,
+            canonical_vendor=self.canonical_vendor,
+            total_amount=self.total_amount,
+            currency=self.currency,
+            items=self.items,
+            language=self.language,
+            confidence=self.confidence,
+            warnings=self.warnings,
+            candidates=self.candidates,
+            raw_text=self.raw_text,
+        )
\ No newline at end of file
@@ -2,230 +2,853 @@
 OCR processor module for extracting data from invoices.
 This module contains the logic for processing different file types and extracting information.
 """
-import os
 import re
-import pytesseract
+import time
+import asyncio
+import threading
+from dataclasses import dataclass, replace
+from functools import partial
 from PIL import Image
-from typing import Dict, Any, List
+from decimal import Decimal
+from typing import Dict, Any, Callable, List, Optional, Tuple
 #import pdf2image
 from dotenv import load_dotenv
+from fastapi.concurrency import run_in_threadpool
+
+from .bands import band_count, plan_bands, crop_band, stitch_bands
+from .candidates import (
+    Candidate, WordIndex, find_candidates, check_consistency, needs_retry, crop_line, reread
+)
+from .engines import get_engine, OCRResult, OCRCancelledError
+from .imaging import iter_frames, load_frame
+from .languages import (
+    AUTO_LANGUAGE, LanguageProfile, resolve_language, detection_languages, detect_language, get_profile
+)
+from .logger import app_logger
+from .triage import (
+    OCR_TRIAGE, OCR_OSD, DOCUMENT, NOT_A_DOCUMENT, NotADocumentError, triage, detect_rotation, upright
+)
+from .models import ExtractedInvoice
+from .progress import report, followed
+from .tracing import span
+from .utils import parse_date, parse_amount
+from .vendors import vendor_registry
+from .workers import ocr_pool, OCRBudget, INTERACTIVE
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Set Tesseract executable path from environment variable
-tesseract_cmd_path = os.getenv("TESSERACT_CMD_PATH")
-if tesseract_cmd_path:
-    pytesseract.pytesseract.tesseract_cmd = tesseract_cmd_path
-    
-# Configure path for Tesseract
+# Tesseract is configured in the engines module
 #pytesseract.pytesseract.tesseract_cmd = dotenv_values(".env")['PATH_TESSERACT']
 #PATH_TESSERACT = r'C:\Program Files\Tesseract-OCR\tesseract'
 
-def process_invoice(file_path: str) -> Dict[str, Any]:
+# Separator inserted between the text of consecutive pages (form feed,
+# as Tesseract itself does for multi-page documents)
+PAGE_SEPARATOR = "\f"
+
+def process_invoice(
+    file_path: str,
+    timeout: Optional[float] = None,
+    cancel_event: Optional[threading.Event] = None,
+    lang: Optional[str] = None
+) -> ExtractedInvoice:
     """
     Process an invoice file and extract data using OCR.
     
+    Synchronous entry point of process_invoice_async, run on an event loop
+    of its own: it must not be called from a coroutine.
+    
+    Args:
+        file_path (str): Path to the invoice file
+        timeout (Optional[float]): OCR time budget in seconds, None for no limit
+        cancel_event (Optional[threading.Event]): Set to abort the OCR calls
+        lang (Optional[str]): OCR language(s) or "auto", None for the configured default
+        
+    Returns:
+        ExtractedInvoice: Extracted data from the invoice
+        
+    Raises:
+        OCRTimeoutError: If OCR does not finish within the time budget
+        OCRCancelledError: If the OCR calls are cancelled
+        ValueError: If the language is not supported
+    """
+    deadline = None if timeout is None else time.monotonic() + timeout
+    return asyncio.run(cancellable(process_invoice_async(file_path, deadline, lang), cancel_event))
+
+# How often (in seconds) a synchronous call checks its cancellation event
+CANCEL_POLL_INTERVAL = 0.1
+
+async def cancellable(coroutine, cancel_event: Optional[threading.Event]):
+    """
+    Await a coroutine, cancelling it when the event is set.
+    
+    Raises:
+        OCRCancelledError: If the event was set before the result was ready
+    """
+    task = asyncio.ensure_future(coroutine)
+    while cancel_event is not None and not task.done():
+        await asyncio.wait({task}, timeout=CANCEL_POLL_INTERVAL)
+        if cancel_event.is_set() and not task.done():
+            task.cancel()
+            raise OCRCancelledError("OCR call cancelled")
+    return await task
+
+def check_pages(pages: List[OCRResult]) -> None:
+    """
+    Check that at least one page of a file was recognized.
+    
+    Raises:
+        NotADocumentError: If every page was skipped by the triage
+    """
+    if pages and all(page.skipped for page in pages):
+        if any(page.skipped == NOT_A_DOCUMENT for page in pages):
+            raise NotADocumentError("The file does not look like a document")
+        raise NotADocumentError("Every page of the file is blank")
+
+def triage_warnings(pages: List[OCRResult]) -> List[str]:
+    """
+    Report the pages skipped by the triage.
+    """
+    return [
+        f"Page {index} was skipped: {page.skipped}"
+        for index, page in enumerate(pages, 1) if page.skipped
+    ]
+
+async def process_invoice_async(
+    file_path: str,
+    deadline: Optional[float] = None,
+    lang: Optional[str] = None,
+    priority: str = INTERACTIVE,
+    budget: Optional[OCRBudget] = None
+) -> ExtractedInvoice:
+    """
+    Process an invoice file, running the OCR of each page on the worker pool.
+    
+    Pages are decoded lazily, one at a time; at most one decoded page per
+    worker is kept in memory while waiting for OCR. With the "auto" language,
+    the other pages wait for the language to be detected on the first one.
+    
     Args:
         file_path (str): Path to the invoice file
+        deadline (Optional[float]): time.monotonic() value by which OCR must finish
+        lang (Optional[str]): OCR language(s) or "auto", None for the configured default
+        priority (str): Priority class of the OCR jobs on the worker pool
+        budget (Optional[OCRBudget]): Budget shared with other requests, used instead
+            of deadline and priority
         
     Returns:
-        Dict[str, Any]: Extracted data from the invoice
+        ExtractedInvoice: Extracted data from the invoice
+        
+    Raises:
+        ValueError: If the language is not supported
+    """
+    budget = budget or OCRBudget(deadline, priority)
+    lang = resolve_language(lang)
+    detecting = lang == AUTO_LANGUAGE
+    ocr_lang = detection_languages() if detecting else lang
+    
+    frames = iter_frames(file_path)
+    tasks = []
+    try:
+        while True:
+            # Wait for a free slot before decoding the next page
+            pending = [task for task in tasks if not task.done()]
+            if len(pending) >= ocr_pool.max_workers:
+                await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            
+            started = time.monotonic()
+            page_number = len(tasks) + 1
+            with span("decode", page=page_number):
+                frame = await run_in_threadpool(next, frames, None)
+            if frame is None:
+                break
+            report("decoded", page=page_number, width=frame.width, height=frame.height,
+                   seconds=round(time.monotonic() - started, 3))
+            task = asyncio.ensure_future(ocr_frame(frame, ocr_lang, budget, page_number))
+            tasks.append(task)
+            if detecting:
+                page = await task
+                if not page.skipped:
+                    # The other pages only need the language of the document
+                    ocr_lang = detect_language(page.text) or ocr_lang
+                    detecting = False
+        
+        pages = await asyncio.gather(*tasks)
+    except BaseException:
+        # Stop the other pages as well (timeout, error or cancellation)
+        for task in tasks:
+            task.cancel()
+        raise
+    finally:
+        frames.close()
+    
+    check_pages(pages)
+    text = PAGE_SEPARATOR.join(page.text for page in pages)
+    profile = document_profile(text, ocr_lang)
+    candidates = await run_in_threadpool(collect_candidates, text, profile, pages)
+    await reread_low_confidence(file_path, candidates, profile, ocr_lang, budget, pages)
+    return await run_in_threadpool(build_invoice, text, profile, candidates, pages)
+
+async def ocr_frame(
+    frame: Image.Image,
+    lang: str,
+    budget: OCRBudget,
+    page: int = 1
+) -> OCRResult:
     """
-    # Get file extension
-    file_ext = os.path.splitext(file_path)[1].lower()
+    Triage a page, turn it upright and recognize it on the worker pool.
+    Blank pages and pages that are not documents are skipped (see OCR_TRIAGE).
+    Large pages are split into bands OCRed in parallel when workers are
+    available (see OCR_BANDS).
     
-    # Convert file to image(s) based on file type
-    if file_ext == '.pdf':
-        None
-        # Convert PDF to image
-        #images = pdf2image.convert_from_path(file_path)
-        # For simplicity, we'll just process the first page
-        #image = images[0]
+    Args:
+        frame (Image.Image): Page image
+        lang (str): OCR language(s)
+        budget (OCRBudget): Deadline and priority of the OCR jobs on the worker pool
+        page (int): Page number, from 1, for progress reporting
+        
+    Returns:
+        OCRResult: Recognized text and words of the page
+    """
+    started = time.monotonic()
+    rotation = 0
+    if OCR_TRIAGE or OCR_OSD:
+        with span("preprocess", page=page) as preprocess_span:
+            verdict = await run_in_threadpool(triage, frame)
+            if OCR_OSD and (verdict.kind == DOCUMENT or not OCR_TRIAGE):
+                rotation = await ocr_pool.run(
+                    partial(detect_rotation, digest=verdict.digest), frame, budget=budget
+                )
+                if rotation:
+                    frame = await run_in_threadpool(upright, frame, rotation)
+            if preprocess_span is not None:
+                preprocess_span.set_attribute("page.kind", verdict.kind)
+                preprocess_span.set_attribute("page.rotation", rotation)
+        report("preprocessed", page=page, kind=verdict.kind, rotation=rotation,
+               seconds=round(time.monotonic() - started, 3))
+        if OCR_TRIAGE and verdict.kind != DOCUMENT:
+            report("ocr", page=page, skipped=verdict.kind, seconds=0.0)
+            return OCRResult("", [], frame.size, skipped=verdict.kind)
+    
+    started = time.monotonic()
+    with span("ocr", page=page, lang=lang):
+        result = await ocr_bands(frame, lang, budget)
+    seconds = round(time.monotonic() - started, 3)
+    if followed():
+        report("ocr", page=page, seconds=seconds, fields=await run_in_threadpool(page_fields, result.text, lang))
     else:
-        # For image files (PNG, JPEG)
-        image = Image.open(file_path)
+        report("ocr", page=page, seconds=seconds)
+    return replace(result, rotation=rotation)
+
+# Fields reported page by page while a document is being recognized
+PROGRESS_FIELDS = ("invoice_number", "date", "due_date", "vendor", "total_amount", "currency")
+
+def page_fields(text: str, lang: Optional[str]) -> Dict[str, Any]:
+    """
+    Extract the fields found on a single page, to show them before the whole
+    document is recognized. The final values may differ.
+    """
+    return invoice_fields(extract_invoice_data(text, lang))
+
+def invoice_fields(invoice: ExtractedInvoice) -> Dict[str, Any]:
+    """
+    Get the main fields of an invoice that were found, for progress reporting.
+    """
+    return {field: getattr(invoice, field) for field in PROGRESS_FIELDS if getattr(invoice, field) is not None}
+
+async def ocr_bands(
+    frame: Image.Image,
+    lang: str,
+    budget: OCRBudget
+) -> OCRResult:
+    """
+    Recognize a page on the worker pool, split into bands OCRed in parallel
+    when it is large and workers are available (see OCR_BANDS).
+    """
+    count = band_count(frame, ocr_pool.spare_workers())
+    bands = await run_in_threadpool(plan_bands, frame, count) if count > 1 else []
+    if len(bands) < 2:
+        return await ocr_pool.run(partial(ocr_page, lang=lang), frame, budget=budget)
     
-    # Perform OCR on the image
-    text = pytesseract.image_to_string(image, config='--psm 4')
+    tasks = [
+        asyncio.ensure_future(ocr_pool.run(
+            partial(ocr_page, lang=lang), crop_band(frame, band), budget=budget
+        ))
+        for band in bands
+    ]
+    try:
+        results = await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        raise
+    return stitch_bands(results, bands, frame.size)
+
+async def reread_low_confidence(
+    file_path: str,
+    candidates: Dict[str, List[Candidate]],
+    profile: Optional[LanguageProfile],
+    lang: str,
+    budget: OCRBudget,
+    pages: List[OCRResult]
+) -> None:
+    """
+    Read again, on their own lines only, the values recognized with a low
+    confidence, on the worker pool. The candidates are updated in place.
     
-    # Extract structured data from the OCR text
-    extracted_data = extract_invoice_data(text)
+    Args:
+        file_path (str): Path to the invoice file
+        candidates (Dict[str, List[Candidate]]): Candidates of each field, best first
+        profile (Optional[LanguageProfile]): Language of the document
+        lang (str): OCR language(s)
+        budget (OCRBudget): Deadline and priority of the OCR jobs on the worker pool
+        pages (List[OCRResult]): OCR results of the pages
+    """
+    plan = retry_plan(candidates)
+    if not plan:
+        return
+    crops = await run_in_threadpool(crop_fields, file_path, plan, pages)
+    results = await asyncio.gather(*[
+        ocr_pool.run(partial(ocr_page, lang=lang, single_block=True), crop, budget=budget)
+        for crop in crops
+    ], return_exceptions=True)
+    for (field, candidate), result in zip(plan, results):
+        if isinstance(result, BaseException):
+            # Keep the value read on the whole page
+            app_logger.warning(f"Could not read the {field} field again: {str(result)}")
+            continue
+        candidates[field][0] = reread_field(field, candidate, result, profile)
+
+def ocr_page(
+    image: Image.Image,
+    timeout: Optional[float] = None,
+    cancel_event: Optional[threading.Event] = None,
+    lang: Optional[str] = None,
+    single_block: bool = False
+) -> OCRResult:
+    """
+    Recognize the text and words of a single page (or part of a page).
     
-    return extracted_data
+    Args:
+        image (Image.Image): Page image
+        timeout (Optional[float]): OCR time budget in seconds, None for no limit
+        cancel_event (Optional[threading.Event]): Set to abort the OCR call
+        lang (Optional[str]): Tesseract language code(s), None for the engine default
+        single_block (bool): The image is a single block of text, e.g. a few lines
+        
+    Returns:
+        OCRResult: Recognized text and words
+    """
+    with span("image_to_string", lang=lang or "", width=image.width, height=image.height, single_block=single_block):
+        return get_engine(lang).recognize(image, timeout=timeout, cancel_event=cancel_event, single_block=single_block)
+
+def document_profile(text: str, language: Optional[str]) -> Optional[LanguageProfile]:
+    """
+    Get the language profile of a document: the one of the language it was
+    recognized with, or else the one of the language detected from its text.
+    """
+    return get_profile(language) or get_profile(detect_language(text))
 
-def extract_invoice_data(text: str) -> Dict[str, Any]:
+def extract_invoice_data(
+    text: str,
+    language: Optional[str] = None,
+    pages: Optional[List[OCRResult]] = None
+) -> ExtractedInvoice:
     """
     Extract structured data from OCR text.
     
+    Dates and amounts are read the way the document language writes them
+    (e.g. "31/01/2023" and "1 234,56" in French). The language is detected
+    from the text when it is not a single known language.
+    
+    Args:
+        text (str): OCR text extracted from the invoice
+        language (Optional[str]): Language the text was recognized with
+        pages (Optional[List[OCRResult]]): OCR results of the pages, whose
+            word confidences and positions help rank the candidate values
+        
+    Returns:
+        ExtractedInvoice: Structured invoice data with normalized values
+    """
+    profile = document_profile(text, language)
+    return build_invoice(text, profile, collect_candidates(text, profile, pages), pages)
+
+def collect_candidates(
+    text: str,
+    profile: Optional[LanguageProfile],
+    pages: Optional[List[OCRResult]] = None
+) -> Dict[str, List[Candidate]]:
+    """
+    Find the candidate values of every field.
+    
+    Args:
+        text (str): OCR text extracted from the invoice
+        profile (Optional[LanguageProfile]): Language of the document
+        pages (Optional[List[OCRResult]]): OCR results of the pages, if available
+        
+    Returns:
+        Dict[str, List[Candidate]]: Candidates of each field, best first
+    """
+    index = WordIndex(pages, PAGE_SEPARATOR) if pages else None
+    candidates = {}
+    for field in FIELDS:
+        with span(f"extract_{field}"):
+            candidates[field] = rank_field(field, text, profile, index)
+    return candidates
+
+def build_invoice(
+    text: str,
+    profile: Optional[LanguageProfile],
+    candidates: Dict[str, List[Candidate]],
+    pages: Optional[List[OCRResult]] = None
+) -> ExtractedInvoice:
+    """
+    Choose the value of every field and build the extracted invoice.
+    
     Args:
         text (str): OCR text extracted from the invoice
+        profile (Optional[LanguageProfile]): Language of the document
+        candidates (Dict[str, List[Candidate]]): Candidates of each field, best first
+        pages (Optional[List[OCRResult]]): OCR results of the pages, if available
         
     Returns:
-        Dict[str, Any]: Structured invoice data
+        ExtractedInvoice: Structured invoice data with normalized values
     """
-    # Initialize result dictionary
-    result = {
-        "invoice_number": extract_invoice_number(text),
-        "date": extract_date(text),
-        "due_date": extract_due_date(text),
-        "vendor": extract_vendor(text),
-        "total_amount": extract_total_amount(text),
-        "items": extract_items(text),
-        "raw_text": text,  # Include raw text for reference
-    }
+    with span("extract_items"):
+        items = extract_items(text, profile)
+        charges = extract_charges(text, profile)
+    chosen, warnings = check_consistency(candidates, items, charges)
+    
+    def value(field: str) -> Any:
+        return chosen[field].value if chosen.get(field) else None
     
-    return result
+    vendor = value("vendor")
+    vendor_match = vendor_registry.lookup(vendor)
+    with span("extract_currency"):
+        currency = extract_currency(text)
+    
+    return ExtractedInvoice(
+        invoice_number=value("invoice_number"),
+        date=value("date"),
+        due_date=value("due_date"),
+        vendor=vendor,
+        vendor_id=vendor_match.vendor_id if vendor_match else None,
+        canonical_vendor=vendor_match.name if vendor_match else None,
+        total_amount=value("total_amount"),
+        currency=currency,
+        items=items,
+        language=profile.code if profile else None,
+        confidence={field: round(candidate.score, 3) for field, candidate in chosen.items() if candidate},
+        warnings=triage_warnings(pages or []) + warnings,
+        candidates={field: [candidate.to_dict() for candidate in ranked] for field, ranked in candidates.items()},
+        raw_text=text,  # Include raw text for reference
+    )
 
-def extract_invoice_number(text: str) -> str:
+def rank_field(
+    field: str,
+    text: str,
+    profile: Optional[LanguageProfile] = None,
+    index: Optional[WordIndex] = None
+) -> List[Candidate]:
     """
-    Extract invoice number from OCR text.
+    Find the candidate values of a field, best first.
     
     Args:
+        field (str): Field name (see FIELDS)
         text (str): OCR text
+        profile (Optional[LanguageProfile]): Language of the document
+        index (Optional[WordIndex]): OCR words of the text, if available
         
     Returns:
-        str: Extracted invoice number or None if not found
+        List[Candidate]: Candidates, best first
+    """
+    spec = FIELDS[field]
+    return find_candidates(
+        text,
+        field_patterns(field, profile),
+        partial(spec.parse, profile=profile),
+        index,
+        prefer=spec.prefer,
+        penalty=spec.penalty,
+    )
+
+def field_patterns(field: str, profile: Optional[LanguageProfile]) -> List[str]:
+    """
+    Get the patterns of a field, those of the document language first.
+    """
+    spec = FIELDS[field]
+    return ordered_patterns(spec.patterns, profile.code if profile else None) + list(spec.fallback)
+
+def retry_plan(candidates: Dict[str, List[Candidate]]) -> List[Tuple[str, Candidate]]:
+    """
+    Get the fields whose best value should be read again, by page.
+    """
+    plan = [(field, ranked[0]) for field, ranked in candidates.items() if ranked and needs_retry(ranked[0])]
+    return sorted(plan, key=lambda entry: entry[1].page)
+
+def crop_fields(
+    file_path: str,
+    plan: List[Tuple[str, Candidate]],
+    pages: List[OCRResult]
+) -> List[Image.Image]:
     """
-    # Common patterns for invoice numbers
-    patterns = [
+    Cut the lines of the values to read again out of their pages, decoding
+    each page once and turning it as it was for OCR.
+    """
+    crops = []
+    frame, frame_index = None, None
+    for _, candidate in plan:
+        if candidate.page != frame_index:
+            frame = upright(load_frame(file_path, candidate.page), pages[candidate.page].rotation)
+            frame_index = candidate.page
+        crops.append(crop_line(frame, candidate.box))
+    return crops
+
+def reread_field(
+    field: str,
+    candidate: Candidate,
+    result: OCRResult,
+    profile: Optional[LanguageProfile]
+) -> Candidate:
+    """
+    Use the value of a field read again on its own lines, if it was read more confidently.
+    """
+    spec = FIELDS[field]
+    return reread(candidate, result, field_patterns(field, profile), partial(spec.parse, profile=profile))
+
+# Amounts as written in English and French invoices ("1,234.56", "1 234,56", "1.234,56")
+AMOUNT = r'(\d{1,3}(?:[,. \u00a0\u202f\']\d{3})+[.,]\d{2}|\d+[.,]\d{2})'
+
+# Numeric dates and dates with the month name ("15 mars 2023", "March 15, 2023")
+DATE = (
+    r'(\d{1,2}[/.-]\d{1,2}[/.-]\d{2,4}|\d{4}-\d{1,2}-\d{1,2}'
+    r'|\d{1,2}(?:er)?\s+[^\W\d_]{3,9}\.?\s+\d{4}|[A-Za-z]{3,9}\.?\s+\d{1,2},?\s+\d{4})'
+)
+
+def ordered_patterns(patterns: Dict[str, List[str]], language: Optional[str]) -> List[str]:
+    """
+    Get the patterns of the document language first, then those of the other languages.
+    
+    Args:
+        patterns (Dict[str, List[str]]): Patterns by language code
+        language (Optional[str]): Language of the document, None if unknown
+        
+    Returns:
+        List[str]: Patterns in the order they should be tried
+    """
+    languages = [language] if language in patterns else []
+    languages += [lang for lang in patterns if lang != language]
+    return [pattern for lang in languages for pattern in patterns[lang]]
+
+# Common patterns for invoice numbers
+INVOICE_NUMBER_PATTERNS = {
+    "eng": [
         r'(?i)invoice\s*(?:#|number|num|no)?[:\s]*([A-Z0-9\-]+)',
         r'(?i)inv\s*(?:#|number|num|no)?[:\s]*([A-Z0-9\-]+)',
-    ]
-    
-    for pattern in patterns:
-        match = re.search(pattern, text)
-        if match:
-            return match.group(1).strip()
+    ],
+    "fra": [
+        r'(?i)facture\s*(?:n[°o]|num[ée]ro)\.?\s*:?\s*([A-Z0-9][A-Z0-9\-_/]*)',
+        r'(?i)\bn[°o]\s*(?:de\s+)?facture\s*:?\s*([A-Z0-9][A-Z0-9\-_/]*)',
+    ],
+}
+
+def extract_invoice_number(text: str, language: Optional[str] = None) -> str:
+    """
+    Extract invoice number from OCR text.
     
-    return None
+    Args:
+        text (str): OCR text
+        language (Optional[str]): Language of the document, None if unknown
+        
+    Returns:
+        str: Extracted invoice number or None if not found
+    """
+    return best_text("invoice_number", text, language)
+
+def parse_invoice_number(value: str, profile: Optional[LanguageProfile] = None) -> Optional[str]:
+    """
+    Keep an invoice number only if it has a digit (not a word following "Invoice").
+    """
+    return value if re.search(r'\d', value) else None
 
-def extract_date(text: str) -> str:
+# Common date patterns (MM/DD/YYYY, DD/MM/YYYY, YYYY-MM-DD, month names)
+DATE_PATTERNS = {
+    "eng": [
+        r'(?i)(?:invoice|bill|statement)\s*date\s*(?::|is|of)?[:\s]*' + DATE,
+        r'(?i)date\s*(?::|of|is)?[:\s]*' + DATE,
+    ],
+    "fra": [
+        r"(?i)date\s+(?:de\s+(?:la\s+)?facture|de\s+facturation|d['’][ée]mission)\s*:?\s*" + DATE,
+        r'(?i)facture\s+du\s+' + DATE,
+    ],
+}
+
+def extract_date(text: str, language: Optional[str] = None) -> str:
     """
     Extract invoice date from OCR text.
     
     Args:
         text (str): OCR text
+        language (Optional[str]): Language of the document, None if unknown
         
     Returns:
         str: Extracted date or None if not found
     """
-    # Common date patterns (MM/DD/YYYY, DD/MM/YYYY, YYYY-MM-DD)
-    patterns = [
-        r'(?i)(?:invoice|bill|statement)\s*date\s*(?::|is|of)?[:\s]*(\d{1,2}[/-]\d{1,2}[/-]\d{2,4})',
-        r'(?i)date\s*(?::|of|is)?[:\s]*(\d{1,2}[/-]\d{1,2}[/-]\d{2,4})',
-        r'(?i)date\s*(?::|of|is)?[:\s]*(\d{2,4}[/-]\d{1,2}[/-]\d{1,2})',
-    ]
-    
-    for pattern in patterns:
-        match = re.search(pattern, text)
-        if match:
-            return match.group(1).strip()
-    
-    return None
+    return best_text("date", text, language)
 
-def extract_due_date(text: str) -> str:
+def parse_field_date(value: str, profile: Optional[LanguageProfile] = None):
+    """
+    Parse a date the way the document language writes it.
+    """
+    return parse_date(value, day_first=profile.day_first if profile else False)
+
+# Labels of the dates that are not the invoice date
+DUE_DATE_LABEL = r"(?i)\b(?:due|payment|pay\s+by|[ée]ch[ée]ance|limite)\b"
+
+# Common due date patterns
+DUE_DATE_PATTERNS = {
+    "eng": [
+        r'(?i)(?:due|payment)\s*date\s*(?::|is)?[:\s]*' + DATE,
+        r'(?i)due\s*(?::|by|on)?[:\s]*' + DATE,
+        r'(?i)(?:payment|pay\s+by)\s*(?::|due|on)?[:\s]*' + DATE,
+    ],
+    "fra": [
+        r"(?i)(?:date\s+d['’])?[ée]ch[ée]ance\s*:?\s*(?:le\s+)?" + DATE,
+        r'(?i)date\s+limite\s+de\s+(?:paiement|r[èe]glement)\s*:?\s*' + DATE,
+        r'(?i)(?:[àa]\s+payer|payable)\s+(?:avant\s+le|au\s+plus\s+tard\s+le|le)\s*:?\s*' + DATE,
+    ],
+}
+
+def extract_due_date(text: str, language: Optional[str] = None) -> str:
     """
     Extract due date from OCR text.
     
     Args:
         text (str): OCR text
+        language (Optional[str]): Language of the document, None if unknown
         
     Returns:
         str: Extracted due date or None if not found
     """
-    # Common due date patterns
-    patterns = [
-        r'(?i)(?:due|payment)\s*date\s*(?::|is)?[:\s]*(\d{1,2}[/-]\d{1,2}[/-]\d{2,4})',
-        r'(?i)due\s*(?::|by|on)?[:\s]*(\d{1,2}[/-]\d{1,2}[/-]\d{2,4})',
-        r'(?i)(?:payment|pay\s+by)\s*(?::|due|on)?[:\s]*(\d{1,2}[/-]\d{1,2}[/-]\d{2,4})',
-    ]
-    
-    for pattern in patterns:
-        match = re.search(pattern, text)
-        if match:
-            return match.group(1).strip()
-    
-    return None
+    return best_text("due_date", text, language)
 
-def extract_vendor(text: str) -> str:
+# Look for "From:" or company labels
+VENDOR_PATTERNS = {
+    "eng": [
+        r'(?i)from\s*:?\s*([A-Za-z0-9\s,\.]+(?:Inc|LLC|Ltd|Corp|Corporation|Company|Co)?)',
+        r'(?i)(?:vendor|supplier|biller)\s*:?\s*([A-Za-z0-9\s,\.]+(?:Inc|LLC|Ltd|Corp|Corporation|Company|Co)?)',
+        r'(?i)([A-Za-z0-9\s,\.]+(?:Inc|LLC|Ltd|Corp|Corporation|Company|Co))',
+    ],
+    "fra": [
+        r'(?i)(?:fournisseur|[ée]metteur|vendeur)\s*:\s*([^\n]+)',
+        r'(?m)^([^\n]*?\b(?:SARL|SASU|SAS|EURL|SNC|SA))\b',
+    ],
+}
+
+def extract_vendor(text: str, language: Optional[str] = None) -> str:
     """
     Extract vendor name from OCR text.
     
     Args:
         text (str): OCR text
+        language (Optional[str]): Language of the document, None if unknown
         
     Returns:
         str: Extracted vendor name or None if not found
     """
-    # Look for "From:" or company labels
-    patterns = [
-        r'(?i)from\s*:?\s*([A-Za-z0-9\s,\.]+(?:Inc|LLC|Ltd|Corp|Corporation|Company|Co)?)',
-        r'(?i)(?:vendor|supplier|biller)\s*:?\s*([A-Za-z0-9\s,\.]+(?:Inc|LLC|Ltd|Corp|Corporation|Company|Co)?)',
-        r'(?i)([A-Za-z0-9\s,\.]+(?:Inc|LLC|Ltd|Corp|Corporation|Company|Co))',
-    ]
+    return best_text("vendor", text, language)
+
+def parse_vendor(value: str, profile: Optional[LanguageProfile] = None) -> Optional[str]:
+    """
+    Limit a vendor name to a reasonable length.
+    """
+    return value.strip()[:50].strip() or None
+
+# If nothing else is found, the first line often contains the company name
+VENDOR_FALLBACK = r'\A\s*([^\n]+)'
+
+# Common patterns for total amount
+TOTAL_AMOUNT_PATTERNS = {
+    "eng": [
+        r'(?i)\btotal\s*(?:amount|payment|due)?[:\s]*[\$£€]?\s*' + AMOUNT,
+        r'(?i)amount\s*(?:due|total)?[:\s]*[\$£€]?\s*' + AMOUNT,
+        r'(?i)(?:sub)?total\s*(?:due)?[:\s]*[\$£€]?\s*' + AMOUNT,
+        r'(?i)balance\s*(?:due)?[:\s]*[\$£€]?\s*' + AMOUNT,
+        r'(?i)(?:please\s+)?pay\s*(?:this\s+amount)?[:\s]*[\$£€]?\s*' + AMOUNT,
+    ],
+    "fra": [
+        r'(?i)(?:net\s*[àa]\s*payer|total\s*[àa]\s*payer|(?:total|montant)\s*t\.?\s?t\.?\s?c\.?)\s*:?\s*(?:€|EUR)?\s*' + AMOUNT,
+        r'(?i)montant\s*(?:total|d[ûu])\s*:?\s*(?:€|EUR)?\s*' + AMOUNT,
+    ],
+}
+
+def extract_total_amount(text: str, language: Optional[str] = None) -> Optional[Decimal]:
+    """
+    Extract total amount from OCR text.
     
-    for pattern in patterns:
-        match = re.search(pattern, text)
-        if match:
-            # Clean up the result
-            vendor = match.group(1).strip()
-            # Limit to a reasonable length
-            if len(vendor) > 50:
-                vendor = vendor[:50]
-            return vendor
-    
-    # If nothing found, return first line (often contains company name)
-    lines = text.split('\n')
-    if lines and lines[0].strip():
-        return lines[0].strip()[:50]
+    Args:
+        text (str): OCR text
+        language (Optional[str]): Language of the document, None if unknown
+        
+    Returns:
+        Optional[Decimal]: Extracted total amount or None if not found
+    """
+    ranked = rank_field("total_amount", text, get_profile(language))
+    return ranked[0].value if ranked else None
+
+def parse_field_amount(value: str, profile: Optional[LanguageProfile] = None) -> Optional[Decimal]:
+    """
+    Parse an amount the way the document language writes it.
+    """
+    return parse_amount(value, profile.decimal_comma if profile else None)
+
+# Labels of the amounts that are not the total amount
+SUBTOTAL_LABEL = r'(?i)sub\s*-?\s*total|\bH\.?\s?T\.?(?!\w)|hors\s+tax'
+
+@dataclass(frozen=True)
+class FieldSpec:
+    """
+    How to find the values of an invoice field.
     
-    return None
+    Attributes:
+        patterns (Dict[str, List[str]]): Patterns by language code, by priority
+        parse (Callable): Normalizes a captured value, given the language profile
+        prefer (Optional[str]): Where the value usually is on the page: "top", "bottom" or None
+        penalty (Optional[str]): Labels of values that belong to another field
+        fallback (Tuple[str, ...]): Patterns tried after those of every language
+    """
+    patterns: Dict[str, List[str]]
+    parse: Callable[..., Any]
+    prefer: Optional[str] = None
+    penalty: Optional[str] = None
+    fallback: Tuple[str, ...] = ()
 
-def extract_total_amount(text: str) -> float:
+FIELDS = {
+    "invoice_number": FieldSpec(INVOICE_NUMBER_PATTERNS, parse_invoice_number, prefer="top"),
+    "date": FieldSpec(DATE_PATTERNS, parse_field_date, prefer="top", penalty=DUE_DATE_LABEL),
+    "due_date": FieldSpec(DUE_DATE_PATTERNS, parse_field_date),
+    "vendor": FieldSpec(VENDOR_PATTERNS, parse_vendor, prefer="top", fallback=(VENDOR_FALLBACK,)),
+    "total_amount": FieldSpec(TOTAL_AMOUNT_PATTERNS, parse_field_amount, prefer="bottom", penalty=SUBTOTAL_LABEL),
+}
+
+def best_text(field: str, text: str, language: Optional[str] = None) -> Optional[str]:
     """
-    Extract total amount from OCR text.
+    Get the text of the best value of a field, None if not found.
+    """
+    ranked = rank_field(field, text, get_profile(language))
+    return ranked[0].text if ranked else None
+
+# Currency symbols and codes mapped to ISO 4217 codes
+CURRENCY_SYMBOLS = {
+    '$': 'USD',
+    '£': 'GBP',
+    '€': 'EUR',
+}
+
+def extract_currency(text: str) -> Optional[str]:
+    """
+    Extract the invoice currency from OCR text.
     
     Args:
         text (str): OCR text
         
     Returns:
-        float: Extracted total amount or None if not found
+        Optional[str]: ISO 4217 currency code or None if not found
     """
-    # Common patterns for total amount
-    patterns = [
-        r'(?i)total\s*(?:amount|payment|due)?[:\s]*[\$£€]?([0-9,]+\.[0-9]{2})',
-        r'(?i)amount\s*(?:due|total)?[:\s]*[\$£€]?([0-9,]+\.[0-9]{2})',
-        r'(?i)(?:sub)?total\s*(?:due)?[:\s]*[\$£€]?([0-9,]+\.[0-9]{2})',
-        r'(?i)balance\s*(?:due)?[:\s]*[\$£€]?([0-9,]+\.[0-9]{2})',
-        r'(?i)(?:please\s+)?pay\s*(?:this\s+amount)?[:\s]*[\$£€]?([0-9,]+\.[0-9]{2})',
-    ]
+    # An explicit currency code wins over a symbol
+    match = re.search(r'\b(USD|EUR|GBP|CHF|CAD|AUD)\b', text)
+    if match:
+        return match.group(1)
     
-    for pattern in patterns:
-        match = re.search(pattern, text)
-        if match:
-            # Remove commas and convert to float
-            amount_str = match.group(1).replace(',', '')
-            try:
-                return float(amount_str)
-            except ValueError:
-                continue
+    match = re.search(r'[\$£€]', text)
+    if match:
+        return CURRENCY_SYMBOLS[match.group(0)]
     
     return None
 
-def extract_items(text: str) -> List[Dict[str, Any]]:
+# Amount of a line item, without or with spaces between thousands: "1 234,56" is only read as
+# one amount in languages with a decimal comma, elsewhere "2 125.00" is a quantity and an amount
+ITEM_AMOUNTS = {
+    False: r'(?:\d{1,3}(?:[,.\u00a0\u202f\']\d{3})+[.,]\d{2}|\d+[.,]\d{2})',
+    True: r'(?:\d{1,3}(?:[,. \u00a0\u202f\']\d{3})+[.,]\d{2}|\d+[.,]\d{2})',
+}
+
+# Line of the items table: description, optional quantity and unit price, then the line amount
+ITEM_LINES = {
+    decimal_comma: re.compile(
+        r'^(?P<description>.*?[^\W\d_].*?)\s+'
+        r'(?:(?P<quantity>\d+(?:[.,]\d+)?)\s*[x×@]?\s+[\$£€]?\s*(?P<unit_price>' + amount + r')\s+)?'
+        r'[\$£€]?\s*(?P<amount>' + amount + r')\s*(?:[\$£€]|EUR|USD|GBP)?$'
+    )
+    for decimal_comma, amount in ITEM_AMOUNTS.items()
+}
+
+# Labels of the lines summing up the items, which are not items themselves
+SUMMARY_LABEL = re.compile(
+    r'(?i)total|\bbalance|\bamount|\bdue\b|\bpaid\b|\bpayment|\bdeposit|montant|acompte|[àa]\s+payer'
+    r'|\bH\.?\s?T\.?(?!\w)|\bT\.?\s?T\.?\s?C\.?(?!\w)|hors\s+tax'
+)
+
+# Labels of the amounts added to the items to make up the total
+CHARGE_LABEL = re.compile(r'(?i)\btax|\bVAT\b|\bTVA\b|\bGST\b|shipping|delivery|livraison|frais\s+de\s+port')
+
+def extract_items(text: str, profile: Optional[LanguageProfile] = None) -> List[Dict[str, Any]]:
     """
     Extract line items from OCR text.
     
+    Every line ending with an amount is an item, unless it is labelled as a
+    total, a tax or another amount added to the items (see extract_charges).
+    
     Args:
         text (str): OCR text
+        profile (Optional[LanguageProfile]): Language of the document, None if unknown
         
     Returns:
-        List[Dict[str, Any]]: List of extracted items
+        List[Dict[str, Any]]: Description, quantity, unit price and amount of each item
+    """
+    item_line = ITEM_LINES[bool(profile and profile.decimal_comma)]
+    items = []
+    for line in text.splitlines():
+        match = item_line.match(line.strip())
+        if not match:
+            continue
+        description = match.group("description").strip(" .:-")
+        if SUMMARY_LABEL.search(description) or CHARGE_LABEL.search(description):
+            continue
+        amount = parse_field_amount(match.group("amount"), profile)
+        if amount is None:
+            continue
+        quantity = parse_field_amount(match.group("quantity"), profile)
+        unit_price = parse_field_amount(match.group("unit_price"), profile)
+        items.append({
+            "description": description,
+            "quantity": float(quantity) if quantity is not None else None,
+            "unit_price": float(unit_price) if unit_price is not None else None,
+            # Keep amounts as JSON numbers, like the total amount
+            "amount": float(amount),
+        })
+    return items
+
+def extract_charges(text: str, profile: Optional[LanguageProfile] = None) -> List[Decimal]:
     """
-    # This is a very simplified approach to item extraction
-    # In a real application, you would need a more sophisticated method
-    # that considers table structure, line breaks, etc.
+    Extract the amounts added to the line items to make up the total (taxes, shipping).
     
-    # For this beginner example, we'll return an empty list
-    return []
\ No newline at end of file
+    Args:
+        text (str): OCR text
+        profile (Optional[LanguageProfile]): Language of the document, None if unknown
+        
+    Returns:
+        List[Decimal]: Amount of each charge
+    """
+    item_line = ITEM_LINES[bool(profile and profile.decimal_comma)]
+    charges = []
+    for line in text.splitlines():
+        match = item_line.match(line.strip())
+        if not match:
+            continue
+        description = match.group("description")
+        if CHARGE_LABEL.search(description) and not SUMMARY_LABEL.search(description):
+            amount = parse_field_amount(match.group("amount"), profile)
+            if amount is not None:
+                charges.append(amount)
+    return charges
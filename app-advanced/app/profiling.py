@@ -0,0 +1,366 @@
+"""
+Profiling module for the Invoice OCR API.
+This module profiles the running service on demand, for a number of seconds or
+of requests, to find where the time goes when latency spikes (Tesseract,
+Pillow decoding, field extraction, password hashing or the event loop itself),
+without restarting the process.
+
+Two modes are available:
+
+- sample: the stack of every thread is sampled at a fixed interval. This sees
+  the OCR workers, the thread pool running blocking code and the event loop,
+  at a low, constant overhead. Results are aggregated per function, or as
+  collapsed stacks for flame graph tools (flamegraph.pl, speedscope).
+- cprofile: every call made on the event-loop thread is traced with cProfile.
+  This gives exact call counts, but slows the traced code down and does not see
+  the work done in other threads.
+
+In both modes, the event-loop lag (how late a timer fires, i.e. how long the
+loop was blocked) is measured while profiling.
+"""
+import asyncio
+import cProfile
+import io
+import math
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Longest profiling session, in seconds
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "120"))
+
+# Seconds between two stack samples
+PROFILE_SAMPLE_INTERVAL = float(os.getenv("PROFILE_SAMPLE_INTERVAL", "0.005"))
+
+# Seconds between two event-loop lag measurements
+PROFILE_LAG_INTERVAL = 0.01
+
+# Deepest stack kept by the sampler
+MAX_STACK_DEPTH = 128
+
+# Profiling modes
+SAMPLE = "sample"
+CPROFILE = "cprofile"
+MODES = (SAMPLE, CPROFILE)
+
+# Innermost frames of threads waiting for work: samples ending in them are
+# idle time, not hot paths (waiting for the Tesseract subprocess is kept)
+IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("threading.py", "_wait_for_tstate_lock"),
+    ("selectors.py", "select"),
+    ("queue.py", "get"),
+    ("thread.py", "_worker"),
+}
+
+# Numbers in thread names (ocr_3, AnyIO worker thread...), merged so that
+# flame graphs group the threads of a pool
+THREAD_NUMBER = re.compile(r"[-_ ]?\d+")
+
+
+class ProfilerBusyError(Exception):
+    """Raised when a profiling session is already running."""
+
+
+def frame_label(code) -> str:
+    """
+    Label of a function in the profiles: name, file and first line.
+    """
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def thread_group(name: str) -> str:
+    """
+    Name of the pool a thread belongs to (its name without numbers).
+    """
+    return THREAD_NUMBER.sub("", name) or "thread"
+
+
+def percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    """
+    Summarize measurements in milliseconds: mean, 95th percentile and maximum.
+    """
+    if not values:
+        return {"mean_ms": None, "p95_ms": None, "max_ms": None}
+    ordered = sorted(values)
+    p95 = ordered[min(len(ordered) - 1, math.ceil(0.95 * len(ordered)) - 1)]
+    return {
+        "mean_ms": round(1000 * sum(ordered) / len(ordered), 3),
+        "p95_ms": round(1000 * p95, 3),
+        "max_ms": round(1000 * ordered[-1], 3),
+    }
+
+
+class StackSampler:
+    """
+    Sample the Python stack of every thread from a background thread.
+
+    Attributes:
+        stacks (Counter): Number of samples per stack (thread group first, innermost frame last)
+        samples (int): Number of sampling rounds
+        idle (int): Number of thread samples dropped as idle
+    """
+
+    def __init__(self, interval: float = PROFILE_SAMPLE_INTERVAL, include_idle: bool = False):
+        self.interval = interval
+        self.include_idle = include_idle
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.idle = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident != own:
+                    self._record(names.get(ident, "thread"), frame)
+            self.samples += 1
+
+    def _record(self, thread_name: str, frame) -> None:
+        leaf = (os.path.basename(frame.f_code.co_filename), frame.f_code.co_name)
+        if not self.include_idle and leaf in IDLE_FRAMES:
+            self.idle += 1
+            return
+        stack = []
+        while frame is not None and len(stack) < MAX_STACK_DEPTH:
+            stack.append(frame_label(frame.f_code))
+            frame = frame.f_back
+        stack.append(thread_group(thread_name))
+        self.stacks[tuple(reversed(stack))] += 1
+
+    def collapsed(self) -> str:
+        """
+        Format the samples as collapsed stacks ("thread;outer;...;inner count"
+        per line), the input format of flamegraph.pl and speedscope.
+        """
+        lines = [f"{';'.join(stack)} {count}" for stack, count in self.stacks.most_common()]
+        return "\n".join(lines) + "\n"
+
+    def top(self, limit: int) -> List[Dict[str, Any]]:
+        """
+        Aggregate the samples per function: `self` counts the samples where the
+        function was running, `total` those where it was on the stack.
+        """
+        total_samples = sum(self.stacks.values()) or 1
+        own: Counter = Counter()
+        inclusive: Counter = Counter()
+        for stack, count in self.stacks.items():
+            own[stack[-1]] += count
+            # Recursive functions are counted once per sample
+            for label in set(stack[1:]):
+                inclusive[label] += count
+        return [
+            {
+                "function": label,
+                "self": own[label],
+                "total": count,
+                "self_percent": round(100 * own[label] / total_samples, 1),
+                "total_percent": round(100 * count / total_samples, 1),
+            }
+            for label, count in sorted(inclusive.items(), key=lambda item: (-own[item[0]], -item[1]))[:limit]
+        ]
+
+
+class LoopLagMonitor:
+    """
+    Measure how late the event loop runs a timer, i.e. for how long it was
+    blocked by synchronous code.
+    """
+
+    def __init__(self, interval: float = PROFILE_LAG_INTERVAL):
+        self.interval = interval
+        self.lags: List[float] = []
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        self._task = asyncio.ensure_future(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    async def _run(self) -> None:
+        while True:
+            started = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self.lags.append(max(0.0, time.monotonic() - started - self.interval))
+
+    def stats(self) -> Dict[str, Any]:
+        return {"measurements": len(self.lags), **percentiles(self.lags)}
+
+
+class Profiler:
+    """
+    Run one profiling session at a time, ended after a number of seconds or of
+    completed requests (whichever comes first).
+    """
+
+    def __init__(self):
+        self._active = False
+        self._requests = 0
+        self._target: Optional[int] = None
+        self._enough: Optional[asyncio.Event] = None
+
+    @property
+    def active(self) -> bool:
+        return self._active
+
+    def request_done(self) -> None:
+        """
+        Count a completed request toward the session in progress, if any.
+        """
+        if not self._active:
+            return
+        self._requests += 1
+        if self._target is not None and self._requests >= self._target and self._enough is not None:
+            self._enough.set()
+
+    async def profile(
+        self,
+        mode: str = SAMPLE,
+        seconds: float = 10.0,
+        requests: Optional[int] = None,
+        interval: float = PROFILE_SAMPLE_INTERVAL,
+        include_idle: bool = False
+    ) -> Tuple[Dict[str, Any], Any]:
+        """
+        Profile the process.
+
+        Args:
+            mode (str): "sample" or "cprofile" (see MODES)
+            seconds (float): Duration of the session (capped by PROFILE_MAX_SECONDS)
+            requests (Optional[int]): End the session once this many requests completed
+            interval (float): Seconds between two samples (sample mode)
+            include_idle (bool): Keep the samples of threads waiting for work (sample mode)
+
+        Returns:
+            Tuple[Dict[str, Any], Any]: Summary of the session, and the StackSampler
+            (sample mode) or pstats.Stats (cprofile mode) holding the results
+
+        Raises:
+            ValueError: If the mode or a limit is invalid
+            ProfilerBusyError: If a session is already running
+        """
+        if mode not in MODES:
+            raise ValueError(f"Unknown profiling mode: {mode} (expected one of {', '.join(MODES)})")
+        if seconds <= 0 or (requests is not None and requests <= 0) or interval <= 0:
+            raise ValueError("seconds, requests and interval must be positive")
+        if self._active:
+            raise ProfilerBusyError("A profiling session is already running")
+        seconds = min(seconds, PROFILE_MAX_SECONDS)
+
+        self._active = True
+        self._requests = 0
+        self._target = requests
+        self._enough = asyncio.Event()
+        lag = LoopLagMonitor()
+        sampler = StackSampler(interval, include_idle) if mode == SAMPLE else None
+        tracer = cProfile.Profile() if mode == CPROFILE else None
+        started = time.monotonic()
+        try:
+            lag.start()
+            if sampler is not None:
+                sampler.start()
+            else:
+                # Coroutines run on this thread: enabling here traces the event loop
+                tracer.enable()
+            try:
+                await asyncio.wait_for(self._enough.wait(), timeout=seconds)
+            except asyncio.TimeoutError:
+                pass
+        finally:
+            if sampler is not None:
+                sampler.stop()
+            else:
+                tracer.disable()
+            await lag.stop()
+            self._active = False
+            self._enough = None
+
+        summary = {
+            "mode": mode,
+            "seconds": round(time.monotonic() - started, 3),
+            "requests": self._requests,
+            "event_loop_lag": lag.stats(),
+        }
+        if sampler is not None:
+            summary.update(interval=interval, samples=sampler.samples, idle_samples=sampler.idle)
+            return summary, sampler
+        return summary, pstats.Stats(tracer)
+
+
+def top_calls(stats: pstats.Stats, limit: int) -> List[Dict[str, Any]]:
+    """
+    Get the functions with the most own time from a cProfile session.
+    """
+    rows = []
+    for (filename, line, name), (_, calls, own, total, _) in stats.stats.items():
+        rows.append({
+            "function": f"{name} ({os.path.basename(filename)}:{line})",
+            "calls": calls,
+            "self_seconds": round(own, 6),
+            "total_seconds": round(total, 6),
+        })
+    rows.sort(key=lambda row: -row["self_seconds"])
+    return rows[:limit]
+
+
+def stats_text(stats: pstats.Stats, limit: int) -> str:
+    """
+    Format a cProfile session as the pstats report, sorted by own time.
+    """
+    output = io.StringIO()
+    stats.stream = output
+    stats.sort_stats("tottime").print_stats(limit)
+    return output.getvalue()
+
+
+class ProfilerMiddleware:
+    """
+    ASGI middleware counting the completed requests for the profiling session
+    in progress. Requests to `exclude` (the profiling endpoint) are not counted.
+    """
+
+    def __init__(self, app, profiler: "Profiler", exclude: str = "/admin/profile"):
+        self.app = app
+        self.profiler = profiler
+        self.exclude = exclude
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"].startswith(self.exclude):
+            await self.app(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.profiler.request_done()
+
+
+# Profiler of this process
+profiler = Profiler()
@@ -0,0 +1,329 @@
+"""
+Progress module for the Invoice OCR API.
+This module records the stages of each extraction as events, so that clients
+can show progress (and the fields found so far) while a long extraction runs,
+and batch clients can spot a file stuck in the pipeline.
+
+Stages, in order:
+
+- received: the file was saved (size, number of pages)
+- joined: the OCR of an identical file in progress is shared (see SingleFlight),
+  its past page events follow
+- decoded: a page was decoded
+- preprocessed: a page was triaged and turned upright
+- ocr: a page was recognized (page k of n, fields found on it so far)
+- extracted: the fields of the document were extracted
+- done or error: the extraction is over
+
+The extraction being tracked is found from a context variable, so the OCR
+pipeline reports its stages without being given the tracker: asyncio tasks
+started while it is set (pages) inherit it. A single-flight computation
+reports to a ProgressGroup, which forwards its events to every request
+waiting for it.
+"""
+import asyncio
+import contextvars
+import os
+import re
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, AsyncIterator, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from dotenv import load_dotenv
+
+from .responses import dumps
+
+# Load environment variables
+load_dotenv()
+
+# Seconds finished extractions are kept, so their events can still be read
+PROGRESS_RETENTION = float(os.getenv("PROGRESS_RETENTION", "300"))
+
+# Maximum number of extractions kept (the oldest finished ones are dropped first)
+PROGRESS_MAX_JOBS = int(os.getenv("PROGRESS_MAX_JOBS", "1000"))
+
+# Seconds between two keep-alive comments on an idle event stream
+PROGRESS_HEARTBEAT = 15.0
+
+# Job ids chosen by clients (X-Job-Id header)
+JOB_ID = re.compile(r"^[A-Za-z0-9_.:-]{1,64}$")
+
+# Stages ending an extraction
+DONE = "done"
+ERROR = "error"
+
+
+class Progress:
+    """
+    Events of one extraction.
+
+    Attributes:
+        job_id (str): Id of the extraction
+        filename (Optional[str]): Name of the processed file
+        username (Optional[str]): User who submitted the file
+        pages (Optional[int]): Number of pages, once known
+        events (List[Dict[str, Any]]): Events so far, oldest first
+        followers (int): Number of clients following the events
+    """
+
+    def __init__(self, job_id: str, filename: Optional[str] = None, username: Optional[str] = None):
+        self.job_id = job_id
+        self.filename = filename
+        self.username = username
+        self.pages: Optional[int] = None
+        self.events: List[Dict[str, Any]] = []
+        self.followers = 0
+        self.started = time.monotonic()
+        self.finished_at: Optional[float] = None
+        # Set (and replaced) on each event
+        self._changed = asyncio.Event()
+
+    @property
+    def finished(self) -> bool:
+        return self.finished_at is not None
+
+    def emit(self, stage: str, **data: Any) -> None:
+        """
+        Record an event and wake up the followers.
+        Events after the end of the extraction are ignored.
+
+        Args:
+            stage (str): Stage reached
+            **data: Details of the stage (page number, timings, fields...)
+        """
+        if self.finished:
+            return
+        event = {"stage": stage, "elapsed": round(time.monotonic() - self.started, 3), **data}
+        if stage == "ocr" and self.pages:
+            event.setdefault("pages", self.pages)
+        self.events.append(event)
+        if stage in (DONE, ERROR):
+            self.finished_at = time.monotonic()
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    def finish(self, error: Optional[str] = None) -> None:
+        """
+        Record the end of the extraction, once.
+        """
+        if error is None:
+            self.emit(DONE)
+        else:
+            self.emit(ERROR, detail=error)
+
+    async def follow(self, heartbeat: float = PROGRESS_HEARTBEAT) -> AsyncIterator[Optional[Dict[str, Any]]]:
+        """
+        Iterate over the events, past ones first, until the extraction is over.
+
+        Args:
+            heartbeat (float): Seconds without event after which None is yielded
+
+        Yields:
+            Optional[Dict[str, Any]]: Each event, or None when nothing happened for `heartbeat` seconds
+        """
+        self.followers += 1
+        try:
+            sent = 0
+            while True:
+                while sent < len(self.events):
+                    sent += 1
+                    yield self.events[sent - 1]
+                if self.finished:
+                    return
+                try:
+                    await asyncio.wait_for(self._changed.wait(), timeout=heartbeat)
+                except asyncio.TimeoutError:
+                    yield None
+        finally:
+            self.followers -= 1
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        Summarize the extraction: last stage reached and time since the last event.
+        """
+        last = self.events[-1] if self.events else {"stage": None, "elapsed": 0.0}
+        elapsed = (self.finished_at or time.monotonic()) - self.started
+        return {
+            "job_id": self.job_id,
+            "filename": self.filename,
+            "username": self.username,
+            "stage": last["stage"],
+            "pages": self.pages,
+            "pages_done": sum(1 for event in self.events if event["stage"] == "ocr"),
+            "elapsed": round(elapsed, 3),
+            "idle": round(elapsed - last["elapsed"], 3),
+            "finished": self.finished,
+        }
+
+
+class ProgressGroup:
+    """
+    Trackers of the requests sharing one computation: its events are recorded
+    on each of them, and replayed to the requests joining it later.
+
+    Attributes:
+        trackers (List[Progress]): Trackers of the requests
+    """
+
+    def __init__(self, trackers: Iterable[Optional[Progress]] = ()):
+        self.trackers: List[Progress] = []
+        self._history: List[Tuple[str, Dict[str, Any]]] = []
+        for progress in trackers:
+            self.add(progress)
+
+    @property
+    def followers(self) -> int:
+        return sum(progress.followers for progress in self.trackers)
+
+    def add(self, progress: Optional[Progress], joined: bool = False) -> None:
+        """
+        Add the tracker of a request, giving it the events so far.
+
+        Args:
+            progress (Optional[Progress]): Tracker of the request, None if not tracked
+            joined (bool): The request joined the computation after it started
+        """
+        if progress is None or progress in self.trackers:
+            return
+        if joined:
+            progress.emit("joined")
+        for stage, data in self._history:
+            progress.emit(stage, **data)
+        self.trackers.append(progress)
+
+    def emit(self, stage: str, **data: Any) -> None:
+        """
+        Record an event on every tracker (see Progress.emit).
+        """
+        self._history.append((stage, data))
+        for progress in self.trackers:
+            progress.emit(stage, **data)
+
+
+class ProgressRegistry:
+    """
+    Extractions in progress and recently finished, by job id.
+    """
+
+    def __init__(self, retention: float = PROGRESS_RETENTION, max_jobs: int = PROGRESS_MAX_JOBS):
+        self.retention = retention
+        self.max_jobs = max_jobs
+        self._jobs: "OrderedDict[str, Progress]" = OrderedDict()
+
+    def _prune(self) -> None:
+        now = time.monotonic()
+        for job_id, progress in list(self._jobs.items()):
+            if progress.finished and now - progress.finished_at > self.retention:
+                del self._jobs[job_id]
+        finished = [job_id for job_id, progress in self._jobs.items() if progress.finished]
+        while len(self._jobs) >= self.max_jobs and finished:
+            del self._jobs[finished.pop(0)]
+
+    def start(self, job_id: str, filename: Optional[str] = None, username: Optional[str] = None) -> Progress:
+        """
+        Start tracking an extraction.
+
+        Args:
+            job_id (str): Id of the extraction, chosen by the client or generated
+            filename (Optional[str]): Name of the processed file
+            username (Optional[str]): User who submitted the file
+
+        Returns:
+            Progress: Tracker of the extraction
+
+        Raises:
+            ValueError: If the job id is invalid or already used by an extraction in progress
+        """
+        if not JOB_ID.match(job_id):
+            raise ValueError("Invalid job id: use up to 64 letters, digits, '_', '.', ':' or '-'")
+        self._prune()
+        existing = self._jobs.get(job_id)
+        if existing is not None and not existing.finished:
+            raise ValueError(f"Job {job_id} is already in progress")
+        progress = Progress(job_id, filename, username)
+        self._jobs.pop(job_id, None)
+        self._jobs[job_id] = progress
+        return progress
+
+    def get(self, job_id: str) -> Optional[Progress]:
+        """
+        Get the tracker of an extraction, None if unknown or expired.
+        """
+        self._prune()
+        return self._jobs.get(job_id)
+
+    def list(self, username: Optional[str] = None) -> List[Progress]:
+        """
+        List the tracked extractions, oldest first, optionally only those of a user.
+        """
+        self._prune()
+        return [
+            progress for progress in self._jobs.values()
+            if username is None or progress.username == username
+        ]
+
+
+# Extractions of this process
+progress_registry = ProgressRegistry()
+
+# Tracker of the extraction running in the current context
+current_progress: "contextvars.ContextVar[Optional[Union[Progress, ProgressGroup]]]" = contextvars.ContextVar(
+    "current_progress", default=None
+)
+
+
+def report(stage: str, **data: Any) -> None:
+    """
+    Record an event on the extraction running in the current context, if tracked.
+    """
+    progress = current_progress.get()
+    if progress is not None:
+        progress.emit(stage, **data)
+
+
+def followed() -> bool:
+    """
+    Tell whether a client follows the extraction running in the current context,
+    to skip the work done only for it (such as extracting fields page by page).
+    """
+    progress = current_progress.get()
+    return progress is not None and progress.followers > 0
+
+
+@contextmanager
+def tracking(progress: Optional[Progress]) -> Iterator[Optional[Progress]]:
+    """
+    Make `progress` the tracker of the code run in this block, and record the
+    end of the extraction when the block exits (an error if it raised).
+    """
+    if progress is None:
+        yield None
+        return
+    token = current_progress.set(progress)
+    try:
+        yield progress
+    except BaseException as e:
+        progress.finish(error=str(getattr(e, "detail", "") or e) or type(e).__name__)
+        raise
+    else:
+        progress.finish()
+    finally:
+        current_progress.reset(token)
+
+
+def format_event(event: Optional[Dict[str, Any]], name: str = "progress") -> str:
+    """
+    Format an event for a text/event-stream response; None gives a keep-alive comment.
+    """
+    if event is None:
+        return ": keep-alive\n\n"
+    return f"event: {name}\ndata: {dumps(event).decode('utf-8')}\n\n"
+
+
+async def event_stream(progress: Progress, heartbeat: float = PROGRESS_HEARTBEAT) -> AsyncIterator[str]:
+    """
+    Stream the events of an extraction as Server-Sent Events, until it is over.
+    """
+    async for event in progress.follow(heartbeat):
+        yield format_event(event)
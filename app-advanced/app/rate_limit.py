@@ -0,0 +1,290 @@
+"""
+Rate limiting module for the Invoice OCR API.
+This module enforces per-user quotas on the expensive OCR endpoints:
+a token bucket limits the request rate and a counter limits the number of
+OCR jobs a user may have in flight at the same time.
+
+The quota state lives in memory by default. Set RATE_LIMIT_DB to the path of a
+SQLite database to share it between several API processes.
+"""
+import math
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, Optional, Tuple
+
+from dotenv import load_dotenv
+from fastapi import Depends, HTTPException, status
+
+from .auth import authenticate_user
+from .logger import app_logger
+
+# Load environment variables
+load_dotenv()
+
+# Sustained request rate allowed per user, and the size of a burst above it
+# (a rate of 0 disables the rate limit)
+RATE_LIMIT_PER_MINUTE = float(os.getenv("RATE_LIMIT_PER_MINUTE", "60"))
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "10"))
+
+# Maximum number of OCR jobs a single user can run concurrently
+MAX_IN_FLIGHT_PER_USER = int(os.getenv("MAX_IN_FLIGHT_PER_USER", "4"))
+
+# In-flight slots older than this (in seconds) are considered leaked by a
+# crashed process and are reclaimed
+IN_FLIGHT_TTL = float(os.getenv("IN_FLIGHT_TTL", "3600"))
+
+# Optional SQLite database used to share quota state between processes
+RATE_LIMIT_DB = os.getenv("RATE_LIMIT_DB", "")
+
+
+class InMemoryQuotaStore:
+    """
+    Quota state kept in the memory of the current process.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+        self._in_flight: Dict[str, Dict[str, float]] = {}
+
+    def take_token(self, key: str, rate: float, burst: float, now: Optional[float] = None) -> float:
+        """
+        Take one token from the bucket of a user.
+
+        Args:
+            key (str): User the bucket belongs to
+            rate (float): Tokens added per second (0 or less for no limit)
+            burst (float): Bucket capacity
+            now (Optional[float]): Current time, defaults to time.monotonic()
+
+        Returns:
+            float: 0 if a token was taken, otherwise the seconds to wait for one
+        """
+        if rate <= 0:
+            return 0.0
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            if tokens >= 1:
+                self._buckets[key] = (tokens - 1, now)
+                return 0.0
+            self._buckets[key] = (tokens, now)
+            return (1 - tokens) / rate
+
+    def acquire_slot(self, key: str, limit: int, now: Optional[float] = None) -> Optional[str]:
+        """
+        Reserve one in-flight job slot for a user.
+
+        Args:
+            key (str): User requesting the slot
+            limit (int): Maximum number of slots per user
+            now (Optional[float]): Current time, defaults to time.monotonic()
+
+        Returns:
+            Optional[str]: Slot token to release later, or None if the user is at the limit
+        """
+        now = time.monotonic() if now is None else now
+        with self._lock:
+            slots = self._in_flight.setdefault(key, {})
+            for token in [t for t, acquired in slots.items() if now - acquired > IN_FLIGHT_TTL]:
+                del slots[token]
+            if len(slots) >= limit:
+                return None
+            token = uuid.uuid4().hex
+            slots[token] = now
+            return token
+
+    def release_slot(self, key: str, token: str) -> None:
+        """
+        Release an in-flight job slot.
+
+        Args:
+            key (str): User owning the slot
+            token (str): Token returned by acquire_slot
+        """
+        with self._lock:
+            self._in_flight.get(key, {}).pop(token, None)
+
+    def in_flight(self, key: str) -> int:
+        """
+        Count the jobs a user currently has in flight.
+
+        Args:
+            key (str): User to look up
+
+        Returns:
+            int: Number of reserved slots
+        """
+        with self._lock:
+            return len(self._in_flight.get(key, {}))
+
+
+class SQLiteQuotaStore:
+    """
+    Quota state stored in a SQLite database shared by several processes.
+
+    Wall-clock time is used instead of a monotonic clock because the
+    timestamps are compared across processes.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        conn = self._connect()
+        try:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS buckets ("
+                "key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS in_flight ("
+                "token TEXT PRIMARY KEY, key TEXT NOT NULL, acquired REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS in_flight_key ON in_flight (key)")
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        # Autocommit mode, transactions are opened explicitly with BEGIN IMMEDIATE
+        conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def _transaction(self, statements) -> Any:
+        """
+        Run a function inside a write transaction and return its result.
+        """
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = statements(conn)
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+            return result
+        finally:
+            conn.close()
+
+    def take_token(self, key: str, rate: float, burst: float, now: Optional[float] = None) -> float:
+        """
+        Take one token from the bucket of a user (see InMemoryQuotaStore.take_token).
+        """
+        if rate <= 0:
+            return 0.0
+        now = time.time() if now is None else now
+
+        def statements(conn):
+            row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+            tokens, updated = row if row else (burst, now)
+            tokens = min(burst, tokens + max(0.0, now - updated) * rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate
+            conn.execute(
+                "INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                (key, tokens, now),
+            )
+            return wait
+
+        return self._transaction(statements)
+
+    def acquire_slot(self, key: str, limit: int, now: Optional[float] = None) -> Optional[str]:
+        """
+        Reserve one in-flight job slot for a user (see InMemoryQuotaStore.acquire_slot).
+        """
+        now = time.time() if now is None else now
+
+        def statements(conn):
+            conn.execute("DELETE FROM in_flight WHERE acquired < ?", (now - IN_FLIGHT_TTL,))
+            (count,) = conn.execute("SELECT COUNT(*) FROM in_flight WHERE key = ?", (key,)).fetchone()
+            if count >= limit:
+                return None
+            token = uuid.uuid4().hex
+            conn.execute(
+                "INSERT INTO in_flight (token, key, acquired) VALUES (?, ?, ?)", (token, key, now)
+            )
+            return token
+
+        return self._transaction(statements)
+
+    def release_slot(self, key: str, token: str) -> None:
+        """
+        Release an in-flight job slot (see InMemoryQuotaStore.release_slot).
+        """
+        self._transaction(
+            lambda conn: conn.execute(
+                "DELETE FROM in_flight WHERE token = ? AND key = ?", (token, key)
+            )
+        )
+
+    def in_flight(self, key: str) -> int:
+        """
+        Count the jobs a user currently has in flight.
+        """
+        conn = self._connect()
+        try:
+            (count,) = conn.execute("SELECT COUNT(*) FROM in_flight WHERE key = ?", (key,)).fetchone()
+            return count
+        finally:
+            conn.close()
+
+
+def create_quota_store():
+    """
+    Create the quota store configured by the environment.
+
+    Returns:
+        InMemoryQuotaStore or SQLiteQuotaStore: The quota store
+    """
+    if RATE_LIMIT_DB:
+        app_logger.info(f"Using shared SQLite quota store at {RATE_LIMIT_DB}")
+        return SQLiteQuotaStore(RATE_LIMIT_DB)
+    return InMemoryQuotaStore()
+
+
+# Quota store shared by all requests of this process
+quota_store = create_quota_store()
+
+
+def enforce_ocr_quota(username: str = Depends(authenticate_user)):
+    """
+    Authenticate the user and enforce their OCR quotas for the whole request.
+
+    Args:
+        username (str): Authenticated username
+
+    Yields:
+        str: The username, while an in-flight slot is held for the request
+
+    Raises:
+        HTTPException: 429 if the user exceeded their rate or concurrency quota
+    """
+    wait = quota_store.take_token(username, RATE_LIMIT_PER_MINUTE / 60.0, RATE_LIMIT_BURST)
+    if wait > 0:
+        app_logger.warning(f"Rate limit exceeded for user {username}")
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Rate limit exceeded",
+            headers={"Retry-After": str(math.ceil(wait))},
+        )
+
+    token = quota_store.acquire_slot(username, MAX_IN_FLIGHT_PER_USER)
+    if token is None:
+        app_logger.warning(f"Too many concurrent OCR jobs for user {username}")
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many concurrent requests",
+            headers={"Retry-After": "1"},
+        )
+
+    try:
+        yield username
+    finally:
+        quota_store.release_slot(username, token)
@@ -0,0 +1,238 @@
+"""
+Response helpers for the Invoice OCR API.
+This module contains the fast JSON response class, the payload filters used by
+the extraction endpoints and the response compression middleware.
+"""
+import datetime
+import gzip
+import json
+import os
+from decimal import Decimal
+from typing import Any, Dict, Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.responses import JSONResponse
+
+from .models import InvoiceData
+from .tracing import span
+
+# orjson is optional: it is several times faster than the standard json module,
+# but the API keeps working without it
+try:
+    import orjson
+except ImportError:  # pragma: no cover - depends on the environment
+    orjson = None
+
+# Brotli is optional too: without it, only gzip compression is offered
+try:
+    import brotli
+except ImportError:  # pragma: no cover - depends on the environment
+    brotli = None
+
+# Responses smaller than this (in bytes) are not worth compressing
+COMPRESSION_MIN_SIZE = int(os.getenv("COMPRESSION_MIN_SIZE", "1024"))
+
+# Content types that are streamed to the client and must never be buffered
+STREAMING_CONTENT_TYPES = ("text/event-stream",)
+
+
+def _default(obj: Any) -> Any:
+    """
+    Fallback serializer for the types the JSON encoders do not know about:
+    decimals (as exact strings) and dates (in ISO 8601, for the json module).
+
+    Args:
+        obj (Any): Object to serialize
+
+    Returns:
+        Any: A JSON-compatible representation of the object
+
+    Raises:
+        TypeError: If the object is of any other type, which is a serialization bug
+    """
+    if isinstance(obj, Decimal):
+        return str(obj)
+    if isinstance(obj, (datetime.date, datetime.time)):
+        return obj.isoformat()
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+    """
+    Serialize content to compact JSON bytes, using orjson when available.
+
+    Args:
+        content (Any): Data to serialize
+
+    Returns:
+        bytes: JSON document
+    """
+    if orjson is not None:
+        return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(content, default=_default, separators=(",", ":")).encode("utf-8")
+
+
+def dumps_pretty(content: Any) -> str:
+    """
+    Serialize content to indented JSON text for display in the web interface.
+
+    Args:
+        content (Any): Data to serialize
+
+    Returns:
+        str: Indented JSON document
+    """
+    if orjson is not None:
+        return orjson.dumps(
+            content, default=_default, option=orjson.OPT_INDENT_2 | orjson.OPT_NON_STR_KEYS
+        ).decode("utf-8")
+    return json.dumps(content, default=_default, indent=2)
+
+
+class ORJSONResponse(JSONResponse):
+    """
+    JSON response rendered with orjson (falls back to the json module).
+    """
+
+    def render(self, content: Any) -> bytes:
+        with span("serialize") as serialize_span:
+            body = dumps(content)
+            if serialize_span is not None:
+                serialize_span.set_attribute("response.bytes", len(body))
+            return body
+
+
+def filter_extracted_data(
+    data: InvoiceData,
+    include_raw_text: bool = True,
+    include_items: bool = True,
+    include_candidates: bool = False,
+) -> Dict[str, Any]:
+    """
+    Dump the extracted data to JSON-ready values, dropping the bulky parts
+    the client did not ask for.
+
+    Args:
+        data (InvoiceData): Extracted invoice data
+        include_raw_text (bool): Keep the full OCR text
+        include_items (bool): Keep the line items
+        include_candidates (bool): Keep the ranked candidate values of each field
+
+    Returns:
+        Dict[str, Any]: JSON-compatible extracted data
+    """
+    excluded = set()
+    if not include_raw_text:
+        excluded.add("raw_text")
+    if not include_items:
+        excluded.add("items")
+    if not include_candidates:
+        excluded.add("candidates")
+
+    return data.model_dump(mode="json", exclude=excluded)
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """
+    Pick the best content encoding supported by both the client and the server.
+
+    Args:
+        accept_encoding (str): Value of the Accept-Encoding request header
+
+    Returns:
+        Optional[str]: "br", "gzip" or None if no compression should be used
+    """
+    accepted = set()
+    for part in accept_encoding.split(","):
+        token, _, params = part.strip().partition(";")
+        # An explicit q=0 means "not acceptable"
+        if params.replace(" ", "") in ("q=0", "q=0.0"):
+            continue
+        accepted.add(token.strip().lower())
+
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    """
+    Compress a response body with the given encoding.
+
+    Args:
+        body (bytes): Uncompressed body
+        encoding (str): "br" or "gzip"
+
+    Returns:
+        bytes: Compressed body
+    """
+    if encoding == "br":
+        # Quality 4 is a good speed/ratio trade-off for dynamic content
+        return brotli.compress(body, quality=4)
+    return gzip.compress(body, compresslevel=6)
+
+
+class CompressionMiddleware:
+    """
+    ASGI middleware compressing responses with Brotli or gzip.
+
+    Only single-chunk responses above `minimum_size` bytes are compressed;
+    streamed responses (such as Server-Sent Events) are passed through untouched.
+    """
+
+    def __init__(self, app, minimum_size: int = COMPRESSION_MIN_SIZE):
+        self.app = app
+        self.minimum_size = minimum_size
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+
+        start_message = None
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start_message, passthrough
+
+            if message["type"] == "http.response.start":
+                # Hold the headers back until we know the size of the body
+                start_message = message
+                return
+
+            if message["type"] != "http.response.body" or passthrough:
+                await send(message)
+                return
+
+            headers = MutableHeaders(raw=list(start_message["headers"]))
+            start_message["headers"] = headers.raw
+            body = message.get("body", b"")
+            more_body = message.get("more_body", False)
+
+            if (
+                more_body
+                or len(body) < self.minimum_size
+                or "content-encoding" in headers
+                or headers.get("content-type", "").startswith(STREAMING_CONTENT_TYPES)
+            ):
+                # Streamed, small or already-encoded response: send it as is
+                passthrough = True
+                await send(start_message)
+                await send(message)
+                return
+
+            compressed = compress(body, encoding)
+            headers["Content-Encoding"] = encoding
+            headers["Content-Length"] = str(len(compressed))
+            headers.add_vary_header("Accept-Encoding")
+            await send(start_message)
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, send_wrapper)
@@ -0,0 +1,134 @@
+"""
+Shared-memory image transport for the Invoice OCR API.
+This module hands decoded images to OCR worker processes without pickling
+them: the pixels are written once into a shared memory segment and only a
+small handle (segment name, mode and size) is sent to the worker, which maps
+the same memory.
+
+Lifecycle: the sending process owns the segment. It creates it with
+`SharedImage` and must close it (which also unlinks it) once the worker has
+answered, ideally with a `with` block. Workers only attach to the segment with
+`open_shared_image`, and detach when the block exits.
+
+Call `prepare_transport()` before starting the worker processes: it starts the
+multiprocessing resource tracker so that the workers share it with the API
+process. Segments are then tracked in one place, and the tracker deletes any
+segment left behind if the API process crashes.
+"""
+from contextlib import contextmanager
+from dataclasses import dataclass
+from multiprocessing import resource_tracker, shared_memory
+from typing import Iterator, Optional, Tuple
+
+from PIL import Image
+
+from .engines import get_engine
+
+
+# Image modes fully described by their raw bytes, mode and size
+SHAREABLE_MODES = ("1", "L", "RGB", "RGBA")
+
+
+def prepare_transport() -> None:
+    """
+    Start the resource tracker before the worker processes are created,
+    so that they inherit it instead of starting their own.
+    """
+    resource_tracker.ensure_running()
+
+
+@dataclass(frozen=True)
+class SharedImageHandle:
+    """
+    Picklable reference to an image stored in shared memory.
+
+    Attributes:
+        name (str): Name of the shared memory segment
+        mode (str): Pillow image mode (e.g. "L" or "RGB")
+        size (Tuple[int, int]): Image width and height
+    """
+    name: str
+    mode: str
+    size: Tuple[int, int]
+
+
+class SharedImage:
+    """
+    Owner side of an image placed in shared memory.
+    """
+
+    def __init__(self, image: Image.Image):
+        if image.mode not in SHAREABLE_MODES:
+            # Palette and other exotic modes need extra data to be decoded
+            image = image.convert("RGB")
+        data = image.tobytes()
+        # A segment cannot be empty
+        self._shm: Optional[shared_memory.SharedMemory] = shared_memory.SharedMemory(
+            create=True, size=max(1, len(data))
+        )
+        self._shm.buf[:len(data)] = data
+        self.handle = SharedImageHandle(self._shm.name, image.mode, image.size)
+
+    def close(self) -> None:
+        """
+        Release and delete the shared memory segment. Safe to call twice.
+        """
+        if self._shm is None:
+            return
+        self._shm.close()
+        self._shm.unlink()
+        self._shm = None
+
+    def __enter__(self) -> SharedImageHandle:
+        return self.handle
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+
+@contextmanager
+def open_shared_image(handle: SharedImageHandle) -> Iterator[Image.Image]:
+    """
+    Attach to an image in shared memory (worker side).
+
+    The yielded image reads the shared pixels directly, without a copy, so it
+    must not be used after the `with` block; call `.copy()` to keep it.
+
+    Args:
+        handle (SharedImageHandle): Handle received from the owner process
+
+    Yields:
+        Image.Image: The shared image
+    """
+    shm = shared_memory.SharedMemory(name=handle.name)
+    image = None
+    try:
+        image = Image.frombuffer(handle.mode, handle.size, shm.buf, "raw", handle.mode, 0, 1)
+        yield image
+    finally:
+        # Drop the image (and its view of the buffer) before detaching
+        if image is not None:
+            image.close()
+        del image
+        shm.close()
+
+
+def ocr_shared_image(
+    handle: SharedImageHandle,
+    timeout: Optional[float] = None,
+    lang: Optional[str] = None,
+) -> str:
+    """
+    Recognize the text of an image stored in shared memory.
+    Meant to run in an OCR worker process.
+
+    Args:
+        handle (SharedImageHandle): Handle of the image
+        timeout (Optional[float]): OCR time budget in seconds, None for no limit
+        lang (Optional[str]): Tesseract language code(s), None for the engine default
+
+    Returns:
+        str: Recognized text
+    """
+    with open_shared_image(handle) as image:
+        return get_engine(lang).image_to_string(image, timeout=timeout)
@@ -0,0 +1,83 @@
+"""
+Single-flight module for the Invoice OCR API.
+This module coalesces identical concurrent OCR requests: when a client retries
+an upload before the first call has finished, the retry waits for the result of
+the computation already in flight instead of running Tesseract a second time.
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, Dict
+
+
+class SingleFlight:
+    """
+    Run at most one computation per key at a time and share its result.
+
+    Attributes:
+        executed (int): Number of computations actually run
+        deduplicated (int): Number of calls served by a computation already in flight
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, asyncio.Task] = {}
+        self._waiters: Dict[str, int] = {}
+        self.executed = 0
+        self.deduplicated = 0
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Run `fn` for `key`, or wait for the call already in flight for that key.
+
+        The computation runs in its own task, so a caller that gets cancelled
+        (e.g. a client that disconnects) does not cancel it for the others.
+        It is only cancelled once every caller waiting for it has gone away.
+
+        Args:
+            key (str): Identity of the computation (content hash and configuration)
+            fn (Callable[[], Awaitable[Any]]): Coroutine function performing the computation
+
+        Returns:
+            Any: Result of the computation (exceptions are shared too)
+        """
+        task = self._calls.get(key)
+        if task is None:
+            self.executed += 1
+            task = asyncio.ensure_future(fn())
+            self._calls[key] = task
+            task.add_done_callback(lambda done: self._forget(key, done))
+        else:
+            self.deduplicated += 1
+
+        self._waiters[key] = self._waiters.get(key, 0) + 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if self._waiters[key] == 1 and not task.done():
+                # Nobody else is interested in the result anymore
+                task.cancel()
+            raise
+        finally:
+            self._waiters[key] -= 1
+            if not self._waiters[key]:
+                del self._waiters[key]
+
+    def _forget(self, key: str, task: asyncio.Task) -> None:
+        """
+        Remove a finished computation so the next call for its key runs again.
+        """
+        self._calls.pop(key, None)
+        if not task.cancelled():
+            # Mark the exception as retrieved even if every caller went away
+            task.exception()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Get the single-flight counters.
+
+        Returns:
+            Dict[str, int]: Executed, deduplicated and currently in-flight computations
+        """
+        return {
+            "executed": self.executed,
+            "deduplicated": self.deduplicated,
+            "in_flight": len(self._calls),
+        }
@@ -0,0 +1,358 @@
+"""
+Results store module for the Invoice OCR API.
+This module keeps the extraction results in an embedded SQLite database so that
+past invoices can be looked up without uploading them again.
+
+Each filterable field has an index ending with the row id, so that filtered
+queries and cursor-based pagination (newest first) stay fast on millions of
+rows. The raw OCR text is indexed for full-text search with FTS5 when the
+SQLite library supports it.
+"""
+import base64
+import datetime
+import json
+import os
+import sqlite3
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from .logger import app_logger
+from .models import ExtractedInvoice
+
+# Load environment variables
+load_dotenv()
+
+# Path of the results database, an empty value disables the store
+RESULTS_DB = os.getenv("RESULTS_DB", "invoices.db")
+
+# Columns returned for each stored invoice (the raw text only on request)
+SUMMARY_COLUMNS = "id, filename, content_hash, username, created_at, message_id, data"
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS invoices (
+        id INTEGER PRIMARY KEY,
+        filename TEXT NOT NULL,
+        content_hash TEXT NOT NULL,
+        username TEXT,
+        created_at TEXT NOT NULL,
+        invoice_number TEXT,
+        vendor TEXT,
+        vendor_id TEXT,
+        date TEXT,
+        due_date TEXT,
+        total_amount TEXT,
+        currency TEXT,
+        message_id TEXT,
+        data TEXT NOT NULL,
+        raw_text TEXT
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS invoices_invoice_number ON invoices (invoice_number, id)",
+    "CREATE INDEX IF NOT EXISTS invoices_vendor ON invoices (vendor, id)",
+    "CREATE INDEX IF NOT EXISTS invoices_vendor_id ON invoices (vendor_id, id)",
+    "CREATE INDEX IF NOT EXISTS invoices_date ON invoices (date, id)",
+    # Each file (content) is stored once, even when saved by concurrent requests
+    "CREATE UNIQUE INDEX IF NOT EXISTS invoices_content_hash ON invoices (content_hash)",
+    """
+    CREATE TABLE IF NOT EXISTS invoice_messages (
+        message_id TEXT NOT NULL,
+        invoice_id INTEGER NOT NULL REFERENCES invoices (id),
+        PRIMARY KEY (message_id, invoice_id)
+    ) WITHOUT ROWID
+    """,
+]
+
+FTS_SCHEMA = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS invoices_fts
+    USING fts5(raw_text, content='invoices', content_rowid='id')
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS invoices_fts_insert AFTER INSERT ON invoices BEGIN
+        INSERT INTO invoices_fts (rowid, raw_text) VALUES (new.id, new.raw_text);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS invoices_fts_delete AFTER DELETE ON invoices BEGIN
+        INSERT INTO invoices_fts (invoices_fts, rowid, raw_text) VALUES ('delete', old.id, old.raw_text);
+    END
+    """,
+]
+
+
+def encode_cursor(invoice_id: int) -> str:
+    """
+    Encode the id of the last returned invoice as an opaque pagination cursor.
+    """
+    return base64.urlsafe_b64encode(str(invoice_id).encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> int:
+    """
+    Decode a pagination cursor.
+
+    Raises:
+        ValueError: If the cursor is not valid
+    """
+    padded = cursor + "=" * (-len(cursor) % 4)
+    try:
+        return int(base64.urlsafe_b64decode(padded.encode()).decode())
+    except Exception:
+        raise ValueError(f"Invalid cursor: {cursor}")
+
+
+class ResultsStore:
+    """
+    SQLite database of extraction results.
+
+    Each thread uses its own connection; the database is in WAL mode so that
+    reads are not blocked by writes.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._local = threading.local()
+        conn = self._connection()
+        for statement in SCHEMA:
+            conn.execute(statement)
+        try:
+            for statement in FTS_SCHEMA:
+                conn.execute(statement)
+            self.fts_enabled = True
+        except sqlite3.OperationalError:
+            app_logger.warning("SQLite FTS5 is not available, full-text search is disabled")
+            self.fts_enabled = False
+        conn.commit()
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10.0)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def save(
+        self,
+        filename: str,
+        content_hash: str,
+        invoice: ExtractedInvoice,
+        username: Optional[str] = None,
+        message_id: Optional[str] = None,
+    ) -> int:
+        """
+        Store an extraction result. A file already stored (same content hash)
+        is not stored twice, but is still linked to the email it came with.
+
+        Args:
+            filename (str): Name of the processed file
+            content_hash (str): SHA-256 digest of the file content
+            invoice (ExtractedInvoice): Extracted invoice data
+            username (Optional[str]): User who submitted the file
+            message_id (Optional[str]): Message-ID of the email the file was attached to
+
+        Returns:
+            int: Id of the stored invoice
+        """
+        conn = self._connection()
+        with conn:
+            invoice_id = self._find(conn, content_hash)
+            if invoice_id is None:
+                invoice_id = self._insert(conn, filename, content_hash, invoice, username, message_id)
+            if invoice_id is None:
+                # Stored by another connection in the meantime
+                invoice_id = self._find(conn, content_hash)
+            if message_id is not None:
+                conn.execute(
+                    "INSERT OR IGNORE INTO invoice_messages (message_id, invoice_id) VALUES (?, ?)",
+                    (message_id, invoice_id),
+                )
+            return invoice_id
+
+    def _find(self, conn: sqlite3.Connection, content_hash: str) -> Optional[int]:
+        """
+        Get the id of the invoice stored for a file content, None if there is none.
+        """
+        row = conn.execute("SELECT id FROM invoices WHERE content_hash = ?", (content_hash,)).fetchone()
+        return row["id"] if row else None
+
+    def _insert(
+        self,
+        conn: sqlite3.Connection,
+        filename: str,
+        content_hash: str,
+        invoice: ExtractedInvoice,
+        username: Optional[str],
+        message_id: Optional[str],
+    ) -> Optional[int]:
+        """
+        Insert a new extraction result (see save) and return its id, None if
+        the file content is already stored.
+        """
+        data = invoice.to_model().model_dump(mode="json", exclude={"raw_text", "candidates"})
+        cursor = conn.execute(
+            "INSERT INTO invoices (filename, content_hash, username, created_at, invoice_number, "
+            "vendor, vendor_id, date, due_date, total_amount, currency, message_id, data, raw_text) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (content_hash) DO NOTHING",
+            (
+                filename,
+                content_hash,
+                username,
+                datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+                invoice.invoice_number,
+                invoice.vendor,
+                invoice.vendor_id,
+                data["date"],
+                data["due_date"],
+                None if invoice.total_amount is None else str(invoice.total_amount),
+                invoice.currency,
+                message_id,
+                json.dumps(data),
+                invoice.raw_text,
+            ),
+        )
+        return cursor.lastrowid if cursor.rowcount else None
+
+    def has_message(self, message_id: str) -> bool:
+        """
+        Tell whether invoices attached to an email were already stored.
+
+        Args:
+            message_id (str): Message-ID of the email
+
+        Returns:
+            bool: Whether an invoice is linked to this Message-ID
+        """
+        row = self._connection().execute(
+            "SELECT 1 FROM invoice_messages WHERE message_id = ? LIMIT 1", (message_id,)
+        ).fetchone()
+        return row is not None
+
+    def ping(self) -> None:
+        """
+        Check that the database can be read.
+
+        Raises:
+            sqlite3.Error: If it cannot
+        """
+        self._connection().execute("SELECT 1 FROM invoices LIMIT 1").fetchall()
+
+    def get(self, invoice_id: int, include_raw_text: bool = True) -> Optional[Dict[str, Any]]:
+        """
+        Get a stored invoice by id.
+
+        Args:
+            invoice_id (int): Id of the invoice
+            include_raw_text (bool): Include the raw OCR text
+
+        Returns:
+            Optional[Dict[str, Any]]: The stored invoice, or None if it does not exist
+        """
+        columns = SUMMARY_COLUMNS + (", raw_text" if include_raw_text else "")
+        row = self._connection().execute(
+            f"SELECT {columns} FROM invoices WHERE id = ?", (invoice_id,)
+        ).fetchone()
+        return self._to_dict(row) if row else None
+
+    def search(
+        self,
+        invoice_number: Optional[str] = None,
+        vendor: Optional[str] = None,
+        vendor_id: Optional[str] = None,
+        date_from: Optional[datetime.date] = None,
+        date_to: Optional[datetime.date] = None,
+        content_hash: Optional[str] = None,
+        message_id: Optional[str] = None,
+        text: Optional[str] = None,
+        limit: int = 50,
+        cursor: Optional[str] = None,
+        include_raw_text: bool = False,
+    ) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        Search the stored invoices, newest first.
+
+        Args:
+            invoice_number (Optional[str]): Exact invoice number
+            vendor (Optional[str]): Exact vendor name, as found in the document
+            vendor_id (Optional[str]): Id of the canonical vendor
+            date_from (Optional[datetime.date]): Earliest invoice date
+            date_to (Optional[datetime.date]): Latest invoice date
+            content_hash (Optional[str]): SHA-256 digest of the file content
+            message_id (Optional[str]): Message-ID of an email the file was attached to
+            text (Optional[str]): Full-text query on the raw OCR text (FTS5 syntax)
+            limit (int): Maximum number of invoices to return
+            cursor (Optional[str]): Cursor returned by the previous page
+            include_raw_text (bool): Include the raw OCR text
+
+        Returns:
+            Tuple[List[Dict[str, Any]], Optional[str]]: Invoices and the cursor of the next page
+
+        Raises:
+            ValueError: If the cursor or the full-text query is not valid
+        """
+        conditions = []
+        params: List[Any] = []
+        for column, value in (
+            ("invoice_number", invoice_number),
+            ("vendor", vendor),
+            ("vendor_id", vendor_id),
+            ("content_hash", content_hash),
+        ):
+            if value is not None:
+                conditions.append(f"{column} = ?")
+                params.append(value)
+        if message_id is not None:
+            conditions.append("id IN (SELECT invoice_id FROM invoice_messages WHERE message_id = ?)")
+            params.append(message_id)
+        if date_from is not None:
+            conditions.append("date >= ?")
+            params.append(date_from.isoformat())
+        if date_to is not None:
+            conditions.append("date <= ?")
+            params.append(date_to.isoformat())
+        if text:
+            if not self.fts_enabled:
+                raise ValueError("Full-text search is not available")
+            conditions.append("id IN (SELECT rowid FROM invoices_fts WHERE invoices_fts MATCH ?)")
+            params.append(text)
+        if cursor:
+            conditions.append("id < ?")
+            params.append(decode_cursor(cursor))
+
+        columns = SUMMARY_COLUMNS + (", raw_text" if include_raw_text else "")
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        # Fetch one extra row to know whether there is a next page
+        query = f"SELECT {columns} FROM invoices {where} ORDER BY id DESC LIMIT ?"
+        try:
+            rows = self._connection().execute(query, params + [limit + 1]).fetchall()
+        except sqlite3.OperationalError as e:
+            # Typically a malformed full-text query
+            raise ValueError(str(e))
+
+        next_cursor = encode_cursor(rows[limit - 1]["id"]) if len(rows) > limit else None
+        return [self._to_dict(row) for row in rows[:limit]], next_cursor
+
+    @staticmethod
+    def _to_dict(row: sqlite3.Row) -> Dict[str, Any]:
+        data = json.loads(row["data"])
+        if "raw_text" in row.keys():
+            data["raw_text"] = row["raw_text"]
+        return {
+            "id": row["id"],
+            "filename": row["filename"],
+            "content_hash": row["content_hash"],
+            "username": row["username"],
+            "created_at": row["created_at"],
+            "message_id": row["message_id"],
+            "extracted_data": data,
+        }
+
+
+# Results store shared by all requests of this process (None when disabled)
+results_store = ResultsStore(RESULTS_DB) if RESULTS_DB else None
@@ -0,0 +1,462 @@
+"""
+Tracing module for the Invoice OCR API.
+This module records OpenTelemetry-style spans around each request and each
+stage of the OCR pipeline (save, decoding, preprocessing, OCR, extraction of
+each field, serialization), so that the latency of this service can be
+correlated with the services calling it.
+
+Incoming W3C trace context (`traceparent` header) is continued: the spans of a
+request are children of the caller's span, in the caller's trace. Spans are
+handed to an exporter in batches from a background thread:
+
+- jsonl: one JSON span per line in TRACE_FILE, for environments without a collector
+- otlp: OTLP/HTTP (JSON encoding) to a collector at TRACE_OTLP_ENDPOINT
+- module:Class: any class implementing SpanExporter
+- none: tracing is disabled (the default), at no cost
+
+The current span is kept in a context variable: asyncio tasks, thread pool
+calls and OCR worker jobs started within a span are recorded as its children.
+"""
+import atexit
+import contextvars
+import importlib
+import json
+import os
+import random
+import re
+import threading
+import time
+import urllib.request
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Exporter of the spans: none, jsonl, otlp or module:Class
+TRACE_EXPORTER = os.getenv("TRACE_EXPORTER", "none")
+
+# File written by the jsonl exporter
+TRACE_FILE = os.getenv("TRACE_FILE", "traces.jsonl")
+
+# Collector URL of the otlp exporter
+TRACE_OTLP_ENDPOINT = os.getenv("TRACE_OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+
+# Name of this service in the exported spans
+TRACE_SERVICE_NAME = os.getenv("TRACE_SERVICE_NAME", "invoice-ocr-api")
+
+# Share of the traces started here (without incoming context) that are recorded
+TRACE_SAMPLE_RATIO = float(os.getenv("TRACE_SAMPLE_RATIO", "1.0"))
+
+# Seconds between two exports, and largest batch exported at once
+TRACE_EXPORT_INTERVAL = float(os.getenv("TRACE_EXPORT_INTERVAL", "2"))
+TRACE_BATCH_SIZE = 512
+
+# Spans waiting for export; beyond this, new spans are dropped
+TRACE_MAX_QUEUE = int(os.getenv("TRACE_MAX_QUEUE", "10000"))
+
+# Span kinds
+SERVER = "server"
+INTERNAL = "internal"
+
+# W3C trace context header: version-trace_id-parent_id-flags
+TRACEPARENT = re.compile(r"^([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+INVALID_TRACE_ID = "0" * 32
+INVALID_SPAN_ID = "0" * 16
+
+
+class Span:
+    """
+    Timed operation of a trace.
+
+    Attributes:
+        name (str): Name of the operation
+        trace_id (str): Id of the trace (32 hex digits)
+        span_id (str): Id of the span (16 hex digits)
+        parent_id (Optional[str]): Id of the parent span, None for the root of the trace here
+        kind (str): "server" for requests, "internal" for pipeline stages
+        attributes (Dict[str, Any]): Details of the operation
+        status (str): "unset", "ok" or "error"
+    """
+
+    def __init__(
+        self,
+        name: str,
+        trace_id: str,
+        parent_id: Optional[str] = None,
+        kind: str = INTERNAL,
+        attributes: Optional[Dict[str, Any]] = None
+    ):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = new_span_id()
+        self.parent_id = parent_id
+        self.kind = kind
+        self.attributes: Dict[str, Any] = dict(attributes or {})
+        self.status = "unset"
+        self.status_message: Optional[str] = None
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.thread = threading.current_thread().name
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def set_error(self, error: BaseException) -> None:
+        self.status = "error"
+        self.status_message = str(error) or type(error).__name__
+        self.attributes["exception.type"] = type(error).__name__
+
+    def end(self) -> None:
+        if self.end_ns is None:
+            self.end_ns = time.time_ns()
+
+    def to_dict(self) -> Dict[str, Any]:
+        """
+        Export the span with the field names of OpenTelemetry (OTLP JSON).
+        """
+        return {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "parentSpanId": self.parent_id or "",
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": self.start_ns,
+            "endTimeUnixNano": self.end_ns,
+            "durationMs": round(((self.end_ns or self.start_ns) - self.start_ns) / 1e6, 3),
+            "attributes": {"thread.name": self.thread, **self.attributes},
+            "status": {"code": self.status, "message": self.status_message},
+            "resource": {"service.name": TRACE_SERVICE_NAME},
+        }
+
+
+class SpanExporter:
+    """
+    Base class for span exporters. `export` is called from the export thread,
+    one batch at a time.
+    """
+
+    def export(self, spans: List[Span]) -> None:
+        raise NotImplementedError
+
+    def shutdown(self) -> None:
+        pass
+
+
+class JsonlFileExporter(SpanExporter):
+    """
+    Append the spans to a file, one JSON object per line.
+    """
+
+    def __init__(self, path: str = TRACE_FILE):
+        self.path = path
+
+    def export(self, spans: List[Span]) -> None:
+        lines = "".join(json.dumps(span.to_dict(), default=str) + "\n" for span in spans)
+        with open(self.path, "a", encoding="utf-8") as output:
+            output.write(lines)
+
+
+class OtlpHttpExporter(SpanExporter):
+    """
+    Send the spans to an OpenTelemetry collector with OTLP/HTTP, JSON encoding.
+    """
+
+    KINDS = {INTERNAL: 1, SERVER: 2}
+    STATUSES = {"unset": 0, "ok": 1, "error": 2}
+
+    def __init__(self, endpoint: str = TRACE_OTLP_ENDPOINT, timeout: float = 10.0):
+        self.endpoint = endpoint
+        self.timeout = timeout
+
+    @staticmethod
+    def attribute(key: str, value: Any) -> Dict[str, Any]:
+        if isinstance(value, bool):
+            return {"key": key, "value": {"boolValue": value}}
+        if isinstance(value, int):
+            return {"key": key, "value": {"intValue": str(value)}}
+        if isinstance(value, float):
+            return {"key": key, "value": {"doubleValue": value}}
+        return {"key": key, "value": {"stringValue": str(value)}}
+
+    def encode(self, span: Span) -> Dict[str, Any]:
+        data = span.to_dict()
+        status = {"code": self.STATUSES[span.status]}
+        if span.status_message:
+            status["message"] = span.status_message
+        return {
+            "traceId": span.trace_id,
+            "spanId": span.span_id,
+            "parentSpanId": span.parent_id or "",
+            "name": span.name,
+            "kind": self.KINDS.get(span.kind, 1),
+            "startTimeUnixNano": str(span.start_ns),
+            "endTimeUnixNano": str(span.end_ns),
+            "attributes": [self.attribute(key, value) for key, value in data["attributes"].items()],
+            "status": status,
+        }
+
+    def export(self, spans: List[Span]) -> None:
+        body = {
+            "resourceSpans": [{
+                "resource": {"attributes": [self.attribute("service.name", TRACE_SERVICE_NAME)]},
+                "scopeSpans": [{"scope": {"name": "app.tracing"}, "spans": [self.encode(span) for span in spans]}],
+            }]
+        }
+        request = urllib.request.Request(
+            self.endpoint, data=json.dumps(body).encode("utf-8"), headers={"Content-Type": "application/json"}
+        )
+        with urllib.request.urlopen(request, timeout=self.timeout):
+            pass
+
+
+def create_exporter(name: str = TRACE_EXPORTER) -> Optional[SpanExporter]:
+    """
+    Create a span exporter by name.
+
+    Args:
+        name (str): "none", "jsonl", "otlp", or "package.module:Class" for a custom exporter
+
+    Returns:
+        Optional[SpanExporter]: The new exporter, None when tracing is disabled
+
+    Raises:
+        ValueError: If the exporter name is unknown
+    """
+    if name in ("", "none"):
+        return None
+    if name == "jsonl":
+        return JsonlFileExporter()
+    if name == "otlp":
+        return OtlpHttpExporter()
+    if ":" in name:
+        module, _, cls = name.partition(":")
+        return getattr(importlib.import_module(module), cls)()
+    raise ValueError(f"Unknown trace exporter: {name}")
+
+
+class Tracer:
+    """
+    Create spans and export them in batches from a background thread.
+
+    Attributes:
+        exporter (Optional[SpanExporter]): Where the spans go, None to disable tracing
+        dropped (int): Spans dropped because the export queue was full
+        failed (int): Spans lost because their export failed
+    """
+
+    def __init__(self, exporter: Optional[SpanExporter] = None, sample_ratio: float = TRACE_SAMPLE_RATIO):
+        self.exporter = exporter
+        self.sample_ratio = sample_ratio
+        self.dropped = 0
+        self.failed = 0
+        self._queue: Deque[Span] = deque()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.exporter is not None
+
+    def record(self, span: Span) -> None:
+        """
+        Queue a finished span for export.
+        """
+        with self._lock:
+            if len(self._queue) >= TRACE_MAX_QUEUE:
+                self.dropped += 1
+                return
+            self._queue.append(span)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="trace-export", daemon=True)
+                self._thread.start()
+            if len(self._queue) >= TRACE_BATCH_SIZE:
+                self._wake.set()
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait(TRACE_EXPORT_INTERVAL)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Export the queued spans now.
+        """
+        while True:
+            with self._lock:
+                batch = [self._queue.popleft() for _ in range(min(TRACE_BATCH_SIZE, len(self._queue)))]
+            if not batch or self.exporter is None:
+                return
+            try:
+                self.exporter.export(batch)
+            except Exception:
+                # Tracing must never break the service
+                self.failed += len(batch)
+
+    def shutdown(self) -> None:
+        if self.exporter is not None:
+            self.flush()
+            self.exporter.shutdown()
+
+    def sampled(self) -> bool:
+        return self.sample_ratio >= 1.0 or random.random() < self.sample_ratio
+
+
+# Tracer of this process
+tracer = Tracer(create_exporter())
+atexit.register(tracer.shutdown)
+
+# Span of the operation running in the current context
+current_span: "contextvars.ContextVar[Optional[Span]]" = contextvars.ContextVar("current_span", default=None)
+
+# Remote parent of the request running in the current context: (trace id, span id, sampled)
+remote_parent: "contextvars.ContextVar[Optional[Tuple[str, str, bool]]]" = contextvars.ContextVar(
+    "remote_parent", default=None
+)
+
+
+def new_trace_id() -> str:
+    return "%032x" % random.getrandbits(128)
+
+
+def new_span_id() -> str:
+    return "%016x" % random.getrandbits(64)
+
+
+def parse_traceparent(header: Optional[str]) -> Optional[Tuple[str, str, bool]]:
+    """
+    Parse a W3C `traceparent` header.
+
+    Args:
+        header (Optional[str]): Header value, e.g. "00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01"
+
+    Returns:
+        Optional[Tuple[str, str, bool]]: Trace id, parent span id and sampled flag,
+        None if the header is missing or invalid
+    """
+    match = TRACEPARENT.match((header or "").strip().lower())
+    if match is None:
+        return None
+    version, trace_id, parent_id, flags = match.groups()
+    if version == "ff" or trace_id == INVALID_TRACE_ID or parent_id == INVALID_SPAN_ID:
+        return None
+    return trace_id, parent_id, bool(int(flags, 16) & 1)
+
+
+class _SpanScope:
+    """
+    Context manager recording a span and making it the current one.
+    """
+
+    __slots__ = ("span", "token")
+
+    def __init__(self, span: Span):
+        self.span = span
+        self.token = None
+
+    def __enter__(self) -> Span:
+        self.token = current_span.set(self.span)
+        return self.span
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        current_span.reset(self.token)
+        if exc is not None:
+            self.span.set_error(exc)
+        self.span.end()
+        tracer.record(self.span)
+        return False
+
+
+class _NoSpan:
+    """
+    Context manager standing for a span that is not recorded.
+    """
+
+    def __enter__(self) -> None:
+        return None
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        return False
+
+
+NO_SPAN = _NoSpan()
+
+
+def span(name: str, kind: str = INTERNAL, **attributes: Any):
+    """
+    Record the code run in a `with` block as a span, child of the current span.
+
+    Outside of any span, a new trace is started (continuing the remote parent
+    of the request, if any). Nothing is recorded when tracing is disabled or
+    the trace is not sampled; the block then gets None instead of the span.
+
+    Args:
+        name (str): Name of the operation
+        kind (str): Span kind (SERVER or INTERNAL)
+        **attributes: Details of the operation
+
+    Returns:
+        Context manager giving the Span, or None when not recorded
+    """
+    if not tracer.enabled:
+        return NO_SPAN
+    parent = current_span.get()
+    if parent is not None:
+        return _SpanScope(Span(name, parent.trace_id, parent.span_id, kind, attributes))
+    remote = remote_parent.get()
+    if remote is not None:
+        trace_id, parent_id, sampled = remote
+        if not sampled:
+            return NO_SPAN
+        return _SpanScope(Span(name, trace_id, parent_id, kind, attributes))
+    if not tracer.sampled():
+        return NO_SPAN
+    return _SpanScope(Span(name, new_trace_id(), None, kind, attributes))
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware recording a server span per HTTP request, continuing the
+    trace context of the caller (`traceparent` header). The trace id is sent
+    back in the `X-Trace-Id` response header.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not tracer.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        remote = parse_traceparent(headers.get(b"traceparent", b"").decode("latin-1"))
+        token = remote_parent.set(remote)
+        try:
+            with span(f"{scope['method']} {scope['path']}", kind=SERVER, **{
+                "http.method": scope["method"],
+                "http.target": scope["path"],
+            }) as request_span:
+                async def send_wrapper(message):
+                    if message["type"] == "http.response.start" and request_span is not None:
+                        # Name the span after the route (/invoices/{invoice_id}), known once routed
+                        route = getattr(scope.get("route"), "path", None)
+                        if route:
+                            request_span.name = f"{scope['method']} {route}"
+                            request_span.set_attribute("http.route", route)
+                        request_span.set_attribute("http.status_code", message["status"])
+                        if message["status"] >= 500:
+                            request_span.status = "error"
+                        message.setdefault("headers", [])
+                        message["headers"] = list(message["headers"]) + [
+                            (b"x-trace-id", request_span.trace_id.encode("latin-1"))
+                        ]
+                    await send(message)
+
+                await self.app(scope, receive, send_wrapper)
+        finally:
+            remote_parent.reset(token)
@@ -0,0 +1,212 @@
+"""
+Page triage module for the Invoice OCR API.
+This module looks at each page before OCR, on a small thumbnail, to avoid
+paying the full OCR cost for pages that cannot give any field:
+
+- blank pages (e.g. separator sheets) are skipped,
+- images that do not look like a document (photos, dark images) are skipped,
+  and a file whose pages are all skipped is rejected,
+- pages scanned sideways or upside down are turned upright, using the
+  orientation detection (OSD) of the OCR engine, so that the OCR runs once
+  on a correctly oriented page (optional, see OCR_OSD).
+
+A document page is mostly light paper with some dark ink: the statistics used
+are the gray level of the background (median), the share of pixels close to
+it (paper), the share of pixels much darker than it (ink) and the spread of
+the horizontal gradient (edges, high on sharp text).
+"""
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Optional
+
+import numpy as np
+from dotenv import load_dotenv
+from PIL import Image
+
+from .engines import get_engine
+
+# Load environment variables
+load_dotenv()
+
+# Skip blank pages and reject files that do not look like documents
+OCR_TRIAGE = os.getenv("OCR_TRIAGE", "true").lower() == "true"
+
+# Turn pages upright with the orientation detection of the OCR engine. Off by
+# default: it costs an extra OCR engine run per page, for the few pages that
+# are scanned sideways or upside down
+OCR_OSD = os.getenv("OCR_OSD", "false").lower() == "true"
+
+# Longest side (in pixels) of the thumbnail the statistics are computed on
+TRIAGE_SIDE = 512
+
+# Pixels darker than the background by this many gray levels are ink, pixels
+# within PAPER_TOLERANCE of it are paper
+INK_CONTRAST = 40
+PAPER_TOLERANCE = 30
+
+# Pages with less ink than this (share of the pixels), or with a flatter
+# gradient than BLANK_MAX_EDGES (shading, scanner noise), are blank
+TRIAGE_BLANK_INK = float(os.getenv("TRIAGE_BLANK_INK", "0.001"))
+BLANK_MAX_EDGES = 2.0
+
+# Pages with less paper than this (share of the pixels), or a background
+# darker than MIN_BACKGROUND, are not documents
+TRIAGE_MIN_PAPER = float(os.getenv("TRIAGE_MIN_PAPER", "0.5"))
+MIN_BACKGROUND = 128
+
+# Orientations detected with a lower confidence are ignored
+OSD_MIN_CONFIDENCE = float(os.getenv("OSD_MIN_CONFIDENCE", "2.0"))
+
+# Longest side (in pixels) of the image given to orientation detection, which
+# does not need the full OCR resolution
+OSD_MAX_SIDE = 1754
+
+# Number of detected orientations kept, by page thumbnail
+OSD_CACHE_SIZE = 256
+
+# Page kinds
+DOCUMENT = "document"
+BLANK = "blank"
+NOT_A_DOCUMENT = "not a document"
+
+
+class NotADocumentError(ValueError):
+    """
+    Raised when no page of a file looks like a document.
+    """
+
+
+@dataclass(frozen=True)
+class Triage:
+    """
+    What a page looks like, from its thumbnail.
+
+    Attributes:
+        kind (str): DOCUMENT, BLANK or NOT_A_DOCUMENT
+        background (float): Gray level of the background (0 to 255)
+        paper (float): Share of the pixels close to the background
+        ink (float): Share of the pixels much darker than the background
+        edges (float): Standard deviation of the horizontal gradient
+        digest (str): Digest of the thumbnail, identifying the page content
+    """
+    kind: str
+    background: float
+    paper: float
+    ink: float
+    edges: float
+    digest: str
+
+
+def thumbnail(image: Image.Image, side: int = TRIAGE_SIDE) -> Image.Image:
+    """
+    Shrink a page to a grayscale thumbnail by sampling its pixels.
+
+    Sampling reads a fraction of the pixels only, and unlike averaging, it
+    keeps the share of ink pixels of the page.
+    """
+    scale = side / max(image.size)
+    if scale < 1:
+        size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+        image = image.resize(size, Image.NEAREST)
+    return image.convert("L")
+
+
+def triage(image: Image.Image) -> Triage:
+    """
+    Tell whether a page is a document, blank, or not a document.
+    Takes a few milliseconds, whatever the page size.
+
+    Args:
+        image (Image.Image): Page image
+
+    Returns:
+        Triage: Kind and statistics of the page
+    """
+    thumb = thumbnail(image)
+    pixels = np.asarray(thumb, dtype=np.int16)
+    background = float(np.median(pixels))
+    paper = float((np.abs(pixels - background) <= PAPER_TOLERANCE).mean())
+    ink = float((pixels < background - INK_CONTRAST).mean())
+    edges = float(np.abs(np.diff(pixels, axis=1)).std()) if pixels.shape[1] > 1 else 0.0
+
+    if background < MIN_BACKGROUND or paper < TRIAGE_MIN_PAPER:
+        kind = NOT_A_DOCUMENT
+    elif ink < TRIAGE_BLANK_INK or edges < BLANK_MAX_EDGES:
+        kind = BLANK
+    else:
+        kind = DOCUMENT
+    digest = hashlib.sha1(thumb.tobytes()).hexdigest()
+    return Triage(kind, background, paper, ink, edges, digest)
+
+
+class OrientationCache:
+    """
+    Bounded cache of detected orientations, by page thumbnail digest, so that
+    the same page sent again is not analysed twice.
+    """
+
+    def __init__(self, max_size: int = OSD_CACHE_SIZE):
+        self.max_size = max_size
+        self._rotations: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, digest: str) -> Optional[int]:
+        with self._lock:
+            rotation = self._rotations.get(digest)
+            if rotation is not None:
+                self._rotations.move_to_end(digest)
+            return rotation
+
+    def put(self, digest: str, rotation: int) -> None:
+        with self._lock:
+            self._rotations[digest] = rotation
+            self._rotations.move_to_end(digest)
+            while len(self._rotations) > self.max_size:
+                self._rotations.popitem(last=False)
+
+
+orientation_cache = OrientationCache()
+
+
+def detect_rotation(
+    image: Image.Image,
+    digest: str,
+    timeout: Optional[float] = None,
+    cancel_event: Optional[threading.Event] = None,
+) -> int:
+    """
+    Get the clockwise rotation that makes a page upright.
+
+    Args:
+        image (Image.Image): Page image
+        digest (str): Digest of the page thumbnail (see Triage)
+        timeout (Optional[float]): Time budget in seconds, None for no limit
+        cancel_event (Optional[threading.Event]): Set to abort the call
+
+    Returns:
+        int: 0, 90, 180 or 270 degrees
+    """
+    rotation = orientation_cache.get(digest)
+    if rotation is not None:
+        return rotation
+
+    factor = max(image.size) // OSD_MAX_SIDE
+    small = image.reduce(factor) if factor >= 2 else image
+    detected = get_engine().detect_orientation(small, timeout=timeout, cancel_event=cancel_event)
+    rotation = 0
+    if detected is not None and detected[1] >= OSD_MIN_CONFIDENCE and detected[0] % 90 == 0:
+        rotation = detected[0]
+    orientation_cache.put(digest, rotation)
+    return rotation
+
+
+def upright(image: Image.Image, rotation: int) -> Image.Image:
+    """
+    Rotate a page clockwise by a multiple of 90 degrees (a lossless transpose).
+    """
+    if rotation == 0:
+        return image
+    return image.rotate(-rotation, expand=True)
@@ -0,0 +1,51 @@
+"""
+Tuning module for the Invoice OCR API.
+This module loads the settings written by the calibration command
+(`python -m benchmarks.autotune`): the number of OCR workers and the number of
+threads per Tesseract process that gave the best throughput on this machine.
+
+The tuning file uses the .env format. Settings from the environment or from
+the .env file take precedence over it.
+"""
+import datetime
+import os
+from typing import Any, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+# Load environment variables
+load_dotenv()
+
+# Settings file written by the calibration command
+OCR_TUNING_FILE = os.getenv("OCR_TUNING_FILE", "ocr_tuning.env")
+
+
+def load_tuning(path: Optional[str] = None) -> bool:
+    """
+    Load the tuned settings into the environment, without overriding any
+    setting that is already defined.
+
+    Args:
+        path (Optional[str]): Tuning file, None for OCR_TUNING_FILE
+
+    Returns:
+        bool: Whether a tuning file was found
+    """
+    path = path or OCR_TUNING_FILE
+    return os.path.isfile(path) and load_dotenv(path, override=False)
+
+
+def write_tuning(path: str, settings: Dict[str, Any], notes: List[str] = ()) -> None:
+    """
+    Write tuned settings to a tuning file.
+
+    Args:
+        path (str): Tuning file
+        settings (Dict[str, Any]): Setting names and values
+        notes (List[str]): Comment lines written above the settings
+    """
+    lines = [f"# Written by benchmarks/autotune.py on {datetime.datetime.now().isoformat(timespec='seconds')}"]
+    lines += [f"# {note}" for note in notes]
+    lines += [f"{name}={value}" for name, value in settings.items()]
+    with open(path, "w", encoding="utf-8") as tuning_file:
+        tuning_file.write("\n".join(lines) + "\n")
@@ -4,7 +4,22 @@ This module contains helper functions used across the application.
 """
 import os
 import re
-from typing import List, Dict, Any
+import sys
+import hashlib
+import threading
+import datetime
+import unicodedata
+from contextlib import contextmanager
+from decimal import Decimal, InvalidOperation
+from typing import List, Dict, Any, Optional, Tuple
+
+from .tracing import span
+
+# The resource module is not available on Windows
+try:
+    import resource
+except ImportError:  # pragma: no cover - depends on the platform
+    resource = None
 
 def ensure_dir_exists(directory: str) -> None:
     """
@@ -16,6 +31,180 @@ def ensure_dir_exists(directory: str) -> None:
     if not os.path.exists(directory):
         os.makedirs(directory)
 
+def save_upload_file(source, destination: str) -> str:
+    """
+    Copy an uploaded file to disk while computing its SHA-256 content hash.
+    
+    Args:
+        source: Binary file-like object to read from
+        destination (str): Path of the file to write
+        
+    Returns:
+        str: Hex digest of the file content
+    """
+    digest = hashlib.sha256()
+    with span("save") as save_span, open(destination, "wb") as buffer:
+        for chunk in iter(lambda: source.read(1024 * 1024), b""):
+            digest.update(chunk)
+            buffer.write(chunk)
+        if save_span is not None:
+            save_span.set_attribute("file.bytes", buffer.tell())
+    return digest.hexdigest()
+
+def save_buffer(buffer, destination: str) -> str:
+    """
+    Write a file held in memory to disk and compute its SHA-256 content hash.
+    
+    Args:
+        buffer: Bytes-like object with the file content
+        destination (str): Path of the file to write
+        
+    Returns:
+        str: Hex digest of the file content
+    """
+    with span("save", **{"file.bytes": len(buffer)}):
+        with open(destination, "wb") as output:
+            output.write(buffer)
+        return hashlib.sha256(buffer).hexdigest()
+
+def hash_file(path: str) -> str:
+    """
+    Compute the SHA-256 content hash of a file.
+    
+    Args:
+        path (str): Path of the file
+        
+    Returns:
+        str: Hex digest of the file content
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as source:
+        for chunk in iter(lambda: source.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def current_rss_mb() -> Optional[float]:
+    """
+    Get the current resident set size (RSS) of this process.
+    
+    Returns:
+        Optional[float]: RSS in megabytes, or None if it cannot be measured
+    """
+    try:
+        with open("/proc/self/statm") as statm:
+            pages = int(statm.read().split()[1])
+        return pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+def read_peak_rss_mb() -> Optional[float]:
+    """
+    Get the kernel high-water mark of the resident set size (VmHWM) of this process.
+    
+    Returns:
+        Optional[float]: Peak RSS in megabytes, or None if it cannot be measured
+    """
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except (OSError, ValueError, IndexError):
+        pass
+    return None
+
+class RSSWindow:
+    """
+    Resident memory of this process during one request (see PeakRSSTracker.track).
+    """
+
+    def __init__(self, start_mb: Optional[float]):
+        self.start_mb = start_mb
+        self.peak_mb: Optional[float] = None
+
+    @property
+    def growth_mb(self) -> Optional[float]:
+        """
+        Growth of the RSS from the start of the window to its peak.
+        """
+        if self.start_mb is None or self.peak_mb is None:
+            return None
+        return max(0.0, self.peak_mb - self.start_mb)
+
+class PeakRSSTracker:
+    """
+    Peak resident set size of this process, per request and over its lifetime.
+    
+    On Linux, the high-water mark of the kernel is reset (/proc/self/clear_refs)
+    when a request starts while no other one is tracked, so the peak of a
+    request only covers the time since then. The peak of overlapping requests
+    includes the memory of the others. Where the mark cannot be reset, the peak
+    of a request is unknown.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._active = 0
+        # Highest mark seen before a reset, the kernel one only covers the time since
+        self._lifetime_mb = 0.0
+        self._resettable = True
+
+    def _reset(self) -> bool:
+        """
+        Reset the high-water mark of the kernel to the current RSS.
+        """
+        if not self._resettable:
+            return False
+        peak = read_peak_rss_mb()
+        try:
+            with open("/proc/self/clear_refs", "w") as clear_refs:
+                clear_refs.write("5")
+        except OSError:
+            self._resettable = False
+            return False
+        if peak is not None:
+            self._lifetime_mb = max(self._lifetime_mb, peak)
+        return True
+
+    @contextmanager
+    def track(self):
+        """
+        Track the peak RSS of a request.
+        
+        Yields:
+            RSSWindow: Memory of the request, its peak is set on exit
+        """
+        with self._lock:
+            if self._active == 0:
+                self._reset()
+            self._active += 1
+        window = RSSWindow(current_rss_mb())
+        try:
+            yield window
+        finally:
+            with self._lock:
+                self._active -= 1
+                if self._resettable:
+                    window.peak_mb = read_peak_rss_mb()
+
+    def lifetime_peak_mb(self) -> Optional[float]:
+        """
+        Get the peak RSS of this process since it started.
+        
+        Returns:
+            Optional[float]: Peak RSS in megabytes, or None if it cannot be measured
+        """
+        peaks = [self._lifetime_mb or None, read_peak_rss_mb()]
+        if resource is not None:
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            # ru_maxrss is in bytes on macOS and in kilobytes elsewhere
+            peaks.append(peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024)
+        peaks = [peak for peak in peaks if peak is not None]
+        return max(peaks) if peaks else None
+
+# Peak RSS tracker shared by the whole process
+peak_rss = PeakRSSTracker()
+
 def clean_text(text: str) -> str:
     """
     Clean OCR text by removing extra spaces, normalizing line breaks, etc.
@@ -60,4 +249,136 @@ def validate_invoice_data(data: Dict[str, Any]) -> List[str]:
     if not data.get('total_amount'):
         errors.append("Total amount not found")
     
-    return errors
\ No newline at end of file
+    return errors
+
+# Month names (English and French, without accents) mapped to month numbers
+MONTHS = {
+    "january": 1, "jan": 1, "janvier": 1, "janv": 1,
+    "february": 2, "feb": 2, "fevrier": 2, "fevr": 2, "fev": 2,
+    "march": 3, "mar": 3, "mars": 3,
+    "april": 4, "apr": 4, "avril": 4, "avr": 4,
+    "may": 5, "mai": 5,
+    "june": 6, "jun": 6, "juin": 6,
+    "july": 7, "jul": 7, "juillet": 7, "juil": 7,
+    "august": 8, "aug": 8, "aout": 8,
+    "september": 9, "sep": 9, "sept": 9, "septembre": 9,
+    "october": 10, "oct": 10, "octobre": 10,
+    "november": 11, "nov": 11, "novembre": 11,
+    "december": 12, "dec": 12, "decembre": 12,
+}
+
+def parse_date(value: Optional[str], day_first: bool = False) -> Optional[datetime.date]:
+    """
+    Normalize a date string found by the extractors into a date object.
+    
+    Supports YYYY-MM-DD, numeric dates with the month first (MM/DD/YYYY) or
+    the day first (DD/MM/YYYY), and dates with the month name in English or
+    French ("March 15, 2023", "15 mars 2023", "1er avril 2023").
+    Month-first is assumed unless `day_first` is set or the first number
+    cannot be a month. Two-digit years are interpreted as 20YY.
+    
+    Args:
+        value (Optional[str]): Date string, e.g. "01/31/2023"
+        day_first (bool): Read ambiguous numeric dates day first (e.g. French invoices)
+        
+    Returns:
+        Optional[datetime.date]: Parsed date or None if it is not a valid date
+    """
+    if not value:
+        return None
+    
+    value = value.strip()
+    parts = re.split(r'[/\-.]', value)
+    if len(parts) == 3 and all(part.isdigit() for part in parts):
+        numbers = [int(part) for part in parts]
+        if len(parts[0]) == 4:
+            year, month, day = numbers
+        else:
+            if day_first:
+                day, month, year = numbers
+            else:
+                month, day, year = numbers
+            if month > 12:
+                # Not a valid month, so the day and month are the other way round
+                day, month = month, day
+            if len(parts[2]) == 2:
+                year += 2000
+    else:
+        date_parts = _parse_month_name_date(value)
+        if date_parts is None:
+            return None
+        year, month, day = date_parts
+    
+    try:
+        return datetime.date(year, month, day)
+    except ValueError:
+        return None
+
+def _parse_month_name_date(value: str) -> Optional[Tuple[int, int, int]]:
+    """
+    Parse a date written with the month name ("15 mars 2023", "March 15, 2023").
+    
+    Returns:
+        Optional[Tuple[int, int, int]]: Year, month and day, or None if not recognized
+    """
+    ascii_value = unicodedata.normalize("NFKD", value).encode("ascii", "ignore").decode("ascii").lower()
+    match = (
+        re.fullmatch(r'(\d{1,2})(?:er|st|nd|rd|th)?\s+([a-z]+)\.?,?\s+(\d{4})', ascii_value)
+        or re.fullmatch(r'([a-z]+)\.?\s+(\d{1,2})(?:st|nd|rd|th)?,?\s+(\d{4})', ascii_value)
+    )
+    if not match:
+        return None
+    if match.group(1).isdigit():
+        day, month_name, year = match.groups()
+    else:
+        month_name, day, year = match.groups()
+    month = MONTHS.get(month_name)
+    if month is None:
+        return None
+    return int(year), month, int(day)
+
+# Characters used to group thousands in amounts ("1,234.56", "1 234,56", "1'234.56")
+THOUSANDS_SEPARATORS = " \u00a0\u202f'"
+
+def parse_amount(value: Optional[str], decimal_comma: Optional[bool] = None) -> Optional[Decimal]:
+    """
+    Normalize an amount string found by the extractors into a Decimal.
+    
+    Both English ("1,234.56") and French ("1 234,56", "1.234,56") notations are
+    supported. When an amount has a single kind of separator, `decimal_comma`
+    tells how to read it; by default a comma followed by one or two digits at
+    the end is taken as the decimal separator.
+    
+    Args:
+        value (Optional[str]): Amount string, e.g. "1,234.56"
+        decimal_comma (Optional[bool]): The amount uses a decimal comma, None to guess
+        
+    Returns:
+        Optional[Decimal]: Parsed amount or None if it is not a number
+    """
+    if not value:
+        return None
+    
+    value = value.strip()
+    for separator in THOUSANDS_SEPARATORS:
+        value = value.replace(separator, '')
+    
+    if ',' in value and '.' in value:
+        # The separator that comes last is the decimal one
+        decimal_separator = ',' if value.rfind(',') > value.rfind('.') else '.'
+    elif ',' in value:
+        if decimal_comma is None:
+            decimal_comma = re.search(r',\d{1,2}$', value) is not None
+        decimal_separator = ',' if decimal_comma else '.'
+    elif '.' in value and decimal_comma and re.fullmatch(r'\d{1,3}(?:\.\d{3})+', value):
+        # "1.234" written with dots between thousands
+        decimal_separator = ','
+    else:
+        decimal_separator = '.'
+    
+    thousands_separator = '.' if decimal_separator == ',' else ','
+    value = value.replace(thousands_separator, '').replace(decimal_separator, '.')
+    try:
+        return Decimal(value)
+    except InvalidOperation:
+        return None
@@ -0,0 +1,249 @@
+"""
+Vendor normalization module for the Invoice OCR API.
+This module maps the vendor names found by OCR ("ACME Inc", "ACME lnc.",
+"Acme  Inc") to the canonical vendors listed in a vendors file.
+
+The vendors are indexed by character trigrams: a lookup only scores the few
+vendors sharing the most trigrams with the extracted name, with an edit
+distance, so it stays well under a millisecond for thousands of vendors.
+The index is rebuilt automatically when the vendors file changes.
+
+The vendors file is a JSON list:
+    [{"id": "acme", "name": "ACME Inc", "aliases": ["Acme Corporation"]}]
+"""
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from .logger import app_logger
+
+# Load environment variables
+load_dotenv()
+
+# Path of the vendors file, the normalization is disabled when it does not exist
+VENDORS_FILE = os.getenv("VENDORS_FILE", "vendors.json")
+
+# Minimum similarity (0 to 1) for an extracted name to match a vendor
+VENDOR_MATCH_THRESHOLD = float(os.getenv("VENDOR_MATCH_THRESHOLD", "0.8"))
+
+# Number of trigram candidates scored with the edit distance
+VENDOR_CANDIDATES = 10
+
+# How often (in seconds) the vendors file is checked for changes
+VENDORS_RELOAD_INTERVAL = 5.0
+
+# Legal forms ignored when comparing names
+LEGAL_FORMS = {
+    "inc", "incorporated", "llc", "ltd", "limited", "corp", "corporation",
+    "co", "company", "plc", "gmbh", "sa", "sas", "sarl", "sasu", "eurl", "bv", "ag",
+}
+
+# Common OCR confusions inside words
+OCR_CONFUSIONS = str.maketrans({"0": "o", "1": "l", "|": "l", "5": "s"})
+OCR_SEQUENCE_CONFUSIONS = (("rn", "m"), ("vv", "w"))
+
+
+@dataclass(frozen=True)
+class VendorMatch:
+    """
+    Canonical vendor matched for an extracted name.
+
+    Attributes:
+        vendor_id (str): Id of the canonical vendor
+        name (str): Canonical vendor name
+        score (float): Similarity between the extracted and the matched name
+    """
+    vendor_id: str
+    name: str
+    score: float
+
+
+def normalize_vendor_name(name: str) -> str:
+    """
+    Normalize a vendor name for comparison.
+
+    Accents, case, punctuation, legal forms and common OCR confusions are
+    removed, e.g. "ACME lnc." and "Acme, Inc" both become "acme".
+
+    Args:
+        name (str): Vendor name
+
+    Returns:
+        str: Normalized name
+    """
+    name = unicodedata.normalize("NFKD", name).encode("ascii", "ignore").decode("ascii").lower()
+    # "S.A." is the same legal form as "SA"
+    name = name.replace(".", "")
+    words = []
+    for word in re.findall(r"[a-z0-9|]+", name):
+        if not word.isdigit():
+            word = word.translate(OCR_CONFUSIONS)
+            for confusion, replacement in OCR_SEQUENCE_CONFUSIONS:
+                word = word.replace(confusion, replacement)
+        # "lnc" is how OCR often reads "inc"
+        if word in LEGAL_FORMS or word == "lnc":
+            continue
+        words.append(word)
+    return " ".join(words)
+
+
+def trigrams(text: str) -> List[str]:
+    """
+    Get the character trigrams of a normalized name, padded at both ends.
+    """
+    padded = f"  {text} "
+    return [padded[i:i + 3] for i in range(len(padded) - 2)]
+
+
+def similarity(a: str, b: str) -> float:
+    """
+    Similarity of two strings from their Levenshtein edit distance.
+
+    Returns:
+        float: 1.0 for identical strings, down to 0.0
+    """
+    if a == b:
+        return 1.0
+    if not a or not b:
+        return 0.0
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (char_a != char_b),
+            ))
+        previous = current
+    return 1.0 - previous[-1] / max(len(a), len(b))
+
+
+class VendorIndex:
+    """
+    Trigram index of the known vendors.
+    """
+
+    def __init__(self, vendors: List[Dict]):
+        # Every name and alias is an entry pointing to its vendor
+        self._entries: List[Tuple[str, str, str]] = []
+        self._exact: Dict[str, int] = {}
+        self._postings: Dict[str, List[int]] = {}
+        for vendor in vendors:
+            for name in [vendor["name"]] + list(vendor.get("aliases", [])):
+                normalized = normalize_vendor_name(name)
+                if not normalized:
+                    continue
+                entry = len(self._entries)
+                self._entries.append((normalized, str(vendor["id"]), vendor["name"]))
+                self._exact.setdefault(normalized, entry)
+                for gram in set(trigrams(normalized)):
+                    self._postings.setdefault(gram, []).append(entry)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def lookup(self, name: Optional[str], threshold: float = VENDOR_MATCH_THRESHOLD) -> Optional[VendorMatch]:
+        """
+        Find the canonical vendor of an extracted name.
+
+        Args:
+            name (Optional[str]): Vendor name found by OCR
+            threshold (float): Minimum similarity for a match
+
+        Returns:
+            Optional[VendorMatch]: The best match, or None if no vendor is close enough
+        """
+        if not name:
+            return None
+        normalized = normalize_vendor_name(name)
+        if not normalized:
+            return None
+
+        entry = self._exact.get(normalized)
+        if entry is not None:
+            _, vendor_id, canonical = self._entries[entry]
+            return VendorMatch(vendor_id, canonical, 1.0)
+
+        # Candidates: the entries sharing the most trigrams with the name
+        counts = Counter()
+        for gram in set(trigrams(normalized)):
+            counts.update(self._postings.get(gram, ()))
+
+        best = None
+        for entry, _ in counts.most_common(VENDOR_CANDIDATES):
+            candidate, vendor_id, canonical = self._entries[entry]
+            score = similarity(normalized, candidate)
+            if score >= threshold and (best is None or score > best.score):
+                best = VendorMatch(vendor_id, canonical, round(score, 3))
+        return best
+
+
+class VendorRegistry:
+    """
+    Vendor index loaded from the vendors file and reloaded when the file changes.
+    """
+
+    def __init__(self, path: str = VENDORS_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._index = VendorIndex([])
+        self._mtime: Optional[float] = None
+        self._checked = 0.0
+        self.reload()
+
+    def reload(self) -> bool:
+        """
+        Rebuild the index from the vendors file if it changed.
+
+        Returns:
+            bool: True if the index was rebuilt
+        """
+        with self._lock:
+            self._checked = time.monotonic()
+            try:
+                mtime = os.path.getmtime(self.path)
+            except OSError:
+                mtime = None
+            if mtime == self._mtime:
+                return False
+
+            # Build the new index completely before swapping it in
+            try:
+                vendors = []
+                if mtime is not None:
+                    with open(self.path, "r", encoding="utf-8") as vendors_file:
+                        vendors = json.load(vendors_file)
+                if not isinstance(vendors, list):
+                    raise ValueError("the vendors file must hold a list of vendors")
+                index = VendorIndex(vendors)
+            except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+                # Keep serving the previous index, and only retry once the file changes again
+                self._mtime = mtime
+                app_logger.error(f"Could not load vendors file {self.path}: {e!r}")
+                return False
+
+            self._index = index
+            self._mtime = mtime
+            app_logger.info(f"Loaded {len(self._index)} vendor names from {self.path}")
+            return True
+
+    def lookup(self, name: Optional[str]) -> Optional[VendorMatch]:
+        """
+        Find the canonical vendor of an extracted name (see VendorIndex.lookup).
+        """
+        if time.monotonic() - self._checked > VENDORS_RELOAD_INTERVAL:
+            self.reload()
+        return self._index.lookup(name)
+
+
+# Vendor registry shared by the whole process
+vendor_registry = VendorRegistry()
@@ -0,0 +1,392 @@
+"""
+OCR worker pool module for the Invoice OCR API.
+This module runs OCR jobs on a dedicated, bounded pool of worker threads so that
+slow jobs never block the event loop or the threads serving other requests.
+
+Each job gets a deadline and a cancellation event. When the caller gives up
+(timeout or client disconnect) the event is set, the OCR subprocess is killed
+and the worker is free for the next job right away.
+
+Jobs are queued by priority class: interactive jobs (a person is waiting) are
+started before queued bulk jobs, but bulk jobs are guaranteed a minimum share
+of the workers so that they are never starved.
+"""
+import asyncio
+import contextvars
+import math
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future
+from typing import Any, Callable, Deque, Dict, Optional
+
+from dotenv import load_dotenv
+
+from .engines import OCRTimeoutError
+from .tuning import load_tuning
+
+# Load environment variables, then the tuned settings
+load_dotenv()
+load_tuning()
+
+# Number of OCR jobs run in parallel
+OCR_WORKERS = int(os.getenv("OCR_WORKERS", str(os.cpu_count() or 1)))
+
+# Default and maximum time budget (in seconds) of a single OCR request
+OCR_TIMEOUT = float(os.getenv("OCR_TIMEOUT", "60"))
+OCR_MAX_TIMEOUT = float(os.getenv("OCR_MAX_TIMEOUT", "300"))
+
+# Priority classes, from the most to the least urgent
+INTERACTIVE = "interactive"
+BULK = "bulk"
+PRIORITIES = (INTERACTIVE, BULK)
+
+# Minimum share of the jobs started that go to bulk work while bulk jobs are queued
+OCR_BULK_MIN_SHARE = float(os.getenv("OCR_BULK_MIN_SHARE", "0.2"))
+
+# Priority of requests that do not ask for one
+OCR_DEFAULT_PRIORITY = os.getenv("OCR_DEFAULT_PRIORITY", INTERACTIVE)
+
+# Users whose requests default to another priority, e.g. "batch:bulk,nightly:bulk"
+OCR_USER_PRIORITIES = dict(
+    entry.strip().split(":", 1)
+    for entry in os.getenv("OCR_USER_PRIORITIES", "").split(",")
+    if ":" in entry
+)
+
+# Number of recent queue wait times kept per priority class for the metrics
+QUEUE_WAIT_SAMPLES = 1000
+
+
+class OCRBudget:
+    """
+    Deadline and priority class of the OCR jobs of a document.
+
+    A budget shared by several requests (see SingleFlight) is raised to the
+    most generous deadline and most urgent priority among them with
+    OCRWorkerPool.raise_budget, including for the jobs already queued.
+
+    Attributes:
+        deadline (Optional[float]): time.monotonic() value by which the jobs must finish, None for no limit
+        priority (str): Priority class of the jobs (see PRIORITIES)
+    """
+    __slots__ = ("deadline", "priority")
+
+    def __init__(self, deadline: Optional[float] = None, priority: str = INTERACTIVE):
+        self.deadline = deadline
+        self.priority = priority
+
+
+class _Job:
+    """
+    OCR job waiting in the queue of the worker pool.
+    """
+    __slots__ = ("fn", "args", "budget", "cancel_event", "future", "priority", "enqueued_at", "context")
+
+    def __init__(self, fn, args, budget, cancel_event):
+        self.fn = fn
+        self.args = args
+        self.budget = budget
+        self.cancel_event = cancel_event
+        self.future = Future()
+        # Queue the job is in, which may change if its budget is raised
+        self.priority = budget.priority
+        self.enqueued_at = time.monotonic()
+        # Context of the caller (current trace span, progress tracker), for the worker thread
+        self.context = contextvars.copy_context()
+
+
+class OCRWorkerPool:
+    """
+    Bounded pool of worker threads running OCR jobs by priority.
+    """
+
+    def __init__(self, max_workers: int = OCR_WORKERS, bulk_min_share: float = OCR_BULK_MIN_SHARE):
+        self.max_workers = max_workers
+        # Interactive jobs started in a row while bulk jobs wait, before a bulk job must go
+        if bulk_min_share > 0:
+            self._interactive_burst = max(0, math.ceil((1 - bulk_min_share) / bulk_min_share))
+        else:
+            self._interactive_burst = math.inf
+        self._interactive_streak = 0
+        self._lock = threading.Lock()
+        self._job_available = threading.Condition(self._lock)
+        self._queues: Dict[str, Deque[_Job]] = {priority: deque() for priority in PRIORITIES}
+        self._threads = []
+        self._idle = 0
+        self._waits: Dict[str, Deque[float]] = {
+            priority: deque(maxlen=QUEUE_WAIT_SAMPLES) for priority in PRIORITIES
+        }
+        self.queued = 0
+        self.busy = 0
+        self.completed = 0
+        self.timed_out = 0
+        self.cancelled = 0
+
+    def _next_job(self) -> Optional[_Job]:
+        """
+        Take the next job to start from the queues. Must be called with the lock held.
+        """
+        interactive, bulk = self._queues[INTERACTIVE], self._queues[BULK]
+        if bulk and (not interactive or self._interactive_streak >= self._interactive_burst):
+            self._interactive_streak = 0
+            job = bulk.popleft()
+        elif interactive:
+            if bulk:
+                self._interactive_streak += 1
+            job = interactive.popleft()
+        else:
+            return None
+
+        # Started under the lock, so a job is either cancelled in the queue or running
+        job.future.set_running_or_notify_cancel()
+        self.queued -= 1
+        self.busy += 1
+        self._waits[job.priority].append(time.monotonic() - job.enqueued_at)
+        return job
+
+    def _worker(self) -> None:
+        """
+        Worker thread loop: run the queued jobs, most urgent first.
+        """
+        while True:
+            with self._lock:
+                self._idle += 1
+                job = self._next_job()
+                while job is None:
+                    self._job_available.wait()
+                    job = self._next_job()
+                self._idle -= 1
+            self._run_job(job)
+
+    def _run_job(self, job: _Job) -> None:
+        """
+        Run a job on a worker thread, within what is left of its time budget.
+        """
+        result, error = None, None
+        try:
+            timeout = None
+            deadline = job.budget.deadline
+            if deadline is not None:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    # The budget was spent waiting in the queue
+                    raise OCRTimeoutError("OCR time budget exhausted while queued")
+            result = job.context.run(job.fn, *job.args, timeout=timeout, cancel_event=job.cancel_event)
+        except BaseException as e:
+            error = e
+        # Free the worker before the caller resumes, so the stats it reads are up to date
+        with self._lock:
+            self.busy -= 1
+            self.completed += 1
+            if isinstance(error, OCRTimeoutError):
+                self.timed_out += 1
+        if error is not None:
+            job.future.set_exception(error)
+        else:
+            job.future.set_result(result)
+
+    def _submit(self, job: _Job) -> None:
+        """
+        Queue a job, starting a new worker thread if none is idle.
+        """
+        with self._lock:
+            self._queues[job.priority].append(job)
+            self.queued += 1
+            if self._idle < self.queued and len(self._threads) < self.max_workers:
+                thread = threading.Thread(
+                    target=self._worker, name=f"ocr_{len(self._threads)}", daemon=True
+                )
+                self._threads.append(thread)
+                thread.start()
+            self._job_available.notify()
+
+    async def run(
+        self,
+        fn: Callable[..., Any],
+        *args,
+        deadline: Optional[float] = None,
+        priority: str = INTERACTIVE,
+        budget: Optional[OCRBudget] = None,
+    ) -> Any:
+        """
+        Run `fn(*args, timeout=..., cancel_event=...)` on the pool.
+
+        If the awaiting task is cancelled, the job is removed from the queue or,
+        when already running, asked to stop through its cancellation event.
+
+        Args:
+            fn (Callable[..., Any]): Job function
+            *args: Positional arguments of the job
+            deadline (Optional[float]): time.monotonic() value by which the job must finish
+            priority (str): Priority class of the job (see PRIORITIES)
+            budget (Optional[OCRBudget]): Budget of the document the job belongs to,
+                used instead of deadline and priority
+
+        Returns:
+            Any: Result of the job
+
+        Raises:
+            ValueError: If the priority class is unknown
+        """
+        budget = budget or OCRBudget(deadline, priority)
+        if budget.priority not in self._queues:
+            raise ValueError(f"Unknown priority: {budget.priority}")
+        job = _Job(fn, args, budget, threading.Event())
+        self._submit(job)
+        try:
+            return await asyncio.wrap_future(job.future)
+        except asyncio.CancelledError:
+            job.cancel_event.set()
+            with self._lock:
+                if job.future.cancel():
+                    # Never started: take it out of the queue
+                    self._queues[job.priority].remove(job)
+                    self.queued -= 1
+                self.cancelled += 1
+            raise
+
+    def raise_budget(self, budget: OCRBudget, deadline: Optional[float], priority: str) -> None:
+        """
+        Raise a budget to a later deadline and a more urgent priority, if they
+        are. Queued jobs of the budget move to the interactive queue when it
+        becomes interactive.
+
+        Args:
+            budget (OCRBudget): Budget to raise
+            deadline (Optional[float]): time.monotonic() value by which the jobs must finish, None for no limit
+            priority (str): Priority class of the jobs (see PRIORITIES)
+        """
+        with self._lock:
+            if budget.deadline is not None:
+                budget.deadline = None if deadline is None else max(budget.deadline, deadline)
+            if PRIORITIES.index(priority) >= PRIORITIES.index(budget.priority):
+                return
+            budget.priority = priority
+            for queue in self._queues.values():
+                for job in [job for job in queue if job.budget is budget and job.priority != priority]:
+                    queue.remove(job)
+                    job.priority = priority
+                    self._queues[priority].append(job)
+
+    def load(self) -> float:
+        """
+        Get the load of the pool: running and queued jobs per worker, 1.0 when
+        every worker is busy and no job is waiting.
+
+        Returns:
+            float: Load of the pool
+        """
+        with self._lock:
+            return (self.busy + self.queued) / self.max_workers
+
+    def spare_workers(self) -> int:
+        """
+        Get the number of workers that would stay idle with the jobs already queued.
+
+        Returns:
+            int: Spare workers
+        """
+        with self._lock:
+            return max(0, self.max_workers - self.busy - self.queued)
+
+    def oldest_wait(self) -> float:
+        """
+        Get how long the oldest queued job has been waiting.
+
+        Returns:
+            float: Wait time in seconds, 0 if no job is queued
+        """
+        with self._lock:
+            oldest = [queue[0].enqueued_at for queue in self._queues.values() if queue]
+        return time.monotonic() - min(oldest) if oldest else 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        Get the worker pool counters.
+
+        Returns:
+            Dict[str, Any]: Pool size, queued, busy, completed, timed out and cancelled
+            jobs, and the jobs queued and the recent queue wait times per priority class
+        """
+        with self._lock:
+            return {
+                "workers": self.max_workers,
+                "queued": self.queued,
+                "busy": self.busy,
+                "completed": self.completed,
+                "timed_out": self.timed_out,
+                "cancelled": self.cancelled,
+                "queued_by_priority": {
+                    priority: len(queue) for priority, queue in self._queues.items()
+                },
+                "queue_wait_seconds": {
+                    priority: summarize_waits(waits) for priority, waits in self._waits.items()
+                },
+            }
+
+
+def summarize_waits(waits) -> Dict[str, Optional[float]]:
+    """
+    Summarize recent queue wait times.
+
+    Args:
+        waits: Wait times in seconds
+
+    Returns:
+        Dict[str, Optional[float]]: Number of samples, mean, 95th percentile and maximum
+    """
+    ordered = sorted(waits)
+    if not ordered:
+        return {"samples": 0, "mean": None, "p95": None, "max": None}
+    return {
+        "samples": len(ordered),
+        "mean": round(sum(ordered) / len(ordered), 4),
+        "p95": round(ordered[min(len(ordered) - 1, math.ceil(0.95 * len(ordered)) - 1)], 4),
+        "max": round(ordered[-1], 4),
+    }
+
+
+def resolve_priority(requested: Optional[str], username: Optional[str] = None) -> str:
+    """
+    Get the priority class of a request.
+
+    The priority asked for by the request wins, then the one configured for
+    the user in OCR_USER_PRIORITIES, then OCR_DEFAULT_PRIORITY.
+
+    Args:
+        requested (Optional[str]): Priority asked for by the request, if any
+        username (Optional[str]): User making the request
+
+    Returns:
+        str: Priority class
+
+    Raises:
+        ValueError: If the priority class is unknown
+    """
+    priority = requested or OCR_USER_PRIORITIES.get(username or "") or OCR_DEFAULT_PRIORITY
+    priority = priority.strip().lower()
+    if priority not in PRIORITIES:
+        raise ValueError(f"Unknown priority: {priority}. Supported priorities: {', '.join(PRIORITIES)}")
+    return priority
+
+
+def request_deadline(budget: Optional[float], start: float) -> float:
+    """
+    Compute the deadline of a request from the budget requested by the caller.
+
+    Args:
+        budget (Optional[float]): Budget in seconds requested by the caller, None for the default
+        start (float): time.monotonic() value when the request started
+
+    Returns:
+        float: time.monotonic() value by which OCR must finish
+    """
+    if budget is None or budget <= 0:
+        budget = OCR_TIMEOUT
+    return start + min(budget, OCR_MAX_TIMEOUT)
+
+
+# Worker pool shared by all requests of this process
+ocr_pool = OCRWorkerPool()
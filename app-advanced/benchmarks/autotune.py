@@ -0,0 +1,173 @@
+"""
+Calibration: find the number of OCR workers and of Tesseract threads that give
+the best throughput on this machine, and write them to the tuning file.
+
+Tesseract uses OpenMP threads internally, so N parallel OCR jobs on N cores
+oversubscribe the CPU unless each process is limited (OMP_THREAD_LIMIT). For
+each combination of workers and threads per process, the pages of the samples
+are OCRed by that many workers at once; the throughput (pages per second) and
+the 95th percentile OCR time of a page are reported. The best combination is
+the one with the lowest p95 among those within --tolerance of the best
+throughput, and is written to OCR_TUNING_FILE (ocr_tuning.env by default),
+which the API loads at startup (settings in the environment take precedence).
+
+Usage (from the app-advanced directory):
+    python -m benchmarks.autotune [--workers 1,2,4] [--threads 1,2,4] [--repeat 2] [files ...]
+"""
+import argparse
+import glob
+import itertools
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from app.engines import TesseractEngine
+from app.imaging import iter_frames
+from app.tuning import OCR_TUNING_FILE, write_tuning
+from benchmarks.loadtest import percentile
+
+
+def candidate_grid(
+    cpus: int,
+    workers: Optional[List[int]] = None,
+    threads: Optional[List[int]] = None,
+) -> List[Tuple[int, int]]:
+    """
+    List the combinations of workers and threads per process to measure.
+
+    By default, workers go from 1 to the number of CPUs by powers of two, and
+    threads from 1 to 4. Combinations using more than twice as many threads
+    as there are CPUs are skipped, as they can only be slower.
+
+    Args:
+        cpus (int): Number of CPUs
+        workers (Optional[List[int]]): Worker counts to try
+        threads (Optional[List[int]]): Threads per process to try
+
+    Returns:
+        List[Tuple[int, int]]: Workers and threads of each combination
+    """
+    if not workers:
+        workers = sorted({2 ** i for i in range(cpus.bit_length()) if 2 ** i <= cpus} | {cpus})
+    if not threads:
+        threads = [count for count in (1, 2, 4) if count <= cpus]
+    return [
+        (worker_count, thread_count)
+        for worker_count, thread_count in itertools.product(workers, threads)
+        if worker_count * thread_count <= 2 * cpus
+    ]
+
+
+def summarize_run(workers: int, threads: int, durations: List[float], elapsed: float) -> Dict:
+    """
+    Summarize the OCR of a batch of pages with one combination.
+
+    Args:
+        workers (int): Number of parallel OCR jobs
+        threads (int): Threads per Tesseract process
+        durations (List[float]): OCR time of each page, in seconds
+        elapsed (float): Time to OCR the whole batch, in seconds
+
+    Returns:
+        Dict: Row of the results table
+    """
+    return {
+        "workers": workers,
+        "threads": threads,
+        "pages": len(durations),
+        "throughput": len(durations) / elapsed if elapsed > 0 else 0.0,
+        "p50": percentile(durations, 50),
+        "p95": percentile(durations, 95),
+    }
+
+
+def choose_settings(runs: List[Dict], tolerance: float = 0.05) -> Dict:
+    """
+    Choose the best combination: the lowest p95 among the combinations whose
+    throughput is within `tolerance` of the best, then the fewest threads.
+
+    Args:
+        runs (List[Dict]): Rows of the results table
+        tolerance (float): Throughput loss accepted for a lower latency
+
+    Returns:
+        Dict: The chosen row
+    """
+    best = max(run["throughput"] for run in runs)
+    close = [run for run in runs if run["throughput"] >= (1 - tolerance) * best]
+    return min(close, key=lambda run: (run["p95"], run["workers"] * run["threads"]))
+
+
+def measure(frames, workers: int, threads: int, repeat: int, lang: Optional[str]) -> Dict:
+    """
+    OCR the pages with `workers` parallel jobs of `threads` threads each.
+    """
+    engine = TesseractEngine(lang=lang, threads=threads)
+    batch = frames * max(repeat, -(-workers // len(frames)))
+
+    def timed(frame):
+        start = time.perf_counter()
+        engine.image_to_string(frame)
+        return time.perf_counter() - start
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        start = time.perf_counter()
+        durations = list(executor.map(timed, batch))
+        elapsed = time.perf_counter() - start
+    return summarize_run(workers, threads, durations, elapsed)
+
+
+def parse_counts(value: str) -> List[int]:
+    """
+    Parse a comma-separated list of counts.
+    """
+    return [int(count) for count in value.split(",") if count.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("files", nargs="*", help="Images to recognize (default: the samples in data/)")
+    parser.add_argument("--workers", default="", help="Worker counts to try, e.g. 1,2,4 (default: powers of two up to the CPUs)")
+    parser.add_argument("--threads", default="", help="Threads per Tesseract process to try, e.g. 1,2 (default: 1,2,4)")
+    parser.add_argument("--repeat", type=int, default=2, help="Times each page is OCRed per combination")
+    parser.add_argument("--lang", default=None, help="Tesseract language(s), e.g. fra or eng+fra")
+    parser.add_argument("--tolerance", type=float, default=0.05, help="Throughput loss accepted for a lower p95")
+    parser.add_argument("--output", default=OCR_TUNING_FILE, help="Tuning file to write")
+    parser.add_argument("--dry-run", action="store_true", help="Report the best settings without writing them")
+    args = parser.parse_args()
+
+    files = args.files
+    if not files:
+        data_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+        files = sorted(glob.glob(os.path.join(data_dir, "*.png")))
+    frames = [frame for path in files for frame in iter_frames(path)]
+    cpus = os.cpu_count() or 1
+    print(f"{len(frames)} pages from {len(files)} files, {cpus} CPUs")
+
+    # Load the language data once before timing anything
+    TesseractEngine(lang=args.lang).image_to_string(frames[0])
+
+    runs = []
+    print(f"{'workers':>8} {'threads':>8} {'pages/s':>8} {'p50':>8} {'p95':>8}")
+    for workers, threads in candidate_grid(cpus, parse_counts(args.workers), parse_counts(args.threads)):
+        run = measure(frames, workers, threads, args.repeat, args.lang)
+        runs.append(run)
+        print(f"{workers:>8} {threads:>8} {run['throughput']:>8.2f} {run['p50']:>8.2f} {run['p95']:>8.2f}")
+
+    best = choose_settings(runs, args.tolerance)
+    print(
+        f"Best: OCR_WORKERS={best['workers']} TESSERACT_THREADS={best['threads']} "
+        f"({best['throughput']:.2f} pages/s, p95 {best['p95']:.2f} s)"
+    )
+    if not args.dry_run:
+        write_tuning(
+            args.output,
+            {"OCR_WORKERS": best["workers"], "TESSERACT_THREADS": best["threads"]},
+            [f"{cpus} CPUs, {len(frames)} pages: {best['throughput']:.2f} pages/s, p95 {best['p95']:.2f} s"],
+        )
+        print(f"Wrote {args.output}, restart the API to use it")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+"""
+Benchmark: OCR of whole pages vs. pages split into bands OCRed in parallel.
+
+For each page, the whole-page OCR time is compared with the time to OCR its
+bands (see app/bands.py) on parallel threads, and the fields extracted from
+both texts are compared, since splitting must not change the extraction.
+
+Usage (from the app-advanced directory):
+    python -m benchmarks.bench_bands [--bands 4] [--repeat 3] [--lang eng] [files ...]
+"""
+import argparse
+import glob
+import os
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from app.bands import plan_bands, crop_band, stitch_bands
+from app.engines import TesseractEngine
+from app.imaging import iter_frames
+from app.ocr_processor import extract_invoice_data
+
+# Fields compared between whole-page and banded extraction
+FIELDS = ("invoice_number", "date", "due_date", "vendor", "total_amount", "currency")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("files", nargs="*", help="Images to recognize (default: the samples in data/)")
+    parser.add_argument("--bands", type=int, default=4, help="Bands per page")
+    parser.add_argument("--repeat", type=int, default=3, help="OCR runs per page and mode")
+    parser.add_argument("--lang", default=None, help="Tesseract language(s), e.g. fra or eng+fra")
+    args = parser.parse_args()
+
+    files = args.files
+    if not files:
+        data_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+        files = sorted(glob.glob(os.path.join(data_dir, "*.png")))
+
+    engine = TesseractEngine(lang=args.lang)
+    with ThreadPoolExecutor(max_workers=args.bands) as executor:
+        for path in files:
+            for page, frame in enumerate(iter_frames(path), 1):
+                bands = plan_bands(frame, args.bands)
+                whole_times, band_times = [], []
+                for _ in range(args.repeat):
+                    start = time.perf_counter()
+                    whole = engine.recognize(frame)
+                    whole_times.append(time.perf_counter() - start)
+
+                    start = time.perf_counter()
+                    results = list(executor.map(engine.recognize, [crop_band(frame, band) for band in bands]))
+                    banded = stitch_bands(results, bands, frame.size)
+                    band_times.append(time.perf_counter() - start)
+
+                whole_data = extract_invoice_data(whole.text, args.lang)
+                band_data = extract_invoice_data(banded.text, args.lang)
+                differences = [
+                    field for field in FIELDS if getattr(whole_data, field) != getattr(band_data, field)
+                ]
+                print(
+                    f"{os.path.basename(path)} page {page}: {len(bands)} bands, "
+                    f"whole {statistics.median(whole_times):.2f} s, "
+                    f"banded {statistics.median(band_times):.2f} s, "
+                    f"fields {'identical' if not differences else 'differ: ' + ', '.join(differences)}"
+                )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+"""
+Benchmark: handing images to worker processes by pickling vs. shared memory.
+
+For each image, a worker process receives the image and scans all of its
+pixels (a stand-in for OCR), either as a pickled PIL image or through a
+shared memory handle (see app/shm.py). The time reported is the full round
+trip as seen by the API process, including creating and deleting the segment.
+
+Images used: the samples in data/ and synthetic A4 pages at 300 and 600 dpi.
+
+Usage (from the app-advanced directory):
+    python -m benchmarks.bench_shm [--repeat 20] [--workers 2]
+"""
+import argparse
+import glob
+import os
+import statistics
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image, ImageDraw
+
+from app.shm import SharedImage, open_shared_image, prepare_transport
+
+# A4 page size in inches
+A4_INCHES = (8.27, 11.69)
+
+
+def synthetic_page(dpi: int, mode: str = "L") -> Image.Image:
+    """
+    Create an A4 page with some text-like content at the given resolution.
+    """
+    size = (int(A4_INCHES[0] * dpi), int(A4_INCHES[1] * dpi))
+    image = Image.new(mode, size, color=255 if mode == "L" else (255, 255, 255))
+    draw = ImageDraw.Draw(image)
+    line_height = dpi // 6
+    for y in range(dpi, size[1] - dpi, line_height):
+        draw.rectangle((dpi, y, size[0] - dpi, y + line_height // 3), fill=0)
+    return image
+
+
+def scan_pickled(image: Image.Image):
+    """
+    Worker job receiving the image by pickling.
+    """
+    return image.getextrema()
+
+
+def scan_shared(handle):
+    """
+    Worker job receiving the image through shared memory.
+    """
+    with open_shared_image(handle) as image:
+        return image.getextrema()
+
+
+def time_calls(fn, repeat: int):
+    """
+    Run `fn` `repeat` times and return the durations in milliseconds.
+    """
+    durations = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        durations.append((time.perf_counter() - start) * 1000)
+    return durations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--repeat", type=int, default=20, help="Round trips per image and transport")
+    parser.add_argument("--workers", type=int, default=2, help="Worker processes")
+    args = parser.parse_args()
+
+    images = {}
+    data_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+    for path in sorted(glob.glob(os.path.join(data_dir, "*.png"))):
+        with Image.open(path) as image:
+            images[os.path.basename(path)] = image.convert("RGB")
+    images["synthetic A4 300 dpi (L)"] = synthetic_page(300)
+    images["synthetic A4 600 dpi (L)"] = synthetic_page(600)
+    images["synthetic A4 600 dpi (RGB)"] = synthetic_page(600, "RGB")
+
+    prepare_transport()
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        # Warm up the worker processes
+        list(executor.map(int, range(args.workers)))
+
+        print(f"{'image':<32} {'size':>12} {'MB':>7} {'pickle ms':>10} {'shm ms':>10} {'speedup':>8}")
+        for name, image in images.items():
+            def via_pickle():
+                executor.submit(scan_pickled, image).result()
+
+            def via_shm():
+                with SharedImage(image) as handle:
+                    executor.submit(scan_shared, handle).result()
+
+            pickled = statistics.median(time_calls(via_pickle, args.repeat))
+            shared = statistics.median(time_calls(via_shm, args.repeat))
+            megabytes = len(image.tobytes()) / (1024 * 1024)
+            size = f"{image.width}x{image.height}"
+            print(f"{name:<32} {size:>12} {megabytes:>7.1f} {pickled:>10.2f} {shared:>10.2f} {pickled / shared:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,257 @@
+"""
+Load test: drive the extraction endpoint at increasing arrival rates.
+
+Requests arrive at random (Poisson arrivals) at each rate in turn, for a fixed
+duration per rate, whether or not the previous requests have been answered,
+as real clients do. Each request uploads a file drawn from a corpus: the
+given files, synthetic A4 pages at the given resolutions, or by default the
+samples in data/. Every upload is made unique, so that duplicate detection
+does not hide the OCR work (use --no-unique to measure it instead).
+
+For each rate, the throughput, the errors and the latency percentiles are
+printed (and written to --csv), followed by the saturation point: the first
+rate the service could not sustain.
+
+To size the service independently of the OCR speed, run the API with the fake
+OCR engine and quotas above the tested load, e.g.:
+    OCR_ENGINE=fake FAKE_OCR_PROFILE=ocr_profile.json OCR_WORKERS=4 \\
+    RATE_LIMIT_PER_MINUTE=100000 RATE_LIMIT_BURST=1000 MAX_IN_FLIGHT_PER_USER=1000 \\
+    uvicorn app.main:app
+
+Usage (from the app-advanced directory):
+    python -m benchmarks.loadtest --rates 1,2,4,8 --duration 30 [--synthetic 150:1,300:3]
+"""
+import argparse
+import asyncio
+import csv
+import glob
+import io
+import math
+import os
+import random
+import time
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+from benchmarks.bench_shm import synthetic_page
+
+# Columns of the results table and CSV file
+COLUMNS = [
+    "rate", "sent", "ok", "errors", "throughput", "p50", "p95", "p99", "max", "queue_p95",
+]
+
+
+def percentile(values: List[float], q: float) -> Optional[float]:
+    """
+    Get the q-th percentile (0 to 100) of some values, None if there are none.
+    """
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, math.ceil(q / 100 * len(ordered)) - 1))]
+
+
+def summarize_step(rate: float, results: List[Tuple[int, float]], elapsed: float) -> Dict:
+    """
+    Summarize the requests sent at one arrival rate.
+
+    Args:
+        rate (float): Offered arrival rate (requests per second)
+        results (List[Tuple[int, float]]): Status code (0 for a client error) and latency of each request
+        elapsed (float): Time from the first request to the last response, in seconds
+
+    Returns:
+        Dict: Row of the results table
+    """
+    latencies = [latency for status, latency in results if status == 200]
+    errors: Dict[str, int] = {}
+    for status, _ in results:
+        if status != 200:
+            errors[str(status)] = errors.get(str(status), 0) + 1
+    return {
+        "rate": rate,
+        "sent": len(results),
+        "ok": len(latencies),
+        "errors": errors,
+        "throughput": len(latencies) / elapsed if elapsed > 0 else 0.0,
+        "p50": percentile(latencies, 50),
+        "p95": percentile(latencies, 95),
+        "p99": percentile(latencies, 99),
+        "max": max(latencies) if latencies else None,
+        "queue_p95": None,
+    }
+
+
+def find_saturation(
+    steps: List[Dict],
+    slo: float,
+    min_efficiency: float = 0.9,
+    max_error_rate: float = 0.01,
+) -> Optional[float]:
+    """
+    Find the first arrival rate the service could not sustain.
+
+    A rate is sustained when the throughput keeps up with it, few requests
+    fail and the 95th percentile latency stays within the objective.
+
+    Args:
+        steps (List[Dict]): Rows of the results table, by increasing rate
+        slo (float): 95th percentile latency objective, in seconds
+        min_efficiency (float): Minimum throughput, as a fraction of the rate
+        max_error_rate (float): Maximum fraction of failed requests
+
+    Returns:
+        Optional[float]: The saturation rate, None if every rate was sustained
+    """
+    for step in steps:
+        failed = step["sent"] - step["ok"]
+        if (
+            step["throughput"] < min_efficiency * step["rate"]
+            or failed > max_error_rate * step["sent"]
+            or step["p95"] is None
+            or step["p95"] > slo
+        ):
+            return step["rate"]
+    return None
+
+
+def load_corpus(patterns: List[str], synthetic: str) -> List[Tuple[str, bytes, float]]:
+    """
+    Build the corpus of uploads.
+
+    Args:
+        patterns (List[str]): Glob patterns of files to upload
+        synthetic (str): Synthetic pages as "dpi:weight,...", e.g. "150:1,300:3"
+
+    Returns:
+        List[Tuple[str, bytes, float]]: Filename, content and weight of each upload
+    """
+    corpus = []
+    for pattern in patterns:
+        for path in sorted(glob.glob(pattern)):
+            with open(path, "rb") as upload:
+                corpus.append((os.path.basename(path), upload.read(), 1.0))
+    for entry in filter(None, synthetic.split(",")):
+        dpi, _, weight = entry.partition(":")
+        buffer = io.BytesIO()
+        synthetic_page(int(dpi)).save(buffer, format="PNG")
+        corpus.append((f"synthetic_{dpi}dpi.png", buffer.getvalue(), float(weight or 1)))
+    if not corpus:
+        data_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+        return load_corpus([os.path.join(data_dir, "*.png")], "")
+    return corpus
+
+
+async def send(client, args, corpus, weights, results):
+    """
+    Send one upload and record its status and latency.
+    """
+    filename, content, _ = random.choices(corpus, weights=weights)[0]
+    if args.unique:
+        # Bytes after the end of a PNG or JPEG image are ignored by decoders
+        content += os.urandom(16)
+    headers = {"X-Priority": args.priority} if args.priority else {}
+    start = time.perf_counter()
+    try:
+        response = await client.post(
+            args.endpoint, files={"file": (filename, content)}, headers=headers, timeout=args.timeout
+        )
+        status = response.status_code
+    except httpx.HTTPError:
+        status = 0
+    results.append((status, time.perf_counter() - start))
+
+
+async def run_step(client, args, rate, corpus, weights) -> Dict:
+    """
+    Send Poisson arrivals at the given rate for the configured duration.
+    """
+    results: List[Tuple[int, float]] = []
+    tasks = []
+    start = time.perf_counter()
+    next_arrival = start
+    while next_arrival < start + args.duration:
+        await asyncio.sleep(max(0.0, next_arrival - time.perf_counter()))
+        tasks.append(asyncio.ensure_future(send(client, args, corpus, weights, results)))
+        next_arrival += random.expovariate(rate)
+    await asyncio.gather(*tasks)
+    step = summarize_step(rate, results, time.perf_counter() - start)
+
+    try:
+        metrics = (await client.get("/metrics")).json()
+        step["queue_p95"] = max(
+            (wait["p95"] or 0.0) for wait in metrics["workers"]["queue_wait_seconds"].values()
+        )
+    except (httpx.HTTPError, ValueError, KeyError):
+        pass
+    return step
+
+
+def format_row(step: Dict) -> List[str]:
+    """
+    Format a row of the results table.
+    """
+    def seconds(value):
+        return "-" if value is None else f"{value:.2f}"
+
+    errors = " ".join(f"{status}x{count}" for status, count in sorted(step["errors"].items())) or "0"
+    return [
+        f"{step['rate']:g}", str(step["sent"]), str(step["ok"]), errors, f"{step['throughput']:.2f}",
+        seconds(step["p50"]), seconds(step["p95"]), seconds(step["p99"]), seconds(step["max"]),
+        seconds(step["queue_p95"]),
+    ]
+
+
+async def run(args):
+    corpus = load_corpus(args.files, args.synthetic)
+    weights = [weight for _, _, weight in corpus]
+    sizes = sorted(len(content) for _, content, _ in corpus)
+    print(f"Corpus: {len(corpus)} files, {sizes[0] // 1024} to {sizes[-1] // 1024} KB")
+
+    steps = []
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=100)
+    async with httpx.AsyncClient(
+        base_url=args.url, auth=(args.username, args.password), limits=limits
+    ) as client:
+        print(" ".join(f"{column:>10}" for column in COLUMNS))
+        for rate in args.rates:
+            step = await run_step(client, args, rate, corpus, weights)
+            steps.append(step)
+            print(" ".join(f"{value:>10}" for value in format_row(step)))
+
+    saturation = find_saturation(steps, args.slo)
+    if saturation is None:
+        print(f"No saturation up to {args.rates[-1]:g} requests/s (p95 objective {args.slo:g} s)")
+    else:
+        print(f"Saturation point: {saturation:g} requests/s (p95 objective {args.slo:g} s)")
+
+    if args.csv:
+        with open(args.csv, "w", newline="") as output:
+            writer = csv.writer(output)
+            writer.writerow(COLUMNS)
+            writer.writerows(format_row(step) for step in steps)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--url", default="http://localhost:8000", help="Base URL of the API")
+    parser.add_argument("--endpoint", default="/extract/", help="Endpoint receiving the uploads")
+    parser.add_argument("--username", default=os.getenv("API_USERNAME", "admin"), help="API user")
+    parser.add_argument("--password", default=os.getenv("API_PASSWORD", "password"), help="API password")
+    parser.add_argument("--rates", default="0.5,1,2,4", help="Arrival rates to test (requests per second)")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds of arrivals per rate")
+    parser.add_argument("--files", nargs="*", default=[], help="Glob patterns of files to upload")
+    parser.add_argument("--synthetic", default="", help="Synthetic A4 pages as dpi:weight, e.g. 150:1,300:3")
+    parser.add_argument("--priority", default=None, help="X-Priority header (interactive or bulk)")
+    parser.add_argument("--no-unique", dest="unique", action="store_false", help="Upload identical files")
+    parser.add_argument("--timeout", type=float, default=300, help="Client timeout per request (seconds)")
+    parser.add_argument("--slo", type=float, default=10, help="95th percentile latency objective (seconds)")
+    parser.add_argument("--csv", default=None, help="Write the results table to this CSV file")
+    args = parser.parse_args()
+    args.rates = sorted(float(rate) for rate in args.rates.split(","))
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""
+Record OCR calls for the fake OCR engine (see app/fake_engine.py).
+
+Each page of the given images is recognized with the real engine; its size,
+the OCR time and the text are written to a profile that the fake engine
+replays during load tests (OCR_ENGINE=fake FAKE_OCR_PROFILE=profile.json).
+
+Usage (from the app-advanced directory):
+    python -m benchmarks.record_ocr [--output ocr_profile.json] [--repeat 3] [files ...]
+"""
+import argparse
+import glob
+import json
+import os
+import time
+
+from app.engines import TesseractEngine
+from app.imaging import iter_frames
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("files", nargs="*", help="Images to recognize (default: the samples in data/)")
+    parser.add_argument("--output", default="ocr_profile.json", help="Profile file to write")
+    parser.add_argument("--repeat", type=int, default=3, help="OCR runs per page")
+    parser.add_argument("--lang", default=None, help="Tesseract language(s), e.g. fra or eng+fra")
+    args = parser.parse_args()
+
+    files = args.files
+    if not files:
+        data_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+        files = sorted(glob.glob(os.path.join(data_dir, "*.png")))
+
+    engine = TesseractEngine(lang=args.lang)
+    samples = []
+    for path in files:
+        for page, frame in enumerate(iter_frames(path), 1):
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                text = engine.image_to_string(frame)
+                seconds = time.perf_counter() - start
+                samples.append({
+                    "file": os.path.basename(path),
+                    "page": page,
+                    "pixels": frame.width * frame.height,
+                    "seconds": round(seconds, 4),
+                    "text": text,
+                })
+                print(f"{os.path.basename(path)} page {page}: {frame.width}x{frame.height} {seconds:.2f} s")
+
+    with open(args.output, "w", encoding="utf-8") as output:
+        json.dump({"samples": samples}, output, ensure_ascii=False, indent=2)
+    print(f"Wrote {len(samples)} samples to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
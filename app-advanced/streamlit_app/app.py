@@ -6,6 +6,7 @@ import streamlit as st
 import requests
 import os
 import json
+import time
 from PIL import Image
 import io
 import base64
@@ -26,6 +27,9 @@ API_URL = os.getenv("API_URL", "http://localhost:8000")
 API_USERNAME = os.getenv("API_USERNAME", "admin")
 API_PASSWORD = os.getenv("API_PASSWORD", "password")
 
+# Longest side (in pixels) the API reduces images to for OCR, A4 at 300 dpi by default
+OCR_MAX_SIDE = int(os.getenv("OCR_MAX_SIDE", "3508"))
+
 def get_auth_header():
     """
     Create the Basic Authentication header.
@@ -40,7 +44,7 @@ def get_auth_header():
 def main():
     """Main function for the Streamlit app."""
     st.title("Invoice OCR Demo")
-    st.write("Upload an invoice image (PDF, PNG, or JPEG) to extract information.")
+    st.write("Upload an invoice image (PNG, JPEG, TIFF, WebP or HEIC) to extract information.")
     
     # Authentication status
     st.sidebar.title("API Authentication")
@@ -57,10 +61,19 @@ def main():
         auth_header = get_auth_header()
         st.sidebar.info(f"Using default credentials: {API_USERNAME}")
     
+    # Upload options
+    st.sidebar.title("Upload")
+    downscale = st.sidebar.checkbox(
+        "Downscale before upload", value=True,
+        help="Send a grayscale PNG at the OCR resolution instead of the original file "
+             "(the original is sent when it is smaller)"
+    )
+    max_side = st.sidebar.number_input("Longest side (pixels)", min_value=1000, value=OCR_MAX_SIDE, step=100)
+    
     # File uploader
     uploaded_file = st.file_uploader(
         "Choose an invoice file",
-        type=["pdf", "png", "jpg", "jpeg"]
+        type=["png", "jpg", "jpeg", "tif", "tiff", "webp", "heic"]
     )
     
     if uploaded_file is not None:
@@ -84,65 +97,238 @@ def main():
         
         # Process button
         if st.button("Extract Information"):
-            with st.spinner("Processing invoice..."):
-                # Send to API
-                result = process_invoice(uploaded_file, auth_header)
+            # Progress of the extraction, and the fields found so far
+            progress_bar = st.progress(0.0, text="Uploading...")
+            partial_fields = st.empty()
+            
+            def show_progress(event):
+                text = f"{STAGES.get(event['stage'], event['stage'])} ({event['elapsed']:.1f} s)"
+                value = 0.0
+                if event.get("page") and event.get("pages"):
+                    text = f"{STAGES.get(event['stage'], event['stage'])}: page {event['page']} of {event['pages']} ({event['elapsed']:.1f} s)"
+                    value = event["page"] / event["pages"] if event["stage"] == "ocr" else (event["page"] - 1) / event["pages"]
+                elif event["stage"] in ("extracted", "done"):
+                    value = 1.0
+                progress_bar.progress(value, text=text)
+                if event.get("fields"):
+                    partial_fields.json({name: value for name, value in event["fields"].items() if value is not None})
+            
+            # Shrink the file before sending it, if asked
+            filename, payload, content_type = uploaded_file.name, uploaded_file.getvalue(), uploaded_file.type
+            report = None
+            if downscale:
+                try:
+                    filename, payload, content_type, report = prepare_upload(filename, payload, content_type, max_side)
+                except Exception as e:
+                    st.warning(f"Could not downscale the file, sending the original: {str(e)}")
+            
+            # Send to API, timing the upload until the API reports the file received
+            timings = {}
+            started = time.perf_counter()
+            
+            def on_progress(event):
+                if event["stage"] == "received":
+                    timings["upload"] = time.perf_counter() - started
+                show_progress(event)
+            
+            result = process_invoice(filename, payload, content_type, auth_header, on_progress)
+            timings["total"] = time.perf_counter() - started
+            progress_bar.empty()
+            partial_fields.empty()
+            
+            if report:
+                show_upload_report(report, timings)
+            
+            # Display results
+            st.subheader("Extracted Information")
+            
+            # Check for error
+            if "error" in result:
+                st.error(result["error"])
+            else:
+                # Create two columns
+                col1, col2 = st.columns(2)
+                
+                with col1:
+                    st.write("**Invoice Number:**", result.get("extracted_data", {}).get("invoice_number", "Not found"))
+                    st.write("**Date:**", result.get("extracted_data", {}).get("date", "Not found"))
+                    st.write("**Due Date:**", result.get("extracted_data", {}).get("due_date", "Not found"))
+                    st.write("**Vendor:**", result.get("extracted_data", {}).get("vendor", "Not found"))
+                    st.write("**Total Amount:**", result.get("extracted_data", {}).get("total_amount", "Not found"))
                 
-                # Display results
-                st.subheader("Extracted Information")
+                with col2:
+                    # Display raw JSON
+                    st.write("**Raw JSON Response:**")
+                    st.json(result)
                 
-                # Check for error
-                if "error" in result:
-                    st.error(result["error"])
-                else:
-                    # Create two columns
-                    col1, col2 = st.columns(2)
-                    
-                    with col1:
-                        st.write("**Invoice Number:**", result.get("extracted_data", {}).get("invoice_number", "Not found"))
-                        st.write("**Date:**", result.get("extracted_data", {}).get("date", "Not found"))
-                        st.write("**Due Date:**", result.get("extracted_data", {}).get("due_date", "Not found"))
-                        st.write("**Vendor:**", result.get("extracted_data", {}).get("vendor", "Not found"))
-                        st.write("**Total Amount:**", result.get("extracted_data", {}).get("total_amount", "Not found"))
-                    
-                    with col2:
-                        # Display raw JSON
-                        st.write("**Raw JSON Response:**")
-                        st.json(result)
-                    
-                    # Display raw text
-                    st.subheader("Raw Extracted Text")
-                    st.text(result.get("extracted_data", {}).get("raw_text", "No text extracted"))
+                # Display raw text
+                st.subheader("Raw Extracted Text")
+                st.text(result.get("extracted_data", {}).get("raw_text", "No text extracted"))
+
+# Stage names shown while the invoice is processed
+STAGES = {
+    "received": "File received",
+    "decoded": "Page decoded",
+    "preprocessed": "Page prepared",
+    "ocr": "Page read",
+    "extracted": "Data extracted",
+    "done": "Done",
+    "error": "Failed",
+}
+
+def iter_events(response):
+    """
+    Parse a Server-Sent Events response.
+    
+    Args:
+        response: Streamed requests response
+        
+    Yields:
+        tuple: Name and decoded JSON data of each event
+    """
+    name, data = "message", []
+    for line in response.iter_lines(decode_unicode=True):
+        if not line:
+            if data:
+                yield name, json.loads("\n".join(data))
+            name, data = "message", []
+        elif line.startswith("event:"):
+            name = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data.append(line[len("data:"):].strip())
+
+def prepare_upload(filename, payload, content_type, max_side=OCR_MAX_SIDE):
+    """
+    Shrink an image before upload: reduce it to the OCR resolution and
+    re-encode it losslessly in grayscale (PNG, or deflate TIFF for multi-page
+    files). The original is kept when it is smaller, as a lossless PNG can be
+    larger than a JPEG photo.
+    
+    Args:
+        filename: Name of the file
+        payload: Content of the file
+        content_type: MIME type of the file
+        max_side: Longest side of the pages sent, in pixels
+        
+    Returns:
+        tuple: Name, content and MIME type of the file to send, and a report
+        of the sizes and of the time each step took
+    """
+    report = {"original_bytes": len(payload)}
+    
+    started = time.perf_counter()
+    image = Image.open(io.BytesIO(payload))
+    pages = []
+    for index in range(getattr(image, "n_frames", 1)):
+        image.seek(index)
+        image.load()
+        pages.append(image.copy())
+    report["original_size"] = pages[0].size
+    report["decode_seconds"] = time.perf_counter() - started
+    
+    started = time.perf_counter()
+    reduced = []
+    for page in pages:
+        page = page.convert("L")
+        if max(page.size) > max_side:
+            # reducing_gap: a cheap Image.reduce() first, then the resampling
+            page.thumbnail((max_side, max_side), Image.LANCZOS, reducing_gap=2.0)
+        reduced.append(page)
+    report["sent_size"] = reduced[0].size
+    report["downscale_seconds"] = time.perf_counter() - started
+    
+    started = time.perf_counter()
+    output = io.BytesIO()
+    stem = os.path.splitext(filename)[0]
+    if len(reduced) == 1:
+        reduced[0].save(output, format="PNG")
+        encoded = (f"{stem}.png", output.getvalue(), "image/png")
+    else:
+        reduced[0].save(output, format="TIFF", save_all=True, append_images=reduced[1:], compression="tiff_adobe_deflate")
+        encoded = (f"{stem}.tiff", output.getvalue(), "image/tiff")
+    report["encode_seconds"] = time.perf_counter() - started
+    
+    if len(encoded[1]) >= len(payload):
+        report["sent_bytes"] = len(payload)
+        report["kept_original"] = True
+        return filename, payload, content_type, report
+    report["sent_bytes"] = len(encoded[1])
+    report["kept_original"] = False
+    return encoded + (report,)
+
+def show_upload_report(report, timings):
+    """
+    Show the bytes saved by downscaling and the time each step took.
+    
+    Args:
+        report: Report of prepare_upload
+        timings: Upload and total time of the request, in seconds
+    """
+    saved = report["original_bytes"] - report["sent_bytes"]
+    st.subheader("Upload")
+    col1, col2, col3 = st.columns(3)
+    col1.metric("Original", f"{report['original_bytes'] / 1024:.0f} KB")
+    col2.metric("Sent", f"{report['sent_bytes'] / 1024:.0f} KB")
+    col3.metric("Saved", f"{saved / 1024:.0f} KB", f"{100 * saved / report['original_bytes']:.0f}%")
+    if report["kept_original"]:
+        st.caption("The grayscale PNG was larger than the original file, so the original was sent.")
+    
+    steps = {
+        "Decode": report["decode_seconds"],
+        "Downscale to grayscale": report["downscale_seconds"],
+        "Encode": report["encode_seconds"],
+        "Upload": timings.get("upload"),
+        "Upload and extraction": timings.get("total"),
+    }
+    st.table({
+        "Step": list(steps),
+        "Seconds": [f"{seconds:.2f}" if seconds is not None else "-" for seconds in steps.values()],
+    })
+    st.caption(
+        f"Pages of {report['original_size'][0]}x{report['original_size'][1]} pixels "
+        f"sent as {report['sent_size'][0]}x{report['sent_size'][1]}."
+    )
 
-def process_invoice(file, auth_header):
+def process_invoice(filename, payload, content_type, auth_header, on_progress=None):
     """
-    Send the file to the API for processing.
+    Send the file to the API for processing, following its progress.
     
     Args:
-        file: Uploaded file object
+        filename: Name of the file
+        payload: Content of the file
+        content_type: MIME type of the file
         auth_header: Authentication header
+        on_progress: Called with each progress event
         
     Returns:
         dict: API response or error
     """
     # Create a files dictionary for the request
-    files = {"file": (file.name, file.getvalue(), file.type)}
+    files = {"file": (filename, payload, content_type)}
     
     try:
-        # Make POST request to the API
-        response = requests.post(
-            f"{API_URL}/extract/",
+        # Make POST request to the API, reading the events as they come
+        with requests.post(
+            f"{API_URL}/extract/stream",
             files=files,
-            headers=auth_header
-        )
-        
-        # Check if request was successful
-        if response.status_code == 200:
-            return response.json()
-        elif response.status_code == 401:
-            return {"error": "Authentication failed. Please check your credentials."}
-        else:
-            return {"error": f"Error: {response.status_code} - {response.text}"}
+            # Someone is waiting for the result: go ahead of queued bulk work
+            headers={**auth_header, "X-Priority": "interactive"},
+            stream=True
+        ) as response:
+            # Check if request was successful
+            if response.status_code == 401:
+                return {"error": "Authentication failed. Please check your credentials."}
+            elif response.status_code != 200:
+                return {"error": f"Error: {response.status_code} - {response.text}"}
+            
+            for name, data in iter_events(response):
+                if name == "progress" and on_progress:
+                    on_progress(data)
+                elif name == "result":
+                    return data
+                elif name == "failure":
+                    return {"error": f"Error: {data['status_code']} - {data['detail']}"}
+            return {"error": "Error: the connection closed before the result"}
     
     except Exception as e:
         return {"error": f"Error connecting to API: {str(e)}"}
@@ -5,7 +5,26 @@ import os
 import pytest
 import base64
 from fastapi.testclient import TestClient
+
+# Never create the results database in the working directory while testing
+os.environ["RESULTS_DB"] = ""
+
+from app import hotfolder, mail, main
 from app.main import app
+from app.store import ResultsStore
+
+@pytest.fixture(autouse=True)
+def results_store(tmp_path_factory, monkeypatch):
+    """
+    Give each test an empty results store of its own.
+    
+    Returns:
+        ResultsStore: Results store used by the API
+    """
+    store = ResultsStore(str(tmp_path_factory.mktemp("results") / "invoices.db"))
+    for module in (main, mail, hotfolder):
+        monkeypatch.setattr(module, "results_store", store)
+    return store
 
 @pytest.fixture
 def test_client():
@@ -62,4 +62,117 @@ def test_extract_with_sample_image(test_client, auth_headers, sample_image):
     assert "raw_text" in extracted_data
     
     # Ideally, we would check for specific extracted fields,
-    # but OCR results can be inconsistent, so we'll keep this simple
\ No newline at end of file
+    # but OCR results can be inconsistent, so we'll keep this simple
+
+def test_large_responses_are_compressed(test_client):
+    """Test that responses above the size threshold are gzip-compressed."""
+    response = test_client.get("/openapi.json", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert response.headers["content-encoding"] == "gzip"
+    # httpx transparently decompresses the body
+    assert "paths" in response.json()
+
+def test_small_responses_are_not_compressed(test_client):
+    """Test that small responses are sent uncompressed."""
+    response = test_client.get("/health", headers={"Accept-Encoding": "gzip"})
+    assert response.status_code == 200
+    assert "content-encoding" not in response.headers
+
+def test_filter_extracted_data():
+    """Test that bulky fields can be excluded from the extracted data."""
+    from app.models import InvoiceData
+    from app.responses import filter_extracted_data
+
+    data = InvoiceData(invoice_number="12345", raw_text="INVOICE #12345")
+    filtered = filter_extracted_data(data, include_raw_text=False, include_items=False)
+    assert "raw_text" not in filtered
+    assert "items" not in filtered
+    assert filtered["invoice_number"] == "12345"
+    assert filter_extracted_data(data)["raw_text"] == "INVOICE #12345"
+
+def test_dumps_rejects_unknown_types():
+    """Test that decimals and dates are serialized, and unknown types raise instead of leaking a repr."""
+    import datetime
+    from decimal import Decimal
+    from app.responses import dumps
+
+    assert dumps({"total": Decimal("1234.50"), "date": datetime.date(2023, 1, 15)}) == (
+        b'{"total":"1234.50","date":"2023-01-15"}'
+    )
+    with pytest.raises(TypeError):
+        dumps({"engine": object()})
+
+def test_extract_invoice_data_normalizes_values():
+    """Test that extracted values are normalized (ISO dates, Decimal amounts, currency)."""
+    from decimal import Decimal
+    from app.ocr_processor import extract_invoice_data
+
+    text = "INVOICE #12345\nDate: 01/15/2023\nDue Date: 31/01/2023\nTotal: $1,234.50\n"
+    invoice = extract_invoice_data(text)
+    assert invoice.invoice_number == "12345"
+    assert invoice.date.isoformat() == "2023-01-15"
+    assert invoice.due_date.isoformat() == "2023-01-31"
+    assert invoice.total_amount == Decimal("1234.50")
+    assert invoice.currency == "USD"
+
+    data = invoice.to_model().model_dump(mode="json")
+    assert data["date"] == "2023-01-15"
+    assert data["total_amount"] == 1234.5
+
+def test_extract_raw_body(test_client, auth_headers, monkeypatch):
+    """Test that an image sent as the raw request body is processed, with metadata in headers."""
+    import io
+    from PIL import Image, ImageDraw
+    from app import engines, main
+
+    class TextEngine(engines.OCREngine):
+        def image_to_string(self, image, timeout=None, cancel_event=None):
+            return "INVOICE #RAW-42\nTotal: 12.00\n"
+
+    monkeypatch.setattr(engines, "default_engine", TextEngine())
+    monkeypatch.setattr(main, "results_store", None)
+    image = Image.new("L", (600, 400), 255)
+    ImageDraw.Draw(image).rectangle((50, 50, 550, 80), fill=0)
+    body = io.BytesIO()
+    image.save(body, format="PNG")
+
+    response = test_client.post(
+        "/extract/raw?include_raw_text=false",
+        headers={**auth_headers, "Content-Type": "image/png", "X-Filename": "../scan.png", "X-Language": "eng"},
+        content=body.getvalue(),
+    )
+    assert response.status_code == 200
+    assert response.json()["filename"] == "scan.png"
+    assert response.json()["extracted_data"]["invoice_number"] == "RAW-42"
+    assert "raw_text" not in response.json()["extracted_data"]
+
+def test_extract_raw_body_rejects_bad_requests(test_client, auth_headers, monkeypatch):
+    """Test the content type, format and size checks of the raw-body endpoint."""
+    from app import main
+
+    response = test_client.post("/extract/raw", headers={**auth_headers, "Content-Type": "text/plain"}, content=b"x")
+    assert response.status_code == 415
+
+    headers = {**auth_headers, "Content-Type": "application/octet-stream"}
+    response = test_client.post("/extract/raw", headers=headers, content=b"This is a test file")
+    assert response.status_code == 400
+    assert "Invalid file type" in response.json()["detail"]
+
+    monkeypatch.setattr(main, "MAX_UPLOAD_BYTES", 10)
+    response = test_client.post("/extract/raw", headers=headers, content=b"\x89PNG\r\n\x1a\n" + bytes(100))
+    assert response.status_code == 413
+
+def test_extract_rejects_decompression_bombs(test_client, auth_headers, monkeypatch):
+    """Test that an image far over the pixel budget is rejected with 413, not 500."""
+    import io
+    from PIL import Image
+    from app import imaging
+    monkeypatch.setattr(imaging, "MAX_IMAGE_PIXELS", 1000)
+    monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", 1000 * imaging.JPEG_MAX_DRAFT_REDUCTION // 2)
+    
+    image = io.BytesIO()
+    Image.new("L", (300, 300), color=255).save(image, format="PNG")
+    response = test_client.post(
+        "/extract/", headers=auth_headers, files={"file": ("bomb.png", image.getvalue(), "image/png")}
+    )
+    assert response.status_code == 413
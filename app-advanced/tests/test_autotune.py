@@ -0,0 +1,40 @@
+"""
+Tests for the worker and thread calibration and the tuning file.
+"""
+import os
+from app.engines import TesseractEngine
+from app.tuning import load_tuning, write_tuning
+from benchmarks.autotune import candidate_grid, choose_settings, summarize_run
+
+def test_candidate_grid_skips_oversubscription():
+    """Test that combinations using far more threads than CPUs are not measured."""
+    assert candidate_grid(4) == [(1, 1), (1, 2), (1, 4), (2, 1), (2, 2), (2, 4), (4, 1), (4, 2)]
+    assert candidate_grid(6, workers=[3, 6], threads=[1, 2]) == [(3, 1), (3, 2), (6, 1), (6, 2)]
+
+def test_best_settings_trade_little_throughput_for_latency():
+    """Test that the lowest p95 wins among combinations close to the best throughput."""
+    runs = [
+        summarize_run(4, 1, [2.0] * 19 + [4.0], 10.0),
+        summarize_run(2, 2, [1.0] * 19 + [1.5], 10.4),
+        summarize_run(4, 4, [3.0] * 20, 20.0),
+    ]
+    assert runs[0]["throughput"] == 2.0 and runs[0]["p95"] == 2.0
+    assert choose_settings(runs) == runs[1]
+    assert choose_settings(runs, tolerance=0) == runs[0]
+
+def test_tuning_file_does_not_override_the_environment(tmp_path, monkeypatch):
+    """Test that tuned settings are loaded unless already set."""
+    path = str(tmp_path / "ocr_tuning.env")
+    write_tuning(path, {"OCR_WORKERS": 3, "TESSERACT_THREADS": 2}, ["4 CPUs"])
+    monkeypatch.delenv("TESSERACT_THREADS", raising=False)
+    monkeypatch.setenv("OCR_WORKERS", "8")
+    assert load_tuning(path)
+    assert os.environ["TESSERACT_THREADS"] == "2"
+    assert os.environ["OCR_WORKERS"] == "8"
+    assert not load_tuning(str(tmp_path / "missing.env"))
+
+def test_tesseract_threads_are_limited():
+    """Test that Tesseract processes get OMP_THREAD_LIMIT when threads are set."""
+    assert TesseractEngine(threads=0).process_env() is None
+    engine = TesseractEngine(threads=2).with_language("fra")
+    assert engine.process_env()["OMP_THREAD_LIMIT"] == "2"
@@ -0,0 +1,70 @@
+"""
+Tests for splitting pages into bands OCRed in parallel.
+"""
+import asyncio
+import numpy as np
+from PIL import Image, ImageDraw
+import app.ocr_processor as ocr_processor
+from app.bands import band_count, find_gaps, plan_bands, stitch_bands, OCR_BAND_MAX
+from app.engines import OCRResult, OCRWord
+from app.workers import OCRBudget
+
+def text_page(rows, width=1200, height=1800):
+    """Draw a white page with black bars standing in for lines of text."""
+    page = Image.new("L", (width, height), 255)
+    draw = ImageDraw.Draw(page)
+    for top, bottom in rows:
+        draw.rectangle((100, top, width - 100, bottom - 1), fill=0)
+    return page
+
+# Three paragraphs of two lines each, with tight gaps between the lines
+ROWS = [(100, 130), (138, 168), (600, 630), (638, 668), (1200, 1230), (1238, 1268)]
+
+def test_gaps_skip_line_spacing():
+    """Test that only blank runs taller than line spacing are gaps."""
+    gaps = find_gaps(text_page(ROWS), min_gap=20)
+    assert gaps == [(0, 100), (168, 600), (668, 1200), (1268, 1800)]
+
+def test_bands_are_cut_across_blank_rows():
+    """Test that bands are cut in paragraph gaps, never through text."""
+    page = text_page(ROWS)
+    bands = plan_bands(page, 3)
+    assert bands == [(0, 384), (384, 934), (934, 1800)]
+    ink = (np.asarray(page) < 128).any(axis=1)
+    assert not any(ink[top] for top, _ in bands[1:])
+
+    # A page without blank runs is kept whole
+    assert plan_bands(text_page([(0, 1800)]), 3) == [(0, 1800)]
+
+def test_band_count_modes():
+    """Test when pages are split."""
+    large, small = Image.new("L", (2480, 3508)), Image.new("L", (1240, 1754))
+    assert band_count(large, 8, mode="off") == 1
+    assert band_count(small, 8, mode="always") == 1
+    assert band_count(large, 0, mode="always") == OCR_BAND_MAX
+    assert band_count(large, 0, mode="idle") == 1
+    assert band_count(large, 1, mode="idle") == 2
+
+def test_stitched_result_is_in_page_coordinates():
+    """Test that band results are merged in reading order."""
+    word = OCRWord("Total", 90.0, 10, 5, 50, 20, (1, 1, 1))
+    results = [OCRResult("INVOICE #1\n\f", [word], (800, 100)), OCRResult("Total: 12.00\n\f", [word], (800, 100))]
+    page = stitch_bands(results, [(0, 100), (100, 200)], (800, 200))
+    assert page.text == "INVOICE #1\n\nTotal: 12.00\n\f"
+    assert [w.top for w in page.words] == [5, 105]
+    assert page.words[0].line != page.words[1].line
+
+def test_page_bands_are_ocred_in_parallel(monkeypatch):
+    """Test that each band is OCRed on its own and the text stitched back."""
+    seen = []
+
+    def fake_ocr_page(image, timeout=None, cancel_event=None, lang=None, single_block=False):
+        seen.append(image.size)
+        return OCRResult(f"band {len(seen)}\n", [], image.size)
+
+    monkeypatch.setattr(ocr_processor, "ocr_page", fake_ocr_page)
+    monkeypatch.setattr(ocr_processor, "band_count", lambda image, spare: 3)
+    result = asyncio.run(ocr_processor.ocr_frame(text_page(ROWS), "eng", OCRBudget()))
+    assert sorted(seen) == [(1200, 384), (1200, 550), (1200, 866)]
+    assert result.size == (1200, 1800)
+    assert result.text.count("band") == 3
@@ -0,0 +1,124 @@
+"""
+Tests for the ranking and checking of extracted field candidates.
+"""
+import datetime
+from decimal import Decimal
+from app.candidates import WordIndex, check_consistency, needs_retry, reread
+from app.engines import OCRResult, OCRWord, parse_tsv
+from app.ocr_processor import (
+    collect_candidates, extract_charges, extract_invoice_data, extract_items, field_patterns, FIELDS
+)
+
+def make_page(lines, confidences=None, height=1000):
+    """Build an OCR result with one word per line, 40 pixels apart."""
+    words = [
+        OCRWord(text, (confidences or {}).get(text, 95.0), 10, 40 * i, 100, 30, (1, 1, i))
+        for i, text in enumerate(lines)
+    ]
+    return OCRResult("\n".join(lines), words, (800, height))
+
+def test_subtotal_is_not_the_total():
+    """Test that a subtotal found before the total is ranked below it."""
+    text = "ACME Inc\nINVOICE #12345\nSubtotal: $100.00\nTax: $20.00\nTotal: $120.00\n"
+    invoice = extract_invoice_data(text)
+    assert invoice.total_amount == Decimal("120.00")
+    assert invoice.confidence["total_amount"] > 0
+    assert [c["value"] for c in invoice.candidates["total_amount"]][:2] == [120.0, 100.0]
+
+def test_due_date_is_not_the_invoice_date():
+    """Test that a due date listed first is not taken as the invoice date."""
+    text = "ACME Inc\nINVOICE #12345\nDue Date: 02/15/2023\nDate: 01/15/2023\n"
+    invoice = extract_invoice_data(text)
+    assert invoice.date == datetime.date(2023, 1, 15)
+    assert invoice.due_date == datetime.date(2023, 2, 15)
+    assert invoice.warnings == []
+
+def test_due_date_before_invoice_date_is_reported():
+    """Test that inconsistent dates are reported when no other candidate fits."""
+    text = "INVOICE #12345\nInvoice Date: 03/15/2023\nDue Date: 02/15/2023\n"
+    invoice = extract_invoice_data(text)
+    assert invoice.warnings == ["The due date is before the invoice date"]
+
+def test_items_must_add_up_to_the_total():
+    """Test that the total matching the line items is chosen."""
+    text = "Subtotal: $90.00\nTotal: $120.00\n"
+    candidates = collect_candidates(text, None)
+    chosen, warnings = check_consistency(candidates, [{"amount": 50}, {"amount": 40}])
+    assert chosen["total_amount"].value == Decimal("90.00")
+    assert warnings == []
+
+def test_line_items_are_extracted_and_checked():
+    """Test that line items and charges are read and checked against the total."""
+    text = (
+        "ACME Inc\nINVOICE #12345\nDescription Qty Unit price Amount\n"
+        "Widget 2 x 25.00 50.00\nConsulting services $40.00\n"
+        "Subtotal: $90.00\nTax (20%): $18.00\nShipping 12.00\nTotal: $120.00\n"
+    )
+    assert extract_items(text) == [
+        {"description": "Widget", "quantity": 2.0, "unit_price": 25.0, "amount": 50.0},
+        {"description": "Consulting services", "quantity": None, "unit_price": None, "amount": 40.0},
+    ]
+    assert extract_charges(text) == [Decimal("18.00"), Decimal("12.00")]
+    invoice = extract_invoice_data(text)
+    assert invoice.total_amount == Decimal("120.00")
+    assert invoice.warnings == []
+    
+    invoice = extract_invoice_data(text.replace("Shipping 12.00\n", ""))
+    assert invoice.warnings == ["The line items and charges add up to 108.00, not to the total amount"]
+
+def test_french_line_items():
+    """Test that amounts with spaces between thousands are read in French documents."""
+    text = (
+        "Facture n° F-2023-001\nPrestation de conseil 1 1 234,56 1 234,56\nFrais de déplacement 65,44\n"
+        "Total H.T. : 1 300,00\nTVA 20 % : 260,00\nNet à payer : 1 560,00 €\n"
+    )
+    invoice = extract_invoice_data(text, "fra")
+    assert [item["amount"] for item in invoice.items] == [1234.56, 65.44]
+    assert invoice.total_amount == Decimal("1560.00")
+    assert invoice.warnings == []
+
+def test_word_confidences_rank_candidates():
+    """Test that OCR confidences and positions are used when words are available."""
+    page = make_page(["INVOICE", "Total: $120.00", "Total: $125.00"], confidences={"Total: $125.00": 30.0})
+    candidates = collect_candidates(page.text, None, [page])["total_amount"]
+    assert candidates[0].value == Decimal("120.00")
+    assert candidates[0].confidence == 0.95
+    assert candidates[0].page == 0 and candidates[0].box == (10, 40, 110, 70)
+    low = [c for c in candidates if c.value == Decimal("125.00")][0]
+    assert low.confidence == 0.3 and needs_retry(low)
+
+def test_word_index_maps_text_to_words():
+    """Test that text positions are mapped to the words across pages."""
+    pages = [make_page(["ACME", "Inc"]), make_page(["Total", "42.00"])]
+    index = WordIndex(pages)
+    start = len("ACME\nInc\fTotal\n")
+    words = index.words(start, start + 5)
+    assert [(page, word.text) for page, word in words] == [(1, "42.00")]
+    assert index.position(start, start + 5) == 0.04
+
+def test_parse_tsv_keeps_words_only():
+    """Test that only word rows of the Tesseract TSV output are kept."""
+    tsv = (
+        "level\tpage_num\tblock_num\tpar_num\tline_num\tword_num\tleft\ttop\twidth\theight\tconf\ttext\n"
+        "4\t1\t1\t1\t1\t0\t10\t20\t300\t30\t-1\t\n"
+        "5\t1\t1\t1\t1\t1\t10\t20\t120\t30\t96.5\tTotal:\n"
+        "5\t1\t1\t1\t1\t2\t140\t20\t80\t30\t58.25\t$120.00\n"
+    )
+    words = parse_tsv(tsv)
+    assert [word.text for word in words] == ["Total:", "$120.00"]
+    assert words[1].conf == 58.25 and words[1].line == (1, 1, 1)
+
+def test_reread_keeps_the_more_confident_value():
+    """Test that a value read again more confidently replaces the first reading."""
+    page = make_page(["Total: $12O.00", "Total: $120.00"], confidences={"Total: $120.00": 40.0})
+    candidate = collect_candidates(page.text, None, [page])["total_amount"][0]
+    patterns = field_patterns("total_amount", None)
+    parse = lambda value: FIELDS["total_amount"].parse(value, None)
+
+    retry = make_page(["Total: $126.00"], confidences={"Total: $126.00": 92.0})
+    better = reread(candidate, retry, patterns, parse)
+    assert better.value == Decimal("126.00") and better.retried
+    assert better.score > candidate.score
+
+    worse = make_page(["Total: $128.00"], confidences={"Total: $128.00": 20.0})
+    assert reread(candidate, worse, patterns, parse) is candidate
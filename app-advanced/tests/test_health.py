@@ -0,0 +1,68 @@
+"""
+Tests for the liveness, readiness and load endpoints.
+"""
+import asyncio
+import threading
+from app.fake_engine import FakeEngine
+from app.health import check_disk, check_engine, check_queue, check_readiness, check_store, check_workers
+from app.store import ResultsStore
+from app.workers import OCRWorkerPool
+
+def blocking_job(release, timeout=None, cancel_event=None):
+    """Job keeping a worker busy until released."""
+    release.wait(5)
+
+async def fill_pool(pool, release, jobs):
+    """Start jobs on the pool and let them reach the workers or the queue."""
+    tasks = [asyncio.ensure_future(pool.run(blocking_job, release)) for _ in range(jobs)]
+    await asyncio.sleep(0.05)
+    return tasks
+
+def test_liveness_and_load(test_client):
+    """Test that liveness always answers and the load score is reported."""
+    assert test_client.get("/health/live").json() == {"status": "healthy"}
+    assert test_client.get("/health/load").json()["load"] >= 0
+
+def test_metrics_report_process_memory(test_client):
+    """Test that /metrics reports the current and process-wide peak memory."""
+    memory = test_client.get("/metrics").json()["memory"]
+    assert memory["process_peak_rss_mb"] >= memory["rss_mb"] > 0
+
+def test_readiness_reports_every_check(test_client):
+    """Test that readiness returns the result of each check, with 503 if one fails."""
+    response = test_client.get("/health/ready")
+    body = response.json()
+    assert set(body["checks"]) == {"engine", "workers", "queue", "disk", "store"}
+    assert response.status_code == (200 if body["status"] == "ready" else 503)
+    assert (body["status"] == "ready") == all(check["ok"] for check in body["checks"].values())
+
+def test_saturated_pool_is_not_ready():
+    """Test that a deep queue and long waits make the replica not ready."""
+    async def scenario():
+        pool = OCRWorkerPool(max_workers=1)
+        release = threading.Event()
+        tasks = await fill_pool(pool, release, 4)
+        try:
+            assert pool.load() == 4
+            assert check_workers(pool, max_queue_wait=10)["ok"]
+            assert not check_workers(pool, max_queue_wait=0)["ok"]
+            assert check_queue(pool, max_per_worker=3)["ok"]
+            assert not check_queue(pool, max_per_worker=2)["ok"]
+        finally:
+            release.set()
+            await asyncio.gather(*tasks)
+        assert pool.load() == 0 and pool.oldest_wait() == 0
+
+    asyncio.run(scenario())
+
+def test_engine_disk_and_store_checks(tmp_path):
+    """Test the checks of the OCR engine, the upload disk and the results store."""
+    assert check_engine(FakeEngine())["ok"]
+    assert check_disk(str(tmp_path), min_free_mb=0)["ok"]
+    assert not check_disk(str(tmp_path), min_free_mb=1e12)["ok"]
+    assert not check_disk(str(tmp_path / "missing"))["ok"]
+    assert check_store(None) == {"ok": True, "detail": "disabled"}
+    assert check_store(ResultsStore(str(tmp_path / "results.db")))["ok"]
+
+    ready, checks = check_readiness(FakeEngine(), ["eng"], OCRWorkerPool(max_workers=1), str(tmp_path), None)
+    assert ready == checks["disk"]["ok"]
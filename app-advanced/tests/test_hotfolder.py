@@ -0,0 +1,122 @@
+"""
+Tests for the hot-folder ingestion daemon.
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import pytest
+from PIL import Image, ImageDraw
+from app import engines, hotfolder
+from app.hotfolder import HotFolder, DONE, FAILED
+
+class CountingEngine(engines.OCREngine):
+    """OCR engine double counting the pages it reads."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def image_to_string(self, image, timeout=None, cancel_event=None):
+        self.calls += 1
+        return "INVOICE #HF-7\nTotal: 12.00\n"
+
+@pytest.fixture
+def engine(monkeypatch):
+    engine = CountingEngine()
+    monkeypatch.setattr(engines, "default_engine", engine)
+    monkeypatch.setattr(hotfolder, "results_store", None)
+    return engine
+
+def drop(root, name):
+    """Drop a one-page invoice image into the hot folder."""
+    page = Image.new("L", (600, 400), 255)
+    ImageDraw.Draw(page).rectangle((50, 50, 550, 80), fill=0)
+    path = os.path.join(root, name)
+    page.save(path, format="PNG")
+    return path
+
+def test_dropped_files_are_processed(tmp_path, engine):
+    """Test that files are claimed, OCRed and moved to done/ with their result."""
+    root = str(tmp_path)
+    for index in range(3):
+        drop(root, f"scan{index}.png")
+    with open(os.path.join(root, "scan3.png.part"), "wb") as partial:
+        partial.write(b"still being written")
+
+    folder = HotFolder(root, batch_size=2, settle=0)
+    assert asyncio.run(folder.run_once()) == 3
+    assert sorted(os.listdir(root)) == [".hotfolder", "done", "failed", "scan3.png.part"]
+
+    results = sorted(name for name in os.listdir(folder.done_dir) if name.endswith(".json"))
+    assert len(results) == 3
+    with open(os.path.join(folder.done_dir, results[0])) as result:
+        data = json.load(result)
+    assert data["filename"].startswith("scan")
+    assert data["extracted_data"]["invoice_number"] == "HF-7"
+    assert engine.calls == 3
+
+def test_invalid_files_fail(tmp_path, engine):
+    """Test that a file that cannot be processed is moved to failed/ with its error."""
+    root = str(tmp_path)
+    with open(os.path.join(root, "notes.txt"), "w") as notes:
+        notes.write("not an invoice")
+
+    folder = HotFolder(root, settle=0)
+    assert asyncio.run(folder.run_once()) == 0
+    [name] = [name for name in os.listdir(folder.failed_dir) if not name.endswith(".json")]
+    assert folder.journal.get(name)["state"] == FAILED
+    with open(os.path.join(folder.failed_dir, name + ".json")) as error:
+        assert "Invalid file type" in json.load(error)["error"]
+
+def test_crash_recovery_processes_each_file_once(tmp_path, engine):
+    """Test that files claimed before a crash are resumed, and finished ones are not redone."""
+    root = str(tmp_path)
+    for index in range(3):
+        drop(root, f"scan{index}.png")
+    folder = HotFolder(root, settle=0)
+    claimed = folder.claim(3)
+
+    # Crash after claiming: one file finished, one claimed, one renamed but never journaled
+    asyncio.run(folder.process(claimed[0]))
+    with folder.journal._conn:
+        folder.journal._conn.execute("UPDATE files SET state = 'claimed' WHERE name = ?", (claimed[0],))
+        folder.journal._conn.execute("DELETE FROM files WHERE name = ?", (claimed[2],))
+    folder.journal.close()
+    assert engine.calls == 1
+
+    restarted = HotFolder(root, settle=0)
+    assert asyncio.run(restarted.run_once()) == 2
+    assert engine.calls == 3
+    assert all(restarted.journal.get(name)["state"] == DONE for name in claimed)
+    assert os.listdir(restarted.processing_dir) == []
+
+def test_interrupted_files_are_given_up(tmp_path, engine):
+    """Test that a file interrupted too many times is moved to failed/."""
+    root = str(tmp_path)
+    drop(root, "poison.png")
+    folder = HotFolder(root, settle=0, max_attempts=1)
+    name = folder.claim(1)[0]
+    folder.journal.start(name)
+
+    assert asyncio.run(folder.run_once()) == 0
+    assert folder.journal.get(name)["state"] == FAILED
+    assert engine.calls == 0
+
+def test_results_are_not_lost_when_the_store_fails(tmp_path, engine, monkeypatch):
+    """Test that store-only results fall back to a file, and need an enabled store."""
+    with pytest.raises(ValueError):
+        HotFolder(str(tmp_path), results="store")
+
+    class BrokenStore:
+        def save(self, *args):
+            raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(hotfolder, "results_store", BrokenStore())
+    drop(str(tmp_path), "scan.png")
+    folder = HotFolder(str(tmp_path), settle=0, results="store")
+    assert asyncio.run(folder.run_once()) == 1
+    [result_name] = [name for name in os.listdir(folder.done_dir) if name.endswith(".json")]
+    with open(os.path.join(folder.done_dir, result_name)) as result:
+        data = json.load(result)
+    assert data["extracted_data"]["invoice_number"] == "HF-7"
+    assert data["invoice_id"] is None
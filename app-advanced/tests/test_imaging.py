@@ -0,0 +1,140 @@
+"""
+Tests for format detection and multi-frame image processing.
+"""
+import asyncio
+import io
+import pytest
+from PIL import Image, ImageDraw
+from app import engines
+from app.imaging import sniff_format, detect_format
+from app.ocr_processor import process_invoice, process_invoice_async
+
+class FrameSizeEngine(engines.OCREngine):
+    """OCR engine double returning the width of each page as its text."""
+    
+    def image_to_string(self, image, timeout=None, cancel_event=None):
+        return f"page {image.width}\n"
+
+@pytest.fixture
+def multipage_tiff(tmp_path):
+    """
+    Create a three-page TIFF with pages of different widths.
+    
+    Returns:
+        str: Path to the TIFF file
+    """
+    pages = [Image.new("L", (width, 50), color=255) for width in (100, 200, 300)]
+    for page in pages:
+        # Some ink, so that the pages are not skipped as blank
+        ImageDraw.Draw(page).rectangle((10, 20, page.width - 10, 30), fill=0)
+    path = tmp_path / "fax.tif"
+    pages[0].save(path, save_all=True, append_images=pages[1:])
+    return str(path)
+
+@pytest.mark.parametrize("fmt,expected", [
+    ("PNG", "png"),
+    ("JPEG", "jpeg"),
+    ("TIFF", "tiff"),
+    ("WEBP", "webp"),
+])
+def test_sniff_image_formats(fmt, expected):
+    """Test that formats are recognized from the file content."""
+    buffer = io.BytesIO()
+    Image.new("RGB", (10, 10)).save(buffer, format=fmt)
+    buffer.seek(0)
+    assert detect_format(buffer) == expected
+    # The file object is left at its original position
+    assert buffer.tell() == 0
+
+def test_sniff_unknown_format():
+    """Test that non-image content is not recognized."""
+    assert sniff_format(b"This is a test file") is None
+    assert sniff_format(b"\x00\x00\x00\x18ftypheic\x00\x00\x00\x00") == "heic"
+
+def test_multipage_tiff_text_is_merged(multipage_tiff, monkeypatch):
+    """Test that every page is OCRed and the texts are merged in order."""
+    monkeypatch.setattr(engines, "default_engine", FrameSizeEngine())
+    
+    invoice = process_invoice(multipage_tiff)
+    assert invoice.raw_text == "page 100\n\fpage 200\n\fpage 300\n"
+    
+    invoice = asyncio.run(process_invoice_async(multipage_tiff))
+    assert invoice.raw_text == "page 100\n\fpage 200\n\fpage 300\n"
+
+def test_large_jpeg_is_decoded_at_reduced_scale(tmp_path, monkeypatch):
+    """Test that large JPEGs are draft-decoded close to the OCR resolution."""
+    from app import imaging
+    monkeypatch.setattr(imaging, "OCR_MAX_SIDE", 500)
+    
+    path = tmp_path / "photo.jpg"
+    Image.new("RGB", (2400, 1800), color=(255, 255, 255)).save(path, format="JPEG")
+    
+    frames = list(imaging.iter_frames(str(path)))
+    assert len(frames) == 1
+    # 1/4 scale is the smallest one keeping the longest side >= 500 px
+    assert frames[0].size == (600, 450)
+    assert frames[0].mode == "L"
+
+def test_pixel_budget_is_enforced(tmp_path, monkeypatch):
+    """Test that images above the pixel budget are rejected before decoding."""
+    from app import imaging
+    monkeypatch.setattr(imaging, "MAX_IMAGE_PIXELS", 10000)
+    
+    path = tmp_path / "big.png"
+    Image.new("L", (200, 200), color=255).save(path)
+    
+    with pytest.raises(imaging.ImageTooLargeError):
+        list(imaging.iter_frames(str(path)))
+
+def set_pixel_budget(monkeypatch, pixels):
+    """Set the pixel budget, and the limit of Pillow derived from it."""
+    from app import imaging
+    monkeypatch.setattr(imaging, "MAX_IMAGE_PIXELS", pixels)
+    monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", pixels * imaging.JPEG_MAX_DRAFT_REDUCTION // 2)
+
+def test_decompression_bombs_are_too_large(tmp_path, monkeypatch):
+    """Test that images Pillow refuses to open are rejected as over the pixel budget."""
+    from app import imaging
+    set_pixel_budget(monkeypatch, 1000)
+    
+    path = str(tmp_path / "bomb.png")
+    Image.new("L", (300, 300), color=255).save(path)
+    
+    with pytest.raises(imaging.ImageTooLargeError):
+        list(imaging.iter_frames(path))
+    with pytest.raises(imaging.ImageTooLargeError):
+        imaging.load_frame(path, 0)
+    with pytest.raises(imaging.ImageTooLargeError):
+        imaging.count_frames(path)
+
+def test_pixel_budget_applies_to_the_drafted_jpeg(tmp_path, monkeypatch):
+    """Test that a JPEG over the budget is accepted when decoded at a reduced scale."""
+    from app import imaging
+    set_pixel_budget(monkeypatch, 10000)
+    monkeypatch.setattr(imaging, "OCR_MAX_SIDE", 100)
+    
+    path = str(tmp_path / "photo.jpg")
+    Image.new("RGB", (400, 400), color=(255, 255, 255)).save(path, format="JPEG")
+    
+    assert [frame.size for frame in imaging.iter_frames(path)] == [(100, 100)]
+    assert imaging.load_frame(path, 0).size == (100, 100)
+
+def test_peak_rss_is_measured_per_request():
+    """Test that the peak RSS of a request does not include the peaks of earlier ones."""
+    import os
+    from app.utils import PeakRSSTracker
+    if not os.access("/proc/self/clear_refs", os.W_OK):
+        pytest.skip("The kernel high-water mark cannot be reset here")
+    tracker = PeakRSSTracker()
+    
+    with tracker.track() as large:
+        # Touch every page so they are resident
+        buffer = bytearray(b"\x01" * (64 * 1024 * 1024))
+        del buffer
+    with tracker.track() as small:
+        pass
+    
+    assert large.growth_mb > 50
+    assert small.growth_mb < 50
+    assert small.peak_mb < large.peak_mb
+    assert tracker.lifetime_peak_mb() >= large.peak_mb
@@ -0,0 +1,91 @@
+"""
+Tests for language selection and locale-aware parsing.
+"""
+import datetime
+from decimal import Decimal
+import pytest
+from app.engines import TesseractEngine
+from app.languages import detect_language, resolve_language
+from app.ocr_processor import extract_invoice_data
+from app.utils import parse_amount, parse_date
+
+FRENCH_INVOICE = """ACME SARL
+12 rue de la Paix, 75002 Paris
+Facture N° FAC-2019-0001
+Date de facture : 05/03/2019
+Date d'échéance : 4 avril 2019
+Désignation Quantité Prix unitaire HT
+Total HT 1 028,80 €
+TVA 20 % 205,76 €
+Net à payer : 1 234,56 €
+"""
+
+@pytest.mark.parametrize("value,decimal_comma,expected", [
+    ("1,234.56", None, Decimal("1234.56")),
+    ("1 234,56", None, Decimal("1234.56")),
+    ("1 234,56", None, Decimal("1234.56")),
+    ("1.234,56", None, Decimal("1234.56")),
+    ("1,234", None, Decimal("1234")),
+    ("12,5", None, Decimal("12.5")),
+    ("1.234", True, Decimal("1234")),
+    ("12.50", True, Decimal("12.50")),
+    ("abc", None, None),
+])
+def test_parse_amount_notations(value, decimal_comma, expected):
+    """Test that English and French amount notations are parsed."""
+    assert parse_amount(value, decimal_comma) == expected
+
+@pytest.mark.parametrize("value,day_first,expected", [
+    ("03/05/2019", False, datetime.date(2019, 3, 5)),
+    ("03/05/2019", True, datetime.date(2019, 5, 3)),
+    ("31/01/2023", False, datetime.date(2023, 1, 31)),
+    ("15 mars 2023", False, datetime.date(2023, 3, 15)),
+    ("1er février 2023", False, datetime.date(2023, 2, 1)),
+    ("March 15, 2023", False, datetime.date(2023, 3, 15)),
+    ("15 Foo 2023", False, None),
+])
+def test_parse_date_locales(value, day_first, expected):
+    """Test day-first numeric dates and dates with month names."""
+    assert parse_date(value, day_first=day_first) == expected
+
+def test_detect_language():
+    """Test that the document language is detected from invoice words."""
+    assert detect_language(FRENCH_INVOICE) == "fra"
+    assert detect_language("INVOICE #12345\nAmount due: $500.00\nPayment terms") == "eng"
+    assert detect_language("12345") is None
+
+def test_french_invoice_extraction():
+    """Test that French invoices are parsed with French conventions."""
+    invoice = extract_invoice_data(FRENCH_INVOICE)
+    assert invoice.language == "fra"
+    assert invoice.invoice_number == "FAC-2019-0001"
+    assert invoice.date == datetime.date(2019, 3, 5)
+    assert invoice.due_date == datetime.date(2019, 4, 4)
+    assert invoice.total_amount == Decimal("1234.56")
+    assert invoice.currency == "EUR"
+    assert invoice.vendor == "ACME SARL"
+
+def test_resolve_language():
+    """Test that only the configured languages are accepted."""
+    assert resolve_language("auto") == "auto"
+    assert resolve_language("eng+fra") == "eng+fra"
+    with pytest.raises(ValueError):
+        resolve_language("klingon")
+
+def test_engines_are_cached_per_language():
+    """Test that one engine is created per language and reused."""
+    engine = TesseractEngine()
+    french = engine.with_language("fra")
+    assert french.lang == "fra"
+    assert engine.with_language("fra") is french
+    assert french.with_language("fra") is french
+
+def test_extract_rejects_unsupported_language(test_client, auth_headers):
+    """Test that an unsupported language is rejected before any OCR."""
+    response = test_client.post(
+        "/extract/?lang=klingon",
+        headers=auth_headers,
+        files={"file": ("invoice.png", b"\x89PNG\r\n\x1a\n", "image/png")}
+    )
+    assert response.status_code == 400
+    assert "Unsupported language" in response.json()["detail"]
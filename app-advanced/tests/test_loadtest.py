@@ -0,0 +1,48 @@
+"""
+Tests for the fake OCR engine and the load test reporting.
+"""
+import threading
+import time
+import pytest
+from PIL import Image
+from app.engines import OCRTimeoutError, OCRCancelledError, create_engine
+from app.fake_engine import FakeEngine
+from benchmarks.loadtest import find_saturation, summarize_step
+
+def test_fake_engine_replays_samples():
+    """Test that recorded texts are replayed, with latencies scaled by image size."""
+    engine = FakeEngine(samples=[{"seconds": 0.2, "pixels": 10000, "text": "FACTURE"}])
+    start = time.monotonic()
+    assert engine.image_to_string(Image.new("L", (50, 50))) == "FACTURE"
+    # A quarter of the recorded pixels takes a quarter of the time
+    assert time.monotonic() - start < 0.15
+
+def test_fake_engine_honours_timeout_and_cancel():
+    """Test that the fake engine stops like the real one."""
+    engine = FakeEngine(samples=[{"seconds": 5, "text": "slow"}])
+    image = Image.new("L", (10, 10))
+    with pytest.raises(OCRTimeoutError):
+        engine.image_to_string(image, timeout=0.05)
+
+    cancel_event = threading.Event()
+    threading.Timer(0.05, cancel_event.set).start()
+    with pytest.raises(OCRCancelledError):
+        engine.image_to_string(image, cancel_event=cancel_event)
+
+def test_create_engine_by_name():
+    """Test that the fake engine can be selected by name."""
+    assert create_engine("fake").name == "fake"
+    with pytest.raises(ValueError):
+        create_engine("unknown")
+
+def test_saturation_point():
+    """Test that the first rate the service cannot sustain is reported."""
+    steps = [
+        summarize_step(1, [(200, 0.5)] * 10, 10),
+        summarize_step(2, [(200, 0.8)] * 20, 10),
+        summarize_step(4, [(200, 0.9)] * 25 + [(429, 0.01)] * 15, 10),
+    ]
+    assert steps[2]["errors"] == {"429": 15}
+    assert find_saturation(steps, slo=2) == 4
+    assert find_saturation(steps[:2], slo=2) is None
+    assert find_saturation(steps[:2], slo=0.6) == 2
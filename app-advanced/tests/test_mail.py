@@ -0,0 +1,135 @@
+"""
+Tests for the extraction of invoices attached to emails.
+"""
+import asyncio
+import io
+import pytest
+from email.message import EmailMessage
+from PIL import Image, ImageDraw
+from app import engines, mail
+from app.mail import MailFormatError, iter_messages, iter_raw_messages, process_mail
+
+class TextEngine(engines.OCREngine):
+    """OCR engine double counting the pages it reads."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def image_to_string(self, image, timeout=None, cancel_event=None):
+        self.calls += 1
+        return "INVOICE #MAIL-9\nTotal: 12.00\n"
+
+@pytest.fixture
+def engine(monkeypatch):
+    engine = TextEngine()
+    monkeypatch.setattr(engines, "default_engine", engine)
+    monkeypatch.setattr(mail, "results_store", None)
+    return engine
+
+def invoice_png():
+    page = Image.new("L", (600, 400), 255)
+    ImageDraw.Draw(page).rectangle((50, 50, 550, 80), fill=0)
+    data = io.BytesIO()
+    page.save(data, format="PNG")
+    return data.getvalue()
+
+def make_message(message_id, body="Please find our invoice attached.\n", attachments=()):
+    message = EmailMessage()
+    message["From"] = "billing@acme.example"
+    message["Subject"] = f"Invoice {message_id}"
+    if message_id:
+        message["Message-ID"] = f"<{message_id}>"
+    message.set_content(body)
+    for filename, maintype, subtype, payload in attachments:
+        message.add_attachment(payload, maintype=maintype, subtype=subtype, filename=filename)
+    return message.as_bytes()
+
+def make_mbox(*messages):
+    """Join messages into an mbox file, escaping the "From " lines of the bodies."""
+    lines = []
+    for message in messages:
+        lines.append(b"From billing@acme.example Mon Jan  2 10:00:00 2023\n")
+        for line in message.splitlines(keepends=True):
+            lines.append(b">" + line if line.startswith(b"From ") else line)
+        lines.append(b"\n")
+    return b"".join(lines)
+
+def test_mbox_is_split_into_messages():
+    """Test that mailboxes are split on "From " lines and bodies unescaped."""
+    mbox = make_mbox(make_message("a@x", body="From the team\n"), make_message("b@x"))
+    messages = list(iter_messages(io.BytesIO(mbox)))
+    assert [message.message_id for message in messages] == ["a@x", "b@x"]
+
+    # A single message (.eml) without a Message-ID gets a digest instead
+    [message] = iter_messages(io.BytesIO(make_message(None)))
+    assert message.message_id.startswith("sha256:")
+
+    with pytest.raises(MailFormatError):
+        list(iter_messages(io.BytesIO(b"\x89PNG\r\n\x1a\n")))
+
+def test_oversized_messages_keep_their_headers():
+    """Test that only the headers of a message larger than the limit are kept."""
+    big = make_message("big@x", attachments=[("scan.png", "image", "png", bytes(20000))])
+    [raw] = iter_raw_messages(io.BytesIO(big), max_size=5000)
+    assert not raw["complete"]
+    assert b"Message-ID: <big@x>" in raw["data"]
+    assert len(raw["data"]) < 1000
+
+def test_attachments_are_extracted_once_per_message(engine):
+    """Test that image attachments are OCRed, others skipped, and duplicates not redone."""
+    png = invoice_png()
+    first = make_message("a@x", attachments=[
+        ("invoice.png", "image", "png", png),
+        ("terms.pdf", "application", "pdf", b"%PDF-1.4 terms"),
+    ])
+    mbox = make_mbox(first, make_message("b@x", attachments=[("other.png", "image", "png", png)]), first)
+
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setattr(mail, "MAIL_CONCURRENCY", 1)
+        messages = asyncio.run(process_mail(io.BytesIO(mbox), "."))
+    assert [message["duplicate"] for message in messages] == [False, False, True]
+    invoice, terms = messages[0]["attachments"]
+    assert invoice["extracted_data"]["invoice_number"] == "MAIL-9"
+    assert "raw_text" not in invoice["extracted_data"]
+    assert terms["skipped"].startswith("Unsupported file type")
+    assert messages[2]["attachments"] == []
+    assert engine.calls == 2
+
+def test_mail_endpoint(test_client, auth_headers, engine):
+    """Test the email extraction endpoint."""
+    eml = make_message("c@x", attachments=[("invoice.png", "image", "png", invoice_png())])
+    response = test_client.post(
+        "/extract/mail", headers=auth_headers, files={"file": ("invoice.eml", eml, "message/rfc822")}
+    )
+    assert response.status_code == 200
+    [message] = response.json()["messages"]
+    assert message["message_id"] == "c@x"
+    assert message["attachments"][0]["extracted_data"]["invoice_number"] == "MAIL-9"
+
+    response = test_client.post(
+        "/extract/mail", headers=auth_headers, files={"file": ("notes.txt", b"\x00\x01", "text/plain")}
+    )
+    assert response.status_code == 400
+
+def test_mailbox_posted_again_is_not_redone(test_client, auth_headers, results_store, monkeypatch):
+    """Test that an email whose invoice was already stored on its own is not OCRed again."""
+    engine = TextEngine()
+    monkeypatch.setattr(engines, "default_engine", engine)
+    png = invoice_png()
+    response = test_client.post(
+        "/extract/", headers=auth_headers, files={"file": ("invoice.png", png, "image/png")}
+    )
+    invoice_id = response.json()["invoice_id"]
+
+    mbox = make_mbox(make_message("d@x", attachments=[("invoice.png", "image", "png", png)]))
+    duplicates = []
+    for _ in range(2):
+        response = test_client.post(
+            "/extract/mail", headers=auth_headers, files={"file": ("inbox.mbox", mbox, "application/mbox")}
+        )
+        duplicates.append(response.json()["messages"][0]["duplicate"])
+    assert duplicates == [False, True]
+    assert engine.calls == 2
+    # The stored invoice is linked to the email, without being stored twice
+    items, _ = results_store.search(message_id="d@x")
+    assert [item["id"] for item in items] == [invoice_id]
@@ -0,0 +1,68 @@
+"""
+Tests for the on-demand profiler.
+"""
+import asyncio
+import threading
+import time
+from app import auth
+from app.profiling import Profiler, CPROFILE
+
+def busy_loop(stop):
+    """Burn CPU until stopped, to be found by the sampler."""
+    while not stop.is_set():
+        sum(range(1000))
+
+def test_sampler_finds_hot_functions_in_threads():
+    """Test that samples of other threads are aggregated per function and as collapsed stacks."""
+    stop = threading.Event()
+    worker = threading.Thread(target=busy_loop, args=(stop,), name="ocr_1")
+    worker.start()
+    try:
+        summary, sampler = asyncio.run(Profiler().profile(seconds=0.3, interval=0.002))
+    finally:
+        stop.set()
+        worker.join()
+
+    assert summary["mode"] == "sample" and summary["samples"] > 10
+    hottest = [row["function"] for row in sampler.top(5)]
+    assert any(function.startswith("busy_loop (test_profiling.py") for function in hottest)
+    # Thread numbers are merged so that pools form a single flame
+    assert any(line.startswith("ocr;") and "busy_loop" in line for line in sampler.collapsed().splitlines())
+
+def test_session_ends_after_requests_and_measures_loop_lag():
+    """Test that a session stops after N requests, and sees the loop blocked."""
+    profiler = Profiler()
+
+    async def scenario():
+        session = asyncio.ensure_future(profiler.profile(CPROFILE, seconds=10, requests=2))
+        await asyncio.sleep(0.05)
+        time.sleep(0.1)  # blocking call on the event loop
+        await asyncio.sleep(0.02)
+        profiler.request_done()
+        profiler.request_done()
+        return await session
+
+    started = time.monotonic()
+    summary, stats = asyncio.run(scenario())
+    assert time.monotonic() - started < 5
+    assert summary["requests"] == 2
+    assert summary["event_loop_lag"]["max_ms"] >= 80
+    assert not profiler.active
+
+def test_profile_endpoint(test_client, auth_headers, monkeypatch):
+    """Test the admin check and the output formats of the profiling endpoint."""
+    response = test_client.post("/admin/profile?seconds=0.1&format=collapsed", headers=auth_headers)
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+
+    response = test_client.post("/admin/profile?mode=cprofile&seconds=0.1", headers=auth_headers)
+    assert response.status_code == 200
+    assert response.json()["mode"] == "cprofile"
+    assert "event_loop_lag" in response.json()
+
+    response = test_client.post("/admin/profile?mode=cprofile&format=collapsed", headers=auth_headers)
+    assert response.status_code == 400
+
+    monkeypatch.setattr(auth, "ADMIN_USERS", set())
+    response = test_client.post("/admin/profile?seconds=0.1", headers=auth_headers)
+    assert response.status_code == 403
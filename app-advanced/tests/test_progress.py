@@ -0,0 +1,168 @@
+"""
+Tests for the progress events of extractions.
+"""
+import asyncio
+import io
+import json
+import threading
+import time
+import pytest
+from PIL import Image, ImageDraw
+from app import engines, main
+from app.progress import DONE, ERROR, ProgressRegistry, format_event, tracking, report
+
+class TextEngine(engines.OCREngine):
+    """OCR engine double returning the same invoice for every page."""
+
+    def image_to_string(self, image, timeout=None, cancel_event=None):
+        return "INVOICE #SSE-5\nTotal: 12.00\n"
+
+@pytest.fixture
+def engine(monkeypatch):
+    engine = TextEngine()
+    monkeypatch.setattr(engines, "default_engine", engine)
+    monkeypatch.setattr(main, "results_store", None)
+    return engine
+
+class HeldEngine(TextEngine):
+    """OCR engine double holding the first page until released."""
+
+    def __init__(self):
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def image_to_string(self, image, timeout=None, cancel_event=None):
+        self.started.set()
+        self.release.wait(5)
+        return super().image_to_string(image, timeout, cancel_event)
+
+def invoice_tiff(pages):
+    frames = []
+    for index in range(pages):
+        page = Image.new("L", (600, 400), 255)
+        ImageDraw.Draw(page).rectangle((50, 50 + index * 20, 550, 80 + index * 20), fill=0)
+        frames.append(page)
+    data = io.BytesIO()
+    frames[0].save(data, format="TIFF", save_all=True, append_images=frames[1:])
+    return data.getvalue()
+
+def parse_events(body):
+    """Split a text/event-stream body into (name, data) pairs, skipping comments."""
+    events = []
+    for block in body.strip().split("\n\n"):
+        lines = dict(line.split(": ", 1) for line in block.split("\n") if not line.startswith(":"))
+        if lines:
+            events.append((lines["event"], json.loads(lines["data"])))
+    return events
+
+def test_registry_rejects_bad_and_busy_ids():
+    """Test that job ids are validated, and reused only once finished."""
+    registry = ProgressRegistry()
+    with pytest.raises(ValueError):
+        registry.start("../etc")
+    progress = registry.start("job-1", "scan.png", "alice")
+    with pytest.raises(ValueError):
+        registry.start("job-1")
+    progress.finish()
+    assert registry.start("job-1").events == []
+    assert [job.job_id for job in registry.list("alice")] == []
+
+def test_followers_get_past_events_then_live_ones():
+    """Test that a late follower replays the events, and the stream ends with the extraction."""
+    async def scenario():
+        progress = ProgressRegistry().start("job-2")
+        with tracking(progress):
+            report("received", pages=1)
+            follower = asyncio.ensure_future(collect(progress))
+            await asyncio.sleep(0)
+            report("ocr", page=1)
+        return await follower
+
+    async def collect(progress):
+        return [event for event in [e async for e in progress.follow(heartbeat=0.01)] if event is not None]
+
+    stages = [event["stage"] for event in asyncio.run(scenario())]
+    assert stages == ["received", "ocr", DONE]
+
+def test_errors_end_the_extraction():
+    """Test that an exception in a tracked block is recorded as the last event."""
+    progress = ProgressRegistry().start("job-3")
+    with pytest.raises(RuntimeError):
+        with tracking(progress):
+            raise RuntimeError("engine crashed")
+    assert progress.events[-1]["stage"] == ERROR
+    assert progress.events[-1]["detail"] == "engine crashed"
+    assert format_event(None) == ": keep-alive\n\n"
+
+def test_extract_stream(test_client, auth_headers, engine):
+    """Test that the stream sends the stages in order, page by page, then the result."""
+    response = test_client.post(
+        "/extract/stream",
+        headers={**auth_headers, "X-Job-Id": "stream-1"},
+        files={"file": ("scan.tiff", invoice_tiff(2), "image/tiff")},
+    )
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = parse_events(response.text)
+
+    stages = [data["stage"] for name, data in events if name == "progress"]
+    assert stages[0] == "received" and stages[-2:] == ["extracted", DONE]
+    assert stages.count("decoded") == stages.count("ocr") == 2
+    ocr = [data for name, data in events if name == "progress" and data["stage"] == "ocr"]
+    assert sorted(data["page"] for data in ocr) == [1, 2]
+    assert all(data["pages"] == 2 for data in ocr)
+    # Fields are extracted page by page only once someone follows
+    assert all(data["fields"]["invoice_number"] == "SSE-5" for data in ocr if "fields" in data)
+    extracted = [data for name, data in events if name == "progress" and data["stage"] == "extracted"]
+    assert extracted[0]["fields"]["invoice_number"] == "SSE-5"
+
+    name, result = events[-1]
+    assert name == "result"
+    assert result["extracted_data"]["invoice_number"] == "SSE-5"
+
+    # The finished job can still be looked up
+    summary = test_client.get("/progress/stream-1", headers=auth_headers).json()
+    assert summary["stage"] == DONE and summary["pages_done"] == 2
+    assert test_client.get("/progress", headers=auth_headers).json()["jobs"][-1]["job_id"] == "stream-1"
+
+def test_extract_stream_reports_failures(test_client, auth_headers, engine):
+    """Test that a failed extraction ends the stream with a failure event."""
+    blank = io.BytesIO()
+    Image.new("L", (600, 400), 255).save(blank, format="PNG")
+    response = test_client.post(
+        "/extract/stream", headers=auth_headers, files={"file": ("blank.png", blank.getvalue(), "image/png")}
+    )
+    name, failure = parse_events(response.text)[-1]
+    assert name == "failure"
+    assert failure["status_code"] == 422
+
+def test_joined_extractions_get_the_shared_events(tmp_path, monkeypatch):
+    """Test that a request joining an identical extraction gets its page events too."""
+    engine = HeldEngine()
+    monkeypatch.setattr(engines, "default_engine", engine)
+    paths = []
+    for name in ("first.tiff", "second.tiff"):
+        paths.append(str(tmp_path / name))
+        with open(paths[-1], "wb") as f:
+            f.write(invoice_tiff(2))
+    registry = ProgressRegistry()
+    first, second = registry.start("first"), registry.start("second")
+
+    async def extract(progress, path):
+        with tracking(progress):
+            return await main.run_ocr(path, "same-tiff", time.monotonic() + 10)
+
+    async def scenario():
+        leader = asyncio.ensure_future(extract(first, paths[0]))
+        await asyncio.get_event_loop().run_in_executor(None, engine.started.wait, 5)
+        joiner = asyncio.ensure_future(extract(second, paths[1]))
+        await asyncio.sleep(0.05)
+        engine.release.set()
+        return await asyncio.gather(leader, joiner)
+
+    asyncio.run(scenario())
+    stages = [event["stage"] for event in second.events]
+    assert stages[0] == "joined" and stages[-1] == DONE
+    # Events from before the join are replayed, the later ones forwarded
+    assert stages.count("decoded") == stages.count("ocr") == 2
+    assert [event["stage"] for event in first.events] == stages[1:]
@@ -0,0 +1,62 @@
+"""
+Tests for the per-user rate limiting and concurrency quotas.
+"""
+import pytest
+from app.rate_limit import InMemoryQuotaStore, SQLiteQuotaStore
+
+@pytest.fixture(params=["memory", "sqlite"])
+def quota_store(request, tmp_path):
+    """
+    Create each kind of quota store.
+    
+    Returns:
+        The quota store under test
+    """
+    if request.param == "sqlite":
+        return SQLiteQuotaStore(str(tmp_path / "quotas.db"))
+    return InMemoryQuotaStore()
+
+def test_token_bucket_allows_burst_then_limits(quota_store):
+    """Test that a burst is allowed and the next request must wait."""
+    for _ in range(3):
+        assert quota_store.take_token("alice", rate=1.0, burst=3, now=100.0) == 0
+    
+    wait = quota_store.take_token("alice", rate=1.0, burst=3, now=100.0)
+    assert wait == pytest.approx(1.0)
+    
+    # Another user has their own bucket
+    assert quota_store.take_token("bob", rate=1.0, burst=3, now=100.0) == 0
+    
+    # Tokens are refilled over time
+    assert quota_store.take_token("alice", rate=1.0, burst=3, now=101.5) == 0
+
+def test_zero_rate_disables_the_token_bucket(quota_store):
+    """Test that a rate of 0 means no rate limit rather than a division by zero."""
+    for _ in range(5):
+        assert quota_store.take_token("alice", rate=0.0, burst=1, now=100.0) == 0
+
+def test_in_flight_slots_are_limited_and_released(quota_store):
+    """Test that a user cannot exceed their concurrent job quota."""
+    first = quota_store.acquire_slot("alice", limit=2)
+    second = quota_store.acquire_slot("alice", limit=2)
+    assert first and second
+    assert quota_store.acquire_slot("alice", limit=2) is None
+    assert quota_store.in_flight("alice") == 2
+    
+    quota_store.release_slot("alice", first)
+    assert quota_store.acquire_slot("alice", limit=2) is not None
+
+def test_extract_rate_limited(test_client, auth_headers, monkeypatch):
+    """Test that the extract endpoint answers 429 with Retry-After when over quota."""
+    from app import rate_limit
+    
+    monkeypatch.setattr(rate_limit, "quota_store", InMemoryQuotaStore())
+    monkeypatch.setattr(rate_limit, "RATE_LIMIT_BURST", 1)
+    
+    # The first request passes the quota check (and fails on the missing file)
+    response = test_client.post("/extract/", headers=auth_headers)
+    assert response.status_code == 422
+    
+    response = test_client.post("/extract/", headers=auth_headers)
+    assert response.status_code == 429
+    assert int(response.headers["Retry-After"]) >= 1
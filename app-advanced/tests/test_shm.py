@@ -0,0 +1,45 @@
+"""
+Tests for the shared-memory image transport.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import pytest
+from PIL import Image
+from app.shm import SharedImage, open_shared_image, prepare_transport
+
+def image_extrema(handle):
+    """Worker job reading an image from shared memory."""
+    with open_shared_image(handle) as image:
+        return image.size, image.getextrema()
+
+def test_shared_image_round_trip():
+    """Test that the worker side sees the same pixels as the owner."""
+    image = Image.new("RGB", (64, 32), color=(10, 20, 30))
+    with SharedImage(image) as handle:
+        assert handle.size == (64, 32)
+        with open_shared_image(handle) as shared:
+            assert shared.tobytes() == image.tobytes()
+
+def test_shared_image_is_deleted_on_close():
+    """Test that closing the owner deletes the segment."""
+    shared_image = SharedImage(Image.new("L", (8, 8)))
+    name = shared_image.handle.name
+    shared_image.close()
+    shared_image.close()
+    with pytest.raises(FileNotFoundError):
+        shared_memory.SharedMemory(name=name)
+
+def test_palette_images_are_converted():
+    """Test that images needing extra data (palette) are shared as RGB."""
+    with SharedImage(Image.new("P", (8, 8))) as handle:
+        assert handle.mode == "RGB"
+
+def test_worker_process_reads_shared_image():
+    """Test the hand-off to a worker process."""
+    prepare_transport()
+    image = Image.new("L", (100, 50), color=200)
+    with ProcessPoolExecutor(max_workers=1) as executor:
+        with SharedImage(image) as handle:
+            size, extrema = executor.submit(image_extrema, handle).result()
+    assert size == (100, 50)
+    assert extrema == (200, 200)
@@ -0,0 +1,94 @@
+"""
+Tests for the single-flight coalescing of identical OCR requests.
+"""
+import asyncio
+import os
+import threading
+import time
+from PIL import Image, ImageDraw
+from app import engines, main
+from app.engines import OCRResult, OCRWord
+from app.singleflight import SingleFlight
+from app.workers import BULK
+
+class BlockingEngine(engines.OCREngine):
+    """OCR engine double holding the page until released, with a total to read again."""
+    
+    def __init__(self):
+        self.started = threading.Event()
+        self.release = threading.Event()
+    
+    def recognize(self, image, timeout=None, cancel_event=None, single_block=False):
+        if single_block:
+            return OCRResult("Total: $120.00", [OCRWord("Total: $120.00", 96.0, 10, 0, 100, 30, (1, 1, 0))], image.size)
+        self.started.set()
+        self.release.wait(5)
+        lines = ["INVOICE #SF-1", "Total: $120.00"]
+        words = [
+            OCRWord(text, confidence, 50, 50 + 40 * i, 300, 30, (1, 1, i))
+            for i, (text, confidence) in enumerate(zip(lines, (95.0, 40.0)))
+        ]
+        return OCRResult("\n".join(lines), words, image.size)
+
+def test_concurrent_calls_share_one_computation():
+    """Test that concurrent calls with the same key run the computation once."""
+    flight = SingleFlight()
+    calls = []
+    
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "result"
+    
+    async def scenario():
+        return await asyncio.gather(*(flight.do("same", compute) for _ in range(5)))
+    
+    results = asyncio.run(scenario())
+    assert results == ["result"] * 5
+    assert len(calls) == 1
+    assert flight.stats() == {"executed": 1, "deduplicated": 4, "in_flight": 0}
+
+def test_sequential_calls_are_not_coalesced():
+    """Test that a finished computation is not reused by later calls."""
+    flight = SingleFlight()
+    
+    async def compute():
+        return 42
+    
+    async def scenario():
+        await flight.do("key", compute)
+        await flight.do("key", compute)
+    
+    asyncio.run(scenario())
+    assert flight.stats()["executed"] == 2
+    assert flight.stats()["deduplicated"] == 0
+
+def test_computation_survives_the_first_caller(tmp_path, monkeypatch):
+    """Test that the other callers still get a result when the first one disconnects."""
+    engine = BlockingEngine()
+    monkeypatch.setattr(engines, "default_engine", engine)
+    page = Image.new("L", (600, 400), 255)
+    ImageDraw.Draw(page).rectangle((50, 50, 550, 80), fill=0)
+    first, second = str(tmp_path / "first.png"), str(tmp_path / "second.png")
+    page.save(first)
+    page.save(second)
+    
+    async def scenario():
+        start = time.monotonic()
+        leader = asyncio.ensure_future(main.run_ocr(first, "same-content", start + 10))
+        await asyncio.get_event_loop().run_in_executor(None, engine.started.wait, 5)
+        follower = asyncio.ensure_future(main.run_ocr(second, "same-content", start + 20, priority=BULK))
+        await asyncio.sleep(0.05)
+        # The shared computation now has the longest deadline
+        assert [budget.deadline for budget, _ in main.shared_computations.values()] == [start + 20]
+        
+        # The first caller disconnects, and its upload is removed
+        leader.cancel()
+        os.remove(first)
+        engine.release.set()
+        return await follower
+    
+    invoice = asyncio.run(scenario())
+    assert invoice.invoice_number == "SF-1"
+    assert os.listdir(tmp_path) == ["second.png"]
+    assert main.shared_computations == {}
@@ -0,0 +1,126 @@
+"""
+Tests for the results store and the invoice search endpoints.
+"""
+import datetime
+import threading
+from decimal import Decimal
+import pytest
+from app.models import ExtractedInvoice
+from app.store import ResultsStore
+
+def make_invoice(number, vendor, date, text):
+    """Create an extracted invoice for the tests."""
+    return ExtractedInvoice(
+        invoice_number=number,
+        date=date,
+        due_date=None,
+        vendor=vendor,
+        vendor_id=vendor.lower().split()[0],
+        canonical_vendor=vendor,
+        total_amount=Decimal("100.00"),
+        currency="EUR",
+        items=[],
+        language=None,
+        confidence={},
+        warnings=[],
+        candidates={},
+        raw_text=text,
+    )
+
+@pytest.fixture
+def store(tmp_path):
+    """
+    Create a results store with a few invoices.
+    
+    Returns:
+        ResultsStore: The populated store
+    """
+    store = ResultsStore(str(tmp_path / "invoices.db"))
+    store.save("a.png", "hash-a", make_invoice("A-1", "ACME Inc", datetime.date(2023, 1, 10), "facture acme"))
+    store.save("b.png", "hash-b", make_invoice("B-1", "Globex", datetime.date(2023, 2, 10), "invoice globex"))
+    store.save("c.png", "hash-c", make_invoice("A-2", "ACME Inc", datetime.date(2023, 3, 10), "invoice acme"))
+    return store
+
+def test_same_content_is_stored_once(store):
+    """Test that a file already stored is not stored twice."""
+    first_id = store.search(content_hash="hash-a")[0][0]["id"]
+    again = store.save("a-copy.png", "hash-a", make_invoice("A-1", "ACME Inc", None, "facture acme"))
+    assert again == first_id
+
+def test_concurrent_saves_store_once(tmp_path):
+    """Test that the same file saved by concurrent requests is stored once."""
+    store = ResultsStore(str(tmp_path / "invoices.db"))
+    invoice = make_invoice("A-1", "ACME Inc", datetime.date(2023, 1, 10), "facture acme")
+    for trial in range(20):
+        start = threading.Barrier(8)
+        ids = []
+
+        def save():
+            start.wait()
+            ids.append(store.save("a.png", f"hash-{trial}", invoice))
+
+        threads = [threading.Thread(target=save) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert len(set(ids)) == 1
+        assert len(store.search(content_hash=f"hash-{trial}")[0]) == 1
+
+def test_search_filters(store):
+    """Test filtering on the indexed fields and full-text search."""
+    items, _ = store.search(vendor="ACME Inc")
+    assert [item["extracted_data"]["invoice_number"] for item in items] == ["A-2", "A-1"]
+    
+    items, _ = store.search(vendor_id="globex")
+    assert [item["filename"] for item in items] == ["b.png"]
+    
+    items, _ = store.search(date_from=datetime.date(2023, 2, 1), date_to=datetime.date(2023, 2, 28))
+    assert [item["filename"] for item in items] == ["b.png"]
+    
+    if store.fts_enabled:
+        items, _ = store.search(text="acme")
+        assert {item["filename"] for item in items} == {"a.png", "c.png"}
+
+def test_cursor_pagination(store):
+    """Test that pages follow each other without gaps or duplicates."""
+    first_page, cursor = store.search(limit=2)
+    assert len(first_page) == 2
+    assert cursor is not None
+    
+    second_page, cursor = store.search(limit=2, cursor=cursor)
+    assert [item["filename"] for item in first_page + second_page] == ["c.png", "b.png", "a.png"]
+    assert cursor is None
+
+def test_invalid_cursor(store):
+    """Test that a malformed cursor is rejected."""
+    with pytest.raises(ValueError):
+        store.search(cursor="not-a-cursor")
+
+def test_invoices_endpoint(test_client, auth_headers, store, monkeypatch):
+    """Test the invoice search and lookup endpoints."""
+    from app import main
+    monkeypatch.setattr(main, "results_store", store)
+    
+    response = test_client.get("/invoices?vendor=Globex", headers=auth_headers)
+    assert response.status_code == 200
+    items = response.json()["items"]
+    assert len(items) == 1
+    assert items[0]["extracted_data"]["date"] == "2023-02-10"
+    assert "raw_text" not in items[0]["extracted_data"]
+    
+    response = test_client.get(f"/invoices/{items[0]['id']}", headers=auth_headers)
+    assert response.status_code == 200
+    assert response.json()["extracted_data"]["raw_text"] == "invoice globex"
+    
+    assert test_client.get("/invoices/9999", headers=auth_headers).status_code == 404
+    assert test_client.get("/invoices").status_code == 401
+
+def test_results_are_tagged_with_message_id(tmp_path):
+    """Test that invoices attached to an email can be found by its Message-ID."""
+    store = ResultsStore(str(tmp_path / "invoices.db"))
+    store.save("a.png", "hash-a", make_invoice("A-1", "ACME Inc", None, "facture"), "mail", "a@x")
+    assert store.has_message("a@x")
+    assert not store.has_message("b@x")
+    [item], _ = store.search(message_id="a@x")
+    assert item["message_id"] == "a@x"
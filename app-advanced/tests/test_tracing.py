@@ -0,0 +1,102 @@
+"""
+Tests for the trace spans.
+"""
+import io
+import json
+import pytest
+from PIL import Image, ImageDraw
+from app import engines, main
+from app.tracing import JsonlFileExporter, SpanExporter, create_exporter, parse_traceparent, span, tracer
+
+TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
+PARENT_ID = "00f067aa0ba902b7"
+
+class MemoryExporter(SpanExporter):
+    """Exporter keeping the spans in a list."""
+
+    def __init__(self):
+        self.spans = []
+
+    def export(self, spans):
+        self.spans.extend(spans)
+
+class TextEngine(engines.OCREngine):
+    def image_to_string(self, image, timeout=None, cancel_event=None):
+        return "INVOICE #TRACE-1\nTotal: 12.00\n"
+
+@pytest.fixture
+def exporter(monkeypatch):
+    exporter = MemoryExporter()
+    monkeypatch.setattr(tracer, "exporter", exporter)
+    monkeypatch.setattr(engines, "default_engine", TextEngine())
+    monkeypatch.setattr(main, "results_store", None)
+    return exporter
+
+def invoice_png():
+    page = Image.new("L", (600, 400), 255)
+    ImageDraw.Draw(page).rectangle((50, 50, 550, 80), fill=0)
+    data = io.BytesIO()
+    page.save(data, format="PNG")
+    return data.getvalue()
+
+def test_parse_traceparent():
+    """Test that valid W3C trace contexts are read and invalid ones ignored."""
+    assert parse_traceparent(f"00-{TRACE_ID}-{PARENT_ID}-01") == (TRACE_ID, PARENT_ID, True)
+    assert parse_traceparent(f"00-{TRACE_ID}-{PARENT_ID}-00") == (TRACE_ID, PARENT_ID, False)
+    assert parse_traceparent(f"00-{'0' * 32}-{PARENT_ID}-01") is None
+    assert parse_traceparent("not a trace") is None
+    assert parse_traceparent(None) is None
+
+def test_request_spans_continue_the_incoming_trace(test_client, auth_headers, exporter):
+    """Test that the request and every pipeline stage are spans of the caller's trace."""
+    response = test_client.post(
+        "/extract/",
+        headers={**auth_headers, "traceparent": f"00-{TRACE_ID}-{PARENT_ID}-01"},
+        files={"file": ("scan.png", invoice_png(), "image/png")},
+    )
+    assert response.status_code == 200
+    assert response.headers["x-trace-id"] == TRACE_ID
+    tracer.flush()
+
+    spans = {span.name: span for span in exporter.spans}
+    assert {span.trace_id for span in exporter.spans} == {TRACE_ID}
+    for name in ("save", "Image.open", "decode", "preprocess", "ocr", "image_to_string",
+                 "extract_invoice_number", "extract_items", "serialize"):
+        assert name in spans, name
+
+    request = spans["POST /extract/"]
+    assert request.parent_id == PARENT_ID
+    assert request.attributes["http.status_code"] == 200
+    # The OCR call runs on a worker thread, as a child of the page span
+    assert spans["image_to_string"].parent_id == spans["ocr"].span_id
+    assert spans["image_to_string"].thread.startswith("ocr_")
+
+def test_unsampled_traces_are_not_recorded(test_client, exporter):
+    """Test that a caller's decision not to sample is followed."""
+    test_client.get("/health", headers={"traceparent": f"00-{TRACE_ID}-{PARENT_ID}-00"})
+    tracer.flush()
+    assert exporter.spans == []
+
+def test_jsonl_exporter(tmp_path, monkeypatch):
+    """Test that the file exporter writes one span per line, with errors recorded."""
+    path = tmp_path / "traces.jsonl"
+    monkeypatch.setattr(tracer, "exporter", JsonlFileExporter(str(path)))
+    with span("outer"):
+        with pytest.raises(ValueError):
+            with span("inner", page=1):
+                raise ValueError("bad page")
+    tracer.flush()
+
+    inner, outer = [json.loads(line) for line in path.read_text().splitlines()]
+    assert inner["parentSpanId"] == outer["spanId"]
+    assert inner["attributes"]["page"] == 1
+    assert inner["status"] == {"code": "error", "message": "bad page"}
+    assert outer["parentSpanId"] == ""
+
+def test_create_exporter():
+    """Test that exporters are created by name, including custom classes."""
+    assert create_exporter("none") is None
+    assert isinstance(create_exporter("jsonl"), JsonlFileExporter)
+    assert isinstance(create_exporter("tests.test_tracing:MemoryExporter"), MemoryExporter)
+    with pytest.raises(ValueError):
+        create_exporter("zipkin")
@@ -0,0 +1,132 @@
+"""
+Tests for the page triage before OCR and the orientation detection.
+"""
+import asyncio
+import time
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw
+from app import engines, ocr_processor, triage
+from app.engines import parse_osd
+from app.ocr_processor import process_invoice, process_invoice_async
+from app.triage import BLANK, DOCUMENT, NOT_A_DOCUMENT, NotADocumentError, detect_rotation, upright
+
+def text_page(width=2480, height=3508):
+    """Draw an A4 page at 300 dpi with black bars standing in for lines of text."""
+    page = Image.new("L", (width, height), 255)
+    draw = ImageDraw.Draw(page)
+    for top in range(300, height - 300, 60):
+        for left in range(200, width - 400, 320):
+            draw.rectangle((left, top, left + 250, top + 25), fill=0)
+    return page
+
+def photo(width=1600, height=1200):
+    """Draw a smooth gray gradient standing in for a photo."""
+    x = np.linspace(0, 6 * np.pi, width)
+    y = np.linspace(0, 4 * np.pi, height)[:, None]
+    pixels = 128 + 100 * np.sin(x) * np.cos(y)
+    return Image.fromarray(pixels.astype(np.uint8))
+
+class OrientationEngine(engines.OCREngine):
+    """OCR engine double reading every page as upside down."""
+
+    def __init__(self):
+        self.calls = 0
+
+    def image_to_string(self, image, timeout=None, cancel_event=None):
+        return f"page {image.width}x{image.height}\n"
+
+    def detect_orientation(self, image, timeout=None, cancel_event=None):
+        self.calls += 1
+        return 180, 5.0
+
+def test_pages_are_classified():
+    """Test that pages are told apart from their statistics."""
+    assert triage.triage(text_page()).kind == DOCUMENT
+    assert triage.triage(Image.new("L", (2480, 3508), 255)).kind == BLANK
+    assert triage.triage(photo()).kind == NOT_A_DOCUMENT
+    assert triage.triage(Image.new("L", (800, 600), 20)).kind == NOT_A_DOCUMENT
+
+    # Scanner noise on a white page is not ink
+    noise = np.random.default_rng(0).normal(245, 3, (1754, 1240)).clip(0, 255)
+    assert triage.triage(Image.fromarray(noise.astype(np.uint8))).kind == BLANK
+
+def test_triage_is_cheap():
+    """Test that a full-size page is triaged in a few milliseconds."""
+    page = text_page()
+    triage.triage(page)
+    start = time.perf_counter()
+    for _ in range(5):
+        triage.triage(page)
+    assert (time.perf_counter() - start) / 5 < 0.05
+
+def test_parse_osd():
+    """Test that the rotation and its confidence are read from the OSD output."""
+    osd = "Page number: 0\nOrientation in degrees: 90\nRotate: 270\nOrientation confidence: 4.12\nScript: Latin\n"
+    assert parse_osd(osd) == (270, 4.12)
+    assert parse_osd("Too few characters") is None
+
+def test_rotation_is_cached_by_digest(monkeypatch):
+    """Test that a page sent again is not analysed twice."""
+    engine = OrientationEngine()
+    monkeypatch.setattr(engines, "default_engine", engine)
+    monkeypatch.setattr(triage, "orientation_cache", triage.OrientationCache())
+    page = text_page(1240, 1754)
+    digest = triage.triage(page).digest
+    assert detect_rotation(page, digest) == 180
+    assert detect_rotation(page, digest) == 180
+    assert engine.calls == 1
+
+def test_low_confidence_rotation_is_ignored(monkeypatch):
+    """Test that an unsure orientation leaves the page as it is."""
+    engine = OrientationEngine()
+    engine.detect_orientation = lambda image, timeout=None, cancel_event=None: (90, 0.5)
+    monkeypatch.setattr(engines, "default_engine", engine)
+    monkeypatch.setattr(triage, "orientation_cache", triage.OrientationCache())
+    assert detect_rotation(text_page(1240, 1754), "unsure") == 0
+
+def test_upright():
+    """Test that pages are turned clockwise by quarter turns."""
+    page = Image.new("L", (300, 200), 255)
+    page.putpixel((0, 0), 0)
+    turned = upright(page, 90)
+    assert turned.size == (200, 300)
+    assert turned.getpixel((199, 0)) == 0
+    assert upright(page, 0) is page
+
+def test_orientation_detection_is_opt_in(tmp_path, monkeypatch):
+    """Test that OSD only runs, once per page, when OCR_OSD is enabled."""
+    engine = OrientationEngine()
+    monkeypatch.setattr(engines, "default_engine", engine)
+    monkeypatch.setattr(triage, "orientation_cache", triage.OrientationCache())
+    path = str(tmp_path / "scan.png")
+    text_page(1240, 1754).save(path)
+
+    asyncio.run(process_invoice_async(path))
+    assert engine.calls == 0
+
+    monkeypatch.setattr(ocr_processor, "OCR_OSD", True)
+    asyncio.run(process_invoice_async(path))
+    assert engine.calls == 1
+
+def test_blank_pages_are_skipped(tmp_path, monkeypatch):
+    """Test that blank pages are not OCRed and reported in the warnings."""
+    monkeypatch.setattr(engines, "default_engine", OrientationEngine())
+    monkeypatch.setattr(triage, "orientation_cache", triage.OrientationCache())
+    path = str(tmp_path / "scan.tiff")
+    pages = [text_page(1240, 1754), Image.new("L", (1240, 1754), 255)]
+    pages[0].save(path, save_all=True, append_images=pages[1:])
+
+    invoice = asyncio.run(process_invoice_async(path))
+    assert invoice.raw_text == "page 1240x1754\n\f"
+    assert "Page 2 was skipped: blank" in invoice.warnings
+
+def test_file_without_document_is_rejected(tmp_path, monkeypatch):
+    """Test that a file whose pages are all skipped is rejected."""
+    monkeypatch.setattr(engines, "default_engine", OrientationEngine())
+    path = str(tmp_path / "photo.png")
+    photo().save(path)
+    with pytest.raises(NotADocumentError):
+        process_invoice(path)
+    with pytest.raises(NotADocumentError):
+        asyncio.run(process_invoice_async(path))
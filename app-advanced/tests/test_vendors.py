@@ -0,0 +1,61 @@
+"""
+Tests for the vendor normalization index.
+"""
+import json
+import os
+import pytest
+from app.vendors import VendorIndex, VendorRegistry, normalize_vendor_name
+
+VENDORS = [
+    {"id": "acme", "name": "ACME Inc", "aliases": ["Acme Corporation"]},
+    {"id": "globex", "name": "Globex LLC"},
+    {"id": "initech", "name": "Initech"},
+]
+
+@pytest.mark.parametrize("variant", ["ACME Inc", "ACME lnc.", "Acme, Inc", "ACME  INC", "Acrne Inc"])
+def test_ocr_variants_map_to_canonical_vendor(variant):
+    """Test that OCR variants of a name map to the same vendor."""
+    match = VendorIndex(VENDORS).lookup(variant)
+    assert match is not None
+    assert match.vendor_id == "acme"
+    assert match.name == "ACME Inc"
+
+def test_unknown_vendor_does_not_match():
+    """Test that a name far from every vendor is not matched."""
+    index = VendorIndex(VENDORS)
+    assert index.lookup("Umbrella Pharmaceuticals") is None
+    assert index.lookup(None) is None
+
+def test_normalize_vendor_name():
+    """Test the normalization of vendor names."""
+    assert normalize_vendor_name("Société Générale S.A.") == "societe generale"
+    assert normalize_vendor_name("G1obex, LLC") == "globex"
+
+def test_registry_reloads_changed_file(tmp_path):
+    """Test that the registry picks up changes of the vendors file."""
+    path = tmp_path / "vendors.json"
+    path.write_text(json.dumps(VENDORS[:1]))
+    registry = VendorRegistry(str(path))
+    assert registry.lookup("Globex LLC") is None
+    
+    path.write_text(json.dumps(VENDORS))
+    # Make sure the modification time changes even on coarse file systems
+    os.utime(path, (os.path.getmtime(path) + 10, os.path.getmtime(path) + 10))
+    assert registry.reload()
+    assert registry.lookup("Globex LLC").vendor_id == "globex"
+
+@pytest.mark.parametrize("vendors", [[{"id": "acme"}], {"acme": "ACME Inc"}, [{"id": "acme", "name": 7}]])
+def test_registry_keeps_serving_on_invalid_file(tmp_path, vendors):
+    """Test that an invalid vendors file keeps the previous index, also at startup."""
+    path = tmp_path / "vendors.json"
+    path.write_text(json.dumps(vendors))
+    assert VendorRegistry(str(path)).lookup("ACME Inc") is None
+
+    path.write_text(json.dumps(VENDORS))
+    registry = VendorRegistry(str(path))
+    path.write_text(json.dumps(vendors))
+    os.utime(path, (os.path.getmtime(path) + 10, os.path.getmtime(path) + 10))
+    assert not registry.reload()
+    assert registry.lookup("Globex LLC").vendor_id == "globex"
+    # Not retried until the file changes again
+    assert not registry.reload()
@@ -0,0 +1,195 @@
+"""
+Tests for the OCR worker pool, time budgets and cancellation.
+"""
+import asyncio
+import subprocess
+import sys
+import threading
+import time
+import pytest
+from PIL import Image, ImageDraw
+from app import engines
+from app.engines import TesseractEngine, OCRTimeoutError, OCRCancelledError
+from app.ocr_processor import process_invoice
+from app.workers import OCRBudget, OCRWorkerPool
+
+def sleeping_process():
+    """Start a process standing in for a slow Tesseract run."""
+    return subprocess.Popen(
+        [sys.executable, "-c", "import time; time.sleep(30)"],
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE
+    )
+
+def test_slow_process_is_killed_on_timeout():
+    """Test that an OCR process exceeding its budget is killed."""
+    proc = sleeping_process()
+    start = time.monotonic()
+    with pytest.raises(OCRTimeoutError):
+        TesseractEngine._wait(proc, timeout=0.3, cancel_event=None)
+    assert time.monotonic() - start < 5
+    assert proc.poll() is not None
+
+def test_process_is_killed_on_cancel():
+    """Test that setting the cancellation event kills the OCR process."""
+    proc = sleeping_process()
+    cancel_event = threading.Event()
+    threading.Timer(0.2, cancel_event.set).start()
+    with pytest.raises(OCRCancelledError):
+        TesseractEngine._wait(proc, timeout=None, cancel_event=cancel_event)
+    assert proc.poll() is not None
+
+def test_cancelled_job_frees_its_worker():
+    """Test that cancelling an awaiting task stops the job and frees the worker."""
+    pool = OCRWorkerPool(max_workers=1)
+    
+    def job(timeout=None, cancel_event=None):
+        cancel_event.wait(10)
+        raise OCRCancelledError("OCR cancelled")
+    
+    def quick_job(timeout=None, cancel_event=None):
+        return "done"
+    
+    async def scenario():
+        task = asyncio.ensure_future(pool.run(job))
+        await asyncio.sleep(0.1)
+        task.cancel()
+        # The single worker is available again for the next job
+        return await asyncio.wait_for(pool.run(quick_job), timeout=5)
+    
+    assert asyncio.run(scenario()) == "done"
+    assert pool.stats()["cancelled"] == 1
+    assert pool.stats()["busy"] == 0
+
+def test_synchronous_processing_can_be_cancelled(tmp_path, monkeypatch):
+    """Test that setting the event given to process_invoice stops the running OCR job."""
+    cancel = threading.Event()
+    stopped = threading.Event()
+    
+    class WaitingEngine(engines.OCREngine):
+        def image_to_string(self, image, timeout=None, cancel_event=None):
+            threading.Timer(0.1, cancel.set).start()
+            if cancel_event.wait(5):
+                stopped.set()
+            raise OCRCancelledError("stopped")
+    
+    monkeypatch.setattr(engines, "default_engine", WaitingEngine())
+    path = str(tmp_path / "scan.png")
+    page = Image.new("L", (600, 400), 255)
+    ImageDraw.Draw(page).rectangle((50, 50, 550, 80), fill=0)
+    page.save(path)
+    
+    with pytest.raises(OCRCancelledError):
+        process_invoice(path, cancel_event=cancel)
+    # The worker thread gets the cancellation as the call returns
+    assert stopped.wait(5)
+
+def test_expired_deadline_fails_fast():
+    """Test that a job whose budget was spent in the queue does not run."""
+    pool = OCRWorkerPool(max_workers=1)
+    ran = []
+    
+    def job(timeout=None, cancel_event=None):
+        ran.append(timeout)
+    
+    with pytest.raises(OCRTimeoutError):
+        asyncio.run(pool.run(job, deadline=time.monotonic() - 1))
+    assert ran == []
+    assert pool.stats()["timed_out"] == 1
+
+def test_interactive_jobs_go_before_queued_bulk_jobs():
+    """Test that queued interactive jobs are started before queued bulk jobs."""
+    pool = OCRWorkerPool(max_workers=1, bulk_min_share=0)
+    release = threading.Event()
+    order = []
+    
+    def blocker(timeout=None, cancel_event=None):
+        release.wait(5)
+    
+    def job(name, timeout=None, cancel_event=None):
+        order.append(name)
+    
+    async def scenario():
+        first = asyncio.ensure_future(pool.run(blocker))
+        await asyncio.sleep(0.05)
+        tasks = [asyncio.ensure_future(pool.run(job, f"bulk{i}", priority="bulk")) for i in range(2)]
+        await asyncio.sleep(0.05)
+        tasks.append(asyncio.ensure_future(pool.run(job, "interactive", priority="interactive")))
+        await asyncio.sleep(0.05)
+        release.set()
+        await asyncio.gather(first, *tasks)
+    
+    asyncio.run(scenario())
+    assert order == ["interactive", "bulk0", "bulk1"]
+    stats = pool.stats()
+    assert stats["queue_wait_seconds"]["bulk"]["samples"] == 2
+    assert stats["queued_by_priority"] == {"interactive": 0, "bulk": 0}
+
+def test_raised_budget_moves_queued_jobs():
+    """Test that a bulk budget raised to interactive moves its queued jobs ahead."""
+    pool = OCRWorkerPool(max_workers=1, bulk_min_share=0)
+    release = threading.Event()
+    order = []
+    
+    def blocker(timeout=None, cancel_event=None):
+        release.wait(5)
+    
+    def job(name, timeout=None, cancel_event=None):
+        order.append((name, timeout))
+    
+    async def scenario():
+        first = asyncio.ensure_future(pool.run(blocker))
+        await asyncio.sleep(0.05)
+        budget = OCRBudget(time.monotonic() + 10, "bulk")
+        tasks = [
+            asyncio.ensure_future(pool.run(job, "other", priority="bulk")),
+            asyncio.ensure_future(pool.run(job, "shared", budget=budget)),
+        ]
+        await asyncio.sleep(0.05)
+        pool.raise_budget(budget, time.monotonic() + 5, "interactive")
+        assert pool.stats()["queued_by_priority"] == {"interactive": 1, "bulk": 1}
+        pool.raise_budget(budget, None, "bulk")
+        release.set()
+        await asyncio.gather(first, *tasks)
+        return budget
+    
+    budget = asyncio.run(scenario())
+    assert [name for name, _ in order] == ["shared", "other"]
+    # The later deadline wins, and no deadline is the latest
+    assert order[0][1] is None and budget.deadline is None
+    assert budget.priority == "interactive"
+
+def test_bulk_jobs_get_a_minimum_share():
+    """Test that bulk jobs are not starved by a steady interactive load."""
+    pool = OCRWorkerPool(max_workers=1, bulk_min_share=0.25)
+    release = threading.Event()
+    order = []
+    
+    def blocker(timeout=None, cancel_event=None):
+        release.wait(5)
+    
+    def job(name, timeout=None, cancel_event=None):
+        order.append(name)
+    
+    async def scenario():
+        first = asyncio.ensure_future(pool.run(blocker))
+        await asyncio.sleep(0.05)
+        tasks = [asyncio.ensure_future(pool.run(job, "bulk", priority="bulk")) for _ in range(2)]
+        tasks += [asyncio.ensure_future(pool.run(job, "interactive")) for _ in range(6)]
+        await asyncio.sleep(0.05)
+        release.set()
+        await asyncio.gather(first, *tasks)
+    
+    asyncio.run(scenario())
+    # One bulk job after every three interactive ones
+    assert order[:4] == ["interactive"] * 3 + ["bulk"]
+    assert order.count("bulk") == 2
+
+def test_resolve_priority(monkeypatch):
+    """Test that the request priority wins over the user default."""
+    from app import workers
+    monkeypatch.setattr(workers, "OCR_USER_PRIORITIES", {"nightly": "bulk"})
+    assert workers.resolve_priority(None, "nightly") == "bulk"
+    assert workers.resolve_priority("interactive", "nightly") == "interactive"
+    assert workers.resolve_priority(None, "admin") == "interactive"
+    with pytest.raises(ValueError):
+        workers.resolve_priority("urgent", "admin")